@@ -6,8 +6,9 @@ import atexit
 
 from mapp.context import MappContext, spec_from_env, get_context_from_env, get_cli_access_token
 from mapp.errors import MappError
-from mapp.db import create_tables
+from mapp.db import create_tables, create_tables_plan, explain_queries, migrate_datetime_storage
 from mapp.module import cli as module_cli
+from mspec.core import load_json_or_yaml
 
 
 __all__ = [
@@ -40,15 +41,64 @@ def main(ctx: MappContext, spec:dict):
         description=f':: {project_name} :: create-tables'
     )
     create_tables_parser.add_argument('help', nargs='?', help='Show help for this command')
+    create_tables_parser.add_argument('--plan', action='store_true', help='Print the column and index DDL that would be applied without changing the db')
     def cli_create_tables(ctx, args):
         if args.help == 'help':
             create_tables_parser.print_help()
+        elif args.plan:
+            plan = create_tables_plan(ctx, spec)
+            if not plan:
+                print('-- no column or index changes')
+            for table_name, statements in plan.items():
+                print(f'-- {table_name}')
+                for sql in statements:
+                    print(f'{sql};')
         else:
             ack = create_tables(ctx, spec)
             # return ack
             print(json.dumps(ack.to_dict(), sort_keys=True, indent=4))
     create_tables_parser.set_defaults(func=cli_create_tables)
 
+    db_parser = subparsers.add_parser(
+        'db',
+        help='Database tools',
+        description=f':: {project_name} :: db'
+    )
+    db_subparsers = db_parser.add_subparsers(dest='db_action', help='Available db actions', required=False)
+    db_parser.set_defaults(func=lambda ctx, args: db_parser.print_help())
+
+    explain_parser = db_subparsers.add_parser(
+        'explain',
+        help='Explain the query plans of the queries the spec can produce and suggest indexes',
+        description=f':: {project_name} :: db :: explain'
+    )
+    explain_parser.add_argument('help', nargs='?', help='Show help for this command')
+    explain_parser.add_argument('--flagged', action='store_true', help='Only show queries with a full scan or temp b-tree in their plan')
+    explain_parser.add_argument('--page', action='append', default=[], help='Path to a lingo page spec to scan for db calls, may be repeated')
+    def cli_db_explain(ctx, args):
+        if args.help == 'help':
+            explain_parser.print_help()
+            return
+        page_specs = {page_path: load_json_or_yaml(page_path) for page_path in args.page}
+        entries = explain_queries(ctx, spec, page_specs)
+        if args.flagged:
+            entries = [entry for entry in entries if entry.get('flags') or 'error' in entry]
+        print(json.dumps(entries, sort_keys=True, indent=4))
+    explain_parser.set_defaults(func=cli_db_explain)
+
+    migrate_datetime_parser = db_subparsers.add_parser(
+        'migrate-datetime',
+        help='Convert stored datetimes of existing tables to each model\'s db.datetime_storage',
+        description=f':: {project_name} :: db :: migrate-datetime'
+    )
+    migrate_datetime_parser.add_argument('help', nargs='?', help='Show help for this command')
+    def cli_db_migrate_datetime(ctx, args):
+        if args.help == 'help':
+            migrate_datetime_parser.print_help()
+        else:
+            print(json.dumps(migrate_datetime_storage(ctx, spec), sort_keys=True, indent=4))
+    migrate_datetime_parser.set_defaults(func=cli_db_migrate_datetime)
+
     # parsers for each module #
 
     try:
@@ -88,7 +138,8 @@ def main(ctx: MappContext, spec:dict):
 
     if hasattr(args, 'func'):
         try:
-            args.func(ctx, args)
+            with ctx.db.unit_of_work():
+                args.func(ctx, args)
         except MappError as e:
             print(json.dumps(e.to_dict(), sort_keys=True, indent=4))
             raise SystemExit(1)
@@ -112,7 +163,7 @@ if __name__ == "__main__":
         else:
             raise
     else:
-        cli_ctx = get_context_from_env()
+        cli_ctx = get_context_from_env(mapp_spec)
 
         cli_ctx.current_access_token = lambda: get_cli_access_token(cli_ctx)
         if (token := get_cli_access_token(cli_ctx)) is not None:
@@ -1,16 +1,23 @@
 import os
 import re
 import time
+import fcntl
 import hashlib
 import secrets
+import sqlite3
+import threading
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 import jwt
 
 from mapp.context import MappContext, MAPP_APP_PATH
-from mapp.errors import AuthenticationError, MappError, MappValidationError, ServerError
-from mapp.types import User, PasswordHash
+from mapp.errors import AuthenticationError, MappError, MappValidationError, ServerError, ServiceUnavailableError
+from mapp.types import User, PasswordHash, datetime_for_db
 
 """
 ./run.sh auth create-user run '{"name": "Brad", "email": "brad@example.com", "password": "123", "password_confirm": "123"}'
@@ -23,16 +30,24 @@ MAPP_AUTH_LOGIN_EXPIRATION_MINUTES = os.environ.get('MAPP_AUTH_LOGIN_EXPIRATION_
 MAPP_AUTH_MAX_USER_ACCOUNTS = int(os.environ.get('MAPP_AUTH_MAX_USER_ACCOUNTS', -1))		# limit the total number of user accounts that can be created, -1 for no limit
 MAPP_AUTH_NEW_ACCOUNT_BY_INVITE_ONLY = os.environ.get('MAPP_AUTH_NEW_ACCOUNT_BY_INVITE_ONLY', 'false').lower() == 'true'	# if true, new accounts can only be created by invitation
 MAPP_AUTH_INVITE_USER_ACL_FILE = os.environ.get('MAPP_AUTH_INVITE_USER_ACL_FILE', './app/auth_invite_user_acl.txt')	# path to a file containing email addresses that are allowed to invite new users
+MAPP_AUTH_SESSION_CACHE_SECONDS = float(os.environ.get('MAPP_AUTH_SESSION_CACHE_SECONDS', 30))	# how long a worker trusts a verified access token without checking its session in the db, 0 to disable
+MAPP_AUTH_SESSION_CACHE_SIZE = int(os.environ.get('MAPP_AUTH_SESSION_CACHE_SIZE', 10_000))		# max number of access tokens cached per worker
+MAPP_AUTH_PASSWORD_ITERATIONS = int(os.environ.get('MAPP_AUTH_PASSWORD_ITERATIONS', 100_000))	# pbkdf2-sha256 work factor of new hashes, passwords hashed with another work factor are rehashed on login
+MAPP_AUTH_HASH_WORKERS = int(os.environ.get('MAPP_AUTH_HASH_WORKERS', 1))		# low priority processes per worker that run password hashing, 0 to hash in the worker itself
+MAPP_AUTH_HASH_QUEUE_LIMIT = int(os.environ.get('MAPP_AUTH_HASH_QUEUE_LIMIT', 0))	# max password hashes running at once across all workers of the app, more fail with 503, 0 for no limit
 
 __all__ = [
     'User',
     'PasswordHash',
+    'SessionCache',
+    'session_cache_stats',
     'create_user',
     'login_user',
     'current_user',
     'logout_user',
     'delete_user',
-    'drop_sessions'
+    'drop_sessions',
+    'sweep_sessions'
 ]
 
 #
@@ -55,20 +70,101 @@ def _verify_root_password(user_input:str) -> bool:
     
     return True
 
+#
+# password hashing
+#
+
+"""
+pbkdf2 runs in a pool of MAPP_AUTH_HASH_WORKERS low priority processes per worker so
+request workers serving other traffic are scheduled ahead of it. If
+MAPP_AUTH_HASH_QUEUE_LIMIT is set at most that many hashes run at once across all workers
+of the app, each holds a flock on one of that many slot files in the app directory, when
+no slot is free the request fails fast with a 503 instead of tying up another worker.
+
+hashes are stored as pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>, the older
+<salt hex>$<hash hex> format has 100,000 iterations
+"""
+
+_LEGACY_PASSWORD_ITERATIONS = 100_000
+_HASH_SLOT_DIR = MAPP_APP_PATH / '.mapp-hash-slots'
+
+_hash_pool = None
+_hash_pool_pid = None
+_hash_pool_lock = threading.Lock()
+
+def _pbkdf2(password:str, salt:bytes, iterations:int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+def _hash_worker_init() -> None:
+    os.nice(10)
+
+def _password_hash_pool() -> ProcessPoolExecutor:
+    """the pool of this process, a forked worker creates its own"""
+    global _hash_pool, _hash_pool_pid
+    with _hash_pool_lock:
+        if _hash_pool is None or _hash_pool_pid != os.getpid():
+            _hash_pool = ProcessPoolExecutor(max_workers=MAPP_AUTH_HASH_WORKERS, initializer=_hash_worker_init)
+            _hash_pool_pid = os.getpid()
+        return _hash_pool
+
+def _acquire_hash_slot() -> Optional[int]:
+    """
+    returns the fd of a locked slot file, or None if there is no limit,
+    raises ServiceUnavailableError if every slot is taken
+    """
+    if MAPP_AUTH_HASH_QUEUE_LIMIT <= 0:
+        return None
+
+    os.makedirs(_HASH_SLOT_DIR, exist_ok=True)
+    for slot in range(MAPP_AUTH_HASH_QUEUE_LIMIT):
+        fd = os.open(os.path.join(_HASH_SLOT_DIR, f'{slot}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+
+    raise ServiceUnavailableError('Too many password checks in progress, try again later')
+
+def _run_pbkdf2(password:str, salt:bytes, iterations:int) -> bytes:
+    fd = _acquire_hash_slot()
+    try:
+        if MAPP_AUTH_HASH_WORKERS <= 0:
+            return _pbkdf2(password, salt, iterations)
+        return _password_hash_pool().submit(_pbkdf2, password, salt, iterations).result()
+    finally:
+        if fd is not None:
+            os.close(fd)    # releases the flock
+
+def _parse_password_hash(hashed_password:str) -> tuple[int, bytes, bytes]:
+    """returns (iterations, salt, hash), raises ValueError if malformed"""
+    parts = hashed_password.split('$')
+    match parts:
+        case ['pbkdf2_sha256', iterations, salt, hash_hex]:
+            return int(iterations), bytes.fromhex(salt), bytes.fromhex(hash_hex)
+        case [salt, hash_hex]:
+            return _LEGACY_PASSWORD_ITERATIONS, bytes.fromhex(salt), bytes.fromhex(hash_hex)
+        case _:
+            raise ValueError('unknown password hash format')
+
+def _password_needs_rehash(hashed_password:str) -> bool:
+    return not hashed_password.startswith(f'pbkdf2_sha256${MAPP_AUTH_PASSWORD_ITERATIONS}$')
+
 def _verify_password(plain_password:str, hashed_password:str) -> bool:
+    """raises ServiceUnavailableError if the hash could not be checked now"""
     try:
-        salt, hash_hex = hashed_password.split('$')
-        salt_bytes = bytes.fromhex(salt)
-        hash_bytes = bytes.fromhex(hash_hex)
-        test_hash = hashlib.pbkdf2_hmac('sha256', plain_password.encode('utf-8'), salt_bytes, 100_000)
-        return secrets.compare_digest(test_hash, hash_bytes)
-    except Exception:
+        iterations, salt_bytes, hash_bytes = _parse_password_hash(hashed_password)
+    except ValueError:
         return False
 
+    test_hash = _run_pbkdf2(plain_password, salt_bytes, iterations)
+    return secrets.compare_digest(test_hash, hash_bytes)
+
 def _get_password_hash(password:str) -> str:
+    """raises ServiceUnavailableError if the hash could not be computed now"""
     salt = secrets.token_bytes(16)
-    hash_bytes = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100_000)
-    return f'{salt.hex()}${hash_bytes.hex()}'
+    hash_bytes = _run_pbkdf2(password, salt, MAPP_AUTH_PASSWORD_ITERATIONS)
+    return f'pbkdf2_sha256${MAPP_AUTH_PASSWORD_ITERATIONS}${salt.hex()}${hash_bytes.hex()}'
 
 def _check_user_credentials(ctx: MappContext, email: str, password: str) -> str:
     """
@@ -103,16 +199,29 @@ def _check_user_credentials(ctx: MappContext, email: str, password: str) -> str:
 
     if not _verify_password(password, pw_hash_result[0]):
         raise AuthenticationError(err_msg)
-    
+
+    # rehash with the current work factor #
+
+    if _password_needs_rehash(pw_hash_result[0]):
+        try:
+            ctx.db.cursor.execute(
+                'UPDATE auth_password_hash SET hash = ? WHERE user_id = ? AND hash = ?',
+                (_get_password_hash(password), user_id_result[0], pw_hash_result[0])
+            )
+            ctx.db.commit()
+        except ServiceUnavailableError:
+            ctx.log(f'Skipped password rehash for user {user_id_result[0]}, password hashing is busy')
+
     return str(user_id_result[0])
 
-def _create_access_token(user_id: str) -> tuple[str, str, int]:
+def _create_access_token(user_id: str, expires: Optional[datetime]=None) -> tuple[str, str, int]:
 
     """
     Create an access token for a user.
 
     args ::
-        data :: dict containing the user id as 'sub' key
+        user_id :: str - The id of the user, stored as the 'sub' key
+        expires :: Optional[datetime] - When the token expires, defaults to MAPP_AUTH_LOGIN_EXPIRATION_MINUTES from now
 
     return :: tuple of (token:str, token_type:str, jti:int)
         token - str - The JWT access token with the following fields
@@ -125,7 +234,8 @@ def _create_access_token(user_id: str) -> tuple[str, str, int]:
     raises :: AuthenticationError
     """
 
-    expires = datetime.now(timezone.utc) + timedelta(minutes=int(MAPP_AUTH_LOGIN_EXPIRATION_MINUTES))
+    if expires is None:
+        expires = _session_expires_at()
     jti = secrets.randbits(63)
     data_to_encode = {'sub': user_id, 'exp': expires, 'jti': str(jti)}
     if MAPP_AUTH_SECRET_KEY is None:
@@ -133,10 +243,15 @@ def _create_access_token(user_id: str) -> tuple[str, str, int]:
     token = jwt.encode(data_to_encode, MAPP_AUTH_SECRET_KEY, algorithm='HS256')
     return token, 'bearer', jti
 
-def _parse_access_token(ctx:dict, token:str) -> tuple[User, str]:
+def _session_expires_at() -> datetime:
+    """expiry of a session created now, in whole seconds as the jwt exp claim and the expires_at column can only hold those"""
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    return now + timedelta(minutes=int(MAPP_AUTH_LOGIN_EXPIRATION_MINUTES))
+
+def _decode_access_token(ctx:dict, token:str) -> tuple[str, str, int]:
     """
-    Parse and validate an access token, returning the associated User.
-    if session is invalid or expired, raises AuthenticationError.
+    Decode an access token, returning (user_id, jti, exp).
+    if the token is invalid or expired, raises AuthenticationError.
     """
     try:
         payload = jwt.decode(token, MAPP_AUTH_SECRET_KEY, algorithms=['HS256'])
@@ -151,14 +266,33 @@ def _parse_access_token(ctx:dict, token:str) -> tuple[User, str]:
         
     if time.time() > exp:
 
-        ctx.db.cursor.execute(
-            'DELETE FROM auth_user_session WHERE id = ? AND user_id = ?',
-            (jti, user_id)
-        )
-        ctx.db.commit()
+        # the error rolls back the request's unit of work, so delete after it ends
+        def delete_session():
+            ctx.db.cursor.execute(
+                'DELETE FROM auth_user_session WHERE id = ? AND user_id = ?',
+                (jti, user_id)
+            )
+            ctx.db.commit()
+
+        ctx.db.call_after_unit(delete_session)
 
         raise AuthenticationError('Session has expired')
-    
+
+    return user_id, jti, exp
+
+def _forget_current_user(ctx:dict) -> None:
+    """drop the user memoized by current_user after its sessions change"""
+    request_memo = getattr(ctx, 'request_memo', None)
+    if request_memo is not None:
+        request_memo.pop('current_user', None)
+
+def _parse_access_token(ctx:dict, token:str) -> tuple[User, str]:
+    """
+    Parse and validate an access token, returning the associated User.
+    if session is invalid or expired, raises AuthenticationError.
+    """
+    user_id, jti, _exp = _decode_access_token(ctx, token)
+
     # check session exists #
 
     session_result = ctx.db.cursor.execute(
@@ -184,6 +318,93 @@ def _parse_access_token(ctx:dict, token:str) -> tuple[User, str]:
 
     return user, jti
 
+#
+# session cache
+#
+
+"""
+current_user caches the user of each verified access token in a per worker LRU cache
+on the connection's DBContext for MAPP_AUTH_SESSION_CACHE_SECONDS, skipping the token
+signature check and the session query on a hit. Token expiry is still checked on every
+hit. Revoking sessions (logout, delete_user, drop_sessions) or changing the cached
+user bumps the version in auth_revocation, which every worker reads on each lookup
+and clears its cache when it changed. The cached name, email and number_of_sessions
+can otherwise be up to MAPP_AUTH_SESSION_CACHE_SECONDS old.
+"""
+
+@dataclass
+class SessionCache:
+    size: int
+    ttl: float                          # seconds
+    revocation_version: Optional[int] = None
+    entries: OrderedDict = field(default_factory=OrderedDict)  # access token -> (expires, exp, user)
+    hits: int = 0
+    misses: int = 0
+
+    def get(self, access_token: str) -> Optional[dict]:
+        entry = self.entries.get(access_token)
+        if entry is None or entry[0] < time.monotonic() or time.time() > entry[1]:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(access_token)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, access_token: str, exp: int, user: dict) -> None:
+        self.entries[access_token] = (time.monotonic() + self.ttl, exp, user)
+        self.entries.move_to_end(access_token)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+def _revocation_version(ctx: MappContext) -> int:
+    try:
+        row = ctx.db.cursor.execute('SELECT version FROM auth_revocation WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        # created by the first revocation
+        return 0
+    return 0 if row is None else row[0]
+
+def _session_cache(ctx: MappContext) -> Optional[SessionCache]:
+    """the worker's session cache, cleared if another worker revoked sessions, or None if disabled"""
+    if MAPP_AUTH_SESSION_CACHE_SECONDS <= 0:
+        return None
+
+    cache = getattr(ctx.db, 'session_cache', None)
+    if cache is None:
+        cache = SessionCache(size=MAPP_AUTH_SESSION_CACHE_SIZE, ttl=MAPP_AUTH_SESSION_CACHE_SECONDS)
+        ctx.db.session_cache = cache
+
+    version = _revocation_version(ctx)
+    if version != cache.revocation_version:
+        cache.entries.clear()
+        cache.revocation_version = version
+
+    return cache
+
+def _revoke_cached_sessions(ctx: MappContext) -> None:
+    """
+    clear every worker's session cache, called with the write that revokes sessions
+    or changes a user so it commits with it
+    """
+    ctx.db.cursor.execute('CREATE TABLE IF NOT EXISTS auth_revocation (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)')
+    ctx.db.cursor.execute(
+        'INSERT INTO auth_revocation (id, version) VALUES (1, 1) ON CONFLICT (id) DO UPDATE SET version = version + 1'
+    )
+
+    cache = getattr(ctx.db, 'session_cache', None)
+    if cache is not None:
+        cache.entries.clear()
+        cache.revocation_version = None
+
+    _forget_current_user(ctx)
+
+def session_cache_stats(ctx: MappContext) -> Optional[dict]:
+    """size, entries, hits and misses of the worker's session cache, None if it is not in use"""
+    cache = getattr(ctx.db, 'session_cache', None)
+    if cache is None:
+        return None
+    return {'size': cache.size, 'entries': len(cache.entries), 'hits': cache.hits, 'misses': cache.misses}
+
 #
 # external
 #
@@ -331,13 +552,15 @@ def login_user(ctx: MappContext, email: str, password: str) -> dict:
     email = email.strip().lower()
     password = password
     user_id = _check_user_credentials(ctx, email, password)
-    token, token_type, jti = _create_access_token(user_id)
+    expires = _session_expires_at()
+    token, token_type, jti = _create_access_token(user_id, expires)
     # Create session record
     ctx.db.cursor.execute(
-        'INSERT INTO auth_user_session (id, user_id, created_at) VALUES (?, ?, ?)',
-        (jti, user_id, datetime.now(timezone.utc))
+        'INSERT INTO auth_user_session (id, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)',
+        (jti, user_id, datetime.now(timezone.utc), datetime_for_db(expires))
     )
     ctx.db.commit()
+    _forget_current_user(ctx)
     return {
         'type': 'struct',
         'value': {
@@ -398,6 +621,10 @@ def current_user(ctx: MappContext) -> dict:
             name: str - The name of the current user.
             email: str - The email of the current user.
             number_of_sessions: int - The number of active sessions for the current user.
+
+    The user is resolved with one query and memoized in ctx.request_memo for the
+    rest of the request, keyed by the access token. Between requests it is kept in
+    the worker's session cache, see SessionCache.
     """
     try:
         get_access_token = ctx.current_access_token
@@ -414,28 +641,56 @@ def current_user(ctx: MappContext) -> dict:
         ctx.log('Not logged in - (a) - no access token found')
         raise AuthenticationError('Not logged in')
 
-    user, _jti = _parse_access_token(ctx, access_token)
-    
-    number_of_sessions = ctx.db.cursor.execute(
-        'SELECT COUNT(*) FROM auth_user_session WHERE user_id = ?', (user.id,)
-    ).fetchone()[0]
+    # memoized for this request #
 
-    email_verified_result = ctx.db.cursor.execute(
-        'SELECT email_verified FROM auth_user WHERE id = ?', (user.id,)
+    request_memo = getattr(ctx, 'request_memo', None)
+    if request_memo is not None:
+        try:
+            memo_token, memo_user = request_memo['current_user']
+            if memo_token == access_token:
+                return {'type': 'struct', 'value': dict(memo_user)}
+        except KeyError:
+            pass
+
+    # worker session cache #
+
+    cache = _session_cache(ctx)
+    user = None if cache is None else cache.get(access_token)
+    if user is not None:
+        if request_memo is not None:
+            request_memo['current_user'] = (access_token, user)
+        return {'type': 'struct', 'value': dict(user)}
+
+    # session and user in one query #
+
+    user_id, jti, exp = _decode_access_token(ctx, access_token)
+
+    user_result = ctx.db.cursor.execute(
+        'SELECT u.id, u.name, u.email, u.email_verified, '
+        '(SELECT COUNT(*) FROM auth_user_session WHERE user_id = u.id) '
+        'FROM auth_user_session s JOIN auth_user u ON u.id = s.user_id '
+        'WHERE s.id = ? AND s.user_id = ?',
+        (jti, user_id)
     ).fetchone()
-    email_verified = bool(email_verified_result[0]) if email_verified_result and email_verified_result[0] is not None else False
 
-    return {
-        'type': 'struct',
-        'value': {
-            'id': user.id,
-            'name': user.name,
-            'email': user.email,
-            'email_verified': email_verified,
-            'number_of_sessions': number_of_sessions
-        }
+    if user_result is None:
+        raise AuthenticationError('Invalid session token')
+
+    user = {
+        'id': str(user_result[0]),
+        'name': user_result[1],
+        'email': user_result[2],
+        'email_verified': bool(user_result[3]) if user_result[3] is not None else False,
+        'number_of_sessions': user_result[4]
     }
 
+    if cache is not None:
+        cache.put(access_token, exp, user)
+    if request_memo is not None:
+        request_memo['current_user'] = (access_token, user)
+
+    return {'type': 'struct', 'value': dict(user)}
+
 def logout_user(ctx: MappContext, mode: str) -> dict:
     """
     Log out a user in the auth module.
@@ -486,6 +741,7 @@ def logout_user(ctx: MappContext, mode: str) -> dict:
             raise MappError('INVALID_LOGOUT_MODE', f'Unknown logout mode: {mode}')
         
     ctx.db.cursor.execute(sql, values)
+    _revoke_cached_sessions(ctx)
     ctx.db.commit()
     return {
         'type': 'struct',
@@ -527,6 +783,7 @@ def delete_user(ctx: MappContext) -> dict:
     ctx.db.cursor.execute(
         'DELETE FROM auth_user WHERE id = ?', (user.id,)
     )
+    _revoke_cached_sessions(ctx)
     ctx.db.commit()
     return {
         'type': 'struct',
@@ -554,6 +811,7 @@ def drop_sessions(ctx: MappContext, root_password: str) -> dict:
     ctx.db.cursor.execute(
         'DELETE FROM auth_user_session'
     )
+    _revoke_cached_sessions(ctx)
     ctx.db.commit()
     return {
         'type': 'struct',
@@ -562,3 +820,56 @@ def drop_sessions(ctx: MappContext, root_password: str) -> dict:
             'message': 'All sessions dropped successfully'
         }
     }
+
+def sweep_sessions(ctx: MappContext, batch_size: int = 1000) -> dict:
+    """
+    Delete expired user sessions, batch_size rows per transaction so writers are
+    only blocked briefly. Sessions created before expires_at was stored are expired
+    by created_at and MAPP_AUTH_LOGIN_EXPIRATION_MINUTES. Expired tokens already fail
+    to decode, so the session cache is not revoked.
+    ctx: MappContext - The application context.
+    batch_size: int - Number of sessions deleted per transaction
+
+    return: dict
+        type: struct
+        value: dict with keys:
+            acknowledged: bool - Whether the operation was successful.
+            message: str - Confirmation message of operation.
+            deleted: int - Number of expired sessions deleted.
+    """
+
+    if batch_size < 1:
+        raise MappValidationError('Invalid batch size', {'batch_size': 'must be at least 1'})
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    legacy_cutoff = now - timedelta(minutes=int(MAPP_AUTH_LOGIN_EXPIRATION_MINUTES))
+
+    # expires_at is stored by datetime_for_db, created_at by the sqlite3 default datetime adapter #
+
+    sweeps = [
+        ('expires_at < ?', datetime_for_db(now)),
+        ('expires_at IS NULL AND created_at < ?', legacy_cutoff.isoformat(' ')),
+    ]
+
+    deleted = 0
+    for condition, cutoff in sweeps:
+        while True:
+            cursor = ctx.db.cursor.execute(
+                f'DELETE FROM auth_user_session WHERE id IN (SELECT id FROM auth_user_session WHERE {condition} LIMIT ?)',
+                (cutoff, batch_size)
+            )
+            # the cli runs ops in a unit of work, each batch is still its own transaction
+            ctx.db.commit_batch()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+
+    ctx.log(f'sweep_sessions - {deleted=}')
+    return {
+        'type': 'struct',
+        'value': {
+            'acknowledged': True,
+            'message': f'Deleted {deleted} expired sessions',
+            'deleted': deleted
+        }
+    }
@@ -10,6 +10,7 @@ from email.mime.multipart import MIMEMultipart
 from mapp.auth import (
     current_user, 
     _get_password_hash, 
+    _revoke_cached_sessions, 
     _verify_password,
     EMAIL_REGEX,
     MAPP_AUTH_NEW_ACCOUNT_BY_INVITE_ONLY,
@@ -205,6 +206,8 @@ def verify_email_address(ctx: MappContext, code: str) -> dict:
         'DELETE FROM com_email_verifications WHERE id = ?',
         (matched_id,)
     )
+    # cached users have email_verified false
+    _revoke_cached_sessions(ctx)
     ctx.db.commit()
 
     return {
@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import base64
 import atexit
@@ -6,33 +7,180 @@ import sqlite3
 import getpass
 
 from pathlib import Path
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from typing import Optional, Callable
 from cryptography.fernet import Fernet
 
 from mapp.errors import MappError
 from mapp.types import convert_dict_to_op_params, convert_dict_to_model, CurrentAccessTokenFunc
-from mspec.core import load_mapp_spec
+from mspec.core import load_mapp_spec, PROJECT_DB_PRAGMAS
 
 __all__ = [
     'DEFAULT_DB_PATH',
+    'DB_PROFILES',
     'DBContext',
     'ModelRouteContext',
     'RequestContext',
     'MappContext',
+    'apply_db_profile',
     'get_context_from_env'
 ]
 
 MAPP_APP_PATH = Path(os.getenv('MAPP_APP_PATH', os.getcwd()))
 DEFAULT_DB_PATH = Path(MAPP_APP_PATH) / 'db.sqlite3'
 
+# pragmas applied on connect for each project db.profile, busy_timeout defaults
+# to MAPP_DB_TIMEOUT for every profile
+
+DB_PROFILES = {
+    'default': {},
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    },
+}
+
 
 @dataclass
 class DBContext:
+    """
+    commit() is deferred while a unit of work is open: the unit commits once when
+    it ends successfully or rolls back everything written inside it on error.
+    Outside a unit of work commit() commits immediately as before.
+
+    inside a unit each write operation runs in its own savepoint (see savepoint()),
+    so rollback() undoes only that operation's partial writes
+    """
     db_url: str
     connection: sqlite3.Connection
     cursor: sqlite3.Cursor
     commit: callable
+    profile: str = 'default'
+    pragmas: dict = field(default_factory=dict)
+    commit_count: int = 0
+    deferred_commit_count: int = 0
+    unit_of_work_depth: int = 0
+    savepoints: list = field(default_factory=list)
+    after_unit: list = field(default_factory=list)      # see call_after_unit
+    model_caches: dict = field(default_factory=dict)    # table name -> ModelReadCache, see mapp.module.model.db
+    data_version: Optional[int] = None                  # PRAGMA data_version when the model caches were last checked
+    session_cache: Optional[object] = None              # mapp.auth.SessionCache, created by the first current_user
+
+    def __post_init__(self):
+        self.connection_commit = self.commit
+        self.commit = self._commit
+
+    def _commit(self):
+        if self.unit_of_work_depth > 0:
+            self.deferred_commit_count += 1
+        else:
+            self.connection_commit()
+            self.commit_count += 1
+
+    def commit_batch(self):
+        """
+        commit now even inside a unit of work, for batched writes that should not hold
+        the write lock until the unit ends. Anything written earlier in the unit is
+        committed with the batch. Inside a write op's savepoint this defers like commit()
+        """
+        if self.savepoints:
+            self._commit()
+            return
+        self.connection_commit()
+        self.commit_count += 1
+
+    def rollback(self):
+        """
+        roll back outside of a unit of work, inside one roll back to the innermost
+        savepoint so the rest of the unit is kept
+        """
+        if self.unit_of_work_depth == 0:
+            self.connection.rollback()
+        elif self.savepoints:
+            self.connection.execute(f'ROLLBACK TO {self.savepoints[-1]}')
+
+    @contextmanager
+    def savepoint(self):
+        """
+        inside a unit of work run the block in its own savepoint, which is rolled back
+        if the block raises, outside of one the block runs as is
+        """
+        if self.unit_of_work_depth == 0:
+            yield self
+            return
+
+        # a savepoint outside of a transaction would commit on release
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN')
+
+        name = f'mapp_unit_{len(self.savepoints)}'
+        self.connection.execute(f'SAVEPOINT {name}')
+        self.savepoints.append(name)
+        try:
+            yield self
+        except BaseException:
+            self.connection.execute(f'ROLLBACK TO {name}')
+            raise
+        finally:
+            self.savepoints.pop()
+            self.connection.execute(f'RELEASE {name}')
+
+    def begin_unit_of_work(self):
+        self.unit_of_work_depth += 1
+
+    def end_unit_of_work(self, commit:bool):
+        """end a unit of work, only the outermost unit commits or rolls back"""
+        self.unit_of_work_depth -= 1
+        if self.unit_of_work_depth > 0:
+            return
+
+        try:
+            if not commit:
+                self.connection.rollback()
+                return
+
+            try:
+                self.connection_commit()
+                self.commit_count += 1
+            except Exception:
+                self.connection.rollback()
+                raise
+
+        finally:
+            after_unit, self.after_unit = self.after_unit, []
+            for func in after_unit:
+                func()
+
+    def call_after_unit(self, func:Callable[[], None]):
+        """
+        call func once the outermost unit of work has committed or rolled back, for writes
+        that must be kept even if the unit fails. Outside of a unit func is called now
+        """
+        if self.unit_of_work_depth == 0:
+            func()
+        else:
+            self.after_unit.append(func)
+
+    @contextmanager
+    def unit_of_work(self):
+        self.begin_unit_of_work()
+        try:
+            yield self
+        except BaseException:
+            self.end_unit_of_work(commit=False)
+            raise
+        self.end_unit_of_work(commit=True)
 
 
 @dataclass
@@ -49,8 +197,8 @@ class ModelRouteContext:
     model_class: type
     model_kebab_case: str
     module_kebab_case: str
-    api_instance_regex: str
-    api_model_regex: str
+    api_instance_path: str
+    api_model_path: str
 
 
 @dataclass
@@ -59,7 +207,7 @@ class OpRouteContext:
     output_class: type
     op_kebab_case: str
     module_kebab_case: str
-    api_op_regex: str
+    api_op_path: str
     run_op: callable
     run_op_args: tuple
 
@@ -82,14 +230,49 @@ class MappContext:
     log:Callable[[str], None]
     current_access_token:Optional[CurrentAccessTokenFunc]=None
     self: dict = field(default_factory=dict)
+    request_memo: dict = field(default_factory=dict)    # values resolved once per request, ie: mapp.auth.current_user, shared with copies of the context
+
+def apply_db_profile(connection:sqlite3.Connection, profile:str='default', pragmas:Optional[dict]=None, timeout:float=20) -> dict:
+    """
+    apply the pragmas of a DB_PROFILES entry plus any overrides to a connection,
+    returns the pragma values read back from the connection
+    """
+
+    try:
+        settings = dict(DB_PROFILES[profile])
+    except KeyError:
+        raise MappError('INVALID_DB_PROFILE', f'Unknown db profile: {profile}, expected one of {tuple(DB_PROFILES)}')
+
+    settings.setdefault('busy_timeout', int(timeout * 1000))
+    settings.update(pragmas or {})
+
+    for pragma, value in settings.items():
+        if pragma not in PROJECT_DB_PRAGMAS:
+            raise MappError('INVALID_DB_PRAGMA', f'Unsupported db pragma: {pragma}')
+        if not re.fullmatch(r'-?\w+', str(value)):
+            raise MappError('INVALID_DB_PRAGMA', f'Invalid value for db pragma {pragma}: {value}')
+        # journal_mode returns a row, fetch to finish the statement
+        connection.execute(f'PRAGMA {pragma} = {value}').fetchall()
 
-def get_context_from_env():
+    return {pragma: connection.execute(f'PRAGMA {pragma}').fetchone()[0] for pragma in PROJECT_DB_PRAGMAS}
+
+def get_context_from_env(spec:Optional[dict]=None):
+    """
+    the db profile is read from MAPP_DB_PROFILE if set, otherwise from the
+    spec's project db section, pragma overrides only come from the spec
+    """
+
+    project_db = spec['project'].get('db', {}) if spec is not None else {}
+    db_profile = os.environ.get('MAPP_DB_PROFILE', project_db.get('profile', 'default'))
+    db_timeout = float(os.environ.get('MAPP_DB_TIMEOUT', 20))
 
     # db_url = os.getenv('MAPP_DB_URL', f'file:{DEFAULT_DB_PATH}')
     db_url = os.environ['MAPP_DB_URL']
-    db_conn = sqlite3.connect(db_url, uri=True, timeout=os.environ.get('MAPP_DB_TIMEOUT', 20))
+    db_conn = sqlite3.connect(db_url, uri=True, timeout=db_timeout)
     atexit.register(lambda: db_conn.close())
 
+    db_pragmas = apply_db_profile(db_conn, db_profile, project_db.get('pragmas'), timeout=db_timeout)
+
     client_host = os.getenv('MAPP_CLIENT_HOST', 'http://localhost:8000')
 
     return MappContext(
@@ -104,6 +287,8 @@ def get_context_from_env():
             connection=db_conn,
             cursor=db_conn.cursor(),
             commit=db_conn.commit,
+            profile=db_profile,
+            pragmas=db_pragmas,
         )
     )
 
@@ -1,7 +1,19 @@
+import sqlite3
+
 from mapp.context import MappContext
 from mapp.errors import MappError
 from mapp.types import new_model_class, Acknowledgment
-from mapp.module.model.db import db_model_create_table
+from mspec.core import MODEL_QUERY_OPERATORS
+from mapp.module.model.db import db_model_create_table, db_model_column_plan, db_model_index_plan, db_model_migrate_datetime, model_plan, _query_where, _query_order_keys
+
+
+__all__ = [
+    'create_tables',
+    'create_tables_plan',
+    'migrate_datetime_storage',
+    'explain_queries'
+]
+
 
 def create_tables(ctx: MappContext, spec: dict) -> Acknowledgment:
     try:
@@ -22,3 +34,342 @@ def create_tables(ctx: MappContext, spec: dict) -> Acknowledgment:
                 raise MappError('TABLE_CREATION_FAILED', f'Failed to create table for model: {model_class._model_spec["name"]["kebab_case"]}')
     
     return Acknowledgment(message='All tables created or already existed.')
+
+def create_tables_plan(ctx: MappContext, spec: dict) -> dict[str, list[str]]:
+    """
+    return the column and index DDL create_tables would apply for each model without changing the db,
+    as {table_name: [sql, ...]}, models without pending changes are omitted
+    """
+    try:
+        spec_modules = spec['modules']
+    except KeyError:
+        raise MappError('NO_MODULES_DEFINED', 'No modules defined in the spec file.')
+
+    plan = {}
+    for module in spec_modules.values():
+        for model in module.get('models', {}).values():
+            model_class = new_model_class(spec, model, module)
+            statements = db_model_column_plan(ctx, model_class) + db_model_index_plan(ctx, model_class)
+            if statements:
+                plan[model_plan(model_class).table_name] = statements
+
+    return plan
+
+def migrate_datetime_storage(ctx: MappContext, spec: dict) -> dict[str, str]:
+    """
+    convert the tables of every model whose stored datetimes do not match its
+    db.datetime_storage, returns {table_name: message}, tables that do not exist are skipped
+    """
+    try:
+        spec_modules = spec['modules']
+    except KeyError:
+        raise MappError('NO_MODULES_DEFINED', 'No modules defined in the spec file.')
+
+    results = {}
+    for module in spec_modules.values():
+        for model in module.get('models', {}).values():
+            model_class = new_model_class(spec, model, module)
+            table_name = model_plan(model_class).table_name
+            try:
+                results[table_name] = db_model_migrate_datetime(ctx, model_class).message
+            except MappError as e:
+                if e.code != 'TABLE_NOT_FOUND':
+                    raise
+                results[table_name] = e.error_message
+
+    return results
+
+#
+# query plan inspector
+#
+
+"""
+explain_queries replays the query shapes a spec can produce against the db with
+EXPLAIN QUERY PLAN: every db.query / db.delete_where / db.unique_counts call (and
+their include / unique_counts joins) found in the spec's ops and fields plus any
+extra lingo page specs, the default model list page and the builtin file system
+list queries. Each statement is flagged for full table scans and temp b-trees,
+and flagged spec queries get a suggested index in db.indexes syntax.
+"""
+
+_EXPLAIN_DB_CALLS = ('db.query', 'db.delete_where', 'db.unique_counts', 'db.read')
+
+# operands that produce the same sql shape as a real value, other operators use None
+_EXPLAIN_OPERANDS = {'in': [None], 'not_in': [None], 'prefix': 'a', 'is_null': True, 'search': 'a'}
+
+
+def _explain_literal(expr):
+    if isinstance(expr, (str, int, float, bool)):
+        return expr
+    if isinstance(expr, dict) and 'type' in expr and 'value' in expr and not isinstance(expr['value'], (dict, list)):
+        return expr['value']
+    return None
+
+def _explain_struct(expr) -> dict | None:
+    if not isinstance(expr, dict):
+        return None
+    if expr.get('type') == 'struct' and isinstance(expr.get('value'), dict):
+        return expr['value']
+    if 'call' in expr or 'params' in expr or 'self' in expr or 'state' in expr:
+        return None
+    return expr
+
+def _explain_list(expr) -> list | None:
+    if isinstance(expr, list):
+        return expr
+    if isinstance(expr, dict) and expr.get('type') == 'list' and isinstance(expr.get('value'), list):
+        return expr['value']
+    return None
+
+def _explain_where(where_expr, legacy_fields:bool=False) -> list[tuple[str, str]]:
+    where = _explain_struct(where_expr) or {}
+    conditions = []
+    for field_name, condition in where.items():
+        if isinstance(condition, dict) and len(condition) == 1 and next(iter(condition)) in MODEL_QUERY_OPERATORS:
+            conditions.append((field_name, next(iter(condition))))
+        elif legacy_fields:
+            conditions.append((field_name, 'eq'))
+    return conditions
+
+def _explain_sort(sort_expr) -> list[tuple[str, str]]:
+    sort = []
+    for sort_spec in _explain_list(sort_expr) or []:
+        sort_spec = _explain_struct(sort_spec) or {}
+        field_name = _explain_literal(sort_spec.get('field'))
+        order = _explain_literal(sort_spec.get('order'))
+        if isinstance(field_name, str) and isinstance(order, str):
+            sort.append((field_name, order.lower()))
+    return sort
+
+def _explain_join_shapes(source:str, join_expr, shapes:list[dict], model_joins:dict | None = None) -> None:
+    """include and unique_counts joins, includes may name one of the model's db.joins"""
+    join_name = _explain_literal(join_expr)
+    join = {'join': join_name} if isinstance(join_name, str) else _explain_struct(join_expr) or {}
+    if 'join' in join:
+        join = {**(model_joins or {}).get(_explain_literal(join['join']), {}), **join}
+
+    model_type = _explain_literal(join.get('model_type'))
+    foreign_field = _explain_literal(join.get('foreign_field'))
+    if model_type is None or foreign_field is None or foreign_field == 'id':
+        return
+    shapes.append({
+        'source': source,
+        'model_type': model_type,
+        'where': [(foreign_field, 'in')],
+        'sort': [],
+        'group_by': _explain_literal(join.get('group_by')),
+    })
+
+def _collect_query_shapes(node, source:str, shapes:list[dict], spec_modules:dict | None = None) -> None:
+    """walk a spec and collect the where/sort/group by shape of each db call"""
+
+    if isinstance(node, list):
+        for index, item in enumerate(node):
+            _collect_query_shapes(item, f'{source}[{index}]', shapes, spec_modules)
+        return
+
+    if not isinstance(node, dict):
+        return
+
+    call = node.get('call')
+    args = node.get('args')
+    if call in _EXPLAIN_DB_CALLS and isinstance(args, dict):
+        call_source = f'{source} ({call})'
+        model_type = _explain_literal(args.get('model_type'))
+
+        if model_type is not None and call in ('db.query', 'db.delete_where'):
+            legacy_fields = 'where' not in args
+            shapes.append({
+                'source': call_source,
+                'model_type': model_type,
+                'where': _explain_where(args.get('where', args.get('fields')), legacy_fields=legacy_fields),
+                'sort': _explain_sort(args.get('sort')),
+                'group_by': None,
+            })
+
+        elif model_type is not None and call == 'db.unique_counts':
+            shapes.append({
+                'source': call_source,
+                'model_type': model_type,
+                'where': [(field_name, 'eq') for field_name in (_explain_struct(args.get('filters')) or {})],
+                'sort': [],
+                'group_by': _explain_literal(args.get('group_by')),
+            })
+
+        if 'include' in args:
+            model_joins = None
+            if isinstance(model_type, str) and model_type.count('.') == 1:
+                module_key, model_key = model_type.split('.')
+                model_spec = (spec_modules or {}).get(module_key, {}).get('models', {}).get(model_key, {})
+                model_joins = model_spec.get('db', {}).get('joins')
+            _explain_join_shapes(f'{call_source} include', args['include'], shapes, model_joins)
+
+        for unique_count in _explain_list(args.get('unique_counts')) or []:
+            _explain_join_shapes(f'{call_source} unique_counts', unique_count, shapes)
+
+    for key, value in node.items():
+        _collect_query_shapes(value, f'{source}.{key}', shapes, spec_modules)
+
+def _explain_plan(ctx: MappContext, sql:str, params:tuple=()) -> list[str]:
+    rows = ctx.db.cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    return [row[-1] for row in rows]
+
+def _explain_flags(plan:list[str], filtered:bool) -> list[str]:
+    flags = []
+    for detail in plan:
+        if filtered and detail.startswith('SCAN ') and 'full_scan' not in flags:
+            flags.append('full_scan')
+        # a temp b-tree for the right part of an order by only sorts rows with equal
+        # leading keys (ie. the id tie breaker) and can stream under a limit
+        if 'USE TEMP B-TREE' in detail and 'RIGHT PART' not in detail and 'temp_b_tree' not in flags:
+            flags.append('temp_b_tree')
+    return flags
+
+def _explain_suggested_index(model_spec:dict, table_name:str, shape:dict) -> dict | None:
+    """equality fields first, then range fields, then sort or group by fields"""
+    fields = []
+    for field_name, operator in shape['where']:
+        if operator in ('eq', 'in', 'is_null') and field_name not in fields:
+            fields.append(field_name)
+    for field_name, operator in shape['where']:
+        if operator in ('lt', 'le', 'gt', 'ge', 'prefix') and field_name not in fields:
+            fields.append(field_name)
+    for field_name, _ in shape['sort']:
+        if field_name != 'id' and field_name not in fields:
+            fields.append(field_name)
+    if shape['group_by'] is not None and shape['group_by'] not in fields:
+        fields.append(shape['group_by'])
+
+    if not fields:
+        return None
+
+    for index in model_spec.get('db', {}).get('indexes', []):
+        if index['fields'][:len(fields)] == fields:
+            return None
+
+    return {'name': f'idx_{table_name}_{"_".join(fields)}', 'fields': fields}
+
+def _explain_shape(ctx: MappContext, spec: dict, shape: dict) -> list[dict]:
+    try:
+        module_key, model_key = shape['model_type'].split('.')
+        model = spec['modules'][module_key]['models'][model_key]
+    except (ValueError, KeyError):
+        return [{'source': shape['source'], 'error': f'model not found: {shape["model_type"]}'}]
+
+    model_class = new_model_class(spec, model, spec['modules'][module_key])
+    table_name = model_plan(model_class).table_name
+
+    try:
+        where = {field_name: {operator: _EXPLAIN_OPERANDS.get(operator)} for field_name, operator in shape['where']}
+        where_parts, where_values = _query_where(model_class, where)
+        where_clause = f" WHERE {' AND '.join(where_parts)}" if where_parts else ''
+
+        if shape['group_by'] is not None:
+            statements = [f'SELECT {shape["group_by"]}, COUNT(*) FROM {table_name}{where_clause} GROUP BY {shape["group_by"]}']
+        else:
+            order_keys = _query_order_keys(model_class._model_spec, [{'field': f, 'order': o} for f, o in shape['sort']])
+            order_clause = ' ORDER BY ' + ', '.join(f'{field_name} {direction}' for field_name, direction in order_keys)
+            statements = [f'SELECT * FROM {table_name}{where_clause}{order_clause} LIMIT ? OFFSET ?']
+            if where_parts:
+                statements.append(f'SELECT COUNT(*) FROM {table_name}{where_clause}')
+
+    except ValueError as e:
+        return [{'source': shape['source'], 'error': str(e)}]
+
+    filtered = bool(shape['where']) or shape['group_by'] is not None
+    entries = []
+    for sql in statements:
+        try:
+            plan = _explain_plan(ctx, sql, tuple(where_values) + (None,) * (sql.count('?') - len(where_values)))
+        except sqlite3.Error as e:
+            entries.append({'source': shape['source'], 'sql': sql, 'error': str(e)})
+            continue
+
+        flags = _explain_flags(plan, filtered)
+        entries.append({
+            'source': shape['source'],
+            'sql': sql,
+            'plan': plan,
+            'flags': flags,
+            'suggested_index': _explain_suggested_index(model_class._model_spec, table_name, shape) if flags else None,
+        })
+
+    return entries
+
+def _explain_builtin_queries(ctx: MappContext, spec: dict) -> list[dict]:
+    """run the builtin file system list queries with each filter and explain the captured sql"""
+
+    if 'file_system' not in spec['modules']:
+        return []
+
+    from mapp.file_system import list_files, list_parts
+
+    calls = [
+        ('file_system.list_files', list_files, {}),
+        ('file_system.list_files user_id', list_files, {'user_id': '1'}),
+        ('file_system.list_files file_id', list_files, {'file_id': '1'}),
+        ('file_system.list_files status', list_files, {'status': 'good'}),
+        ('file_system.list_parts file_id', list_parts, {'file_id': '1'}),
+        ('file_system.list_parts user_id', list_parts, {'user_id': '1'}),
+    ]
+
+    entries = []
+    for source, func, kwargs in calls:
+        statements = []
+        ctx.db.connection.set_trace_callback(statements.append)
+        try:
+            func(ctx, **kwargs)
+        except sqlite3.Error as e:
+            entries.append({'source': source, 'error': str(e)})
+            continue
+        finally:
+            ctx.db.connection.set_trace_callback(None)
+
+        for sql in statements:
+            sql = ' '.join(sql.split())
+            plan = _explain_plan(ctx, sql)
+            flags = _explain_flags(plan, filtered=bool(kwargs))
+            entries.append({'source': source, 'sql': sql, 'plan': plan, 'flags': flags, 'suggested_index': None})
+
+    return entries
+
+def explain_queries(ctx: MappContext, spec: dict, page_specs: dict[str, dict] | None = None) -> list[dict]:
+    """
+    explain the queries a spec can produce, page_specs is an optional {name: lingo page spec}
+    to scan for db calls in addition to the spec, returns a list of entries:
+    {source, sql, plan, flags, suggested_index} or {source, error}
+    """
+    try:
+        spec_modules = spec['modules']
+    except KeyError:
+        raise MappError('NO_MODULES_DEFINED', 'No modules defined in the spec file.')
+
+    shapes = []
+
+    for module_key, module in spec_modules.items():
+        for model_key, model in module.get('models', {}).items():
+            shapes.append({'source': f'{module_key}.{model_key} list', 'model_type': f'{module_key}.{model_key}', 'where': [], 'sort': [], 'group_by': None})
+            _collect_query_shapes(model.get('fields', {}), f'{module_key}.{model_key}.fields', shapes, spec_modules)
+
+        _collect_query_shapes(module.get('ops', {}), f'{module_key}.ops', shapes, spec_modules)
+
+    for page_name, page_spec in (page_specs or {}).items():
+        _collect_query_shapes(page_spec, page_name, shapes, spec_modules)
+
+    # merge duplicate shapes from multiple sources #
+
+    merged = {}
+    for shape in shapes:
+        key = (shape['model_type'], tuple(shape['where']), tuple(shape['sort']), shape['group_by'])
+        if key in merged:
+            merged[key]['source'] += f', {shape["source"]}'
+        else:
+            merged[key] = dict(shape)
+
+    entries = []
+    for shape in merged.values():
+        entries.extend(_explain_shape(ctx, spec, shape))
+
+    entries.extend(_explain_builtin_queries(ctx, spec))
+
+    return entries
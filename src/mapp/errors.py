@@ -77,6 +77,8 @@ class ResponseError(MappError):
             case 'VALIDATION_ERROR':
                 field_errors = data['error'].get('field_errors', {})
                 return MappValidationError(message, field_errors)
+            case 'SERVICE_UNAVAILABLE':
+                return ServiceUnavailableError(message)
             case _:
                 return ResponseError(message)
 
@@ -84,6 +86,10 @@ class ServerError(MappError):
     def __init__(self, message: str):
         super().__init__('SERVER_ERROR', message)
 
+class ServiceUnavailableError(MappError):
+    def __init__(self, message: str):
+        super().__init__('SERVICE_UNAVAILABLE', message)
+
 class NotFoundError(MappError):
     def __init__(self, message: str):
         super().__init__('NOT_FOUND', message)
@@ -1,12 +1,17 @@
 import os
+import time
+import secrets
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from hashlib import sha3_256
 from mimetypes import guess_type
 
 from mapp.auth import current_user
 from mapp.context import MappContext
 from mapp.errors import  MappValidationError, MappUserError, NotFoundError, MappError
-from mapp.types import File, FilePart, datetime_now_utc, datetime_for_db, datetime_from_db
+from mapp.module.op.http import http_run_op
+from mapp.types import File, FilePart, datetime_now_utc, datetime_for_db, datetime_from_db, new_op_classes, new_op_params
 
 __all__ = [
 	'ingest_start',
@@ -18,17 +23,28 @@ __all__ = [
 	'list_parts',
 	'get_part_content',
 	'get_file_content',
-	'process_file'
+	'process_file',
+	'http_ingest_file'
 ]
 
 MAPP_FILE_SYSTEM_REPO = os.getenv('MAPP_FILE_SYSTEM_REPO', '')
 FILE_SIZE_LIMIT = int(os.getenv('MAPP_FILE_SIZE_LIMIT', 50 * 1024 * 1024))
 OS_HANDLE_BUFFER_SIZE = int(os.getenv('MAPP_OS_HANDLE_BUFFER_SIZE', 8192))
+MAPP_FILE_PART_SIZE = int(os.getenv('MAPP_FILE_PART_SIZE', 8 * 1024 * 1024))		# the cli uploads files larger than this over http in parts of this size
+MAPP_FILE_UPLOAD_WORKERS = int(os.getenv('MAPP_FILE_UPLOAD_WORKERS', 4))		# parts the cli uploads at once
 
 """
 
 ./run.sh --log -fi ./tests/samples/lorem-document.pdf file-system ingest-start run '{"name": "lorem-document.pdf", "size": 142786, "parts": 1, "finish": true}'
 
+./run.sh --log -fi ./big-video.mp4 file-system ingest-start http '{"name": "big-video.mp4", "size": 734003200, "parts": 1, "finish": true}'	# split in parts over MAPP_FILE_PART_SIZE
+
+./run.sh file-system ingest-start run '{"name": "big.bin", "size": 20000000, "parts": 3}'
+
+./run.sh -fi ./big.bin.part-1 file-system ingest-part run '{"file_id": "", "part_number": 1, "sha3_256": ""}'
+
+./run.sh file-system ingest-finish run '{"file_id": ""}'
+
 ./run.sh file-system list-files run
 
 ./run.sh file-system list-parts run '{"file_id": ""}'
@@ -71,7 +87,12 @@ def _file_part_path(file_id: str, part_number: int) -> str:
 # low level ops
 #
 
-def _ingest_part(ctx: MappContext, part_number:int, file_input: bytes, file_record: File, user: dict) -> FilePart:
+def _ingest_part(ctx: MappContext, part_number:int, file_input: bytes, file_record: File, user: dict, expected_sha3_256: str = '') -> FilePart:
+	"""
+	write one part of a file. The part is written to a temp file and moved into place so it
+	is either complete or absent. Uploading a part number again is a retry: the same content
+	is acknowledged without writing it again, different content replaces the part.
+	"""
 	
 	part_size = len(file_input)
 	part_sha3_256 = sha3_256(file_input).hexdigest()
@@ -79,16 +100,40 @@ def _ingest_part(ctx: MappContext, part_number:int, file_input: bytes, file_reco
 	if part_size > FILE_SIZE_LIMIT:
 		raise MappUserError('FILE_PART_TOO_LARGE', f'File part size {part_size} exceeds limit of {FILE_SIZE_LIMIT} bytes')
 
+	if expected_sha3_256 and expected_sha3_256.lower() != part_sha3_256:
+		raise MappUserError('FILE_PART_CHECKSUM_MISMATCH', f'File part {part_number} has sha3_256 {part_sha3_256} but expected {expected_sha3_256}')
+
 	ctx.log(f'_ingest_part - begin - {file_record.id=} {part_number=} {part_size=} {part_sha3_256=}')
 
 	part_path = _file_part_path(str(file_record.id), part_number)
-	os.makedirs(os.path.dirname(part_path), exist_ok=True)
 
-	if os.path.exists(part_path):
-		raise MappUserError('FILE_PART_ALREADY_EXISTS', f'File part exists for file_id: {file_record.id} part_number: {part_number}')
+	existing = ctx.db.cursor.execute(
+		'SELECT id, sha3_256, user_id, uploaded_at FROM file_system_file_part WHERE file_id = ? AND part_number = ?',
+		(file_record.id, part_number)
+	).fetchone()
+
+	if existing is not None and existing[1] == part_sha3_256 and os.path.exists(part_path):
+		ctx.log(f'_ingest_part - already uploaded - {file_record.id=} {part_number=}')
+		return FilePart(
+			id=str(existing[0]),
+			file_id=file_record.id,
+			size=part_size,
+			part_number=part_number,
+			sha3_256=part_sha3_256,
+			user_id=str(existing[2]),
+			uploaded_at=existing[3]
+		)
 
-	with open(part_path, 'wb+') as f:
-		f.write(file_input)
+	os.makedirs(os.path.dirname(part_path), exist_ok=True)
+	tmp_path = f'{part_path}.{secrets.token_hex(8)}.tmp'
+	try:
+		with open(tmp_path, 'wb') as f:
+			f.write(file_input)
+		os.replace(tmp_path, part_path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
 
 	file_part = FilePart(
 		id=None,
@@ -104,6 +149,8 @@ def _ingest_part(ctx: MappContext, part_number:int, file_input: bytes, file_reco
 		"""
 		INSERT INTO file_system_file_part (file_id, size, part_number, sha3_256, user_id, uploaded_at)
 		VALUES (?, ?, ?, ?, ?, ?)
+		ON CONFLICT (file_id, part_number) DO UPDATE SET
+			size = excluded.size, sha3_256 = excluded.sha3_256, user_id = excluded.user_id, uploaded_at = excluded.uploaded_at
 		""",
 		(
 			file_part.file_id,
@@ -115,11 +162,16 @@ def _ingest_part(ctx: MappContext, part_number:int, file_input: bytes, file_reco
 		)
 	)
 
+	part_id = ctx.db.cursor.execute(
+		'SELECT id FROM file_system_file_part WHERE file_id = ? AND part_number = ?',
+		(file_part.file_id, file_part.part_number)
+	).fetchone()[0]
+
 	ctx.db.commit()
 
 	ctx.log(f'_ingest_part - complete - {file_record.id=}')
 
-	return file_part._replace(id=str(ctx.db.cursor.lastrowid))
+	return file_part._replace(id=str(part_id))
 
 def _list_parts(ctx: MappContext, file_id:str) -> list[FilePart]:
 	ctx.db.cursor.execute(
@@ -176,11 +228,13 @@ def _ingest_finish(ctx: MappContext, file_record: File) -> File:
 		updated_at=datetime_for_db(datetime_now_utc())
 	)
 
+	# only one finish can move the file out of ingesting #
+
 	ctx.db.cursor.execute(
 		"""
 		UPDATE file_system_file
 		SET status = ?, message = ?, updated_at = ?
-		WHERE id = ?
+		WHERE id = ? AND status = 'ingesting'
 		""",
 		(
 			file_record.status,
@@ -190,15 +244,28 @@ def _ingest_finish(ctx: MappContext, file_record: File) -> File:
 		)
 	)
 
+	if ctx.db.cursor.rowcount == 0:
+		raise MappUserError('FILE_NOT_INGESTING', f'File {file_record.id} is not ingesting, it may already be finished')
+
 	ctx.db.commit()
 
 	ctx.log(f'_ingest_finish - complete - {file_record.id=} {file_record.status=} {file_record.message=}')
 
 	return file_record
 
+def _parts_missing_error(file_record: File, missing: list[int], reason: str = '') -> MappUserError:
+	missing_str = ', '.join(str(part_number) for part_number in missing[:20]) + (' ...' if len(missing) > 20 else '')
+	msg = f'File {file_record.id} is missing {len(missing)} of {file_record.parts} parts: {missing_str}'
+	if reason:
+		msg += f' - {reason}'
+	return MappUserError('FILE_PARTS_MISSING', msg)
+
 def _process_file(ctx: MappContext, file_record: File) -> File:
 	"""
 	Assemble file from parts, compute sha3_256, update file_record, handle errors.
+	Each part is checked against its stored sha3_256, if one was replaced by another
+	upload its file is removed, the file goes back to ingesting and the part is reported
+	as missing.
 	"""
 	ctx.log(f'_process_file - begin - {file_record.id=}')
 	#
@@ -208,6 +275,7 @@ def _process_file(ctx: MappContext, file_record: File) -> File:
 	file_path = _file_path(file_record)
 	parts = _list_parts(ctx, file_record.id)
 	checksum = sha3_256()
+	mismatched = []
 
 	#
 	# copy data to single file and compute checksum
@@ -221,6 +289,7 @@ def _process_file(ctx: MappContext, file_record: File) -> File:
 		with open(file_path, 'wb') as full_file_handle:
 			for part in parts:
 				part_path = _file_part_path(file_record.id, part.part_number)
+				part_checksum = sha3_256()
 				with open(part_path, 'rb') as part_handle:
 					while True:
 						chunk = part_handle.read(OS_HANDLE_BUFFER_SIZE)
@@ -228,7 +297,10 @@ def _process_file(ctx: MappContext, file_record: File) -> File:
 							break
 						full_file_handle.write(chunk)
 						checksum.update(chunk)
-	
+						part_checksum.update(chunk)
+				if part_checksum.hexdigest() != part.sha3_256:
+					mismatched.append(part.part_number)
+
 	except Exception as e:
 
 		# handle error in process #
@@ -242,6 +314,28 @@ def _process_file(ctx: MappContext, file_record: File) -> File:
 	
 	else:
 
+		# parts replaced by a concurrent upload, keep ingesting so they can be uploaded again #
+
+		if mismatched:
+			os.remove(file_path)
+			for part_number in mismatched:
+				os.remove(_file_part_path(file_record.id, part_number))
+			ctx.db.cursor.execute(
+				"""
+				UPDATE file_system_file
+				SET status = 'ingesting', message = ?, updated_at = ?
+				WHERE id = ?
+				""",
+				(
+					f'Parts do not match their sha3_256: {", ".join(str(part_number) for part_number in mismatched)}',
+					datetime_for_db(datetime_now_utc()),
+					file_record.id
+				)
+			)
+			ctx.db.commit()
+			ctx.log(f'_process_file - parts mismatched - {file_record.id=} {mismatched=}')
+			raise _parts_missing_error(file_record, mismatched, 'their content does not match their sha3_256, upload them again')
+
 		# handle successful process #
 
 		file_record = file_record._replace(
@@ -285,6 +379,19 @@ def _get_file_record(ctx: MappContext, file_id: str) -> File:
 	except IndexError:
 		raise NotFoundError('FILE_NOT_FOUND', f'File not found for id: {file_id}')
 
+def _get_ingesting_file_record(ctx: MappContext, file_id: str, user: dict) -> File:
+	"""the user's file, if it is still accepting parts"""
+	files = list_files(ctx, 0, 1, user_id=user['id'], file_id=file_id)
+	try:
+		file_record = File(**files['items'][0])
+	except IndexError:
+		raise NotFoundError(f'File not found for id: {file_id}')
+
+	if file_record.status != 'ingesting':
+		raise MappUserError('FILE_NOT_INGESTING', f'File {file_id} has status {file_record.status}, parts can only be uploaded while it is ingesting')
+
+	return file_record
+
 #
 # commands
 #
@@ -294,15 +401,14 @@ def ingest_start(ctx: MappContext, name: str, size: int, parts: int, content_typ
 
 	name: file name with extension
 	size: total size of the file in bytes
-	parts: total number of parts the file is split into; must be 1 for now
+	parts: total number of parts the file is split into
 	content_type: optional content type of the file; will be guessed from name if not provided
-	finish: if true, will attempt to finish ingest and process file after ingesting part(s); must provide part content in file_input
-
-	CURRENT LIMITATIONS:
-	- Only single part files are supported (parts must be 1)
-	- must provide finish=true
-	- file must be less than {FILE_SIZE_LIMIT} bytes in size
+	finish: if true, will attempt to finish ingest and process file after ingesting part 1; parts must be 1 and part content must be provided in file_input
 
+	multipart files are started without finish, then each part is uploaded with ingest_part
+	(in any order, in parallel, and retried by part number) and ingest_finish assembles the file.
+	if file_input is provided without finish it is uploaded as part 1.
+	each part must be less than {FILE_SIZE_LIMIT} bytes in size
 	"""
 
 	user = current_user(ctx)['value']
@@ -318,14 +424,14 @@ def ingest_start(ctx: MappContext, name: str, size: int, parts: int, content_typ
 	if finish and file_input is None:
 		field_errors['finish'] = 'User must supply a file_input if finish is true'
 	elif finish and parts != 1:
-		field_errors['finish'] = f'Cannot finish ingest in ingest_start call if multiple parts are specified; got: {parts}'
-	elif not finish:
-		field_errors['finish'] = 'Currently only auto-finish of single part files is supported'
+		field_errors['finish'] = f'Cannot finish ingest in ingest_start call if multiple parts are specified; got: {parts}, upload parts with ingest_part then call ingest_finish'
 	
-	if parts < 0:
-		field_errors['parts'] = 'Parts must be a non-negative integer'
-	elif parts > 1:
-		field_errors['parts'] = 'Ingest of multipart files is not supported yet'
+	if parts < 1:
+		field_errors['parts'] = 'Parts must be a positive integer'
+	elif size < 0:
+		field_errors['size'] = 'Size must be a non-negative integer'
+	elif size > parts * FILE_SIZE_LIMIT:
+		field_errors['size'] = f'Size {size} does not fit in {parts} parts of at most {FILE_SIZE_LIMIT} bytes'
 
 	if field_errors:
 		raise MappValidationError('Error starting file ingest', field_errors)
@@ -393,18 +499,17 @@ def ingest_start(ctx: MappContext, name: str, size: int, parts: int, content_typ
 	
 	return {'file_id': file_record.id, 'message': msg}
 
-def ingest_part(ctx: MappContext, file_id: str, part_number: int) -> dict:
-
-	return {'acknowledged': False, 'message': 'ingest_part is not implemented yet'}
+def ingest_part(ctx: MappContext, file_id: str, part_number: int, sha3_256: str = '') -> dict:
+	"""
+	upload one part of a file started with ingest_start, the content is read from self.file_input.
+	if sha3_256 is given the part is rejected when its content does not match. Parts of one
+	file can be uploaded in parallel and a failed part can be retried with the same part_number
+	"""
 
 	file_input = ctx.self.get('file_input', None)
 	user = current_user(ctx)['value']
 
-	files = list_files(ctx, 0, 1, user.id, file_id)
-	try:
-		file_record = files['items'][0]
-	except IndexError:
-		raise NotFoundError('FILE_NOT_FOUND', f'File not found for id: {file_id}')
+	file_record = _get_ingesting_file_record(ctx, file_id, user)
 
 	#
 	# validate input
@@ -415,8 +520,8 @@ def ingest_part(ctx: MappContext, file_id: str, part_number: int) -> dict:
 	if file_input is None:
 		raise MappUserError('NO_FILE_INPUT', 'User must supply a file_input for ingest_part')
 	
-	if not 0 < part_number <= file_record['parts']:
-		field_errors['part_number'] = f'Part number must be between 1 and {file_record["parts"]} for file_id {file_id}'
+	if not 0 < part_number <= file_record.parts:
+		field_errors['part_number'] = f'Part number must be between 1 and {file_record.parts} for file_id {file_id}'
 
 	if field_errors:
 		raise MappValidationError('Error uploading file part', field_errors)
@@ -425,12 +530,35 @@ def ingest_part(ctx: MappContext, file_id: str, part_number: int) -> dict:
 	# write part
 	#
 
-	_ingest_part(ctx, part_number, file_input, File(**file_record), user)
+	file_part = _ingest_part(ctx, part_number, file_input, file_record, user, sha3_256)
 
-	return {'acknowledged': True, 'message': 'File part uploaded'}
+	return {'acknowledged': True, 'message': f'File part {part_number} of {file_record.parts} uploaded with sha3_256: {file_part.sha3_256}'}
 
 def ingest_finish(ctx: MappContext, file_id: str) -> dict:
-	return {'acknowledged': False, 'message': 'ingest_finish is not implemented yet'}
+	"""
+	finish ingesting a multipart file and assemble it from its parts. If parts are missing
+	the file keeps ingesting, so they can be uploaded and ingest_finish called again
+	"""
+
+	user = current_user(ctx)['value']
+	file_record = _get_ingesting_file_record(ctx, file_id, user)
+
+	uploaded = {part.part_number for part in _list_parts(ctx, file_id) if os.path.exists(_file_part_path(file_id, part.part_number))}
+	missing = [part_number for part_number in range(1, file_record.parts + 1) if part_number not in uploaded]
+	if missing:
+		raise _parts_missing_error(file_record, missing)
+
+	file_record = _ingest_finish(ctx, file_record)
+	if file_record.status == 'processing_queue':
+		file_record = _process_file(ctx, file_record)
+
+	msg = f'file id {file_record.id} finished with status: {file_record.status}'
+	if file_record.message:
+		msg += f' - {file_record.message}'
+
+	ctx.log(f'ingest_finish - {msg}')
+
+	return {'acknowledged': file_record.status == 'good', 'message': msg}
 
 def get_part_content(ctx: MappContext, file_id: str, part_number: int) -> dict:
 
@@ -498,9 +626,6 @@ def get_file_content(ctx: MappContext, file_id: str) -> dict:
 	except IndexError:
 		raise NotFoundError('FILE_NOT_FOUND', f'File not found for id: {file_id}')
 	
-	if file_record_dict['parts'] > 1:
-		raise MappUserError('MULTIPART_FILE', 'get_file_content does not support multipart files yet')
-	
 	file_record = File(**file_record_dict)
 	full_file_path = _file_path(file_record)
 
@@ -527,7 +652,7 @@ def get_file_content(ctx: MappContext, file_id: str) -> dict:
 	
 	return {
 		'acknowledged': True,
-		'message': 'Feature only implemented for single part files'
+		'message': 'File content written to self.file_output'
 	} 
 
 def verify_file(ctx: MappContext, file_id: str) -> dict:
@@ -707,3 +832,56 @@ def process_file(ctx: MappContext, file_id: str) -> dict:
 		)
 		ctx.db.commit()
 		return {'acknowledged': False, 'message': err_msg}
+
+#
+# client
+#
+
+"""
+the cli uploads files larger than MAPP_FILE_PART_SIZE over http in parts: ingest_start
+without content, then each part with ingest_part from MAPP_FILE_UPLOAD_WORKERS threads,
+then ingest_finish. Each part sends its sha3_256 so the server rejects a part corrupted in
+transit, and a part that fails with a server or connection error is retried.
+"""
+
+_PART_UPLOAD_ATTEMPTS = 3
+_PART_RETRY_ERROR_CODES = ('SERVER_ERROR', 'SERVICE_UNAVAILABLE', 'UNKNOWN_ERROR')
+
+def _http_op(ctx: MappContext, module_spec: dict, op_name: str, data: dict, file_input: bytes = None) -> dict:
+	params_class, output_class = new_op_classes(module_spec['ops'][op_name], module_spec)
+	op_self = {} if file_input is None else {'file_input': file_input, 'file_input_name': ctx.self.get('file_input_name', 'file.bin')}
+	return http_run_op(replace(ctx, self=op_self), params_class, output_class, new_op_params(params_class, data)).result
+
+def http_ingest_file(ctx: MappContext, module_spec: dict, name: str, content_type: str = '') -> dict:
+	"""upload ctx.self.file_input over http in parts of MAPP_FILE_PART_SIZE, returns the ingest_start result"""
+
+	file_input = memoryview(ctx.self['file_input'])
+	size = len(file_input)
+	parts = max(1, -(-size // MAPP_FILE_PART_SIZE))
+
+	start = _http_op(ctx, module_spec, 'ingest_start', {'name': name, 'size': size, 'parts': parts, 'content_type': content_type, 'finish': False})
+	file_id = start['file_id']
+	ctx.log(f'http_ingest_file - {file_id=} {size=} {parts=}')
+
+	def upload_part(part_number: int) -> dict:
+		offset = (part_number - 1) * MAPP_FILE_PART_SIZE
+		chunk = file_input[offset:offset + MAPP_FILE_PART_SIZE].tobytes()
+		data = {'file_id': file_id, 'part_number': part_number, 'sha3_256': sha3_256(chunk).hexdigest()}
+		for attempt in range(1, _PART_UPLOAD_ATTEMPTS + 1):
+			try:
+				return _http_op(ctx, module_spec, 'ingest_part', data, chunk)
+			except MappError as e:
+				if e.code not in _PART_RETRY_ERROR_CODES or attempt == _PART_UPLOAD_ATTEMPTS:
+					raise
+				ctx.log(f'http_ingest_file - retrying part {part_number} of {file_id=} after {e.code}')
+				time.sleep(0.5 * 2 ** attempt)
+
+	try:
+		with ThreadPoolExecutor(max_workers=max(1, MAPP_FILE_UPLOAD_WORKERS)) as executor:
+			for _ in executor.map(upload_part, range(1, parts + 1)):
+				pass
+	except MappError as e:
+		raise MappError('FILE_UPLOAD_FAILED', f'Uploading file id {file_id} failed, the uploaded parts are kept, retry the missing parts with ingest-part then run ingest-finish: {e}')
+
+	finish = _http_op(ctx, module_spec, 'ingest_finish', {'file_id': file_id})
+	return {'file_id': file_id, 'message': finish['message']}
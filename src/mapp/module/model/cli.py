@@ -1,3 +1,5 @@
+import sys
+import json
 import argparse
 
 from mapp.context import cli_model_user_input
@@ -5,12 +7,56 @@ from mapp.types import *
 from mapp.errors import MappError
 from mapp.module.model.db import *
 from mapp.module.model.http import *
+from mspec.core import MODEL_DB_COUNT_MODES
 
 __all__ = [
     'add_model_subparser'
 ]
 
 
+def _fields_arg(value:str) -> list[str]:
+    """--fields a,b,c"""
+    return [field_name.strip() for field_name in value.split(',') if field_name.strip()]
+
+def _read_bulk_file(path:str, batch_size:int, ids:bool=False):
+    """yield batches of items from an ndjson file (or plain ids, one per line), - reads stdin"""
+    handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        batch = []
+        for line_num, line in enumerate(handle, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if ids:
+                batch.append(line)
+            else:
+                try:
+                    batch.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise MappError('INVALID_NDJSON', f'{path} line {line_num}: {e}')
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+def _run_bulk(bulk_func, ctx, model_class, path:str, batch_size:int, ids:bool=False) -> ModelBulkResult:
+    """run a db bulk function over a file in batches and merge the results"""
+    merged = ModelBulkResult(items=[], succeeded=0, failed=0)
+    for batch in _read_bulk_file(path, batch_size, ids=ids):
+        result = bulk_func(ctx, model_class, batch)
+        offset = len(merged.items)
+        for item in result.items:
+            item['index'] += offset
+        merged.items.extend(result.items)
+        merged.succeeded += result.succeeded
+        merged.failed += result.failed
+    return merged
+
+
 def add_model_subparser(subparsers, spec:dict, module: dict, model:dict):
 
     model_class = new_model_class(spec, model, module)
@@ -83,11 +129,12 @@ def add_model_subparser(subparsers, spec:dict, module: dict, model:dict):
         description=http_desc + ' :: read'
     )
     read_parser.add_argument('model_id', type=str, help='ID of the model to read')
+    read_parser.add_argument('--fields', type=_fields_arg, default=None, help='Comma separated fields to read, reads all fields if not given')
     def cli_http_model_read(ctx, args):
         if args.model_id == 'help':
             read_parser.print_help()
         else:
-            model = http_model_read(ctx, model_class, args.model_id)
+            model = http_model_read(ctx, model_class, args.model_id, fields=args.fields)
             print(model_to_json(model, sort_keys=True, indent=4))
 
     read_parser.set_defaults(func=cli_http_model_read)
@@ -111,6 +158,23 @@ def add_model_subparser(subparsers, spec:dict, module: dict, model:dict):
         
     update_parser.set_defaults(func=cli_http_model_update)
 
+    # patch #
+    patch_parser = http_actions.add_parser(
+        'patch', 
+        help='Updates only the given fields of a single model via HTTP API.', 
+        description=http_desc + ' :: patch'
+    )
+    patch_parser.add_argument('model_id', type=str, help='ID of the model to patch')
+    patch_parser.add_argument('json', nargs='?', help='JSON object with the fields to update')
+    def cli_http_model_patch(ctx, args):
+        if args.model_id == 'help' or args.json is None:
+            patch_parser.print_help()
+        else:
+            patched_model = http_model_patch(ctx, model_class, args.model_id, json.loads(args.json))
+            print(model_to_json(patched_model, sort_keys=True, indent=4))
+
+    patch_parser.set_defaults(func=cli_http_model_patch)
+
     # delete #
     delete_parser = http_actions.add_parser(
         'delete', 
@@ -136,11 +200,14 @@ def add_model_subparser(subparsers, spec:dict, module: dict, model:dict):
     list_parser.add_argument('help', nargs='?', help='Show help for this command')
     list_parser.add_argument('--offset', type=int, default=0, help='Offset for pagination')
     list_parser.add_argument('--size', type=int, default=50, help='Page size for pagination')
+    list_parser.add_argument('--after', type=str, default=None, help='Cursor from next_cursor of the previous page, overrides --offset')
+    list_parser.add_argument('--count', choices=MODEL_DB_COUNT_MODES, default=None, help='How to compute total, defaults to the model db.count')
+    list_parser.add_argument('--fields', type=_fields_arg, default=None, help='Comma separated fields to read, reads all fields if not given')
     def cli_http_model_list(ctx, args):
         if args.help == 'help':
             list_parser.print_help()
         else:
-            result = http_model_list(ctx, model_class, offset=args.offset, size=args.size)
+            result = http_model_list(ctx, model_class, offset=args.offset, size=args.size, after=args.after, count=args.count, fields=args.fields)
             print(to_json(result, sort_keys=True, indent=4))
     list_parser.set_defaults(func=cli_http_model_list)
 
@@ -200,11 +267,12 @@ def add_model_subparser(subparsers, spec:dict, module: dict, model:dict):
         description=db_desc + ' :: read'
     )
     db_read_parser.add_argument('model_id', type=str, help='ID of the model to read')
+    db_read_parser.add_argument('--fields', type=_fields_arg, default=None, help='Comma separated fields to read, reads all fields if not given')
     def cli_db_model_read(ctx, args):
         if args.model_id == 'help':
             db_read_parser.print_help()
         else:
-            model = db_model_read(ctx, model_class, args.model_id)
+            model = db_model_read(ctx, model_class, args.model_id, fields=args.fields)
             print(model_to_json(model, sort_keys=True, indent=4))
     db_read_parser.set_defaults(func=cli_db_model_read)
 
@@ -230,6 +298,22 @@ def add_model_subparser(subparsers, spec:dict, module: dict, model:dict):
             print(model_to_json(updated_model, sort_keys=True, indent=4))
     db_update_parser.set_defaults(func=cli_db_model_update)
 
+    # patch #
+    db_patch_parser = db_actions.add_parser(
+        'patch', 
+        help='Updates only the given fields of a single model in the local SQLite database.',
+        description=db_desc + ' :: patch'
+    )
+    db_patch_parser.add_argument('model_id', type=str, help='ID of the model to patch')
+    db_patch_parser.add_argument('json', nargs='?', help='JSON object with the fields to update')
+    def cli_db_model_patch(ctx, args):
+        if args.model_id == 'help' or args.json is None:
+            db_patch_parser.print_help()
+        else:
+            patched_model = db_model_patch(ctx, model_class, args.model_id, json.loads(args.json))
+            print(model_to_json(patched_model, sort_keys=True, indent=4))
+    db_patch_parser.set_defaults(func=cli_db_model_patch)
+
     # delete #
     db_delete_parser = db_actions.add_parser(
         'delete', 
@@ -255,14 +339,41 @@ def add_model_subparser(subparsers, spec:dict, module: dict, model:dict):
     db_list_parser.add_argument('help', nargs='?', help='Show help for this command')
     db_list_parser.add_argument('--offset', type=int, default=0, help='Offset for pagination')
     db_list_parser.add_argument('--size', type=int, default=50, help='Page size for pagination')
+    db_list_parser.add_argument('--after', type=str, default=None, help='Cursor from next_cursor of the previous page, overrides --offset')
+    db_list_parser.add_argument('--count', choices=MODEL_DB_COUNT_MODES, default=None, help='How to compute total, defaults to the model db.count')
+    db_list_parser.add_argument('--fields', type=_fields_arg, default=None, help='Comma separated fields to read, reads all fields if not given')
     def cli_db_model_list(ctx, args):
         if args.help == 'help':
             db_list_parser.print_help()
         else:
-            result = db_model_list(ctx, model_class, offset=args.offset, size=args.size)
+            result = db_model_list(ctx, model_class, offset=args.offset, size=args.size, after=args.after, count=args.count, fields=args.fields)
             print(to_json(result, sort_keys=True, indent=4))
     db_list_parser.set_defaults(func=cli_db_model_list)
 
+    # bulk #
+    def add_db_bulk_parser(action:str, bulk_func, help_text:str, ids:bool=False):
+        bulk_parser = db_actions.add_parser(
+            f'bulk-{action}',
+            help=help_text,
+            description=db_desc + f' :: bulk-{action}'
+        )
+        bulk_parser.add_argument('file', help='Path to an ndjson file, one model per line, or - for stdin' if not ids else 'Path to a file with one model id per line, or - for stdin')
+        bulk_parser.add_argument('--batch-size', type=int, default=1000, help='Number of items per db call')
+        bulk_parser.add_argument('--errors-only', action='store_true', help='Only output items that failed')
+        def cli_db_model_bulk(ctx, args):
+            if args.file == 'help':
+                bulk_parser.print_help()
+            else:
+                result = _run_bulk(bulk_func, ctx, model_class, args.file, args.batch_size, ids=ids)
+                if args.errors_only:
+                    result.items = [item for item in result.items if item['error'] is not None]
+                print(to_json(result, sort_keys=True, indent=4))
+        bulk_parser.set_defaults(func=cli_db_model_bulk)
+
+    add_db_bulk_parser('create', db_model_bulk_create, 'Creates models from an ndjson file in the local SQLite database with one commit.')
+    add_db_bulk_parser('update', db_model_bulk_update, 'Updates models from an ndjson file in the local SQLite database with one commit.')
+    add_db_bulk_parser('delete', db_model_bulk_delete, 'Deletes models by id from the local SQLite database with one commit.', ids=True)
+
     # help #
     db_help_parser = db_actions.add_parser('help', help='Show help for this command', aliases=['-h', '--help'])
     db_help_parser.set_defaults(func=lambda ctx, args, p=db_parser: p.print_help())
@@ -1,32 +1,72 @@
-from datetime import datetime
+import json
+import time
+import base64
+import binascii
 import sqlite3
 
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass, field
+from functools import wraps
+from types import SimpleNamespace
+from typing import Callable, Optional
+
 from mapp.auth import current_user
 from mapp.context import MappContext
 from mapp.errors import AuthenticationError, NotFoundError, MappError, MappUserError, MappValidationError
+from mspec.core import MODEL_DB_COUNT_MODES, MODEL_QUERY_OPERATORS
 from mapp.types import (
-    DATETIME_FORMAT_STR,
     MAX_RICH_TEXT_JSON_LENGTH,
     MAX_STR_FIELD_LENGTH,
+    MODEL_TIMESTAMP_FIELDS,
     ModelListResult,
+    ModelBulkResult,
+    convert_dict_to_model,
     validate_model,
+    validate_model_fields,
     Acknowledgment,
 )
 
 
 __all__ = [
+    'ModelPlan',
+    'ModelReadCache',
+    'model_plan',
+    'db_model_cache_stats',
     'db_model_create_table',
+    'db_model_column_plan',
+    'db_model_index_plan',
+    'db_model_migrate_datetime',
     'db_model_create',
     'db_model_read',
     'db_model_update',
+    'db_model_patch',
     'db_model_delete',
+    'db_model_upsert',
+    'db_model_delete_where',
+    'db_model_bulk_create',
+    'db_model_bulk_update',
+    'db_model_bulk_delete',
     'db_model_list',
     'db_model_unique_counts',
-    'db_model_query'
+    'db_model_unique_counts_in',
+    'db_model_select_in',
+    'db_model_query',
+    'db_model_search'
 ]
 
 MODEL_TIMESTAMP_SQL = "STRFTIME('%Y-%m-%dT%H:%M:%f+00:00', 'NOW')"
 
+# microseconds since the unix epoch, julianday is exact to the millisecond at current dates
+MODEL_EPOCH_TIMESTAMP_SQL = "(CAST(ROUND((JULIANDAY('NOW') - 2440587.5) * 86400000) AS INTEGER) * 1000)"
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# max bound params per IN (...) clause, well under SQLITE_MAX_VARIABLE_NUMBER on older builds
+SQL_MAX_IN_PARAMS = 500
+
 
 def _validate_auto_timestamp_fields_not_set(obj: object) -> None:
     field_errors = {}
@@ -38,52 +78,721 @@ def _validate_auto_timestamp_fields_not_set(obj: object) -> None:
     if field_errors:
         raise MappValidationError('Timestamp fields are set automatically.', field_errors)
 
+def _write_op(func: Callable) -> Callable:
+    """run a write op in its own savepoint inside a unit of work, see DBContext.savepoint"""
+    @wraps(func)
+    def wrapper(ctx: MappContext, *args, **kwargs):
+        with ctx.db.savepoint():
+            return func(ctx, *args, **kwargs)
+    return wrapper
+
+
+#
+# model plan
+#
+
+"""
+The table name, sql text and column converters of a model only depend on its spec,
+so they are compiled once into a ModelPlan the first time a db function sees the
+model class and cached on it as model_class._db_plan (None until then, set by
+new_model_class).
+
+Main table rows are (id, date_created, date_modified, *non_list_fields) and list
+tables are {table}_{field} with (id, value, position, {table}_id).
+
+db.datetime_storage picks the DatetimeCodec for datetime fields (and list elements)
+and the timestamps: text stores iso format strings, epoch stores integer microseconds
+since the unix epoch so range filters and sorts compare integers. Naive datetime
+fields are treated as utc in epoch storage, timestamps are always utc.
+"""
+
+def _parse_datetime_column(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return datetime.fromisoformat(value)
+
+def _serialize_datetime(value: datetime) -> str:
+    return value.isoformat()
+
+def _serialize_timestamp(value: datetime) -> str:
+    return value.astimezone(timezone.utc).isoformat(timespec='milliseconds')
+
+def _parse_epoch_column(value: Optional[int]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return _EPOCH + timedelta(0, 0, value)
+
+def _parse_epoch_timestamp(value: int) -> datetime:
+    # the float division round trips to the microsecond for any date before year 2242
+    return datetime.fromtimestamp(value / 1_000_000, timezone.utc)
+
+def _serialize_epoch(value: datetime) -> int:
+    if value.tzinfo is None:
+        return (value - _EPOCH) // _MICROSECOND
+    return (value - _EPOCH_UTC) // _MICROSECOND
+
+
+@dataclass
+class DatetimeCodec:
+    """how one db.datetime_storage mode stores datetime fields and the date_created / date_modified timestamps"""
+    column_type: str
+    timestamp_sql: str
+    parse_timestamp: Callable
+    serialize_timestamp: Callable
+    parse: Callable
+    serialize: Callable
+
+
+DATETIME_CODECS = {
+    'text': DatetimeCodec('TEXT', MODEL_TIMESTAMP_SQL, datetime.fromisoformat, _serialize_timestamp, _parse_datetime_column, _serialize_datetime),
+    'epoch': DatetimeCodec('INTEGER', MODEL_EPOCH_TIMESTAMP_SQL, _parse_epoch_timestamp, _serialize_epoch, _parse_epoch_column, _serialize_epoch),
+}
+
+
+def _column_converter(field_type: str, codec: DatetimeCodec) -> Optional[Callable]:
+    """db value -> python value, None if the value is used as is"""
+    match field_type:
+        case 'bool':
+            return bool
+        case 'datetime':
+            return codec.parse
+        case 'foreign_key':
+            return str
+        case _:
+            return None
+
+
+@dataclass
+class ListFieldPlan:
+    field_name: str
+    table_name: str
+    convert: Optional[Callable]
+    serialize: Optional[Callable]
+    insert_sql: str
+    delete_sql: str
+    select_sql: str     # format with placeholders=
+
+
+@dataclass
+class ModelPlan:
+    table_name: str
+    datetime_storage: str
+    datetime_codec: DatetimeCodec
+    column_names: tuple[str, ...]
+    column_index: dict[str, int]
+    converters: dict[str, Callable]
+    row_to_data: Callable[[tuple], dict]    # id, timestamps and non list fields of a main table row
+    serializers: tuple[tuple[str, Optional[Callable]], ...]
+    insert_sql: str
+    update_sql: str
+    read_sql: str
+    delete_sql: str
+    list_fields: tuple[ListFieldPlan, ...]
+    datetime_columns: frozenset[str]
+    search_fields: tuple[tuple[str, bool], ...]   # (field name, rich text) of fields with search: true
+    search_table: str
+
+    def non_list_values(self, obj: object) -> list:
+        """non list field values of a model in column order, ready to bind"""
+        values = []
+        for field_name, serialize in self.serializers:
+            value = getattr(obj, field_name)
+            if serialize is not None and value is not None:
+                value = serialize(value)
+            values.append(value)
+        return values
+
+    def db_value(self, column_name: str, value):
+        """a filter value in the form it is stored in, datetime columns accept datetimes or iso strings"""
+        if value is None or column_name not in self.datetime_columns:
+            return value
+        if isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                raise MappUserError('INVALID_DATETIME', f'{column_name} must be an iso format datetime, got: {value}')
+        if column_name in MODEL_TIMESTAMP_FIELDS:
+            return self.datetime_codec.serialize_timestamp(value)
+        return self.datetime_codec.serialize(value)
+
+    def list_rows(self, list_field: ListFieldPlan, obj: object) -> list[tuple]:
+        """(value, position, model id) rows for one list field of a model"""
+        serialize = list_field.serialize
+        if serialize is None:
+            return [(value, pos, obj.id) for pos, value in enumerate(getattr(obj, list_field.field_name))]
+        return [(serialize(value), pos, obj.id) for pos, value in enumerate(getattr(obj, list_field.field_name))]
+
+
+def _compile_row_to_data(column_names: tuple[str, ...], converters: dict[str, Callable]) -> Callable[[tuple], dict]:
+    """
+    generate a function that builds the data dict of a row in one expression, so
+    each column costs one converter call or none instead of a type match per column
+    """
+    namespace = {}
+    items = []
+    for index, column_name in enumerate(column_names):
+        if column_name in converters:
+            namespace[f'_convert_{index}'] = converters[column_name]
+            items.append(f'{column_name!r}: _convert_{index}(row[{index}])')
+        else:
+            items.append(f'{column_name!r}: row[{index}]')
 
-def _parse_row_timestamps(row: tuple) -> dict:
-    return {
-        'date_created': datetime.fromisoformat(row[1]),
-        'date_modified': datetime.fromisoformat(row[2]),
-    }
-
+    exec('def row_to_data(row):\n    return {' + ', '.join(items) + '}\n', namespace)
+    return namespace['row_to_data']
 
-def db_model_create_table(ctx:MappContext, model_class: type) -> Acknowledgment:
+def _compile_model_plan(model_class: type, datetime_storage: Optional[str] = None) -> ModelPlan:
+    """datetime_storage overrides the model's db.datetime_storage, used to read tables being migrated"""
     model_spec = model_class._model_spec
     model_snake_case = model_spec['name']['snake_case']
     module_snake_case = model_class._module_spec['name']['snake_case']
     table_name = f'{module_snake_case}_{model_snake_case}'
 
-    # non list fields #
-    
+    if datetime_storage is None:
+        datetime_storage = model_spec.get('db', {}).get('datetime_storage', 'text')
+    codec = DATETIME_CODECS[datetime_storage]
+
+    non_list_names = [field['name']['snake_case'] for field in model_spec['non_list_fields']]
+    column_names = ('id', 'date_created', 'date_modified', *non_list_names)
+
+    converters = {'id': str, 'date_created': codec.parse_timestamp, 'date_modified': codec.parse_timestamp}
+    serializers = []
+    datetime_columns = set(MODEL_TIMESTAMP_FIELDS)
+    for field in model_spec['non_list_fields']:
+        field_name = field['name']['snake_case']
+        convert = _column_converter(field['type'], codec)
+        if convert is not None:
+            converters[field_name] = convert
+        if field['type'] == 'datetime':
+            datetime_columns.add(field_name)
+            serializers.append((field_name, codec.serialize))
+        else:
+            serializers.append((field_name, None))
+
+    if non_list_names:
+        fields_str = ', '.join(f"'{field_name}'" for field_name in non_list_names)
+        placeholder_str = ', '.join('?' for _ in non_list_names)
+        insert_sql = f'INSERT INTO {table_name} ({fields_str}) VALUES ({placeholder_str})'
+    else:
+        insert_sql = f'INSERT INTO {table_name} DEFAULT VALUES'
+
+    set_clause = ', '.join([f"'{field_name}' = ?" for field_name in non_list_names] + [f'date_modified = {codec.timestamp_sql}'])
+
+    list_fields = []
+    for field in model_spec['list_fields']:
+        field_name = field['name']['snake_case']
+        list_table_name = f'{table_name}_{field_name}'
+        list_fields.append(ListFieldPlan(
+            field_name=field_name,
+            table_name=list_table_name,
+            convert=_column_converter(field['element_type'], codec),
+            serialize=codec.serialize if field['element_type'] == 'datetime' else None,
+            insert_sql=f'INSERT INTO {list_table_name} (value, position, {table_name}_id) VALUES (?, ?, ?)',
+            delete_sql=f'DELETE FROM {list_table_name} WHERE {table_name}_id = ?',
+            select_sql=(
+                f'SELECT {table_name}_id, value FROM {list_table_name} '
+                f'WHERE {table_name}_id IN ({{placeholders}}) ORDER BY {table_name}_id, position ASC'
+            ),
+        ))
+
+    return ModelPlan(
+        table_name=table_name,
+        datetime_storage=datetime_storage,
+        datetime_codec=codec,
+        column_names=column_names,
+        column_index={column_name: index for index, column_name in enumerate(column_names)},
+        converters=converters,
+        row_to_data=_compile_row_to_data(column_names, converters),
+        serializers=tuple(serializers),
+        insert_sql=insert_sql,
+        update_sql=f'UPDATE {table_name} SET {set_clause} WHERE id=?',
+        read_sql=f'SELECT * FROM {table_name} WHERE id=?',
+        delete_sql=f'DELETE FROM {table_name} WHERE id = ?',
+        list_fields=tuple(list_fields),
+        datetime_columns=frozenset(datetime_columns),
+        search_fields=tuple(
+            (field['name']['snake_case'], field.get('rich_text') is True)
+            for field in model_spec['non_list_fields'] if field.get('search') is True
+        ),
+        search_table=f'{table_name}_fts',
+    )
+
+def model_plan(model_class: type) -> ModelPlan:
+    """the compiled db plan of a model class, compiled on first use"""
+    plan = getattr(model_class, '_db_plan', None)
+    if plan is None:
+        plan = _compile_model_plan(model_class)
+        model_class._db_plan = plan
+    return plan
+
+
+#
+# row conversion
+#
+
+def _read_list_fields(ctx: MappContext, plan: ModelPlan, model_ids: list[str], field_names: Optional[set[str]] = None) -> dict[str, dict[str, list]]:
+    """
+    read the list fields (or only field_names) for a page of models with one IN (...) query
+    per list field instead of one query per model per field, returns {model_id: {field_name: [values]}}
+    """
+    values_by_id = {model_id: {} for model_id in model_ids}
+    if not model_ids:
+        return values_by_id
+
+    for list_field in plan.list_fields:
+        field_name = list_field.field_name
+        if field_names is not None and field_name not in field_names:
+            continue
+        convert = list_field.convert
+
+        for model_values in values_by_id.values():
+            model_values[field_name] = []
+
+        for chunk_start in range(0, len(model_ids), SQL_MAX_IN_PARAMS):
+            chunk = model_ids[chunk_start:chunk_start + SQL_MAX_IN_PARAMS]
+            rows = ctx.db.cursor.execute(
+                list_field.select_sql.format(placeholders=', '.join('?' * len(chunk))),
+                chunk
+            ).fetchall()
+
+            if convert is None:
+                for parent_id, value in rows:
+                    values_by_id[str(parent_id)][field_name].append(value)
+            else:
+                for parent_id, value in rows:
+                    values_by_id[str(parent_id)][field_name].append(convert(value))
+
+    return values_by_id
+
+
+def _rows_to_models(ctx: MappContext, model_class: type, rows: list[tuple]) -> list:
+    plan = model_plan(model_class)
+    page_data = [plan.row_to_data(row) for row in rows]
+
+    if plan.list_fields:
+        list_values = _read_list_fields(ctx, plan, [data['id'] for data in page_data])
+        for data in page_data:
+            data.update(list_values[data['id']])
+
+    return [model_class(**data) for data in page_data]
+
+
+#
+# field projection
+#
+
+"""
+reads given a list of fields select only id, those columns and those list tables,
+and return dicts of just those fields instead of models
+"""
+
+def _projection(plan: ModelPlan, fields: list[str]) -> tuple[tuple[str, ...], frozenset[str]]:
+    """(main table columns starting with id, list field names) to select for fields"""
+    list_field_names = {list_field.field_name for list_field in plan.list_fields}
+
+    unknown_fields = [field_name for field_name in fields if field_name not in plan.column_index and field_name not in list_field_names]
+    if unknown_fields:
+        raise MappUserError('INVALID_FIELDS', f'fields not found on model: {", ".join(unknown_fields)}')
+
+    columns = tuple(dict.fromkeys(['id', *[field_name for field_name in fields if field_name in plan.column_index]]))
+    return columns, frozenset(list_field_names.intersection(fields))
+
+def _project_rows(ctx: MappContext, plan: ModelPlan, columns: tuple[str, ...], rows: list[tuple], list_field_names: frozenset[str]) -> list[dict]:
+    """convert rows selected with columns (and possibly more trailing columns) to dicts, adding list_field_names"""
+    converters = [plan.converters.get(column) for column in columns]
+    items = []
+    for row in rows:
+        item = {}
+        for column, convert, value in zip(columns, converters, row):
+            item[column] = value if convert is None or value is None else convert(value)
+        items.append(item)
+
+    if list_field_names and items:
+        list_values = _read_list_fields(ctx, plan, [item['id'] for item in items], list_field_names)
+        for item in items:
+            item.update(list_values[item['id']])
+
+    return items
+
+
+#
+# read cache
+#
+
+"""
+models with db.cache in their spec keep the models read by db_model_read in an LRU
+cache on the connection's DBContext, so it is per worker process. Writes through the
+db_model_* functions invalidate the ids they change. Writes from other processes are
+detected with PRAGMA data_version, which changes when another connection commits, and
+clear every cache on the connection. Models are only cached outside of a transaction
+so uncommitted rows are never cached.
+"""
+
+@dataclass
+class ModelReadCache:
+    size: int
+    ttl: float                  # seconds, 0 for no expiry
+    entries: OrderedDict = field(default_factory=OrderedDict)  # model id -> (expires, model)
+    hits: int = 0
+    misses: int = 0
+
+    def get(self, model_id: str):
+        entry = self.entries.get(model_id)
+        if entry is None or (self.ttl and entry[0] < time.monotonic()):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(model_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, model_id: str, model: object) -> None:
+        self.entries[model_id] = (time.monotonic() + self.ttl, model)
+        self.entries.move_to_end(model_id)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, model_ids: Optional[list[str]] = None) -> None:
+        """drop model_ids, or every entry if model_ids is None"""
+        if model_ids is None:
+            self.entries.clear()
+            return
+        for model_id in model_ids:
+            self.entries.pop(str(model_id), None)
+
+
+def _model_cache(ctx: MappContext, model_class: type) -> Optional[ModelReadCache]:
+    """the read cache of a model, or None if db.cache is not enabled for it"""
+    cache_spec = model_class._model_spec.get('db', {}).get('cache')
+    if not cache_spec:
+        return None
+
+    data_version = ctx.db.connection.execute('PRAGMA data_version').fetchone()[0]
+    if data_version != ctx.db.data_version:
+        for cache in ctx.db.model_caches.values():
+            cache.invalidate()
+        ctx.db.data_version = data_version
+
+    table_name = model_plan(model_class).table_name
+    cache = ctx.db.model_caches.get(table_name)
+    if cache is None:
+        cache = ModelReadCache(size=cache_spec.get('size', 1000), ttl=cache_spec.get('ttl', 0))
+        ctx.db.model_caches[table_name] = cache
+    return cache
+
+def _invalidate_cache(ctx: MappContext, model_class: type, model_ids: Optional[list[str]] = None) -> None:
+    cache = ctx.db.model_caches.get(model_plan(model_class).table_name)
+    if cache is not None:
+        cache.invalidate(model_ids)
+
+def db_model_cache_stats(ctx: MappContext) -> dict[str, dict]:
+    """{table name: {size, entries, hits, misses}} for every model read cache on the connection"""
+    return {
+        table_name: {'size': cache.size, 'entries': len(cache.entries), 'hits': cache.hits, 'misses': cache.misses}
+        for table_name, cache in ctx.db.model_caches.items()
+    }
+
+
+#
+# keyset pagination
+#
+
+"""
+A cursor is the sort key of the last row of a page, encoded as url safe base64 json:
+{"k": [[field, "ASC"|"DESC"], ...], "v": [value, ...]}. The sort keys always end with
+id so every row has a unique position. The next page is read with a WHERE clause that
+selects rows after that key instead of walking and discarding OFFSET rows.
+"""
+
+def _encode_cursor(order_keys: list[tuple[str, str]], values: list) -> str:
+    payload = {'k': [list(key) for key in order_keys], 'v': values}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str, order_keys: list[tuple[str, str]]) -> list:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        cursor_keys = [tuple(key) for key in payload['k']]
+        values = payload['v']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise MappUserError('INVALID_CURSOR', 'Cursor could not be decoded')
+
+    if cursor_keys != order_keys or not isinstance(values, list) or len(values) != len(order_keys):
+        raise MappUserError('INVALID_CURSOR', 'Cursor does not match the requested sort')
+
+    return values
+
+
+def _keyset_where(order_keys: list[tuple[str, str]], values: list) -> tuple[str, list]:
+    """
+    build the condition for rows sorted after values, ie for (a ASC, id ASC):
+    (a > ?) OR (a IS ? AND id > ?)
+
+    sqlite sorts NULL first for ASC and last for DESC, which is accounted for here
+    """
+    disjuncts = []
+    params = []
+
+    for key_index, (field_name, direction) in enumerate(order_keys):
+        value = values[key_index]
+
+        if direction == 'ASC':
+            if value is None:
+                after_sql, after_params = f'{field_name} IS NOT NULL', []
+            else:
+                after_sql, after_params = f'{field_name} > ?', [value]
+        else:
+            if value is None:
+                # nothing sorts after NULL in descending order
+                continue
+            after_sql, after_params = f'({field_name} < ? OR {field_name} IS NULL)', [value]
+
+        equal_parts = [f'{name} IS ?' for name, _ in order_keys[:key_index]]
+        disjuncts.append('(' + ' AND '.join(equal_parts + [after_sql]) + ')')
+        params.extend(values[:key_index])
+        params.extend(after_params)
+
+    if not disjuncts:
+        return '0', []
+
+    return '(' + ' OR '.join(disjuncts) + ')', params
+
+
+def _page_rows(column_index: dict[str, int], rows: list[tuple], size: int, order_keys: list[tuple[str, str]]) -> tuple[list[tuple], Optional[str]]:
+    """trim rows fetched with LIMIT size + 1 to the page, and return the cursor if there is a next page"""
+    if len(rows) <= size:
+        return rows, None
+
+    rows = rows[:size]
+    last_row = rows[-1]
+    return rows, _encode_cursor(order_keys, [last_row[column_index[field_name]] for field_name, _ in order_keys])
+
+
+#
+# page select and total count
+#
+
+"""
+total count modes, the default comes from the model spec db.count and can be
+overridden per request:
+
+    exact   - separate SELECT COUNT(*) with the page's WHERE clause
+    none    - no count, total is None, use has_more to detect further pages
+    window  - COUNT(*) OVER() in the page query, one statement
+    counter - unfiltered total from MODEL_COUNT_TABLE kept in sync by insert and
+              delete triggers, the model must default to db.count: counter so the
+              triggers are created. Filtered queries fall back to window.
+"""
+
+MODEL_COUNT_TABLE = 'mapp_model_counts'
+
+
+def _count_mode(model_spec: dict, count: Optional[str]) -> str:
+    model_count_mode = model_spec.get('db', {}).get('count', 'exact')
+    if count is None:
+        return model_count_mode
+
+    if count not in MODEL_DB_COUNT_MODES:
+        raise MappUserError('INVALID_COUNT_MODE', f'count must be one of {", ".join(MODEL_DB_COUNT_MODES)}, got: {count}')
+
+    if count == 'counter' and model_count_mode != 'counter':
+        raise MappUserError('INVALID_COUNT_MODE', 'count=counter is only available for models with db.count: counter')
+
+    return count
+
+
+def _select_page(ctx: MappContext, plan: ModelPlan, where_parts: list[str], where_values: list,
+                 order_keys: list[tuple[str, str]], offset: int, size: int, after: Optional[str], count_mode: str,
+                 columns: Optional[tuple[str, ...]] = None) -> tuple[list[tuple], Optional[str], Optional[int]]:
+    """
+    select a page of rows, returns (rows, next_cursor, total)
+
+    rows have every column, or if columns is given those columns followed by any sort
+    key columns not in it
+    """
+
+    table_name = plan.table_name
+
+    if count_mode == 'counter' and where_parts:
+        count_mode = 'window'
+
+    where_clause = f" WHERE {' AND '.join(where_parts)}" if where_parts else ''
+    order_clause = ' ORDER BY ' + ', '.join(f'{field_name} {direction}' for field_name, direction in order_keys)
+
+    if columns is None:
+        select_str = '*'
+        column_index = plan.column_index
+    else:
+        select_columns = list(dict.fromkeys([*columns, *[field_name for field_name, _ in order_keys]]))
+        select_str = ', '.join(f'"{column}"' for column in select_columns)
+        column_index = {column: index for index, column in enumerate(select_columns)}
+
+    # page query #
+
+    if after is None:
+        if count_mode == 'window':
+            sql = f'SELECT {select_str}, COUNT(*) OVER() FROM {table_name}{where_clause}{order_clause} LIMIT ? OFFSET ?'
+        else:
+            sql = f'SELECT {select_str} FROM {table_name}{where_clause}{order_clause} LIMIT ? OFFSET ?'
+        query_values = (*where_values, size + 1, offset)
+
+    else:
+        keyset_clause, keyset_values = _keyset_where(order_keys, _decode_cursor(after, order_keys))
+        if count_mode == 'window':
+            # count the filtered rows before the keyset condition is applied
+            sql = (
+                f'SELECT {select_str}, window_total FROM (SELECT *, COUNT(*) OVER() AS window_total FROM {table_name}{where_clause}) '
+                f'WHERE {keyset_clause}{order_clause} LIMIT ?'
+            )
+        elif where_parts:
+            sql = f'SELECT {select_str} FROM {table_name}{where_clause} AND {keyset_clause}{order_clause} LIMIT ?'
+        else:
+            sql = f'SELECT {select_str} FROM {table_name} WHERE {keyset_clause}{order_clause} LIMIT ?'
+        query_values = (*where_values, *keyset_values, size + 1)
+
+    rows = ctx.db.cursor.execute(sql, query_values).fetchall()
+    rows, next_cursor = _page_rows(column_index, rows, size, order_keys)
+
+    # total count #
+
+    total = None
+
+    match count_mode:
+        case 'window' if rows:
+            total = rows[0][-1]
+        case 'window' if offset == 0 and after is None:
+            total = 0
+        case 'counter':
+            count_row = ctx.db.cursor.execute(f'SELECT total FROM {MODEL_COUNT_TABLE} WHERE table_name = ?', (table_name,)).fetchone()
+            if count_row is not None:
+                total = count_row[0]
+        case 'none':
+            return rows, next_cursor, None
+
+    if total is None:
+        # exact, or an empty window page / missing counter row
+        total = ctx.db.cursor.execute(f'SELECT COUNT(*) FROM {table_name}{where_clause}', where_values).fetchone()[0]
+
+    return rows, next_cursor, total
+
+
+#
+# spec indexes
+#
+
+"""
+indexes declared in the model spec under db.indexes are created with the table and
+reconciled on every create-table: missing indexes are created and indexes whose
+definition changed are rebuilt. Indexes named with the idx_<table>_ prefix are treated
+as spec managed, if one is no longer in the spec it is dropped.
+"""
+
+def _spec_index_ddl(model_spec: dict, table_name: str) -> dict[str, str]:
+    ddl = {}
+    for index in model_spec.get('db', {}).get('indexes', []):
+        unique = 'UNIQUE ' if index.get('unique') is True else ''
+        columns = ', '.join(index['fields'])
+        sql = f'CREATE {unique}INDEX {index["name"]} ON {table_name}({columns})'
+        if index.get('where'):
+            sql += f' WHERE {index["where"]}'
+        ddl[index['name']] = sql
+    return ddl
+
+
+def db_model_index_plan(ctx: MappContext, model_class: type) -> list[str]:
+    """return the DDL statements needed to bring the table's indexes in line with the spec's db.indexes"""
+
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    existing = dict(ctx.db.cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table_name,)
+    ).fetchall())
+
+    statements = []
+    for index_name, sql in _spec_index_ddl(model_class._model_spec, table_name).items():
+        try:
+            existing_sql = existing.pop(index_name)
+        except KeyError:
+            statements.append(sql)
+            continue
+
+        if ' '.join(existing_sql.split()) != sql:
+            statements.append(f'DROP INDEX {index_name}')
+            statements.append(sql)
+
+    for index_name in existing:
+        if index_name.startswith(f'idx_{table_name}_'):
+            statements.append(f'DROP INDEX {index_name}')
+
+    return statements
+
+
+def _column_ddl(field: dict, codec: DatetimeCodec) -> str:
+    """column definition of a non list field, without any UNIQUE constraint"""
+    field_name = field['name']['snake_case']
+    field_type = field['type']
+
+    match field_type:
+        case 'bool':
+            return f'{field_name} INTEGER'
+        case 'int':
+            return f'{field_name} INTEGER'
+        case 'float':
+            return f'{field_name} REAL'
+        case 'str':
+            max_len = MAX_RICH_TEXT_JSON_LENGTH if field.get('rich_text') is True else MAX_STR_FIELD_LENGTH
+            return f'{field_name} TEXT CHECK (LENGTH("{field_name}") <= {max_len})'
+        case 'enum':
+            return f'{field_name} TEXT'
+        case 'datetime':
+            return f'{field_name} {codec.column_type}'
+        case 'foreign_key':
+            ref_table = field['references']['table']
+            ref_field = field['references']['field']
+            return f"'{field_name}' INTEGER REFERENCES {ref_table}({ref_field})"
+        case _:
+            raise ValueError(f'Unsupported field type: {field_type}')
+
+def db_model_column_plan(ctx: MappContext, model_class: type) -> list[str]:
+    """
+    return the DDL statements that add the spec's non list fields missing from an existing
+    table, new columns are nullable so existing rows read them as None. sqlite can not add
+    a UNIQUE column, unique fields get a unique index instead
+    """
+
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    existing = {column[1] for column in ctx.db.cursor.execute(f'PRAGMA table_info({table_name})').fetchall()}
+    if not existing:
+        return []
+
+    statements = []
+    for field in model_class._model_spec['non_list_fields']:
+        field_name = field['name']['snake_case']
+        if field_name in existing:
+            continue
+        statements.append(f'ALTER TABLE {table_name} ADD COLUMN {_column_ddl(field, plan.datetime_codec)}')
+        if field.get('unique') is True and field['type'] != 'foreign_key':
+            statements.append(f'CREATE UNIQUE INDEX {table_name}_{field_name}_unique_index ON {table_name}({field_name})')
+
+    return statements
+
+def _main_table_ddl(model_class: type, table_name: str) -> tuple[str, list[str]]:
+    """CREATE TABLE sql for the main table and the sql for its foreign key indexes"""
+    model_spec = model_class._model_spec
+    codec = model_plan(model_class).datetime_codec
+
     columns = [
         'id INTEGER PRIMARY KEY AUTOINCREMENT',
-        f'date_created TEXT NOT NULL DEFAULT ({MODEL_TIMESTAMP_SQL})',
-        f'date_modified TEXT NOT NULL DEFAULT ({MODEL_TIMESTAMP_SQL})',
+        f'date_created {codec.column_type} NOT NULL DEFAULT ({codec.timestamp_sql})',
+        f'date_modified {codec.column_type} NOT NULL DEFAULT ({codec.timestamp_sql})',
     ]
     indexes = []
     for field in model_spec['non_list_fields']:
         field_name = field['name']['snake_case']
         field_type = field['type']
-
-        match field_type:
-            case 'bool':
-                col_def = f'{field_name} INTEGER'
-            case 'int':
-                col_def = f'{field_name} INTEGER'
-            case 'float':
-                col_def = f'{field_name} REAL'
-            case 'str':
-                max_len = MAX_RICH_TEXT_JSON_LENGTH if field.get('rich_text') is True else MAX_STR_FIELD_LENGTH
-                col_def = f'{field_name} TEXT CHECK (LENGTH("{field_name}") <= {max_len})'
-            case 'enum':
-                col_def = f'{field_name} TEXT'
-            case 'datetime':
-                col_def = f'{field_name} TEXT'
-            case 'foreign_key':
-                ref_table = field['references']['table']
-                ref_field = field['references']['field']
-                col_def = f"'{field_name}' INTEGER REFERENCES {ref_table}({ref_field})"
-            case _:
-                raise ValueError(f'Unsupported field type: {field_type}')
+        col_def = _column_ddl(field, codec)
 
         # unique constraint: foreign_key columns use quoted identifiers and REFERENCES syntax
         # which does not require a separate UNIQUE clause (use a unique index instead if needed)
@@ -95,10 +804,174 @@ def db_model_create_table(ctx:MappContext, model_class: type) -> Acknowledgment:
         if field_type == 'foreign_key':
             indexes.append(f"CREATE INDEX IF NOT EXISTS {table_name}_{field_name}_fk_index ON {table_name}('{field_name}')")
 
-    # create main table #
-
     columns_str = ', '.join(columns)
-    main_sql_table = f"CREATE TABLE IF NOT EXISTS {table_name}({columns_str})"
+    return f"CREATE TABLE IF NOT EXISTS {table_name}({columns_str})", indexes
+
+
+def _unique_counts_summary_table(table_name: str, field_name: str, group_by: str) -> str:
+    return f'{table_name}_unique_counts_{field_name}_{group_by}'
+
+def _create_unique_counts_summary(ctx: MappContext, table_name: str, field_name: str, group_by: str) -> None:
+    """
+    a db.unique_counts summary table of (key_value, group_value, count) for rows with a
+    non null field_name, created from the current rows and kept in sync by triggers.
+    CREATE TABLE AS SELECT gives the columns the same affinity as field_name and group_by
+    so lookups bind the same values as a query on the main table
+    """
+    summary_table = _unique_counts_summary_table(table_name, field_name, group_by)
+
+    ctx.db.cursor.execute(f"""CREATE TABLE IF NOT EXISTS {summary_table} AS
+        SELECT "{field_name}" AS key_value, "{group_by}" AS group_value, COUNT(*) AS count FROM {table_name}
+        WHERE "{field_name}" IS NOT NULL GROUP BY "{field_name}", "{group_by}"
+    """)
+    ctx.db.cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {summary_table}_index ON {summary_table}(key_value, group_value)')
+
+    increment = f"""
+            INSERT INTO {summary_table} (key_value, group_value, count)
+                SELECT NEW."{field_name}", NEW."{group_by}", 0 WHERE NOT EXISTS (
+                    SELECT 1 FROM {summary_table} WHERE key_value = NEW."{field_name}" AND group_value IS NEW."{group_by}"
+                );
+            UPDATE {summary_table} SET count = count + 1 WHERE key_value = NEW."{field_name}" AND group_value IS NEW."{group_by}";"""
+    decrement = f"""
+            UPDATE {summary_table} SET count = count - 1 WHERE key_value = OLD."{field_name}" AND group_value IS OLD."{group_by}";
+            DELETE FROM {summary_table} WHERE key_value = OLD."{field_name}" AND group_value IS OLD."{group_by}" AND count <= 0;"""
+
+    ctx.db.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {summary_table}_insert AFTER INSERT ON {table_name}
+        WHEN NEW."{field_name}" IS NOT NULL BEGIN{increment}
+        END""")
+    ctx.db.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {summary_table}_delete AFTER DELETE ON {table_name}
+        WHEN OLD."{field_name}" IS NOT NULL BEGIN{decrement}
+        END""")
+    ctx.db.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {summary_table}_update_old AFTER UPDATE OF "{field_name}", "{group_by}" ON {table_name}
+        WHEN OLD."{field_name}" IS NOT NULL BEGIN{decrement}
+        END""")
+    ctx.db.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {summary_table}_update_new AFTER UPDATE OF "{field_name}", "{group_by}" ON {table_name}
+        WHEN NEW."{field_name}" IS NOT NULL BEGIN{increment}
+        END""")
+
+#
+# full text search
+#
+
+"""
+fields with search: true are indexed in an FTS5 table {table}_fts with one column per
+field and the model id as rowid, kept in sync by insert, update and delete triggers.
+rich_text fields index only the strings of the rich text json that are text: text
+elements, link text and table cells, not link urls, colors or the version and type tags
+"""
+
+_RICH_TEXT_NON_TEXT_KEYS = ('link', 'color', 'type', 'version', 'format')
+
+
+def _search_value_sql(ref: str, rich_text: bool) -> str:
+    if not rich_text:
+        return ref
+    non_text_keys = ', '.join(f"'{key}'" for key in _RICH_TEXT_NON_TEXT_KEYS)
+    return (
+        f"(SELECT group_concat(value, ' ') FROM json_tree(CASE WHEN json_valid({ref}) THEN {ref} ELSE '{{}}' END) "
+        f"WHERE type = 'text' AND key NOT IN ({non_text_keys}))"
+    )
+
+def _search_ddl(plan: ModelPlan) -> dict[str, str]:
+    """{name: sql} for the fts table and its triggers"""
+    table_name = plan.table_name
+    search_table = plan.search_table
+    columns = ', '.join(f'"{field_name}"' for field_name, _ in plan.search_fields)
+    new_values = ', '.join(_search_value_sql(f'NEW."{field_name}"', rich_text) for field_name, rich_text in plan.search_fields)
+    set_clause = ', '.join(
+        f'"{field_name}" = ' + _search_value_sql(f'NEW."{field_name}"', rich_text)
+        for field_name, rich_text in plan.search_fields
+    )
+
+    return {
+        search_table: f"CREATE VIRTUAL TABLE {search_table} USING fts5({columns}, tokenize = 'porter unicode61 remove_diacritics 2')",
+        f'{search_table}_insert': (
+            f'CREATE TRIGGER {search_table}_insert AFTER INSERT ON {table_name} BEGIN '
+            f'INSERT INTO {search_table} (rowid, {columns}) VALUES (NEW.id, {new_values}); END'
+        ),
+        f'{search_table}_delete': (
+            f'CREATE TRIGGER {search_table}_delete AFTER DELETE ON {table_name} BEGIN '
+            f'DELETE FROM {search_table} WHERE rowid = OLD.id; END'
+        ),
+        f'{search_table}_update': (
+            f'CREATE TRIGGER {search_table}_update AFTER UPDATE OF {columns} ON {table_name} BEGIN '
+            f'UPDATE {search_table} SET {set_clause} WHERE rowid = NEW.id; END'
+        ),
+    }
+
+def _create_search_table(ctx: MappContext, plan: ModelPlan) -> None:
+    """
+    create or rebuild the fts table and triggers when their definition differs from
+    the spec, a rebuilt table is filled from the current rows. Drops them if no field
+    has search: true
+    """
+    search_table = plan.search_table
+    ddl = _search_ddl(plan) if plan.search_fields else {}
+
+    existing = dict(ctx.db.cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE name IN (?, ?, ?, ?)",
+        (search_table, f'{search_table}_insert', f'{search_table}_delete', f'{search_table}_update')
+    ).fetchall())
+    if {name: ' '.join(sql.split()) for name, sql in existing.items()} == ddl:
+        return
+
+    for name in existing:
+        if name == search_table:
+            ctx.db.cursor.execute(f'DROP TABLE {search_table}')
+        else:
+            ctx.db.cursor.execute(f'DROP TRIGGER {name}')
+
+    if not ddl:
+        return
+
+    for sql in ddl.values():
+        ctx.db.cursor.execute(sql)
+
+    columns = ', '.join(f'"{field_name}"' for field_name, _ in plan.search_fields)
+    values = ', '.join(_search_value_sql(f'"{field_name}"', rich_text) for field_name, rich_text in plan.search_fields)
+    ctx.db.cursor.execute(f'INSERT INTO {search_table} (rowid, {columns}) SELECT id, {values} FROM {plan.table_name}')
+
+def _search_match(text: str, field_name: Optional[str] = None) -> str:
+    """
+    fts5 MATCH expression for user search text: every word must match and the last
+    word also matches as a prefix. Words are quoted so fts5 syntax in the text is literal
+    """
+    words = text.split()
+    if not words:
+        raise ValueError('search text must not be empty')
+    phrases = ['"' + word.replace('"', '""') + '"' for word in words]
+    phrases[-1] += '*'
+    match = ' '.join(phrases)
+    return match if field_name is None else f'{{{field_name}}} : ({match})'
+
+def _table_datetime_storage(ctx: MappContext, table_name: str) -> Optional[str]:
+    """the datetime storage of an existing table from its date_created column type, None if there is no table"""
+    for column in ctx.db.cursor.execute(f'PRAGMA table_info({table_name})').fetchall():
+        if column[1] == 'date_created':
+            return 'epoch' if column[2].upper() == 'INTEGER' else 'text'
+    return None
+
+
+@_write_op
+def db_model_create_table(ctx:MappContext, model_class: type) -> Acknowledgment:
+    model_spec = model_class._model_spec
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    # datetime storage #
+
+    existing_storage = _table_datetime_storage(ctx, table_name)
+    if existing_storage is not None and existing_storage != plan.datetime_storage:
+        raise MappError('DATETIME_STORAGE_MISMATCH',
+            f'{table_name} stores datetimes as {existing_storage} but the spec has db.datetime_storage: {plan.datetime_storage}, '
+            'run: mapp db migrate-datetime')
+
+    # create main table, or add columns for new fields #
+
+    for column_sql in db_model_column_plan(ctx, model_class):
+        ctx.db.cursor.execute(column_sql)
+
+    main_sql_table, indexes = _main_table_ddl(model_class, table_name)
     ctx.db.cursor.execute(main_sql_table)
 
     # create foreign key indexes #
@@ -106,6 +979,15 @@ def db_model_create_table(ctx:MappContext, model_class: type) -> Acknowledgment:
     for index_sql in indexes:
         ctx.db.cursor.execute(index_sql)
 
+    # spec indexes #
+
+    for index_sql in db_model_index_plan(ctx, model_class):
+        try:
+            ctx.db.cursor.execute(index_sql)
+        except sqlite3.Error as e:
+            ctx.db.rollback()
+            raise MappError('INDEX_CREATION_FAILED', f'{index_sql} - {e}')
+
     # list field tables and indexes #
 
     for field in model_spec['list_fields']:
@@ -123,10 +1005,154 @@ def db_model_create_table(ctx:MappContext, model_class: type) -> Acknowledgment:
         index_sql = f"CREATE INDEX IF NOT EXISTS {list_table_name}_index ON {list_table_name}({table_name}_id)"
         ctx.db.cursor.execute(index_sql)
 
+    # total counter #
+
+    if model_spec.get('db', {}).get('count') == 'counter':
+        ctx.db.cursor.execute(f'CREATE TABLE IF NOT EXISTS {MODEL_COUNT_TABLE}(table_name TEXT PRIMARY KEY, total INTEGER NOT NULL)')
+        ctx.db.cursor.execute(
+            f'INSERT OR IGNORE INTO {MODEL_COUNT_TABLE} (table_name, total) SELECT ?, COUNT(*) FROM {table_name}',
+            (table_name,)
+        )
+        ctx.db.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table_name}_count_insert AFTER INSERT ON {table_name} BEGIN
+            UPDATE {MODEL_COUNT_TABLE} SET total = total + 1 WHERE table_name = '{table_name}';
+        END""")
+        ctx.db.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table_name}_count_delete AFTER DELETE ON {table_name} BEGIN
+            UPDATE {MODEL_COUNT_TABLE} SET total = total - 1 WHERE table_name = '{table_name}';
+        END""")
+
+    # unique count summaries #
+
+    for summary in model_spec.get('db', {}).get('unique_counts', []):
+        _create_unique_counts_summary(ctx, table_name, summary['field'], summary['group_by'])
+
+    # full text search #
+
+    _create_search_table(ctx, plan)
+
     ctx.db.commit()
 
     return Acknowledgment(f'Table {table_name} created or already exists.')
 
+@_write_op
+def db_model_migrate_datetime(ctx:MappContext, model_class: type, batch_size: int = 1000) -> Acknowledgment:
+    """
+    convert an existing table's timestamps and datetime fields to the model's db.datetime_storage
+
+    sqlite cannot change a column's type, so the main table is rebuilt: rows are copied
+    with converted values into a new table which replaces the old one, then indexes,
+    triggers and the autoincrement sequence are restored. List values are updated in place.
+    Runs in one transaction.
+    """
+
+    # init #
+
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    source_storage = _table_datetime_storage(ctx, table_name)
+    if source_storage is None:
+        raise MappError('TABLE_NOT_FOUND', f'{table_name} does not exist, run: mapp create-tables')
+    if source_storage == plan.datetime_storage:
+        return Acknowledgment(f'{table_name} already stores datetimes as {source_storage}.')
+
+    source_plan = _compile_model_plan(model_class, datetime_storage=source_storage)
+    target = plan.datetime_codec
+
+    convert_columns = []
+    for index, column_name in enumerate(plan.column_names):
+        if column_name in plan.datetime_columns:
+            serialize = target.serialize_timestamp if column_name in MODEL_TIMESTAMP_FIELDS else target.serialize
+            convert_columns.append((index, source_plan.converters[column_name], serialize))
+
+    def convert_row(row: tuple) -> list:
+        values = list(row)
+        for index, parse, serialize in convert_columns:
+            if values[index] is not None:
+                values[index] = serialize(parse(values[index]))
+        return values
+
+    new_table_name = f'{table_name}_datetime_migration'
+    columns_str = ', '.join(f'"{column_name}"' for column_name in plan.column_names)
+    insert_sql = f'INSERT INTO {new_table_name} ({columns_str}) VALUES ({", ".join("?" * len(plan.column_names))})'
+
+    if not ctx.db.connection.in_transaction:
+        ctx.db.cursor.execute('BEGIN')
+
+    try:
+
+        # main table #
+
+        ctx.db.cursor.execute(_main_table_ddl(model_class, new_table_name)[0])
+
+        source = ctx.db.connection.execute(f'SELECT {columns_str} FROM {table_name}')
+        while rows := source.fetchmany(batch_size):
+            ctx.db.cursor.executemany(insert_sql, [convert_row(row) for row in rows])
+
+        sequence_row = ctx.db.cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table_name,)).fetchone()
+
+        ctx.db.cursor.execute(f'DROP TABLE {table_name}')
+        ctx.db.cursor.execute(f'ALTER TABLE {new_table_name} RENAME TO {table_name}')
+
+        if sequence_row is not None:
+            ctx.db.cursor.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (sequence_row[0], table_name))
+
+        # summaries hold the old datetime values, db_model_create_table rebuilds them
+        for summary in model_class._model_spec.get('db', {}).get('unique_counts', []):
+            ctx.db.cursor.execute(f'DROP TABLE IF EXISTS {_unique_counts_summary_table(table_name, summary["field"], summary["group_by"])}')
+
+        # list tables #
+
+        for source_list_field, list_field in zip(source_plan.list_fields, plan.list_fields):
+            if list_field.serialize is None:
+                continue
+            parse = source_list_field.convert
+            source = ctx.db.connection.execute(f'SELECT id, value FROM {list_field.table_name} WHERE value IS NOT NULL')
+            while rows := source.fetchmany(batch_size):
+                ctx.db.cursor.executemany(
+                    f'UPDATE {list_field.table_name} SET value = ? WHERE id = ?',
+                    [(list_field.serialize(parse(value)), row_id) for row_id, value in rows]
+                )
+
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        ctx.db.rollback()
+        raise MappError('DATETIME_MIGRATION_FAILED', f'{table_name} - {e}')
+
+    # indexes, triggers and commit #
+
+    db_model_create_table(ctx, model_class)
+
+    return Acknowledgment(f'{table_name} converted from {source_storage} to {plan.datetime_storage} datetime storage.')
+
+def _has_create_limits(model_spec: dict) -> bool:
+    auth = model_spec['auth']
+    return auth['max_models_per_user'] >= 0 or any(max_count >= 0 for max_count in auth['max_models_by_field'].values())
+
+def _check_create_limits(ctx:MappContext, model_spec: dict, table_name: str, user_id: str, obj: object) -> None:
+    """raise MappUserError if creating obj would exceed auth.max_models_per_user or auth.max_models_by_field"""
+
+    max_models = model_spec['auth']['max_models_per_user']
+
+    if max_models >= 0:
+        existing_count = ctx.db.cursor.execute(
+            f'SELECT COUNT(*) FROM {table_name} WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()[0]
+
+        if existing_count >= max_models:
+            raise MappUserError('MAX_MODELS_EXCEEDED', f'Maximum number of models ({max_models}) for user exceeded.')
+
+    for field_name, max_count in model_spec['auth']['max_models_by_field'].items():
+        if max_count >= 0:
+            field_value = getattr(obj, field_name)
+            count = ctx.db.cursor.execute(
+                f'SELECT COUNT(*) FROM {table_name} WHERE user_id = ? AND "{field_name}" = ?',
+                (user_id, field_value)
+            ).fetchone()[0]
+            if count >= max_count:
+                raise MappUserError('MAX_MODELS_BY_FIELD_EXCEEDED',
+                    f'Maximum models ({max_count}) for field {field_name} exceeded.')
+
+@_write_op
 def db_model_create(ctx:MappContext, model_class: type, obj: object) -> object:
 
     # init #
@@ -138,9 +1164,8 @@ def db_model_create(ctx:MappContext, model_class: type, obj: object) -> object:
         raise ValueError('id must be null to create a new item')
 
     model_spec = model_class._model_spec
-    model_snake_case = model_class._model_spec['name']['snake_case']
-    module_snake_case = model_class._module_spec['name']['snake_case']
-    table_name = f'{module_snake_case}_{model_snake_case}'
+    plan = model_plan(model_class)
+    table_name = plan.table_name
 
     # auth #
 
@@ -151,61 +1176,14 @@ def db_model_create(ctx:MappContext, model_class: type, obj: object) -> object:
         if 'user_id' in model_spec['fields']:
             obj = obj._replace(user_id=user['value']['id'])
 
-        max_models = model_class._model_spec['auth']['max_models_per_user']
-
-        if max_models >= 0:
-            existing_count = ctx.db.cursor.execute(
-                f'SELECT COUNT(*) FROM {table_name} WHERE user_id = ?',
-                (user['value']['id'],)
-            ).fetchone()[0]
-
-            if existing_count >= max_models:
-                raise MappUserError('MAX_MODELS_EXCEEDED', f'Maximum number of models ({max_models}) for user exceeded.')
-
-        for field_name, max_count in model_spec['auth']['max_models_by_field'].items():
-            if max_count >= 0:
-                field_value = getattr(obj, field_name)
-                count = ctx.db.cursor.execute(
-                    f'SELECT COUNT(*) FROM {table_name} WHERE user_id = ? AND "{field_name}" = ?',
-                    (user['value']['id'], field_value)
-                ).fetchone()[0]
-                if count >= max_count:
-                    raise MappUserError('MAX_MODELS_BY_FIELD_EXCEEDED',
-                        f'Maximum models ({max_count}) for field {field_name} exceeded.')
-
-    # non list sql #
-    
-    fields = []
-    values = []
-    placeholders = []
-    has_non_list_fields = False
-
-    for field in model_spec['non_list_fields']:
-        has_non_list_fields = True
-        field_name = field['name']['snake_case']
-
-        fields.append(field_name)
-        value = getattr(obj, field_name)
-        
-        if field['type'] == 'datetime':
-            value = value.isoformat()
-
-        values.append(value)
-        placeholders.append('?')
-
-    if has_non_list_fields:
-        fields_str = ', '.join(f"'{f}'" for f in fields)
-        placeholder_str = ', '.join(placeholders)
-        non_list_sql = f'INSERT INTO {table_name} (' + fields_str + ') VALUES (' + placeholder_str + ')'
-    else:
-        non_list_sql = f'INSERT INTO {table_name} DEFAULT VALUES'
+        _check_create_limits(ctx, model_spec, table_name, user['value']['id'], obj)
 
     # call db #
 
     try:
-        result = ctx.db.cursor.execute(non_list_sql, values)
+        result = ctx.db.cursor.execute(plan.insert_sql, plan.non_list_values(obj))
     except sqlite3.IntegrityError as e:
-        ctx.db.connection.rollback()
+        ctx.db.rollback()
         msg = f'Another record with the same value exists, check field(s): ' + ', '.join(model_spec['unique_model_fields'])
         raise MappUserError('UNIQUE_CONSTRAINT_VIOLATED', msg)
     assert result.rowcount == 1
@@ -214,33 +1192,26 @@ def db_model_create(ctx:MappContext, model_class: type, obj: object) -> object:
 
     # list fields sql #
 
-    for field in model_spec['list_fields']:
-        field_name = field['name']['snake_case']
-        list_table_name = f'{table_name}_{field_name}'
-        values_list = getattr(obj, field_name, [])
-        for pos, value in enumerate(values_list):
-            if field['element_type'] == 'datetime':
-                value = value.isoformat()
-            try:
-                ctx.db.cursor.execute(
-                    f"INSERT INTO {list_table_name} (value, position, {table_name}_id) VALUES (?, ?, ?)",
-                    (value, pos, obj.id)
-                )
-            except Exception as e:
-                ctx.db.connection.rollback()
-                raise MappError('Failed to insert list field value', str(e))
+    for list_field in plan.list_fields:
+        try:
+            ctx.db.cursor.executemany(list_field.insert_sql, plan.list_rows(list_field, obj))
+        except Exception as e:
+            ctx.db.rollback()
+            raise MappError('Failed to insert list field value', str(e))
 
     ctx.db.commit()
     return db_model_read(ctx, model_class, obj.id)
 
-def db_model_read(ctx:MappContext, model_class: type, model_id: str):
+def db_model_read(ctx:MappContext, model_class: type, model_id: str, fields: Optional[list[str]] = None):
+    """read a model, or if fields is given a dict of id and only those fields"""
 
     # init #
 
-    model_spec = model_class._model_spec
-    model_snake_case = model_spec['name']['snake_case']
-    module_snake_case = model_class._module_spec['name']['snake_case']
-    table_name = f'{module_snake_case}_{model_snake_case}'
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    if fields is not None:
+        columns, list_field_names = _projection(plan, fields)
 
     # auth #
 
@@ -248,57 +1219,39 @@ def db_model_read(ctx:MappContext, model_class: type, model_id: str):
         # will raise AuthenticationError if not logged in
         current_user(ctx)
 
+    # cache #
+
+    model_id = str(model_id)
+    cache = _model_cache(ctx, model_class)
+    if cache is not None:
+        model = cache.get(model_id)
+        if model is not None:
+            if fields is None:
+                return model
+            return {field_name: getattr(model, field_name) for field_name in (*columns, *list_field_names)}
 
     # read non list fields #
 
-    sql = f'SELECT * FROM {table_name} WHERE id=?'
+    if fields is None:
+        main_row = ctx.db.cursor.execute(plan.read_sql, (model_id,)).fetchone()
+    else:
+        columns_str = ', '.join(f'"{column}"' for column in columns)
+        main_row = ctx.db.cursor.execute(f'SELECT {columns_str} FROM {table_name} WHERE id=?', (model_id,)).fetchone()
 
-    main_row = ctx.db.cursor.execute(sql, (model_id,)).fetchone()
     if main_row is None:
         raise NotFoundError(f'{table_name} {model_id} not found')
 
-    # convert non list fields #
-
-    data = {'id': model_id}
-    data.update(_parse_row_timestamps(main_row))
-    for index, field in enumerate(model_spec['non_list_fields'], start=3):
-        field_name = field['name']['snake_case']
-        match field['type']:
-            case 'bool':
-                value = bool(main_row[index])
-            case 'datetime' if main_row[index] is not None:
-                value = datetime.strptime(main_row[index], DATETIME_FORMAT_STR).replace(microsecond=0)
-            case 'foreign_key':
-                value = str(main_row[index])
-            case _:
-                value = main_row[index]
-        data[field_name] = value
-
-    # read list fields #
-
-    for index, field in enumerate(model_spec['list_fields']):
-
-        field_name = field['name']['snake_case']
-        list_table_name = f'{table_name}_{field_name}'
-
-        list_cursor = ctx.db.cursor.execute(
-            f'SELECT value FROM {list_table_name} WHERE {table_name}_id = ? ORDER BY position ASC',
-            (model_id,)
-        )
-        assert list_cursor is not None
-
-        match field['element_type']:
-            case 'bool':
-                convert_element = bool
-            case 'datetime':
-                convert_element = lambda x: datetime.strptime(x, DATETIME_FORMAT_STR).replace(microsecond=0)
-            case _:
-                convert_element = lambda x: x
+    # convert #
 
-        data[field_name] = [convert_element(row[0]) for row in list_cursor.fetchall()]
+    if fields is not None:
+        return _project_rows(ctx, plan, columns, [main_row], list_field_names)[0]
 
-    return model_class(**data)
+    model = _rows_to_models(ctx, model_class, [main_row])[0]
+    if cache is not None and not ctx.db.connection.in_transaction:
+        cache.put(model_id, model)
+    return model
 
+@_write_op
 def db_model_update(ctx:MappContext, model_class: type, obj: object):
     
     # init #
@@ -310,9 +1263,8 @@ def db_model_update(ctx:MappContext, model_class: type, obj: object):
     validate_model(model_class, obj, ctx)
 
     model_spec = model_class._model_spec
-    model_snake_case = model_spec['name']['snake_case']
-    module_snake_case = model_class._module_spec['name']['snake_case']
-    table_name = f'{module_snake_case}_{model_snake_case}'
+    plan = model_plan(model_class)
+    table_name = plan.table_name
 
     # auth #
 
@@ -331,80 +1283,135 @@ def db_model_update(ctx:MappContext, model_class: type, obj: object):
     # non list fields
     #
 
-    # prepare sql #
-
-    non_list_fields = []
-    values = []
-
-    for field in model_spec['non_list_fields']:
-        field_name = field['name']['snake_case']
-        value = getattr(obj, field_name)
-
-        if field['type'] == 'datetime':
-            value = value.isoformat()
-
-        non_list_fields.append(f"'{field_name}' = ?")
-        values.append(value)
-
-    non_list_fields.append(f"date_modified = {MODEL_TIMESTAMP_SQL}")
-    values.append(obj.id)
-    set_clause = ', '.join(non_list_fields)
-    sql = f'UPDATE {table_name} SET {set_clause} WHERE id=?'
-
-    # execute sql #
-    try:
-        result = ctx.db.cursor.execute(sql, values)
-    except Exception as e:
-        ctx.db.connection.rollback()
-        raise MappError('Failed to update model', str(e))
-    
-    if result.rowcount == 0:
-        raise NotFoundError(f'{table_name} {obj.id} not found')
+    try:
+        result = ctx.db.cursor.execute(plan.update_sql, plan.non_list_values(obj) + [obj.id])
+    except Exception as e:
+        ctx.db.rollback()
+        raise MappError('Failed to update model', str(e))
+    
+    if result.rowcount == 0:
+        raise NotFoundError(f'{table_name} {obj.id} not found')
 
     #
     # list fields
     #
 
-    for field in model_spec['list_fields']:
-        field_name = field['name']['snake_case']
-        list_table_name = f'{table_name}_{field_name}'
+    for list_field in plan.list_fields:
 
         # clear existing values #
 
         try:
-            ctx.db.cursor.execute(f'DELETE FROM {list_table_name} WHERE {table_name}_id = ?', (obj.id,))
+            ctx.db.cursor.execute(list_field.delete_sql, (obj.id,))
         except Exception as e:
-            ctx.db.connection.rollback()
+            ctx.db.rollback()
             raise MappError('Failed to clear list field values', str(e))
 
         # insert new values #
-        
-        for pos, value in enumerate(getattr(obj, field_name)):
-            if field['element_type'] == 'datetime':
-                value = value.isoformat()
-            try:
-                ctx.db.cursor.execute(
-                    f'INSERT INTO {list_table_name} (value, position, {table_name}_id) VALUES (?, ?, ?)',
-                    (value, pos, obj.id)
-                )
-            except Exception as e:
-                ctx.db.connection.rollback()
-                raise MappError('Failed to insert list field value', str(e))
+
+        try:
+            ctx.db.cursor.executemany(list_field.insert_sql, plan.list_rows(list_field, obj))
+        except Exception as e:
+            ctx.db.rollback()
+            raise MappError('Failed to insert list field value', str(e))
             
     # finish #
 
+    _invalidate_cache(ctx, model_class, [obj.id])
     ctx.db.commit()
 
     return db_model_read(ctx, model_class, obj.id)
 
+@_write_op
+def db_model_patch(ctx:MappContext, model_class: type, model_id: str, data: dict) -> object:
+    """
+    update only the fields in data on a model: only those fields are validated, one UPDATE
+    sets only their columns (and date_modified), and list fields are diffed by position so
+    only changed, added or removed list rows are written
+    """
+
+    # init #
+
+    if not model_id:
+        raise MappError('MODEL_ID_NOT_PROVIDED', 'id must be provided to update an item')
+
+    _validate_auto_timestamp_fields_not_set(SimpleNamespace(**data))
+    data = {field_name: value for field_name, value in data.items() if field_name not in ('id', *MODEL_TIMESTAMP_FIELDS)}
+    values = validate_model_fields(model_class, data, ctx)
+
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    # auth #
+
+    owner_id = None
+    if model_class._model_spec['auth']['require_login'] is True:
+        # will raise AuthenticationError if not logged in
+        user = current_user(ctx)
+        if 'user_id' in model_class._model_spec['fields']:
+            owner_id = user['value']['id']
+            if 'user_id' in values and values['user_id'] != owner_id:
+                raise AuthenticationError('Not authorized to update this item')
+
+    # non list fields #
+
+    update_fields = [field_name for field_name in plan.column_names[3:] if field_name in values]
+    set_clause = ', '.join([f'"{field_name}" = ?' for field_name in update_fields] + [f'date_modified = {plan.datetime_codec.timestamp_sql}'])
+    owner_sql = ' AND user_id = ?' if owner_id is not None else ''
+
+    try:
+        rows = ctx.db.cursor.execute(
+            f'UPDATE {table_name} SET {set_clause} WHERE id = ?{owner_sql} RETURNING *',
+            [plan.db_value(field_name, values[field_name]) for field_name in update_fields] + [model_id] + ([owner_id] if owner_id is not None else [])
+        ).fetchall()
+    except Exception as e:
+        ctx.db.rollback()
+        raise MappError('Failed to update model', str(e))
+
+    if not rows:
+        if owner_id is not None and ctx.db.cursor.execute(f'SELECT 1 FROM {table_name} WHERE id = ?', (model_id,)).fetchone() is not None:
+            raise AuthenticationError('Not authorized to update this item')
+        raise NotFoundError(f'{table_name} {model_id} not found')
+
+    # list fields #
+
+    for list_field in plan.list_fields:
+        if list_field.field_name not in values:
+            continue
+
+        new_values = [value for value, _, _ in plan.list_rows(list_field, SimpleNamespace(id=model_id, **values))]
+        existing = ctx.db.cursor.execute(
+            f'SELECT id, value FROM {list_field.table_name} WHERE {table_name}_id = ? ORDER BY position',
+            (model_id,)
+        ).fetchall()
+
+        changed = [(value, row_id) for (row_id, old_value), value in zip(existing, new_values) if old_value != value]
+
+        try:
+            if changed:
+                ctx.db.cursor.executemany(f'UPDATE {list_field.table_name} SET value = ? WHERE id = ?', changed)
+            if len(existing) > len(new_values):
+                ctx.db.cursor.execute(
+                    f'DELETE FROM {list_field.table_name} WHERE {table_name}_id = ? AND position >= ?',
+                    (model_id, len(new_values))
+                )
+            elif len(new_values) > len(existing):
+                ctx.db.cursor.executemany(list_field.insert_sql, [(value, position, model_id) for position, value in enumerate(new_values) if position >= len(existing)])
+        except Exception as e:
+            ctx.db.rollback()
+            raise MappError('Failed to update list field values', str(e))
+
+    _invalidate_cache(ctx, model_class, [model_id])
+    ctx.db.commit()
+
+    return _rows_to_models(ctx, model_class, rows)[0]
+
+@_write_op
 def db_model_delete(ctx:MappContext, model_class: type, model_id: str) -> Acknowledgment:
 
     # init #
 
-    model_spec = model_class._model_spec
-    model_snake_case = model_spec['name']['snake_case']
-    module_snake_case = model_class._module_spec['name']['snake_case']
-    table_name = f'{module_snake_case}_{model_snake_case}'
+    plan = model_plan(model_class)
+    table_name = plan.table_name
     msg = f'{table_name} {model_id} has been deleted or was already absent.'
 
     # auth #
@@ -428,104 +1435,535 @@ def db_model_delete(ctx:MappContext, model_class: type, model_id: str) -> Acknow
 
     # list tables #
 
-    for field in model_spec['list_fields']:
-        field_name = field['name']['snake_case']
-        list_table_name = f'{table_name}_{field_name}'
-        ctx.db.cursor.execute(f'DELETE FROM {list_table_name} WHERE {table_name}_id = ?', (model_id,))
+    for list_field in plan.list_fields:
+        ctx.db.cursor.execute(list_field.delete_sql, (model_id,))
 
     # main table #
 
-    ctx.db.cursor.execute(f'DELETE FROM {table_name} WHERE id = ?', (model_id,))
+    ctx.db.cursor.execute(plan.delete_sql, (model_id,))
+    _invalidate_cache(ctx, model_class, [model_id])
     ctx.db.commit()
     return Acknowledgment(msg)
 
-def db_model_list(ctx:MappContext, model_class: type, offset: int = 0, size: int = 50) -> ModelListResult: 
+@_write_op
+def db_model_upsert(ctx:MappContext, model_class: type, data: dict, conflict_fields: list[str]) -> object:
+    """
+    create a model from data, or if a row with the same conflict_fields values exists update
+    the fields in data on it, with one INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement.
+    conflict_fields must match a unique index or constraint of the table. If data does not
+    have every field only the update can succeed, so it runs as one UPDATE ... RETURNING and
+    the updated model is validated.
+
+    models that require login are created for the current user and only the current user's
+    row is updated, the create limits in auth are checked when no row exists yet
+    """
 
     # init #
 
     model_spec = model_class._model_spec
-    model_snake_case = model_spec['name']['snake_case']
-    module_snake_case = model_class._module_spec['name']['snake_case']
-    table_name = f'{module_snake_case}_{model_snake_case}'
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    if data.get('id') is not None:
+        raise MappUserError('MODEL_ID_NOT_ALLOWED', 'id can not be provided to upsert an item')
+    data = {field_name: value for field_name, value in data.items() if field_name != 'id'}
+
+    for field_name in conflict_fields:
+        if field_name not in data:
+            raise MappValidationError(
+                f'db_model_upsert - conflict field missing from data: {field_name}',
+                {field_name: 'Conflict field is required in data.'},
+            )
 
     # auth #
 
-    if model_class._model_spec['auth']['require_login'] is True:
+    owner_id = None
+    if model_spec['auth']['require_login'] is True:
         # will raise AuthenticationError if not logged in
-        current_user(ctx)
+        user = current_user(ctx)
+        if 'user_id' in model_spec['fields']:
+            owner_id = user['value']['id']
+            data['user_id'] = owner_id
 
-    # query #
+    update_fields = [name for name in plan.column_names[3:] if name in data and name not in conflict_fields]
+    timestamp_sql = f'date_modified = {plan.datetime_codec.timestamp_sql}'
+    owner_values = [owner_id] if owner_id is not None else []
 
-    sql = f'SELECT * FROM {table_name} ORDER BY id LIMIT ? OFFSET ?'
-    rows = ctx.db.cursor.execute(sql, (size, offset)).fetchall()
-    
-    # convert results #
+    # call db #
 
-    models = []
+    try:
+        if all(field_name in data for field_name in model_spec['fields']):
+
+            obj = convert_dict_to_model(model_class, {**data, 'id': None})
+            _validate_auto_timestamp_fields_not_set(obj)
+            validate_model(model_class, obj, ctx)
+
+            if owner_id is not None and _has_create_limits(model_spec):
+                conflict_sql = ' AND '.join(f'"{field_name}" = ?' for field_name in conflict_fields)
+                conflict_values = [plan.db_value(field_name, getattr(obj, field_name)) for field_name in conflict_fields]
+                if ctx.db.cursor.execute(f'SELECT 1 FROM {table_name} WHERE {conflict_sql}', conflict_values).fetchone() is None:
+                    _check_create_limits(ctx, model_spec, table_name, owner_id, obj)
+
+            conflict_str = ', '.join(f'"{field_name}"' for field_name in conflict_fields)
+            set_clause = ', '.join([f'"{field_name}" = excluded."{field_name}"' for field_name in update_fields] + [timestamp_sql])
+            owner_sql = f' WHERE {table_name}.user_id = ?' if owner_id is not None else ''
+            rows = ctx.db.cursor.execute(
+                f'{plan.insert_sql} ON CONFLICT({conflict_str}) DO UPDATE SET {set_clause}{owner_sql} RETURNING *',
+                plan.non_list_values(obj) + owner_values
+            ).fetchall()
 
-    for row in rows:
-        data = {'id': str(row[0])}
-        data.update(_parse_row_timestamps(row))
+        else:
 
-        # convert non list fields #
+            obj = None
+            conflict_sql = ' AND '.join(f'"{field_name}" = ?' for field_name in conflict_fields)
+            set_clause = ', '.join([f'"{field_name}" = ?' for field_name in update_fields] + [timestamp_sql])
+            owner_sql = ' AND user_id = ?' if owner_id is not None else ''
+            rows = ctx.db.cursor.execute(
+                f'UPDATE {table_name} SET {set_clause} WHERE {conflict_sql}{owner_sql} RETURNING *',
+                [plan.db_value(field_name, data[field_name]) for field_name in [*update_fields, *conflict_fields]] + owner_values
+            ).fetchall()
+
+            if not rows:
+                if owner_id is not None and ctx.db.cursor.execute(
+                    f'SELECT 1 FROM {table_name} WHERE {conflict_sql}',
+                    [plan.db_value(field_name, data[field_name]) for field_name in conflict_fields]
+                ).fetchone() is not None:
+                    raise AuthenticationError(f'{table_name} not authorized to update this item')
+
+                # no row to update, so this would create a model with missing fields
+                missing_fields = [field_name for field_name in model_spec['fields'] if field_name not in data]
+                raise MappValidationError(
+                    f'db_model_upsert - no existing row and data is missing fields: {", ".join(missing_fields)}',
+                    {field_name: 'Field is required to create the item.' for field_name in missing_fields},
+                )
 
-        for index, field in enumerate(model_spec['non_list_fields'], start=3):
-            field_name = field['name']['snake_case']
-            match field['type']:
-                case 'bool':
-                    value = bool(row[index])
-                case 'datetime' if row[index] is not None:
-                    value = datetime.strptime(row[index], DATETIME_FORMAT_STR).replace(microsecond=0)
-                case 'foreign_key':
-                    value = str(row[index])
-                case _:
-                    value = row[index]
+    except sqlite3.IntegrityError:
+        ctx.db.rollback()
+        msg = f'Another record with the same value exists, check field(s): ' + ', '.join(model_spec['unique_model_fields'])
+        raise MappUserError('UNIQUE_CONSTRAINT_VIOLATED', msg)
+    except sqlite3.OperationalError as e:
+        if 'ON CONFLICT' not in str(e):
+            raise
+        raise MappValidationError(
+            'db_model_upsert - conflict_fields must match a unique index in model definition',
+            {'conflict_fields': 'Must match a unique index in the model definition.'},
+        )
+
+    if not rows:
+        raise AuthenticationError(f'{table_name} not authorized to update this item')
+
+    # list fields #
+
+    model_id = str(rows[0][0])
+    list_obj = obj._replace(id=model_id) if obj is not None else SimpleNamespace(id=model_id, **data)
+    for list_field in plan.list_fields:
+        if list_field.field_name in data:
+            ctx.db.cursor.execute(list_field.delete_sql, (model_id,))
+            ctx.db.cursor.executemany(list_field.insert_sql, plan.list_rows(list_field, list_obj))
+
+    model = _rows_to_models(ctx, model_class, rows)[0]
+
+    # partial data is validated after it is merged with the existing row #
+
+    if obj is None:
+        try:
+            validate_model(model_class, model._replace(date_created=None, date_modified=None), ctx)
+        except MappValidationError:
+            ctx.db.rollback()
+            raise
+
+    _invalidate_cache(ctx, model_class, [model_id])
+    ctx.db.commit()
+    return model
 
-            data[field_name] = value
+@_write_op
+def db_model_delete_where(ctx:MappContext, model_class: type, where: dict) -> int:
+    """
+    delete every model matching a db_model_query where dict with one DELETE per list table
+    and one on the main table, committed together. Models that require login only delete
+    the current user's rows. Returns the number of models deleted
+    """
 
-        # query for and convert list fields #
+    # init #
 
-        for index, field in enumerate(model_spec['list_fields'], start=1):
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+    where_parts, where_values = _query_where(model_class, where)
 
-            field_name = field['name']['snake_case']
-            list_table_name = f'{table_name}_{field_name}'
+    # auth #
 
-            cursor = ctx.db.cursor.execute(
-                f'SELECT value FROM {list_table_name} WHERE {table_name}_id = ? ORDER BY position ASC',
-                (data['id'],)
+    if model_class._model_spec['auth']['require_login'] is True:
+        # will raise AuthenticationError if not logged in
+        user = current_user(ctx)
+        where_parts.append('user_id = ?')
+        where_values.append(user['value']['id'])
+
+    where_clause = f" WHERE {' AND '.join(where_parts)}" if where_parts else ''
+
+    # call db #
+
+    try:
+        for list_field in plan.list_fields:
+            ctx.db.cursor.execute(
+                f'DELETE FROM {list_field.table_name} WHERE {table_name}_id IN (SELECT id FROM {table_name}{where_clause})',
+                where_values
             )
-            
-            match field['element_type']:
-                case 'bool':
-                    convert_element = bool
-                case 'datetime':
-                    convert_element = lambda x: datetime.strptime(x, DATETIME_FORMAT_STR).replace(microsecond=0)
-                case 'foreign_key':
-                    convert_element = str
-                case _:
-                    convert_element = lambda x: x
+        deleted = ctx.db.cursor.execute(f'DELETE FROM {table_name}{where_clause}', where_values).rowcount
+    except sqlite3.Error as e:
+        ctx.db.rollback()
+        raise MappError('DELETE_FAILED', f'{table_name} - {e}')
+
+    _invalidate_cache(ctx, model_class)
+    ctx.db.commit()
+    return deleted
+
+#
+# bulk
+#
+
+"""
+bulk functions validate every item and check auth up front, items that fail are
+reported by index in the result and skipped, the rest are written with executemany
+in the current transaction and committed once
+"""
+
+def _bulk_item_error(e: Exception) -> dict:
+    if isinstance(e, MappError):
+        return e.to_dict()['error']
+    return {'code': 'INVALID_ITEM', 'message': str(e)}
+
+def _bulk_result(results: list[dict]) -> ModelBulkResult:
+    failed = sum(1 for result in results if result['error'] is not None)
+    return ModelBulkResult(items=results, succeeded=len(results) - failed, failed=failed)
+
+def _bulk_validate(ctx: MappContext, model_class: type, items: list, results: list[dict], require_id: bool) -> dict[int, object]:
+    """convert dicts and validate each item, returns {index: obj} for valid items"""
+    objs = {}
+    for index, item in enumerate(items):
+        try:
+            obj = convert_dict_to_model(model_class, item) if isinstance(item, dict) else item
+            if require_id and obj.id is None:
+                raise MappError('MODEL_ID_NOT_PROVIDED', 'id must be provided to update an item')
+            if not require_id and obj.id is not None:
+                raise MappUserError('MODEL_ID_NOT_ALLOWED', 'id must be null to create a new item')
+            _validate_auto_timestamp_fields_not_set(obj)
+            validate_model(model_class, obj, ctx)
+        except (MappError, ValueError, TypeError) as e:
+            results[index]['error'] = _bulk_item_error(e)
+        else:
+            results[index]['id'] = obj.id
+            objs[index] = obj
+    return objs
+
+def _bulk_owners(ctx: MappContext, table_name: str, model_ids: list[str], has_user_id: bool) -> dict[str, Optional[str]]:
+    """{id: user_id} for each existing id, user_id is None when the model has no user_id field"""
+    owners = {}
+    columns = 'id, user_id' if has_user_id else 'id, NULL'
+    for start in range(0, len(model_ids), SQL_MAX_IN_PARAMS):
+        chunk = model_ids[start:start + SQL_MAX_IN_PARAMS]
+        placeholders = ', '.join('?' for _ in chunk)
+        for model_id, user_id in ctx.db.cursor.execute(f'SELECT {columns} FROM {table_name} WHERE id IN ({placeholders})', chunk):
+            owners[str(model_id)] = None if user_id is None else str(user_id)
+    return owners
+
+def _bulk_write_list_fields(ctx: MappContext, plan: ModelPlan, objs: list, clear: bool) -> None:
+    for list_field in plan.list_fields:
+        if clear:
+            ctx.db.cursor.executemany(list_field.delete_sql, [(obj.id,) for obj in objs])
+
+        rows = [row for obj in objs for row in plan.list_rows(list_field, obj)]
+        if rows:
+            ctx.db.cursor.executemany(list_field.insert_sql, rows)
+
+def _bulk_insert_rows(ctx: MappContext, table_name: str, sql: str, rows: list[list]) -> list[Optional[str]]:
+    """
+    insert rows with executemany and return their ids, if a row violates a
+    constraint the batch is rolled back to a savepoint and inserted row by row
+    so that only the offending rows are skipped (their id is None)
+    """
+
+    # a savepoint outside of a transaction would commit on release
+    if not ctx.db.connection.in_transaction:
+        ctx.db.cursor.execute('BEGIN')
+
+    ctx.db.cursor.execute('SAVEPOINT mapp_bulk_insert')
+    try:
+        ctx.db.cursor.executemany(sql, rows)
+
+    except sqlite3.IntegrityError:
+        ctx.db.cursor.execute('ROLLBACK TO mapp_bulk_insert')
+        model_ids = []
+        for row in rows:
+            try:
+                model_ids.append(str(ctx.db.cursor.execute(sql, row).lastrowid))
+            except sqlite3.IntegrityError:
+                model_ids.append(None)
+        return model_ids
+
+    else:
+        # ids are assigned consecutively while this transaction holds the write lock
+        last_id = ctx.db.cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table_name,)).fetchone()[0]
+        return [str(model_id) for model_id in range(last_id - len(rows) + 1, last_id + 1)]
+
+    finally:
+        ctx.db.cursor.execute('RELEASE mapp_bulk_insert')
+
+@_write_op
+def db_model_bulk_create(ctx:MappContext, model_class: type, items: list) -> ModelBulkResult:
+    """
+    create many models with one commit, items are model instances or dicts,
+    returns the id or error of each item, created models are not read back
+    """
+
+    # init #
+
+    model_spec = model_class._model_spec
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    results = [{'index': index, 'id': None, 'error': None} for index in range(len(items))]
+    objs = _bulk_validate(ctx, model_class, items, results, require_id=False)
+
+    # auth #
+
+    if model_spec['auth']['require_login'] is True and objs:
+        # will raise AuthenticationError if not logged in
+        user = current_user(ctx)
+        user_id = user['value']['id']
+
+        if 'user_id' in model_spec['fields']:
+            objs = {index: obj._replace(user_id=user_id) for index, obj in objs.items()}
+
+        # limits are checked in item order against existing counts plus
+        # the items accepted so far in this batch
+
+        max_models = model_spec['auth']['max_models_per_user']
+        if max_models >= 0:
+            remaining = max_models - ctx.db.cursor.execute(
+                f'SELECT COUNT(*) FROM {table_name} WHERE user_id = ?',
+                (user_id,)
+            ).fetchone()[0]
+
+        field_counts = {}
+        for field_name, max_count in model_spec['auth']['max_models_by_field'].items():
+            if max_count < 0:
+                continue
+            counts = field_counts[field_name] = {}
+            field_values = list({getattr(obj, field_name) for obj in objs.values()})
+            for start in range(0, len(field_values), SQL_MAX_IN_PARAMS):
+                chunk = field_values[start:start + SQL_MAX_IN_PARAMS]
+                placeholders = ', '.join('?' for _ in chunk)
+                counts.update(ctx.db.cursor.execute(
+                    f'SELECT "{field_name}", COUNT(*) FROM {table_name} WHERE user_id = ? AND "{field_name}" IN ({placeholders}) GROUP BY "{field_name}"',
+                    (user_id, *chunk)
+                ).fetchall())
+
+        for index, obj in list(objs.items()):
+            error = None
+            if max_models >= 0 and remaining <= 0:
+                error = MappUserError('MAX_MODELS_EXCEEDED', f'Maximum number of models ({max_models}) for user exceeded.')
+            else:
+                for field_name, counts in field_counts.items():
+                    max_count = model_spec['auth']['max_models_by_field'][field_name]
+                    if counts.get(getattr(obj, field_name), 0) >= max_count:
+                        error = MappUserError('MAX_MODELS_BY_FIELD_EXCEEDED', f'Maximum models ({max_count}) for field {field_name} exceeded.')
+                        break
+
+            if error is not None:
+                results[index]['error'] = _bulk_item_error(error)
+                del objs[index]
+                continue
+
+            if max_models >= 0:
+                remaining -= 1
+            for field_name, counts in field_counts.items():
+                field_value = getattr(obj, field_name)
+                counts[field_value] = counts.get(field_value, 0) + 1
+
+    if not objs:
+        return _bulk_result(results)
+
+    # main table #
 
-            data[field_name] = [convert_element(row[0]) for row in cursor.fetchall()]
+    indexes = list(objs)
+    model_ids = _bulk_insert_rows(ctx, table_name, plan.insert_sql, [plan.non_list_values(objs[index]) for index in indexes])
 
-        models.append(model_class(**data))
+    created = []
+    for index, model_id in zip(indexes, model_ids):
+        if model_id is None:
+            msg = f'Another record with the same value exists, check field(s): ' + ', '.join(model_spec['unique_model_fields'])
+            results[index]['error'] = _bulk_item_error(MappUserError('UNIQUE_CONSTRAINT_VIOLATED', msg))
+        else:
+            results[index]['id'] = model_id
+            created.append(objs[index]._replace(id=model_id))
+
+    # list tables #
+
+    _bulk_write_list_fields(ctx, plan, created, clear=False)
+
+    ctx.db.commit()
+    return _bulk_result(results)
+
+@_write_op
+def db_model_bulk_update(ctx:MappContext, model_class: type, items: list) -> ModelBulkResult:
+    """update many models with one commit, items are model instances or dicts with an id"""
+
+    # init #
+
+    model_spec = model_class._model_spec
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+    has_user_id = 'user_id' in model_spec['fields']
+
+    results = [{'index': index, 'id': None, 'error': None} for index in range(len(items))]
+    objs = _bulk_validate(ctx, model_class, items, results, require_id=True)
+
+    # existence and auth #
+
+    user_id = None
+    if model_spec['auth']['require_login'] is True and objs:
+        # will raise AuthenticationError if not logged in
+        user_id = current_user(ctx)['value']['id']
+
+    owners = _bulk_owners(ctx, table_name, list({obj.id for obj in objs.values()}), has_user_id)
+
+    for index, obj in list(objs.items()):
+        if obj.id not in owners:
+            error = NotFoundError(f'{table_name} {obj.id} not found')
+        elif user_id is not None and has_user_id and (obj.user_id != user_id or owners[obj.id] != user_id):
+            error = AuthenticationError('Not authorized to update this item')
+        else:
+            continue
+        results[index]['error'] = _bulk_item_error(error)
+        del objs[index]
+
+    if not objs:
+        return _bulk_result(results)
+
+    # main table #
+
+    ctx.db.cursor.executemany(plan.update_sql, [plan.non_list_values(obj) + [obj.id] for obj in objs.values()])
+
+    # list tables #
+
+    _bulk_write_list_fields(ctx, plan, list(objs.values()), clear=True)
+
+    _invalidate_cache(ctx, model_class, [obj.id for obj in objs.values()])
+    ctx.db.commit()
+    return _bulk_result(results)
+
+@_write_op
+def db_model_bulk_delete(ctx:MappContext, model_class: type, model_ids: list[str]) -> ModelBulkResult:
+    """delete many models with one commit, ids that are already absent succeed like db_model_delete"""
+
+    # init #
+
+    model_spec = model_class._model_spec
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    model_ids = [str(model_id) for model_id in model_ids]
+    results = [{'index': index, 'id': model_id, 'error': None} for index, model_id in enumerate(model_ids)]
+    to_delete = set(model_ids)
+
+    # auth #
+
+    if model_spec['auth']['require_login'] is True and model_ids:
+        user_id = current_user(ctx)['value']['id']
+
+        owners = _bulk_owners(ctx, table_name, list(to_delete), has_user_id=True)
+        for result in results:
+            model_id = result['id']
+            if model_id in owners and owners[model_id] != user_id:
+                error = AuthenticationError(f'{table_name} {model_id} not found or not authorized to delete')
+                result['error'] = _bulk_item_error(error)
+                to_delete.discard(model_id)
+
+    if not to_delete:
+        return _bulk_result(results)
+
+    # list tables then main table #
+
+    delete_params = [(model_id,) for model_id in to_delete]
+
+    for list_field in plan.list_fields:
+        ctx.db.cursor.executemany(list_field.delete_sql, delete_params)
+
+    ctx.db.cursor.executemany(plan.delete_sql, delete_params)
+
+    _invalidate_cache(ctx, model_class, list(to_delete))
+    ctx.db.commit()
+    return _bulk_result(results)
+
+def db_model_list(ctx:MappContext, model_class: type, offset: int = 0, size: int = 50, after: Optional[str] = None, count: Optional[str] = None,
+                  fields: Optional[list[str]] = None) -> ModelListResult:
+    """
+    list models ordered by id, either by offset or, if after is a cursor from a
+    previous page's next_cursor, by keyset in which case offset is ignored
+
+    count selects how total is computed (see _select_page), defaults to the model's db.count
+
+    if fields is given items are dicts of id and only those fields
+    """
+
+    # init #
+
+    model_spec = model_class._model_spec
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+    columns, list_field_names = _projection(plan, fields) if fields is not None else (None, None)
+
+    # auth #
+
+    if model_class._model_spec['auth']['require_login'] is True:
+        # will raise AuthenticationError if not logged in
+        current_user(ctx)
+
+    # query #
+
+    order_keys = [('id', 'ASC')]
+    count_mode = _count_mode(model_spec, count)
+    rows, next_cursor, total = _select_page(ctx, plan, [], [], order_keys, offset, size, after, count_mode, columns)
+
+    # convert results #
+
+    if fields is None:
+        models = _rows_to_models(ctx, model_class, rows)
+    else:
+        models = _project_rows(ctx, plan, columns, rows, list_field_names)
 
     # result #
-        
-    total_items = ctx.db.cursor.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]
 
     return ModelListResult(
         items=models, 
-        total=total_items
+        total=total,
+        next_cursor=next_cursor,
+        has_more=next_cursor is not None
     )
 
+def _unique_counts_groups(plan: ModelPlan, group_by: str, rows: list[tuple]) -> list[dict]:
+    """{group, count} dicts from (group, count) rows"""
+    if group_by in plan.datetime_columns:
+        # groups are reported in the same iso format for either datetime storage
+        parse = plan.converters[group_by]
+        return [{'group': _serialize_datetime(parse(row[0])) if row[0] is not None else None, 'count': row[1]} for row in rows]
+
+    return [{'group': str(row[0]) if row[0] is not None else None, 'count': row[1]} for row in rows]
+
+def _unique_counts_summary(model_class: type, field_name: str, group_by: str) -> Optional[str]:
+    """the db.unique_counts summary table for field_name and group_by, if the spec has one"""
+    for summary in model_class._model_spec.get('db', {}).get('unique_counts', []):
+        if summary['field'] == field_name and summary['group_by'] == group_by:
+            return _unique_counts_summary_table(model_plan(model_class).table_name, field_name, group_by)
+    return None
+
 def db_model_unique_counts(ctx:MappContext, model_class: type, group_by: str, filters: dict = None) -> list:
 
     # init #
 
     model_spec = model_class._model_spec
-    model_snake_case = model_spec['name']['snake_case']
-    module_snake_case = model_class._module_spec['name']['snake_case']
-    table_name = f'{module_snake_case}_{model_snake_case}'
+    plan = model_plan(model_class)
+    table_name = plan.table_name
 
     # auth #
 
@@ -538,6 +1976,18 @@ def db_model_unique_counts(ctx:MappContext, model_class: type, group_by: str, fi
     if group_by not in field_names:
         raise ValueError(f'db_model_unique_counts - group_by field not found: {group_by}')
 
+    # summary table #
+
+    if filters and len(filters) == 1:
+        field_name, value = next(iter(filters.items()))
+        summary_table = _unique_counts_summary(model_class, field_name, group_by)
+        if summary_table is not None:
+            rows = ctx.db.cursor.execute(
+                f'SELECT group_value, count FROM {summary_table} WHERE key_value = ? ORDER BY group_value',
+                (plan.db_value(field_name, value),)
+            ).fetchall()
+            return _unique_counts_groups(plan, group_by, rows)
+
     # build where clause #
 
     where_parts = []
@@ -548,7 +1998,7 @@ def db_model_unique_counts(ctx:MappContext, model_class: type, group_by: str, fi
             if field_name not in field_names:
                 raise ValueError(f'db_model_unique_counts - filter field not found: {field_name}')
             where_parts.append(f'{field_name} = ?')
-            where_values.append(value)
+            where_values.append(plan.db_value(field_name, value))
 
     where_clause = f" WHERE {' AND '.join(where_parts)}" if where_parts else ''
 
@@ -557,69 +2007,236 @@ def db_model_unique_counts(ctx:MappContext, model_class: type, group_by: str, fi
     sql = f'SELECT {group_by}, COUNT(*) FROM {table_name}{where_clause} GROUP BY {group_by}'
     rows = ctx.db.cursor.execute(sql, where_values).fetchall()
 
-    # convert results #
+    return _unique_counts_groups(plan, group_by, rows)
 
-    return [{'group': str(row[0]) if row[0] is not None else None, 'count': row[1]} for row in rows]
+def db_model_unique_counts_in(ctx:MappContext, model_class: type, group_by: str, field_name: str, values: list) -> dict:
+    """
+    db_model_unique_counts for every value of field_name in values at once, with one
+    GROUP BY field_name, group_by query per SQL_MAX_IN_PARAMS values, or a lookup in the
+    db.unique_counts summary table when the spec has one for field_name and group_by.
+    Returns {value: [{group, count}, ...]} for values with at least one row, keyed by
+    the field's python value (ie. a str for ids and foreign keys)
+    """
 
-def db_model_query(ctx:MappContext, model_class: type, where: dict, offset: int=0, size: int=25, sort: list=None) -> dict:
+    # init #
 
-    """
-    where is a dict like this:
-    {
-        "field_a": {"eq": "value"},
-        "field_b": {"ne": "value"}
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+
+    # auth #
+
+    if model_class._model_spec['auth']['require_login'] is True:
+        current_user(ctx)
+
+    # validate fields #
+
+    field_names = [f['name']['snake_case'] for f in model_class._model_spec['non_list_fields']]
+    if group_by not in field_names:
+        raise ValueError(f'db_model_unique_counts - group_by field not found: {group_by}')
+    if field_name not in field_names and field_name != 'id':
+        raise ValueError(f'db_model_unique_counts - filter field not found: {field_name}')
+
+    # query #
+
+    summary_table = _unique_counts_summary(model_class, field_name, group_by)
+    if summary_table is not None:
+        sql = f'SELECT key_value, group_value, count FROM {summary_table} WHERE key_value IN ({{}}) ORDER BY key_value, group_value'
+    else:
+        sql = f'SELECT "{field_name}", "{group_by}", COUNT(*) FROM {table_name} WHERE "{field_name}" IN ({{}}) GROUP BY "{field_name}", "{group_by}" ORDER BY "{field_name}", "{group_by}"'
+
+    distinct_values = list(dict.fromkeys(value for value in values if value is not None))
+    rows_by_key = {}
+    for chunk_start in range(0, len(distinct_values), SQL_MAX_IN_PARAMS):
+        chunk = distinct_values[chunk_start:chunk_start + SQL_MAX_IN_PARAMS]
+        rows = ctx.db.cursor.execute(sql.format(', '.join('?' * len(chunk))), [plan.db_value(field_name, value) for value in chunk]).fetchall()
+        for key, group, count in rows:
+            rows_by_key.setdefault(key, []).append((group, count))
+
+    # convert results #
+
+    convert_key = plan.converters.get(field_name)
+    return {
+        convert_key(key) if convert_key is not None else key: _unique_counts_groups(plan, group_by, rows)
+        for key, rows in rows_by_key.items()
     }
+
+def db_model_select_in(ctx:MappContext, model_class: type, field_name: str, values: list, fields: list[str]) -> list[dict]:
+    """
+    read only the given fields of every model whose field_name is one of values, for
+    resolving joins for a whole page at once: one IN (...) query per SQL_MAX_IN_PARAMS
+    values plus one per requested list field. Returns dicts of id, field_name and fields
+    ordered by id
     """
 
     # init #
 
-    model_spec = model_class._model_spec
-    model_snake_case = model_spec['name']['snake_case']
-    module_snake_case = model_class._module_spec['name']['snake_case']
-    table_name = f'{module_snake_case}_{model_snake_case}'
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+    list_field_names = {list_field.field_name for list_field in plan.list_fields}
+
+    for name in [field_name, *fields]:
+        if name not in plan.column_index and (name == field_name or name not in list_field_names):
+            raise ValueError(f'db_model_select_in - field not found on model: {name}')
 
     # auth #
 
     if model_class._model_spec['auth']['require_login'] is True:
         current_user(ctx)
 
-    # validate fields - only str and foreign_key supported #
+    # query #
+
+    columns = ['id']
+    for name in [field_name, *fields]:
+        if name not in columns and name not in list_field_names:
+            columns.append(name)
+    columns_str = ', '.join(f'"{column}"' for column in columns)
+
+    distinct_values = list(dict.fromkeys(value for value in values if value is not None))
+    rows = []
+    for chunk_start in range(0, len(distinct_values), SQL_MAX_IN_PARAMS):
+        chunk = distinct_values[chunk_start:chunk_start + SQL_MAX_IN_PARAMS]
+        rows.extend(ctx.db.cursor.execute(
+            f'SELECT {columns_str} FROM {table_name} WHERE "{field_name}" IN ({", ".join("?" * len(chunk))}) ORDER BY id',
+            [plan.db_value(field_name, value) for value in chunk]
+        ).fetchall())
+
+    if len(distinct_values) > SQL_MAX_IN_PARAMS:
+        rows.sort(key=lambda row: row[0])
+
+    # convert #
+
+    return _project_rows(ctx, plan, tuple(columns), rows, frozenset(list_field_names.intersection(fields)))
+
+#
+# query conditions
+#
+
+"""
+operators allowed per field type in db_model_query where conditions, id and the
+timestamps can be filtered too. Every condition compares the column directly so
+an index on it can be used, prefix is a range on the string rather than a LIKE
+"""
+
+_QUERY_RANGE_OPERATORS = ('eq', 'ne', 'lt', 'le', 'gt', 'ge', 'in', 'not_in', 'is_null')
 
-    field_map = {f['name']['snake_case']: f for f in model_spec['non_list_fields']}
+QUERY_OPERATORS_BY_TYPE = {
+    'str': MODEL_QUERY_OPERATORS,
+    'enum': tuple(operator for operator in MODEL_QUERY_OPERATORS if operator != 'search'),
+    'int': _QUERY_RANGE_OPERATORS,
+    'float': _QUERY_RANGE_OPERATORS,
+    'datetime': _QUERY_RANGE_OPERATORS,
+    'id': ('eq', 'ne', 'lt', 'le', 'gt', 'ge', 'in', 'not_in'),
+    'bool': ('eq', 'ne', 'is_null'),
+    'foreign_key': ('eq', 'ne', 'in', 'not_in', 'is_null'),
+}
+
+_QUERY_COMPARISONS = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+
+
+def _query_field_types(model_spec: dict) -> dict[str, str]:
+    field_types = {'id': 'id', 'date_created': 'datetime', 'date_modified': 'datetime'}
+    field_types.update((f['name']['snake_case'], f['type']) for f in model_spec['non_list_fields'])
+    return field_types
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """the smallest string greater than every string starting with prefix, None if there is none"""
+    prefix = prefix.rstrip('\U0010ffff')
+    if not prefix:
+        return None
+    next_char = ord(prefix[-1]) + 1
+    if 0xD800 <= next_char <= 0xDFFF:
+        # surrogates can not be encoded, skip to the next code point
+        next_char = 0xE000
+    return prefix[:-1] + chr(next_char)
+
+
+def _query_value(plan: ModelPlan, field_name: str, value):
+    if value is not None and not isinstance(value, (str, int, float, datetime)):
+        raise ValueError(f'db_model_query - unsupported value for field "{field_name}": {value!r}')
+    return plan.db_value(field_name, value)
+
+
+def _query_where(model_class: type, where: dict) -> tuple[list[str], list]:
+    """convert a db_model_query where dict to sql conditions and values"""
+
+    plan = model_plan(model_class)
+    field_types = _query_field_types(model_class._model_spec)
 
     where_parts = []
     where_values = []
 
     for field_name, condition in where.items():
 
-        if field_name not in field_map:
+        try:
+            field_type = field_types[field_name]
+        except KeyError:
+            if field_name in model_class._model_spec['fields']:
+                raise ValueError(
+                    f'db_model_query - unsupported field type "{model_class._model_spec["fields"][field_name]["type"]}" for field "{field_name}". '
+                    f'List fields can not be filtered.'
+                )
             raise ValueError(f'db_model_query - field not found on model: {field_name}')
 
-        field_type = field_map[field_name]['type']
-        if field_type not in ('str', 'foreign_key'):
-            raise ValueError(
-                f'db_model_query - unsupported field type "{field_type}" for field "{field_name}". '
-                f'Only str and foreign_key fields are supported.'
-            )
-        
-        operator = next(iter(condition.keys()))
-        value = condition[operator]
+        if not isinstance(condition, dict) or len(condition) != 1:
+            raise ValueError(f'db_model_query - condition for field "{field_name}" must have a single operator')
+
+        operator, value = next(iter(condition.items()))
+
+        if operator not in QUERY_OPERATORS_BY_TYPE[field_type]:
+            raise ValueError(f'db_model_query - unsupported operator: {operator} for {field_type} field "{field_name}"')
+
+        match operator:
+            case 'in' | 'not_in':
+                if not isinstance(value, (list, tuple)):
+                    raise ValueError(f'db_model_query - {operator} for field "{field_name}" expects a list')
+                if len(value) > SQL_MAX_IN_PARAMS:
+                    raise ValueError(f'db_model_query - {operator} for field "{field_name}" accepts at most {SQL_MAX_IN_PARAMS} values')
+                if not value:
+                    # nothing is in an empty list
+                    where_parts.append('0' if operator == 'in' else '1')
+                    continue
+                sql_operator = 'IN' if operator == 'in' else 'NOT IN'
+                where_parts.append(f'{field_name} {sql_operator} ({", ".join("?" * len(value))})')
+                where_values.extend(_query_value(plan, field_name, item) for item in value)
+
+            case 'prefix':
+                if not isinstance(value, str):
+                    raise ValueError(f'db_model_query - prefix for field "{field_name}" expects a str')
+                upper = _prefix_upper_bound(value)
+                if upper is None:
+                    where_parts.append(f'{field_name} >= ?')
+                    where_values.append(value)
+                else:
+                    where_parts.append(f'({field_name} >= ? AND {field_name} < ?)')
+                    where_values.extend((value, upper))
+
+            case 'is_null':
+                if not isinstance(value, bool):
+                    raise ValueError(f'db_model_query - is_null for field "{field_name}" expects a bool')
+                where_parts.append(f'{field_name} IS NULL' if value else f'{field_name} IS NOT NULL')
+
+            case 'search':
+                if field_name not in dict(plan.search_fields):
+                    raise ValueError(f'db_model_query - search for field "{field_name}" requires search: true on the field')
+                if not isinstance(value, str):
+                    raise ValueError(f'db_model_query - search for field "{field_name}" expects a str')
+                where_parts.append(f'id IN (SELECT rowid FROM {plan.search_table} WHERE {plan.search_table} MATCH ?)')
+                where_values.append(_search_match(value, field_name))
 
-        if operator == 'eq':
-            where_parts.append(f'{field_name} = ?')
-        elif operator == 'ne':
-            where_parts.append(f'{field_name} != ?')
-        else:
-            raise ValueError(f'db_model_query - unsupported operator: {operator}')
-        
-        where_values.append(value)
+            case _:
+                where_parts.append(f'{field_name} {_QUERY_COMPARISONS[operator]} ?')
+                where_values.append(_query_value(plan, field_name, value))
+
+    return where_parts, where_values
 
-    # sort #
+def _query_order_keys(model_spec: dict, sort: Optional[list]) -> list[tuple[str, str]]:
+    """convert db_model_query sort specs to (field, ASC|DESC) keys ending with the id tie breaker"""
 
     sortable_fields = {'id', 'date_created', 'date_modified'}
-    sortable_fields.update(field_map.keys())
+    sortable_fields.update(f['name']['snake_case'] for f in model_spec['non_list_fields'])
 
-    order_parts = []
+    order_keys = []
     for index, sort_spec in enumerate(sort or []):
         field_name = sort_spec.get('field')
         order = sort_spec.get('order')
@@ -629,66 +2246,128 @@ def db_model_query(ctx:MappContext, model_class: type, where: dict, offset: int=
         if order not in ('asc', 'desc'):
             raise ValueError(f'db_model_query - unsupported sort order in sort[{index}]: {order}')
 
-        order_parts.append(f'{field_name} {order.upper()}')
+        order_keys.append((field_name, order.upper()))
 
-    # query #
+    # id is the tie breaker so every row has a unique sort key for cursors
+    if 'id' not in [field_name for field_name, _ in order_keys]:
+        order_keys.append(('id', 'ASC'))
 
-    where_clause = f" WHERE {' AND '.join(where_parts)}" if where_parts else ''
-    order_clause = f" ORDER BY {', '.join(order_parts)}" if order_parts else ''
-    query_values = tuple(where_values) + (size, offset)
-    sql = f'SELECT * FROM {table_name}{where_clause}{order_clause} LIMIT ? OFFSET ?'
-    rows = ctx.db.cursor.execute(sql, query_values).fetchall()
+    return order_keys
 
-    # total count #
-    count_sql = f'SELECT COUNT(*) FROM {table_name}{where_clause}'
-    total = ctx.db.cursor.execute(count_sql, where_values).fetchone()[0]
-    
-    # ctx.log(f'Executed query: {sql} with values {query_values}, total count: {total}')
+def db_model_query(ctx:MappContext, model_class: type, where: dict, offset: int=0, size: int=25, sort: list=None, after: Optional[str]=None, count: Optional[str]=None,
+                   fields: Optional[list[str]]=None) -> dict:
+
+    """
+    where is a dict with one condition per field, all of which must match:
+    {
+        "field_a": {"eq": "value"},
+        "field_b": {"ge": 10},
+        "field_c": {"in": ["x", "y"]},
+        "field_d": {"prefix": "ab"},
+        "field_e": {"is_null": false}
+    }
+    see QUERY_OPERATORS_BY_TYPE for the operators allowed on each field type
+
+    after is the next_cursor of a previous page with the same where and sort,
+    when given the page is read by keyset and offset is ignored
+
+    count selects how total is computed (see _select_page), defaults to the model's db.count
+
+    if fields is given items are dicts of id and only those fields
+    """
+
+    # init #
+
+    model_spec = model_class._model_spec
+    plan = model_plan(model_class)
+    table_name = plan.table_name
+    columns, list_field_names = _projection(plan, fields) if fields is not None else (None, None)
+
+    # auth #
+
+    if model_class._model_spec['auth']['require_login'] is True:
+        current_user(ctx)
+
+    # where and sort #
+
+    where_parts, where_values = _query_where(model_class, where)
+    order_keys = _query_order_keys(model_spec, sort)
+
+    # query #
+
+    count_mode = _count_mode(model_spec, count)
+    rows, next_cursor, total = _select_page(ctx, plan, where_parts, where_values, order_keys, offset, size, after, count_mode, columns)
 
     # convert results #
 
-    models = []
+    if fields is None:
+        models = _rows_to_models(ctx, model_class, rows)
+    else:
+        models = _project_rows(ctx, plan, columns, rows, list_field_names)
 
-    for row in rows:
-        data = {'id': str(row[0])}
-        data.update(_parse_row_timestamps(row))
-
-        for index, field in enumerate(model_spec['non_list_fields'], start=3):
-            field_name = field['name']['snake_case']
-            match field['type']:
-                case 'bool':
-                    value = bool(row[index])
-                case 'datetime' if row[index] is not None:
-                    value = datetime.strptime(row[index], DATETIME_FORMAT_STR).replace(microsecond=0)
-                case 'foreign_key':
-                    value = str(row[index])
-                case _:
-                    value = row[index]
-
-            data[field_name] = value
-
-        for index, field in enumerate(model_spec['list_fields'], start=1):
-
-            field_name = field['name']['snake_case']
-            list_table_name = f'{table_name}_{field_name}'
-
-            cursor = ctx.db.cursor.execute(
-                f'SELECT value FROM {list_table_name} WHERE {table_name}_id = ? ORDER BY position ASC',
-                (data['id'],)
-            )
+    return {'items': models, 'total': total, 'next_cursor': next_cursor, 'has_more': next_cursor is not None}
+
+def db_model_search(ctx:MappContext, model_class: type, q: str, where: Optional[dict]=None, offset: int=0, size: int=25,
+                    fields: Optional[list[str]]=None) -> dict:
 
-            match field['element_type']:
-                case 'bool':
-                    convert_element = bool
-                case 'datetime':
-                    convert_element = lambda x: datetime.strptime(x, DATETIME_FORMAT_STR).replace(microsecond=0)
-                case 'foreign_key':
-                    convert_element = str
-                case _:
-                    convert_element = lambda x: x
+    """
+    full text search of the fields with search: true, every word of q must match and
+    the last word also matches as a prefix. Items are ordered by relevance (bm25) and
+    the page is read by offset, next_cursor is always None
 
-            data[field_name] = [convert_element(row[0]) for row in cursor.fetchall()]
+    where is an optional db_model_query where dict to filter the matches with
+
+    if fields is given items are dicts of id and only those fields
+    """
 
-        models.append(model_class(**data))
+    # init #
+
+    plan = model_plan(model_class)
+    if not plan.search_fields:
+        raise MappUserError('SEARCH_NOT_ENABLED', f'model {plan.table_name} has no fields with search enabled')
+
+    columns, list_field_names = _projection(plan, fields) if fields is not None else (None, None)
+    match_value = _search_match(q)
+
+    # auth #
+
+    if model_class._model_spec['auth']['require_login'] is True:
+        current_user(ctx)
+
+    # where #
+
+    where_parts, where_values = _query_where(model_class, where or {})
+    where_clause = f" WHERE {' AND '.join(where_parts)}" if where_parts else ''
+    select_str = f'{plan.table_name}.*' if columns is None else ', '.join(f'"{column}"' for column in columns)
+
+    # query #
+
+    # the fts table has columns named like the model's search fields, so it is only
+    # exposed through a subquery with search_id and search_rank to keep where_parts unambiguous
+    search_table = plan.search_table
+    sql = (
+        f'SELECT {select_str}, COUNT(*) OVER() FROM {plan.table_name} '
+        f'JOIN (SELECT rowid AS search_id, rank AS search_rank FROM {search_table} WHERE {search_table} MATCH ?) ON id = search_id'
+        f'{where_clause} ORDER BY search_rank, id LIMIT ? OFFSET ?'
+    )
+    rows = ctx.db.cursor.execute(sql, (match_value, *where_values, size + 1, offset)).fetchall()
+    has_more = len(rows) > size
+    rows = rows[:size]
+
+    if rows:
+        total = rows[0][-1]
+    else:
+        total = ctx.db.cursor.execute(
+            f'SELECT COUNT(*) FROM {plan.table_name} WHERE id IN (SELECT rowid FROM {search_table} WHERE {search_table} MATCH ?)'
+            + (f" AND {' AND '.join(where_parts)}" if where_parts else ''),
+            (match_value, *where_values)
+        ).fetchone()[0]
+
+    # convert results #
+
+    if fields is None:
+        models = _rows_to_models(ctx, model_class, rows)
+    else:
+        models = _project_rows(ctx, plan, columns, rows, list_field_names)
 
-    return {'items': models, 'total': total}
+    return {'items': models, 'total': total, 'next_cursor': None, 'has_more': has_more}
@@ -1,17 +1,20 @@
 import json
 
+from typing import Optional
+from urllib.parse import urlencode
 from urllib.request import Request, urlopen
 from urllib.error import HTTPError
 
 from mapp.context import MappContext
 from mapp.errors import *
-from mapp.types import json_to_model, model_to_json, model_list_from_json, Acknowledgment
+from mapp.types import json_to_model, model_to_json, model_list_from_json, convert_dict_to_model_fields, Acknowledgment, MappJsonEncoder
 
 
 __all__ = [
     'http_model_create',
     'http_model_read',
     'http_model_update',
+    'http_model_patch',
     'http_model_delete',
     'http_model_list'
 ]
@@ -45,13 +48,16 @@ def http_model_create(ctx: MappContext, model_class:type, model:object) -> objec
     except Exception as e:
         raise MappError('UNKNOWN_ERROR', f'Error creating model: {e}')
 
-def http_model_read(ctx: MappContext, model_class: type, model_id: str) -> object:
+def http_model_read(ctx: MappContext, model_class: type, model_id: str, fields: Optional[list[str]] = None) -> object:
+    """if fields is given, returns a dict of id and only those fields"""
 
     # init #
 
     module_kebab = model_class._module_spec['name']['kebab_case']
     model_kebab = model_class._model_spec['name']['kebab_case']
     url = f'{ctx.client.host}/api/{module_kebab}/{model_kebab}/{model_id}'
+    if fields is not None:
+        url += '?' + urlencode({'fields': ','.join(fields)})
 
     # send request #
 
@@ -59,6 +65,8 @@ def http_model_read(ctx: MappContext, model_class: type, model_id: str) -> objec
         request = Request(url, headers=ctx.client.headers, method='GET')
         with urlopen(request) as response:
             response_body = response.read().decode('utf-8')
+            if fields is not None:
+                return convert_dict_to_model_fields(model_class, json.loads(response_body))
             return json_to_model(response_body, model_class)
         
     except HTTPError as e:
@@ -98,6 +106,33 @@ def http_model_update(ctx: MappContext, model_class: type, model_id: str, model:
     except Exception as e:
         raise MappError(f'Error updating model: {e}')
 
+def http_model_patch(ctx: MappContext, model_class: type, model_id: str, data: dict) -> object:
+
+    # init #
+
+    module_kebab = model_class._module_spec['name']['kebab_case']
+    model_kebab = model_class._model_spec['name']['kebab_case']
+    url = f'{ctx.client.host}/api/{module_kebab}/{model_kebab}/{model_id}'
+    request_body = json.dumps(data, cls=MappJsonEncoder).encode()
+
+    # send request #
+
+    try:
+        request = Request(url, headers=ctx.client.headers, method='PATCH', data=request_body)
+        with urlopen(request) as response:
+            response_body = response.read().decode('utf-8')
+            return json_to_model(response_body, model_class)
+        
+    except HTTPError as e:
+        if e.code >= 500:
+            raise ServerError(f'Got {e.code}: {e}')
+        
+        else:
+            raise ResponseError.from_json(e.read().decode('utf-8'))
+
+    except Exception as e:
+        raise MappError(f'Error patching model: {e}')
+
 def http_model_delete(ctx: MappContext, model_class: type, model_id: str) -> Acknowledgment:
 
     # init #
@@ -132,13 +167,38 @@ def http_model_delete(ctx: MappContext, model_class: type, model_id: str) -> Ack
     except Exception as e:
         raise MappError(f'Error deleting model: {e}')
 
-def http_model_list(ctx: MappContext, model_class: type, offset: int = 0, size: int = 50) -> dict:
+def http_model_list(ctx: MappContext, model_class: type, offset: int = 0, size: int = 50, after: Optional[str] = None, count: Optional[str] = None, where: Optional[dict] = None,
+                    fields: Optional[list[str]] = None, q: Optional[str] = None) -> dict:
+    """
+    where uses the db_model_query format and is sent as {field}.{operator} query params,
+    if fields is given items are dicts of id and only those fields,
+    if q is given the items are full text search results ordered by relevance
+    """
 
     # init #
 
     module_kebab = model_class._module_spec['name']['kebab_case']
     model_kebab = model_class._model_spec['name']['kebab_case']
-    url = f'{ctx.client.host}/api/{module_kebab}/{model_kebab}?offset={offset}&size={size}'
+
+    query = {'offset': offset, 'size': size}
+    if after is not None:
+        query['after'] = after
+    if count is not None:
+        query['count'] = count
+    if fields is not None:
+        query['fields'] = ','.join(fields)
+    if q is not None:
+        query['q'] = q
+
+    for field_name, condition in (where or {}).items():
+        for operator, value in condition.items():
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif isinstance(value, list):
+                value = ['true' if item is True else 'false' if item is False else item for item in value]
+            query[f'{field_name}.{operator}'] = value
+
+    url = f'{ctx.client.host}/api/{module_kebab}/{model_kebab}?{urlencode(query, doseq=True)}'
 
     # send request #
 
@@ -146,7 +206,7 @@ def http_model_list(ctx: MappContext, model_class: type, offset: int = 0, size:
         request = Request(url, headers=ctx.client.headers, method='GET')
         with urlopen(request) as response:
             response_body = response.read().decode('utf-8')
-            return model_list_from_json(response_body, model_class)
+            return model_list_from_json(response_body, model_class, fields)
         
     except HTTPError as e:
         if e.code >= 500:
@@ -1,26 +1,34 @@
-import re
+import json
 
+from functools import partial
+from typing import Optional
 from urllib.parse import parse_qs
 
-from mapp.errors import NotFoundError
+from mapp.errors import NotFoundError, RequestError
 from mapp.context import MappContext, RequestContext, ModelRouteContext
-from mapp.types import JSONResponse, new_model_class, json_to_model_w_convert
+from mapp.types import JSONResponse, ModelListResult, new_model_class, json_to_model_w_convert
 from mapp.module.model.db import *
+from mapp.module.model.db import _query_field_types
 
 
 __all__ = [
+    'MODEL_BULK_MAX_ITEMS',
     'create_model_routes',
     'model_routes'
 ]
 
+MODEL_BULK_MAX_ITEMS = 10_000
+
 
 #
 # router
 #
 
-def create_model_routes(app_spec:dict, module_spec:dict, model_spec:dict) -> tuple[callable, type]:
+def create_model_routes(app_spec:dict, module_spec:dict, model_spec:dict) -> tuple[list[tuple[str, str, callable]], type]:
     """
-    Take a module and model spec and return a route resolver function for that model along with the model class.
+    Take a module and model spec and return the routes for that model along with the model class.
+
+    Routes are a list of (method, path, handler) tuples to be added to a mapp.router.Router.
     """
     model_class = new_model_class(app_spec, model_spec, module_spec)
     model_kebab_case = model_spec['name']['kebab_case']
@@ -30,89 +38,199 @@ def create_model_routes(app_spec:dict, module_spec:dict, model_spec:dict) -> tup
         model_class=model_class,
         model_kebab_case=model_kebab_case,
         module_kebab_case=module_kebab_case,
-        api_instance_regex=rf'/api/{module_kebab_case}/{model_kebab_case}/(.+)',
-        api_model_regex=rf'/api/{module_kebab_case}/{model_kebab_case}'
+        api_instance_path=f'/api/{module_kebab_case}/{model_kebab_case}/{{instance_id}}',
+        api_model_path=f'/api/{module_kebab_case}/{model_kebab_case}'
     )
 
-    route_resolver = lambda server, request: model_routes(route_ctx, server, request)
-    return route_resolver, model_class
-
-def model_routes(route: ModelRouteContext, server: MappContext, request: RequestContext):
-
-    #
-    # instance routes
-    #
-
-    if (instance := re.match(route.api_instance_regex, request.env['PATH_INFO'])) is not None:
-        instance_id = instance.group(1)
-
-        # read #
-
-        if request.env['REQUEST_METHOD'] == 'GET':
-            try:
-                item = db_model_read(server, route.model_class, instance_id)
-                server.log(f'GET {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
-                raise JSONResponse('200 OK', item)
-            
-            except NotFoundError:
-                server.log(f'GET {route.module_kebab_case}.{route.model_kebab_case}/{instance_id} - Not Found')
-                raise
-
-        # update #
-
-        elif request.env['REQUEST_METHOD'] == 'PUT':
-            req_body = request.raw_req_body.decode('utf-8')
-            incoming_item = json_to_model_w_convert(route.model_class, req_body, instance_id)
-
-            try:
-                updated_item = db_model_update(server, route.model_class, incoming_item)
-            except NotFoundError:
-                server.log(f'PUT {route.module_kebab_case}.{route.model_kebab_case}/{instance_id} - Not Found')
-                raise
-            
-            server.log(f'PUT {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
-            raise JSONResponse('200 OK', updated_item)
-
-        # delete #
-
-        elif request.env['REQUEST_METHOD'] == 'DELETE':
-            ack = db_model_delete(server, route.model_class, instance_id)
-            server.log(f'DELETE {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
-            raise JSONResponse('200 OK', ack)
-        
-        # invalid method #
+    routes = model_routes(route_ctx)
+    return routes, model_class
 
-        else:
-            server.log(f'ERROR 405 {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
-            raise JSONResponse('405 Method Not Allowed', {'error': 'invalid request method'})
-
-    #
-    # model routes
-    #
-
-    elif re.match(route.api_model_regex, request.env['PATH_INFO']):
+def model_routes(route: ModelRouteContext) -> list[tuple[str, str, callable]]:
+    return [
+        ('GET', route.api_instance_path, partial(model_read_route, route)),
+        ('PUT', route.api_instance_path, partial(model_update_route, route)),
+        ('PATCH', route.api_instance_path, partial(model_patch_route, route)),
+        ('DELETE', route.api_instance_path, partial(model_delete_route, route)),
+        ('POST', route.api_model_path, partial(model_create_route, route)),
+        ('GET', route.api_model_path, partial(model_list_route, route)),
+        ('POST', route.api_model_path + '/_bulk', partial(model_bulk_route, route)),
+    ]
 
-        # create #
-
-        if request.env['REQUEST_METHOD'] == 'POST':
-            incoming_item = json_to_model_w_convert(route.model_class, request.raw_req_body.decode('utf-8'))
-            item = db_model_create(server, route.model_class, incoming_item)
+#
+# instance routes
+#
 
-            server.log(f'POST {route.module_kebab_case}.{route.model_kebab_case} - id: {item.id}')
-            raise JSONResponse('200 OK', item)
-        
-        # list #
-        
-        elif request.env['REQUEST_METHOD'] == 'GET':
-            query = parse_qs(request.env['QUERY_STRING'])
-            offset = int(query.get('offset', [0])[0])
-            size = int(query.get('size', [25])[0])
+def _query_string_fields(query: dict) -> Optional[list[str]]:
+    """fields=a,b,c selects only id and those fields, returns None if not given"""
+    raw_values = query.get('fields')
+    if raw_values is None:
+        return None
+
+    fields = [field_name.strip() for raw in raw_values for field_name in raw.split(',') if field_name.strip()]
+    if not fields:
+        raise RequestError('fields must list at least one field name')
+    return fields
+
+def model_read_route(route: ModelRouteContext, server: MappContext, request: RequestContext, instance_id:str):
+    fields = _query_string_fields(parse_qs(request.env.get('QUERY_STRING', '')))
+    try:
+        item = db_model_read(server, route.model_class, instance_id, fields=fields)
+        server.log(f'GET {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
+        return JSONResponse('200 OK', item)
+    
+    except NotFoundError:
+        server.log(f'GET {route.module_kebab_case}.{route.model_kebab_case}/{instance_id} - Not Found')
+        raise
+
+def model_update_route(route: ModelRouteContext, server: MappContext, request: RequestContext, instance_id:str):
+    req_body = request.raw_req_body.decode('utf-8')
+    incoming_item = json_to_model_w_convert(route.model_class, req_body, instance_id)
+
+    try:
+        updated_item = db_model_update(server, route.model_class, incoming_item)
+    except NotFoundError:
+        server.log(f'PUT {route.module_kebab_case}.{route.model_kebab_case}/{instance_id} - Not Found')
+        raise
+    
+    server.log(f'PUT {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
+    return JSONResponse('200 OK', updated_item)
+
+def model_patch_route(route: ModelRouteContext, server: MappContext, request: RequestContext, instance_id:str):
+    """body: json object with only the fields to change"""
+    try:
+        incoming_data = json.loads(request.raw_req_body.decode('utf-8'))
+    except ValueError:
+        raise RequestError('Patch request body must be a json object')
+
+    if not isinstance(incoming_data, dict):
+        raise RequestError('Patch request body must be a json object')
+
+    try:
+        updated_item = db_model_patch(server, route.model_class, instance_id, incoming_data)
+    except NotFoundError:
+        server.log(f'PATCH {route.module_kebab_case}.{route.model_kebab_case}/{instance_id} - Not Found')
+        raise
+
+    server.log(f'PATCH {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
+    return JSONResponse('200 OK', updated_item)
+
+def model_delete_route(route: ModelRouteContext, server: MappContext, request: RequestContext, instance_id:str):
+    ack = db_model_delete(server, route.model_class, instance_id)
+    server.log(f'DELETE {route.module_kebab_case}.{route.model_kebab_case}/{instance_id}')
+    return JSONResponse('200 OK', ack)
 
-            result = db_model_list(server, route.model_class, offset=offset, size=size)
-            server.log(f'GET {route.module_kebab_case}.{route.model_kebab_case}')
+#
+# model routes
+#
 
-            raise JSONResponse('200 OK', result)
-        
+def model_create_route(route: ModelRouteContext, server: MappContext, request: RequestContext):
+    incoming_item = json_to_model_w_convert(route.model_class, request.raw_req_body.decode('utf-8'))
+    item = db_model_create(server, route.model_class, incoming_item)
+
+    server.log(f'POST {route.module_kebab_case}.{route.model_kebab_case} - id: {item.id}')
+    return JSONResponse('200 OK', item)
+
+def _query_string_value(field_type: Optional[str], operator: str, raw: str):
+    """convert a query param value to the type db_model_query expects for the field"""
+    if operator == 'is_null' or field_type == 'bool':
+        if raw not in ('true', 'false'):
+            raise RequestError(f'Expected true or false, got: {raw}')
+        return raw == 'true'
+    if operator == 'prefix':
+        return raw
+    try:
+        match field_type:
+            case 'int':
+                return int(raw)
+            case 'float':
+                return float(raw)
+            case _:
+                return raw
+    except ValueError:
+        raise RequestError(f'Expected a {field_type} value, got: {raw}')
+
+def _query_string_where(model_class: type, query_string: str) -> dict:
+    """
+    where conditions from query params named {field}.{operator}, ie: ?price.ge=10&color.in=red&color.in=blue
+    in and not_in take the param once per value, other operators once per field
+    """
+    field_types = _query_field_types(model_class._model_spec)
+    where = {}
+
+    for key, raw_values in parse_qs(query_string, keep_blank_values=True).items():
+        field_name, separator, operator = key.rpartition('.')
+        if not separator:
+            continue
+
+        if field_name in where:
+            raise RequestError(f'Only one condition per field is supported: {field_name}')
+
+        field_type = field_types.get(field_name)
+        if operator in ('in', 'not_in'):
+            where[field_name] = {operator: [_query_string_value(field_type, operator, raw) for raw in raw_values]}
+        elif len(raw_values) > 1:
+            raise RequestError(f'Query param {key} was given more than once')
         else:
-            server.log(f'ERROR 405 {route.module_kebab_case}.{route.model_kebab_case}')
-            raise JSONResponse('405 Method Not Allowed', {'error': 'invalid request method'})
+            where[field_name] = {operator: _query_string_value(field_type, operator, raw_values[0])}
+
+    return where
+
+def model_list_route(route: ModelRouteContext, server: MappContext, request: RequestContext):
+    query = parse_qs(request.env['QUERY_STRING'])
+    offset = int(query.get('offset', [0])[0])
+    size = int(query.get('size', [25])[0])
+    after = query.get('after', [None])[0]
+    count = query.get('count', [None])[0]
+    fields = _query_string_fields(query)
+    search = query.get('q', [None])[0]
+    where = _query_string_where(route.model_class, request.env['QUERY_STRING'])
+
+    if search is not None:
+        # ranked results are paged by offset only
+        if after is not None:
+            raise RequestError('after is not supported with q, use offset')
+        try:
+            result = ModelListResult(**db_model_search(server, route.model_class, search, where, offset=offset, size=size, fields=fields))
+        except ValueError as e:
+            raise RequestError(str(e))
+    elif where:
+        try:
+            result = ModelListResult(**db_model_query(server, route.model_class, where, offset=offset, size=size, after=after, count=count, fields=fields))
+        except ValueError as e:
+            raise RequestError(str(e))
+    else:
+        result = db_model_list(server, route.model_class, offset=offset, size=size, after=after, count=count, fields=fields)
+    server.log(f'GET {route.module_kebab_case}.{route.model_kebab_case}')
+
+    return JSONResponse('200 OK', result)
+
+def model_bulk_route(route: ModelRouteContext, server: MappContext, request: RequestContext):
+    """
+    body: {"action": "create" | "update" | "delete", "items": [...]}, items are
+    model json objects for create and update and ids for delete
+    """
+    try:
+        body = json.loads(request.raw_req_body.decode('utf-8'))
+        action = body['action']
+        items = body['items']
+    except (ValueError, KeyError, TypeError):
+        raise RequestError('Bulk request body must be a json object with action and items')
+
+    if not isinstance(items, list):
+        raise RequestError('Bulk request items must be a list')
+
+    if len(items) > MODEL_BULK_MAX_ITEMS:
+        raise RequestError(f'Bulk request has {len(items)} items, limit is {MODEL_BULK_MAX_ITEMS}')
+
+    match action:
+        case 'create':
+            result = db_model_bulk_create(server, route.model_class, items)
+        case 'update':
+            result = db_model_bulk_update(server, route.model_class, items)
+        case 'delete':
+            result = db_model_bulk_delete(server, route.model_class, items)
+        case _:
+            raise RequestError(f'Invalid bulk action: {action}, expected create, update or delete')
+
+    server.log(f'POST {route.module_kebab_case}.{route.model_kebab_case}/_bulk - {action} {result.succeeded=} {result.failed=}')
+    return JSONResponse('200 OK', result)
@@ -3,6 +3,7 @@ import argparse
 from mapp.types import *
 from mapp.module.op.run import op_create_callable
 from mapp.module.op.http import http_run_op
+from mapp.file_system import MAPP_FILE_PART_SIZE, http_ingest_file
 from mapp.context import MappContext, cli_op_user_input, cli_write_session, cli_delete_session
 
 __all__ = [
@@ -97,7 +98,13 @@ def add_op_subparser(subparsers, spec:dict, module: dict, op:dict):
             else:
                 params = cli_op_user_input(param_class, args.json, args.interactive)
 
-            raw_output = http_run_op(ctx, param_class, output_class, params)
+            file_input = ctx.self.get('file_input', None)
+            if args.module == 'file-system' and args.model == 'ingest-start' and params.finish and file_input is not None and len(file_input) > MAPP_FILE_PART_SIZE:
+                # too large for one request, upload in parts
+                result = http_ingest_file(ctx, module, params.name, params.content_type)
+                raw_output = new_op_output(output_class, {'result': result})
+            else:
+                raw_output = http_run_op(ctx, param_class, output_class, params)
 
             if args.module == 'auth':
                 if args.model == 'login-user' and not args.no_session:
@@ -104,7 +104,10 @@ def http_run_op(ctx: MappContext, params_class:type, output_class:type, params:o
 				return json_to_op_output(response_body, output_class)
 
 	except HTTPError as e:
-		if e.code >= 500:
+		if e.code == 503:
+			# ServiceUnavailableError, the op can be retried
+			raise ResponseError.from_json(e.read().decode('utf-8'))
+		elif e.code >= 500:
 			ctx.log(f'Server error when running op via http: {e}\n{traceback.format_exc()}')
 			raise ServerError(f'Got {e.code}: {e}')
 		else:
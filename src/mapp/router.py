@@ -0,0 +1,118 @@
+from typing import Callable, Optional
+
+from mapp.context import MappContext, RequestContext
+from mapp.types import MappResponse, JSONResponse
+
+
+__all__ = [
+    'Router',
+    'RouteHandler'
+]
+
+RouteHandler = Callable[..., Optional[MappResponse]]
+
+
+#
+# route table
+#
+
+class _RouteNode:
+    __slots__ = ('children', 'param_name', 'param_child', 'methods')
+
+    def __init__(self) -> None:
+        self.children: dict[str, '_RouteNode'] = {}
+        self.param_name: Optional[str] = None
+        self.param_child: Optional['_RouteNode'] = None
+        self.methods: dict[str, RouteHandler] = {}
+
+
+class Router:
+    """
+    Route table compiled once at server start.
+
+    Routes are stored in a trie keyed on path segments with the request method
+    at the leaf, so resolving a request costs one dict lookup per path segment
+    no matter how many modules, models and ops the spec defines.
+
+    A path segment wrapped in braces (ie. '{model_id}') matches any single segment,
+    literal segments take priority over it. Matched segments are passed to the
+    handler as keyword args: handler(server, request, **params)
+
+    Matching follows the regexes the routes replaced: literal routes accept a trailing
+    slash (/api/m/model/ lists models), routes with params do not (/api/m/model/42/ is
+    not found, the old regex read the id as '42/'). A param never contains a '/', so
+    /api/m/model/42/extra is not found instead of reading the id '42/extra'.
+    """
+
+    def __init__(self) -> None:
+        self.root = _RouteNode()
+        self.total_routes = 0
+
+    @staticmethod
+    def split_path(path:str) -> list[str]:
+        stripped = path.strip('/')
+        return stripped.split('/') if stripped else []
+
+    def add(self, method:str, path:str, handler:RouteHandler) -> None:
+        node = self.root
+
+        for segment in self.split_path(path):
+            if segment.startswith('{') and segment.endswith('}'):
+                param_name = segment[1:-1]
+                if node.param_child is None:
+                    node.param_child = _RouteNode()
+                    node.param_name = param_name
+                elif node.param_name != param_name:
+                    raise ValueError(f'Route param conflict at {path}: {{{node.param_name}}} vs {segment}')
+                node = node.param_child
+            else:
+                node = node.children.setdefault(segment, _RouteNode())
+
+        method = method.upper()
+        if method in node.methods:
+            raise ValueError(f'Route already defined: {method} {path}')
+
+        node.methods[method] = handler
+        self.total_routes += 1
+
+    def resolve(self, method:str, path:str) -> Optional[Callable[[MappContext, RequestContext], Optional[MappResponse]]]:
+        """
+        Find the handler for method + path.
+
+        Returns a route resolver with the same signature as the other server
+        routes: resolver(server, request), or None if the path is not in the table.
+        If the path exists but the method does not a 405 resolver is returned.
+        """
+
+        node = self.root
+        params = {}
+
+        for segment in self.split_path(path):
+            try:
+                node = node.children[segment]
+            except KeyError:
+                if node.param_child is None:
+                    return None
+                params[node.param_name] = segment
+                node = node.param_child
+
+        if not node.methods:
+            return None
+
+        if params and path.endswith('/'):
+            return None
+
+        try:
+            handler = node.methods[method]
+        except KeyError:
+            return _method_not_allowed
+
+        if params:
+            return lambda server, request: handler(server, request, **params)
+        else:
+            return handler
+
+
+def _method_not_allowed(server:MappContext, request:RequestContext) -> JSONResponse:
+    server.log(f'ERROR 405 - Invalid Method {request.env["REQUEST_METHOD"]} - {request.env["PATH_INFO"]}')
+    return JSONResponse('405 Method Not Allowed', {'error': 'invalid request method'})
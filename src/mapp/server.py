@@ -8,9 +8,12 @@ from typing import NamedTuple
 
 from mapp.context import get_context_from_env, MappContext, RequestContext, spec_from_env
 from mapp.errors import *
-from mapp.types import JSONResponse, PlainTextResponse, StaticFileResponse, DownloadFileResponse, to_json
+from mapp.types import MappResponse, JSONResponse, PlainTextResponse, StaticFileResponse, DownloadFileResponse, to_json
+from mapp.auth import session_cache_stats, sweep_sessions
 from mapp.db import create_tables
+from mapp.router import Router
 from mapp.module.model.server import create_model_routes
+from mapp.module.model.db import db_model_cache_stats
 from mapp.module.op.server import create_op_routes
 from mapp.file_system import FILE_SIZE_LIMIT
 from mspec.core import get_mapp_ui_files, load_browser2_spec
@@ -48,7 +51,16 @@ def debug_page(server: MappContext, request: RequestContext):
     output += f'   :: {"DBContext.db_url": <{header_col}}:: {str(server.db.db_url)}\n'
     output += f'   :: {"DBContext.connection": <{header_col}}:: {str(type(server.db.connection))}\n'
     output += f'   :: {"DBContext.cursor": <{header_col}}:: {str(type(server.db.cursor))}\n'
-    output += f'   :: {"DBContext.commit": <{header_col}}:: {str(type(server.db.commit))}\n\n'
+    output += f'   :: {"DBContext.commit": <{header_col}}:: {str(type(server.db.commit))}\n'
+    output += f'   :: {"DBContext.profile": <{header_col}}:: {server.db.profile}\n'
+    for pragma, value in server.db.pragmas.items():
+        output += f'     :: {"PRAGMA " + pragma: <{header_col - 2}}:: {value}\n'
+    for table_name, stats in db_model_cache_stats(server).items():
+        output += f'     :: {"cache " + table_name: <{header_col - 2}}:: {stats["entries"]}/{stats["size"]} entries, {stats["hits"]} hits, {stats["misses"]} misses\n'
+    session_stats = session_cache_stats(server)
+    if session_stats is not None:
+        output += f'     :: {"cache auth sessions": <{header_col - 2}}:: {session_stats["entries"]}/{session_stats["size"]} entries, {session_stats["hits"]} hits, {session_stats["misses"]} misses\n'
+    output += '\n'
     output += f'RequestContext.raw_req_body ::{str(type(request.raw_req_body))} {len(request.raw_req_body)=}\n'
     output += 'RequestContext.env ::\n\n'
 
@@ -69,7 +81,7 @@ def debug_routes(server: MappContext, request: RequestContext):
     path = request.env['PATH_INFO']
     # /api/debug (no exception name): show debug_page output
     if path.rstrip('/') == '/api/debug':
-        raise PlainTextResponse('200 OK', debug_page(server, request))
+        return PlainTextResponse('200 OK', debug_page(server, request))
 
     # /api/debug/<ExceptionName>: throw example exception
     match = re.match(r'/api/debug/([a-zA-Z_]+)$', path)
@@ -78,9 +90,9 @@ def debug_routes(server: MappContext, request: RequestContext):
 
     exc_name = match.group(1)
     if exc_name == 'PlainTextResponse':
-        raise PlainTextResponse('200 OK', 'This is a plain text debug response')
+        return PlainTextResponse('200 OK', 'This is a plain text debug response')
     elif exc_name == 'JSONResponse':
-        raise JSONResponse('200 OK', {'message': 'This is a JSON debug response'})
+        return JSONResponse('200 OK', {'message': 'This is a JSON debug response'})
     elif exc_name == 'NotFoundError':
         raise NotFoundError('Debug: NotFoundError thrown')
     elif exc_name == 'AuthenticationError':
@@ -101,16 +113,28 @@ def debug_routes(server: MappContext, request: RequestContext):
 # context
 #
 
-main_ctx = get_context_from_env()
+mapp_spec = spec_from_env()
+
+main_ctx = get_context_from_env(mapp_spec)
 main_ctx.log = uwsgi.log
 
 #
 # init server routes
 #
 
-route_list = []
+"""
+Api routes for models and ops are compiled into a Router at startup and resolved
+by path segment lookup. Routes that can't be keyed on path segments (debug, static
+and dynamic pages) are kept in fallback_route_list and tried in order when the
+router has no match.
+
+Every route has the signature route(server, request) and returns a MappResponse
+for a match or None to pass the request on. Routes may also raise their response
+for compatibility with the older style, errors are always raised.
+"""
 
-mapp_spec = spec_from_env()
+router = Router()
+fallback_route_list = []
 
 create_tables(main_ctx, mapp_spec)
 
@@ -124,16 +148,43 @@ for module in spec_modules.values():
     for model in module.get('models', {}).values():
 
         if model.get('hidden', False) is False:
-            route_resolver, model_class = create_model_routes(mapp_spec, module, model)
-            route_list.append(route_resolver)
+            model_route_defs, model_class = create_model_routes(mapp_spec, module, model)
+            for method, path, handler in model_route_defs:
+                router.add(method, path, handler)
         
     for op in module.get('ops', {}).values():
         if op['hidden']is False and op['entry_points']['server'] is True:
-            route_resolver = create_op_routes(module, op)
-            route_list.append(route_resolver)
+            for method, path, handler in create_op_routes(module, op):
+                router.add(method, path, handler)
 
 if MAPP_SERVER_DEVELOPMENT_MODE is True:
-    route_list.append(debug_routes)
+    fallback_route_list.append(debug_routes)
+
+#
+# expired session sweeper
+#
+
+"""
+worker 1 registers a uWSGI timer that deletes expired auth sessions every
+MAPP_AUTH_SESSION_SWEEP_SECONDS. With lazy-apps each worker loads the app, so the
+handler is (re)registered by worker 1 only and the timer is added once, when the
+signal is first registered.
+"""
+
+MAPP_AUTH_SESSION_SWEEP_SECONDS = int(os.environ.get('MAPP_AUTH_SESSION_SWEEP_SECONDS', 3600))	# 0 to disable, run: mapp auth sweep-sessions run
+MAPP_AUTH_SESSION_SWEEP_SIGNAL = 17
+
+def _sweep_sessions_signal(signum: int) -> None:
+    try:
+        sweep_sessions(main_ctx)
+    except Exception as e:
+        main_ctx.log(f'sweep_sessions failed - {e.__class__.__name__}: {e}')
+
+if MAPP_AUTH_SESSION_SWEEP_SECONDS > 0 and uwsgi.worker_id() <= 1:
+    sweep_timer_added = uwsgi.signal_registered(MAPP_AUTH_SESSION_SWEEP_SIGNAL)
+    uwsgi.register_signal(MAPP_AUTH_SESSION_SWEEP_SIGNAL, 'worker1', _sweep_sessions_signal)
+    if not sweep_timer_added:
+        uwsgi.add_timer(MAPP_AUTH_SESSION_SWEEP_SIGNAL, MAPP_AUTH_SESSION_SWEEP_SECONDS)
 
 #
 # generate dynamic index.html
@@ -610,7 +661,7 @@ class StaticFileData(NamedTuple):
 
 static_files = {}
 static_protocol_files = {}
-dynamic_files = []
+dynamic_files = {}
 
 ui_src_dir = os.environ.get('MAPP_UI_FILE_SOURCE', None)
 
@@ -741,17 +792,14 @@ for module_key, module in mapp_spec['modules'].items():
                 content_type='text/html'
             )
 
-        # model instance dynamic route #
-
-        pattern = f'/{module_kebab}/{model_kebab}/[0-9a-zA-Z]+$'
+        # model instance dynamic route: /<module>/<model>/<model_id> #
 
-        dynamic_files.append((
-            re.compile(pattern),
+        dynamic_files[(module_kebab, model_kebab)] = (
             generate_model_instance_html,
             mapp_spec,
             module_key,
             model_key
-        ))
+        )
 
     # add static op pages #
     for op_key, op in module.get('ops', {}).items():
@@ -791,24 +839,31 @@ def static_routes(server: MappContext, request: RequestContext):
             server.log(f'Static file not found: {path}')
 
     if file_data is not None:
-        raise StaticFileResponse('200 OK', file_data.content, file_data.content_type)
+        return StaticFileResponse('200 OK', file_data.content, file_data.content_type)
     
+dynamic_file_id_regex = re.compile(r'[0-9a-zA-Z]+$')
+
 def dynamic_file_routes(server: MappContext, request: RequestContext):
     """resolve dynamic file routes"""
 
-    for pattern, generator_func, *gen_args in dynamic_files:
-        if pattern.match(request.env['PATH_INFO']):
-            mapp_spec, module_key, model_key = gen_args
-    
-            html_content:bytes = generator_func(server, request, mapp_spec, module_key, model_key)
-            raise StaticFileResponse(
-                '200 OK',
-                content=html_content,
-                content_type='text/html'
-            )
+    path_split = request.env['PATH_INFO'].strip('/').split('/')
+    if len(path_split) != 3 or not dynamic_file_id_regex.match(path_split[2]):
+        return
+
+    try:
+        generator_func, mapp_spec, module_key, model_key = dynamic_files[(path_split[0], path_split[1])]
+    except KeyError:
+        return
 
-route_list.append(static_routes)
-route_list.append(dynamic_file_routes)
+    html_content:bytes = generator_func(server, request, mapp_spec, module_key, model_key)
+    return StaticFileResponse(
+        '200 OK',
+        content=html_content,
+        content_type='text/html'
+    )
+
+fallback_route_list.append(static_routes)
+fallback_route_list.append(dynamic_file_routes)
 
 #
 # wsgi application
@@ -891,39 +946,28 @@ def application(env, start_response):
     # route request
     #
 
+    api_route = router.resolve(env['REQUEST_METHOD'], env['PATH_INFO'])
+    route_list = fallback_route_list if api_route is None else (api_route,)
+
+    # one db transaction per request, commits inside the route are deferred #
+
+    db_commit_count = server_ctx.db.commit_count
+    db_deferred_commit_count = server_ctx.db.deferred_commit_count
+    server_ctx.db.begin_unit_of_work()
+
     for route in route_list:
         additional_headers = []
 
         try:
-            route(server_ctx, request)
+            response = route(server_ctx, request)
+            if response is None:
+                continue
 
         # success responses #
 
-        except PlainTextResponse as e:
-            body = e.text
-            status_code = e.status
-            content_type = e.content_type
-            break
-
-        except JSONResponse as e:
-            body = e.data
-            status_code = e.status
-            content_type = e.content_type
-            break
-
-        except StaticFileResponse as e:
-            body = e.content
-            status_code = e.status
-            content_type = e.content_type
-            break
-
-        except DownloadFileResponse as e:
-            server_ctx.log(f'Preparing download response for file: {e.filename} {len(e.content)=} bytes')
-            body = e.content
-            status_code = '200 OK'
-            content_type = e.content_type
-            additional_headers.append(('Content-Disposition', f'attachment; filename="{e.filename}"'))
-            break
+        except MappResponse as e:
+            # compatibility: resolvers that raise their response instead of returning it
+            response = e
 
         # error responses #
 
@@ -972,6 +1016,15 @@ def application(env, start_response):
             server_ctx.log(f'  :: RequestError - {e.__class__.__name__} - {e} \n' + format_exc())
             break
 
+        except ServiceUnavailableError as e:
+            # ie: password hashing is at its limit, fail fast and let the client retry
+            body = e.to_dict()
+            status_code = '503 Service Unavailable'
+            content_type = JSONResponse.content_type
+            additional_headers.append(('Retry-After', '1'))
+            server_ctx.log(f'  :: ServiceUnavailableError - {e}')
+            break
+
         # uncaught exception | internal server error #
 
         except Exception as e:
@@ -987,6 +1040,17 @@ def application(env, start_response):
             server_ctx.log(f'  :: UNCAUGHT_EXCEPTION - {e.__class__.__name__} - {e} \n' + format_exc())
             break
 
+        # success response #
+
+        if isinstance(response, DownloadFileResponse):
+            server_ctx.log(f'Preparing download response for file: {response.filename} {len(response.content)=} bytes')
+
+        body = response.body()
+        status_code = response.status
+        content_type = response.content_type
+        additional_headers.extend(response.headers())
+        break
+
     # url not found #
         
     else:
@@ -995,6 +1059,28 @@ def application(env, start_response):
         status_code = '404 Not Found'
         content_type = JSONResponse.content_type
 
+    # finish db transaction, error responses roll back the whole request #
+
+    try:
+        server_ctx.db.end_unit_of_work(commit=status_code[0] in '23')
+    except Exception as e:
+        body = {
+            'error': {
+                'code': 'INTERNAL_SERVER_ERROR',
+                'message': 'Contact support or check logs for details',
+                'request_id': str(request_id)
+            }
+        }
+        status_code = '500 Internal Server Error'
+        content_type = JSONResponse.content_type
+        additional_headers = []
+        server_ctx.log(f'  :: COMMIT_FAILED - {e.__class__.__name__} - {e} \n' + format_exc())
+
+    db_commits = server_ctx.db.commit_count - db_commit_count
+    db_deferred_commits = server_ctx.db.deferred_commit_count - db_deferred_commit_count
+    server_ctx.log(f':: RES :: {status_code} :: {request_id} - {db_commits=} {db_deferred_commits=}')
+    uwsgi.set_logvar('db_commits', str(db_commits))
+
     start_response(status_code, [('Content-Type', content_type)] + additional_headers)
 
     if content_type == JSONResponse.content_type:
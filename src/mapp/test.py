@@ -1554,6 +1554,8 @@ class TestMTemplateApp(unittest.TestCase):
         endpoints = [
             '/api/auth/drop-sessions',
             '/auth/drop-sessions',
+            '/api/auth/sweep-sessions',
+            '/auth/sweep-sessions',
 
             '/api/com/send-email',
             '/com/send-email'
@@ -1578,6 +1580,7 @@ class TestMTemplateApp(unittest.TestCase):
 
         commands = [
             ['auth', 'drop-sessions'],
+            ['auth', 'sweep-sessions'],
             ['com', 'send-email']
         ]
 
@@ -5,6 +5,7 @@ from collections import namedtuple
 from typing import Any, Optional, NamedTuple, Callable
 from datetime import datetime, timezone
 from dataclasses import dataclass, asdict
+from types import SimpleNamespace
 
 from mapp.errors import MappValidationError, MappError, MappUserError
 from mspec.core import validate_rich_text_json_string
@@ -17,9 +18,11 @@ __all__ = [
     'MAX_LIST_FIELD_ITEMS',
     'MAX_LIST_STR_TOTAL_LENGTH',
     'Acknowledgment',
+    'MappResponse',
     'PlainTextResponse',
     'JSONResponse',
     'StaticFileResponse',
+    'DownloadFileResponse',
 
     'User',
     'UserSession',
@@ -29,6 +32,7 @@ __all__ = [
     'CurrentAccessTokenFunc',
 
     'ModelListResult',
+    'ModelBulkResult',
     'new_model_class',
     'new_model',
     'new_op_classes',
@@ -36,9 +40,11 @@ __all__ = [
     'new_op_output',
    
     'convert_dict_to_model',
+    'convert_dict_to_model_fields',
     'convert_dict_to_op_params',
 
     'validate_model',
+    'validate_model_fields',
     'validate_op_params',
     'validate_op_output',
 
@@ -113,14 +119,36 @@ class Acknowledgment:
             'message': self.message
         }
 
-class PlainTextResponse(Exception):
+class MappResponse(Exception):
+    """
+    Base class for successful responses.
+
+    Route resolvers return a response instance, or None to pass the request on
+    to the next resolver. Responses are still exceptions so that resolvers which
+    raise their response keep working, but returning skips the cost of raising
+    and catching on every request.
+    """
+    status: str = '200 OK'
+    content_type: str = 'application/octet-stream'
+
+    def body(self) -> Any:
+        """the response body, str or bytes, or a dict for json content types; empty by default"""
+        return b''
+
+    def headers(self) -> list[tuple[str, str]]:
+        return []
+
+class PlainTextResponse(MappResponse):
     content_type = 'text/plain'
     def __init__(self, status:str, text:str) -> None:
         super().__init__('PlainTextResponse')
         self.status = status
         self.text = text
 
-class JSONResponse(Exception):
+    def body(self) -> str:
+        return self.text
+
+class JSONResponse(MappResponse):
     content_type = 'application/json'
     def __init__(self, status:str, data:dict|None=None, response_file:bytes|None=None) -> None:
         super().__init__('JSONResponse')
@@ -128,20 +156,32 @@ class JSONResponse(Exception):
         self.data = data
         self.response_file = response_file
 
-class StaticFileResponse(Exception):
+    def body(self) -> Any:
+        return self.data
+
+class StaticFileResponse(MappResponse):
     def __init__(self, status:str, content:bytes, content_type:str) -> None:
         super().__init__('StaticFileResponse')
         self.status = status
         self.content = content
         self.content_type = content_type
 
-class DownloadFileResponse(Exception):
+    def body(self) -> bytes:
+        return self.content
+
+class DownloadFileResponse(MappResponse):
     def __init__(self, content:bytes, content_type:str, filename:str) -> None:
         super().__init__('DownloadFileResponse')
         self.content = content
         self.content_type = content_type
         self.filename = filename
 
+    def body(self) -> bytes:
+        return self.content
+
+    def headers(self) -> list[tuple[str, str]]:
+        return [('Content-Disposition', f'attachment; filename="{self.filename}"')]
+
 #
 # auth
 #
@@ -231,7 +271,15 @@ CurrentAccessTokenFunc = Callable[[], Optional[str]]
 @dataclass
 class ModelListResult:
     items: list
-    total: int
+    total: Optional[int]
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+@dataclass
+class ModelBulkResult:
+    items: list         # one {index, id, error} dict per input item, error is null on success
+    succeeded: int
+    failed: int
 
 def new_model_class(app_spec:dict, model_spec:dict, module_spec:Optional[dict]=None) -> type:
     """
@@ -291,6 +339,7 @@ def new_model_class(app_spec:dict, model_spec:dict, module_spec:Optional[dict]=N
                         db=ctx.db,
                         log=ctx.log,
                         current_access_token=ctx.current_access_token,
+                        request_memo=ctx.request_memo,
                         self=deepcopy(ctx.self)
                     )
                     validate_ctx.self['value'] = value
@@ -304,6 +353,7 @@ def new_model_class(app_spec:dict, model_spec:dict, module_spec:Optional[dict]=N
     new_class = namedtuple(class_name, fields, defaults=[None] * len(MODEL_TIMESTAMP_FIELDS))
     new_class._model_spec = _model_spec
     new_class._module_spec = deepcopy(module_spec)
+    new_class._db_plan = None   # compiled sql and converters, see mapp.module.model.db.model_plan
     return new_class
 
 def new_model(model_class:type, data:dict):
@@ -562,6 +612,21 @@ def convert_dict_to_model(model_class:type, data:dict):
         object: An instance of the model class.
     """
 
+    return new_model(model_class, _convert_model_dict(model_class, data))
+
+def convert_dict_to_model_fields(model_class:type, data:dict) -> dict:
+    """
+    Converts a dictionary holding some of a model's fields, such as a read with
+    fields=..., converting only the fields that are present.
+
+    Returns:
+        dict: The converted field values.
+    """
+
+    return _convert_model_dict(model_class, data)
+
+def _convert_model_dict(model_class:type, data:dict) -> dict:
+
     converted_data = _convert_incoming_fields(model_class._model_spec['fields'], data)
 
     try:
@@ -589,7 +654,7 @@ def convert_dict_to_model(model_class:type, data:dict):
         else:
             raise ValueError(f'Model field "{field_name}" must be datetime, str, or None')
 
-    return new_model(model_class, converted_data)
+    return converted_data
 
 def convert_dict_to_op_params(op_class:type, data:dict):
     """
@@ -800,6 +865,31 @@ def validate_model(model_class:type, model_instance:object, ctx=None) -> object:
         ctx=ctx
     )
 
+def validate_model_fields(model_class:type, data:dict, ctx=None) -> dict:
+    """
+    Converts and validates only the fields in data, for partial updates.
+
+    Returns the converted field values. Raises MappValidationError if data has a field
+    the model does not define or a value is invalid.
+    """
+    fields = model_class._model_spec['fields']
+    unknown_fields = [field_name for field_name in data if field_name not in fields]
+    if unknown_fields:
+        raise MappValidationError(
+            f'Model Validation failed for: {model_class._model_spec["name"]["pascal_case"]}',
+            {field_name: f'Field "{field_name}" is not defined on the model.' for field_name in unknown_fields}
+        )
+
+    data_spec = {field_name: fields[field_name] for field_name in data}
+    converted_data = _convert_incoming_fields(data_spec, data)
+    _validate_obj(
+        data_spec,
+        SimpleNamespace(**converted_data),
+        f'Model Validation failed for: {model_class._model_spec["name"]["pascal_case"]}',
+        ctx=ctx
+    )
+    return converted_data
+
 def validate_op_params(op_class:type, op_params_instance:object, ctx=None) -> object:
     return _validate_obj(
         op_class._op_spec['params'], 
@@ -835,8 +925,10 @@ class MappJsonEncoder(json.JSONEncoder):
                 return obj.strftime(DATETIME_FORMAT_STR)
         elif isinstance(obj, ModelListResult):
             return {
-                'items': [item._asdict() for item in obj.items],
-                'total': obj.total
+                'items': [item._asdict() if hasattr(item, '_asdict') else item for item in obj.items],
+                'total': obj.total,
+                'next_cursor': obj.next_cursor,
+                'has_more': obj.has_more
             }
         elif hasattr(obj, '_asdict'):
             return obj._asdict()
@@ -923,16 +1015,20 @@ def json_to_model_w_convert(model_class:type, json_str:str, model_id:Optional[st
 
     return convert_dict_to_model(model_class, data)
 
-def model_list_from_json(json_str:str, model_class:type) -> 'ModelListResult':
+def model_list_from_json(json_str:str, model_class:type, fields:Optional[list[str]]=None) -> 'ModelListResult':
+    """items are models, or dicts of the fields present if the list was read with fields"""
     try:
         data = json.loads(json_str)
         items = []
         for item in data['items']:
+            if fields is not None:
+                items.append(convert_dict_to_model_fields(model_class, item))
+                continue
             for field_name in MODEL_TIMESTAMP_FIELDS:
                 item[field_name] = model_timestamp_from_str(item[field_name])
             items.append(model_class(**item))
         total = data['total']
-        return ModelListResult(items=items, total=total)
+        return ModelListResult(items=items, total=total, next_cursor=data.get('next_cursor'), has_more=data.get('has_more', False))
     
     except json.JSONDecodeError as e:
         raise MappValidationError(f'Invalid JSON: {e}')
@@ -17,6 +17,11 @@ __all__ = [
     'SAMPLE_RICH_TEXT_SPEC_DIR',
     'DIST_DIR',
     'MAPP_UI_FILES',
+    'MODEL_DB_COUNT_MODES',
+    'MODEL_DB_DATETIME_STORAGE',
+    'MODEL_QUERY_OPERATORS',
+    'PROJECT_DB_PROFILES',
+    'PROJECT_DB_PRAGMAS',
     'builtin_spec_files',
     'load_json_or_yaml',
     'load_browser2_spec',
@@ -36,6 +41,19 @@ SAMPLE_GENERATOR_SPEC_DIR = SAMPLE_DATA_DIR / 'generator'
 DIST_DIR = Path(__file__).parent.parent.parent / 'dist'
 MAPP_UI_FILES = SAMPLE_DATA_DIR / 'mapp-ui' / 'src'
 
+# how list/query results compute total, see model db.count in docs/LINGO_MAPP_SPEC.md
+MODEL_DB_COUNT_MODES = ('exact', 'none', 'window', 'counter')
+
+# how datetime fields and timestamps are stored, see model db.datetime_storage in docs/LINGO_MAPP_SPEC.md
+MODEL_DB_DATETIME_STORAGE = ('text', 'epoch')
+
+# where condition operators of db.query / db.delete_where and the model list route, see db.query in docs/LINGO_FUNCTIONS.md
+MODEL_QUERY_OPERATORS = ('eq', 'ne', 'lt', 'le', 'gt', 'ge', 'in', 'not_in', 'prefix', 'is_null', 'search')
+
+# sqlite connection profiles, see project db in docs/LINGO_MAPP_SPEC.md
+PROJECT_DB_PROFILES = ('default', 'performance', 'durable')
+PROJECT_DB_PRAGMAS = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store', 'busy_timeout')
+
 def load_json_or_yaml(file_path:Path|str) -> dict:
     """
     load json or yaml file based on file extension
@@ -171,6 +189,25 @@ def init_generator_spec(spec:dict, source_path:Path) -> dict:
         if key not in project['name']:
             project['name'][key] = value
 
+    # db #
+
+    if 'db' not in project:
+        project['db'] = {}
+
+    if 'profile' not in project['db']:
+        project['db']['profile'] = 'default'
+    elif project['db']['profile'] not in PROJECT_DB_PROFILES:
+        raise ValueError(f'project has invalid db.profile: {project["db"]["profile"]}, expected one of {PROJECT_DB_PROFILES}')
+
+    if 'pragmas' not in project['db']:
+        project['db']['pragmas'] = {}
+    elif not isinstance(project['db']['pragmas'], dict):
+        raise ValueError('project db.pragmas must be a mapping of pragma name to value')
+
+    for pragma in project['db']['pragmas']:
+        if pragma not in PROJECT_DB_PRAGMAS:
+            raise ValueError(f'project has invalid db.pragmas key: {pragma}, expected one of {PROJECT_DB_PRAGMAS}')
+
     try:
         spec_modules:dict = spec['modules']
     except KeyError:
@@ -379,6 +416,11 @@ def init_generator_spec(spec:dict, source_path:Path) -> dict:
                     type_id += '_enum'
                     enum_fields.append(field)
                 
+                if 'search' not in field:
+                    field['search'] = False
+                elif field['search'] is True and field_type != 'str':
+                    raise ValueError(f'only str fields can define search, field {field_name} in model {model_path} has type {field_type}')
+
                 if 'rich_text' in field:
                     if field_type != 'str':
                         raise ValueError(f'only str fields can define rich_text, field {field_name} in model {model_path} has type {field_type}')
@@ -433,6 +475,86 @@ def init_generator_spec(spec:dict, source_path:Path) -> dict:
                     'max_models_by_field': {}
                 }
 
+            # db #
+
+            if 'db' not in model:
+                model['db'] = {}
+
+            if 'count' not in model['db']:
+                model['db']['count'] = 'exact'
+            elif model['db']['count'] not in MODEL_DB_COUNT_MODES:
+                raise ValueError(f'model {model_path} has invalid db.count: {model["db"]["count"]}, expected one of {MODEL_DB_COUNT_MODES}')
+
+            if 'datetime_storage' not in model['db']:
+                model['db']['datetime_storage'] = 'text'
+            elif model['db']['datetime_storage'] not in MODEL_DB_DATETIME_STORAGE:
+                raise ValueError(f'model {model_path} has invalid db.datetime_storage: {model["db"]["datetime_storage"]}, expected one of {MODEL_DB_DATETIME_STORAGE}')
+
+            indexable_fields = ['id', 'date_created', 'date_modified'] + [f['name']['snake_case'] for f in non_list_fields]
+            for index_num, index in enumerate(model['db'].get('indexes', [])):
+                try:
+                    index_name = index['name']
+                    index_fields = index['fields']
+                except KeyError as e:
+                    raise ValueError(f'model {model_path} db.indexes[{index_num}] missing key: {e}')
+
+                if not isinstance(index_fields, list) or len(index_fields) == 0:
+                    raise ValueError(f'model {model_path} db.indexes[{index_num}] fields must be a non empty list')
+                
+                for index_field in index_fields:
+                    if index_field not in indexable_fields:
+                        raise ValueError(f'model {model_path} db.indexes[{index_num}] field {index_field} is not a non list field of the model')
+
+                if not index_name.replace('_', '').isalnum():
+                    raise ValueError(f'model {model_path} db.indexes[{index_num}] name must be alphanumeric with underscores: {index_name}')
+
+                if 'unique' not in index:
+                    index['unique'] = False
+                elif not isinstance(index['unique'], bool):
+                    raise ValueError(f'model {model_path} db.indexes[{index_num}] unique must be a bool')
+
+                if 'where' in index and not isinstance(index['where'], str):
+                    raise ValueError(f'model {model_path} db.indexes[{index_num}] where must be an sql expression string')
+
+            for join_name, join in model['db'].get('joins', {}).items():
+                for join_key in ('model_type', 'local_field', 'foreign_field', 'fields'):
+                    if join_key not in join:
+                        raise ValueError(f'model {model_path} db.joins.{join_name} missing key: {join_key}')
+
+                if join['local_field'] not in indexable_fields:
+                    raise ValueError(f'model {model_path} db.joins.{join_name} local_field {join["local_field"]} is not a non list field of the model')
+
+                if not isinstance(join['fields'], list) or len(join['fields']) == 0:
+                    raise ValueError(f'model {model_path} db.joins.{join_name} fields must be a non empty list')
+
+                if 'cardinality' not in join:
+                    join['cardinality'] = 'one'
+                elif join['cardinality'] not in ('one', 'many'):
+                    raise ValueError(f'model {model_path} db.joins.{join_name} has invalid cardinality: {join["cardinality"]}')
+
+            non_list_field_names = [f['name']['snake_case'] for f in non_list_fields]
+            for summary_num, summary in enumerate(model['db'].get('unique_counts', [])):
+                for summary_key in ('field', 'group_by'):
+                    try:
+                        summary_field = summary[summary_key]
+                    except KeyError as e:
+                        raise ValueError(f'model {model_path} db.unique_counts[{summary_num}] missing key: {e}')
+                    if summary_field not in non_list_field_names:
+                        raise ValueError(f'model {model_path} db.unique_counts[{summary_num}] {summary_key} {summary_field} is not a non list field of the model')
+
+            cache = model['db'].get('cache', False)
+            if cache is True:
+                cache = model['db']['cache'] = {}
+            if cache is not False:
+                if not isinstance(cache, dict):
+                    raise ValueError(f'model {model_path} db.cache must be a bool or a struct with size and ttl')
+                cache.setdefault('size', 1000)
+                cache.setdefault('ttl', 0)
+                if not isinstance(cache['size'], int) or isinstance(cache['size'], bool) or cache['size'] < 1:
+                    raise ValueError(f'model {model_path} db.cache.size must be a positive int')
+                if not isinstance(cache['ttl'], (int, float)) or isinstance(cache['ttl'], bool) or cache['ttl'] < 0:
+                    raise ValueError(f'model {model_path} db.cache.ttl must be a number of seconds >= 0')
+
             if user_id is not None and model['auth']['require_login'] is False and model['hidden'] is False:
                 raise ValueError(f'model {model_path} has user_id field, auth.require_login must be true')
             
@@ -10,18 +10,17 @@ from typing import Any, Optional
 from itertools import dropwhile, takewhile, islice, accumulate
 from functools import reduce
 
-from mapp.auth import create_user, login_user, is_logged_in, current_user, logout_user, delete_user, drop_sessions
+from mapp.auth import create_user, login_user, is_logged_in, current_user, logout_user, delete_user, drop_sessions, sweep_sessions
 from mapp.com import send_email, start_email_verification, verify_email_address, invite_user
 from mapp.context import MappContext
-from mapp.file_system import get_file_content, ingest_start, list_files, get_part_content, list_parts, process_file
+from mapp.file_system import get_file_content, ingest_start, ingest_part, ingest_finish, list_files, get_part_content, list_parts, process_file
 from mapp.errors import NotFoundError, MappValidationError, AuthenticationError
 from mapp.media import create_image, get_image, get_master_image, get_media_file_content, ingest_master_image, list_images, list_master_images
-from mapp.module.model.db import db_model_create, db_model_read, db_model_update, db_model_delete, db_model_unique_counts, db_model_query
+from mapp.module.model.db import db_model_create, db_model_read, db_model_patch, db_model_upsert, db_model_delete_where, db_model_unique_counts, db_model_unique_counts_in, db_model_query, db_model_select_in
 from mapp.types import get_python_type_for_field, new_model_class, convert_dict_to_model
+from mspec.core import MODEL_QUERY_OPERATORS
 
 datetime_format_str = '%Y-%m-%dT%H:%M:%S'
-db_query_batch_size = 1000000
-db_upsert_conflict_check_size = 2
 
 @dataclass
 class LingoApp:
@@ -55,6 +54,7 @@ def _map_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=None)
                 db=ctx.db,
                 log=ctx.log,
                 current_access_token=ctx.current_access_token,
+                request_memo=ctx.request_memo,
                 self=deepcopy(ctx.self)
             )
             new_ctx.self.update({'item': item})
@@ -103,6 +103,7 @@ def _indexed_map_function_args(app:LingoApp, expression: dict, ctx:Optional[dict
                 db=ctx.db,
                 log=ctx.log,
                 current_access_token=ctx.current_access_token,
+                request_memo=ctx.request_memo,
                 self=deepcopy(ctx.self)
             )
             new_ctx.self.update({'item': item, 'index': idx})
@@ -225,6 +226,11 @@ def _drop_sessions_function_args(app:LingoApp, expression: dict, ctx:Optional[di
 
     return (ctx, root_password), {}
 
+def _sweep_sessions_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=None) -> tuple[tuple, dict]:
+    batch_size_expr = expression['args'].get('batch_size', 1000)
+    batch_size = unwrap_primitive(lingo_execute(app, batch_size_expr, ctx))
+    return (ctx,), {'batch_size': batch_size}
+
 #
 # com
 #
@@ -289,6 +295,30 @@ def _ingest_start_function_args(app:LingoApp, expression: dict, ctx:Optional[dic
 
     return (ctx, name, size, parts, content_type, finish), {}
 
+def _ingest_part_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=None) -> tuple[tuple, dict]:
+    try:
+        file_id_expr = expression['args']['file_id']
+        part_number_expr = expression['args']['part_number']
+        sha3_256_expr = expression['args'].get('sha3_256', '')
+    except KeyError as e:
+        raise ValueError(f'ingest_part - missing arg: {e}')
+
+    file_id = unwrap_primitive(lingo_execute(app, file_id_expr, ctx))
+    part_number = unwrap_primitive(lingo_execute(app, part_number_expr, ctx))
+    sha3_256 = unwrap_primitive(lingo_execute(app, sha3_256_expr, ctx))
+
+    return (ctx, file_id, part_number, sha3_256), {}
+
+def _ingest_finish_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=None) -> tuple[tuple, dict]:
+    try:
+        file_id_expr = expression['args']['file_id']
+    except KeyError as e:
+        raise ValueError(f'ingest_finish - missing arg: {e}')
+
+    file_id = unwrap_primitive(lingo_execute(app, file_id_expr, ctx))
+
+    return (ctx, file_id), {}
+
 def _file_system_list_files_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=None) -> tuple[tuple, dict]:
     try:
         offset_expr = expression['args']['offset']
@@ -492,6 +522,12 @@ def _resolve_list_expression(app:LingoApp, expression: Any, ctx:Optional[dict],
         raise ValueError(error_message)
     return result
 
+def _db_parse_select(app:LingoApp, select_expr: Any, ctx:Optional[dict], function_name: str) -> list[str]:
+    select = [str(unwrap_primitive(field_name)) for field_name in _resolve_list_expression(app, select_expr, ctx, f'{function_name} - select must evaluate to a list')]
+    if len(select) == 0:
+        raise ValueError(f'{function_name} - select must not be empty')
+    return select
+
 def _db_create_data_dict(app:LingoApp, data_expr: Any, ctx:Optional[dict]) -> dict:
     input_data = _resolve_struct_expression(app, data_expr, ctx, 'db.create - data expression must evaluate to a struct')
     data = {}
@@ -526,11 +562,15 @@ def _db_parse_where_conditions(app:LingoApp, where_expr: Any, ctx:Optional[dict]
             raise ValueError(f'{error_prefix} - each field condition must be a struct with a single operator: {field_name}')
 
         operator, operand_expr = next(iter(condition.items()))
-        if operator not in ('eq', 'ne'):
+        if operator not in MODEL_QUERY_OPERATORS:
             raise ValueError(f'{error_prefix} - unsupported operator: {operator} in field condition for field {field_name}')
 
-        operand_value = lingo_execute(app, operand_expr, ctx)
-        conditions[field_name] = {operator: unwrap_primitive(operand_value)}
+        operand_value = unwrap_primitive(lingo_execute(app, operand_expr, ctx))
+        if operator in ('in', 'not_in'):
+            if not isinstance(operand_value, list):
+                raise ValueError(f'{error_prefix} - {operator} operand must be a list for field {field_name}')
+            operand_value = [unwrap_primitive(item) for item in operand_value]
+        conditions[field_name] = {operator: operand_value}
 
     return conditions
 
@@ -539,10 +579,26 @@ def _db_is_legacy_fields_condition(condition: Any) -> bool:
         return True
     if len(condition) != 1:
         return True
-    return next(iter(condition.keys())) not in ('eq', 'ne')
+    return next(iter(condition.keys())) not in MODEL_QUERY_OPERATORS
 
-def _db_parse_include_spec(app:LingoApp, include_expr: Any, ctx:Optional[dict]) -> dict:
-    include = _resolve_struct_expression(app, include_expr, ctx, 'db.include - include expression must evaluate to a struct')
+def _db_parse_include_spec(app:LingoApp, include_expr: Any, ctx:Optional[dict], model_class:type) -> dict:
+    """
+    include is either a struct with the join keys, the name of a join in the model's
+    db.joins, or a struct with a join key naming one of those plus keys to override
+    """
+    include = unwrap_primitive(lingo_execute(app, include_expr, ctx))
+    if isinstance(include, str):
+        include = {'join': include}
+    if not isinstance(include, dict):
+        raise ValueError('db.include - include expression must evaluate to a struct')
+
+    if 'join' in include:
+        join_name = str(_resolve_expression_value(app, include['join'], ctx))
+        try:
+            join = model_class._model_spec.get('db', {}).get('joins', {})[join_name]
+        except KeyError:
+            raise ValueError(f'db.include - join not found in model db.joins: {join_name}')
+        include = {'alias': join_name, **join, **{key: value for key, value in include.items() if key != 'join'}}
 
     try:
         alias = _resolve_expression_value(app, include['alias'], ctx)
@@ -557,12 +613,17 @@ def _db_parse_include_spec(app:LingoApp, include_expr: Any, ctx:Optional[dict])
     if cardinality not in ('one', 'many'):
         raise ValueError(f'db.include - unsupported cardinality: {cardinality}')
 
-    model_class = _get_model_class_from_type(app, str(model_type))
-    field_list = [str(field_name) for field_name in fields]
+    include_model_class = _get_model_class_from_type(app, str(model_type))
+    field_list = [str(unwrap_primitive(field_name)) for field_name in fields]
+
+    include_fields = ['id', 'date_created', 'date_modified', *include_model_class._model_spec['fields']]
+    for field_name in [str(foreign_field), *field_list]:
+        if field_name not in include_fields:
+            raise ValueError(f'db.include - field not found on included model: {field_name}')
 
     return {
         'alias': str(alias),
-        'model_class': model_class,
+        'model_class': include_model_class,
         'local_field': str(local_field),
         'foreign_field': str(foreign_field),
         'fields': field_list,
@@ -643,7 +704,11 @@ def _db_read_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=No
 
     include_expr = expression['args'].get('include')
     if include_expr is not None:
-        kwargs['include'] = _db_parse_include_spec(app, include_expr, ctx)
+        kwargs['include'] = _db_parse_include_spec(app, include_expr, ctx, model_class)
+
+    select_expr = expression['args'].get('select')
+    if select_expr is not None:
+        kwargs['select'] = _db_parse_select(app, select_expr, ctx, 'db.read')
 
     return (ctx, model_class, str(model_id)), kwargs
 
@@ -744,7 +809,7 @@ def _db_query_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=N
     kwargs = {}
     include_expr = expression['args'].get('include')
     if include_expr is not None:
-        kwargs['include'] = _db_parse_include_spec(app, include_expr, ctx)
+        kwargs['include'] = _db_parse_include_spec(app, include_expr, ctx, model_class)
 
     unique_counts_expr = expression['args'].get('unique_counts')
     if unique_counts_expr is not None:
@@ -754,6 +819,18 @@ def _db_query_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=N
     if sort_expr is not None:
         kwargs['sort'] = _db_parse_sort_specs(app, sort_expr, ctx)
 
+    if 'after' in expression['args']:
+        after = _resolve_expression_value(app, expression['args']['after'], ctx)
+        if after is not None:
+            kwargs['after'] = str(after)
+
+    if 'count' in expression['args']:
+        kwargs['count'] = str(_resolve_expression_value(app, expression['args']['count'], ctx))
+
+    select_expr = expression['args'].get('select')
+    if select_expr is not None:
+        kwargs['select'] = _db_parse_select(app, select_expr, ctx, 'db.query')
+
     return (ctx, model_class, where, offset, size), kwargs
 
 def _db_delete_where_function_args(app:LingoApp, expression: dict, ctx:Optional[dict]=None) -> tuple[tuple, dict]:
@@ -773,55 +850,75 @@ def _db_delete_where_function_args(app:LingoApp, expression: dict, ctx:Optional[
 
     return (ctx, model_class, where), kwargs
 
-def _db_project_model_fields(model: Any, field_names: list[str]) -> dict:
-    model_data = model._asdict()
-    projected = {}
-    for field_name in field_names:
-        try:
-            projected[field_name] = model_data[field_name]
-        except KeyError:
-            raise ValueError(f'db.include - field not found on included model: {field_name}')
-    return projected
-
-def _db_sort_models_by_id(models: list[Any]) -> list[Any]:
-    """Sort model rows by ID with numeric ordering when IDs are numeric strings."""
-    def _sort_key(model):
-        model_id = getattr(model, 'id', None)
-        try:
-            return int(model_id)
-        except (TypeError, ValueError):
-            return str(model_id)
-    return sorted(models, key=_sort_key)
-
-def _db_resolve_include_for_row(ctx, row: dict, include: dict) -> Any:
-    local_value = row.get(include['local_field'])
-    if local_value is None:
-        return [] if include['cardinality'] == 'many' else None
-
-    if include['foreign_field'] == 'id':
-        try:
-            joined_model = db_model_read(ctx, include['model_class'], str(local_value))
-            joined_rows = [joined_model]
-        except NotFoundError:
-            joined_rows = []
-    else:
-        joined_result = db_model_query(ctx, include['model_class'], {include['foreign_field']: {'eq': local_value}}, 0, db_query_batch_size)
-        joined_rows = joined_result['items']
-
-    joined_rows = _db_sort_models_by_id(joined_rows)
-    projected_rows = [_db_project_model_fields(model, include['fields']) for model in joined_rows]
+def _db_resolve_includes(ctx, rows: list[dict], include: dict) -> None:
+    """
+    set include['alias'] on every row from one db_model_select_in call for the whole
+    page, joined rows are ordered by id and 'one' includes take the first match
+    """
+    local_field = include['local_field']
+    local_values = [row.get(local_field) for row in rows]
+    joined_by_value = {}
+
+    if any(value is not None for value in local_values):
+        joined_rows = db_model_select_in(ctx, include['model_class'], include['foreign_field'], local_values, include['fields'])
+        for joined in joined_rows:
+            joined_by_value.setdefault(str(joined[include['foreign_field']]), []).append(
+                {field_name: joined[field_name] for field_name in include['fields']}
+            )
 
-    if include['cardinality'] == 'many':
-        return projected_rows
+    for row, local_value in zip(rows, local_values):
+        matches = joined_by_value.get(str(local_value), []) if local_value is not None else []
+        if include['cardinality'] == 'many':
+            row[include['alias']] = [dict(match) for match in matches]
+        else:
+            row[include['alias']] = dict(matches[0]) if matches else None
+
+def _db_resolve_unique_counts(ctx, rows: list[dict], unique_count: dict) -> None:
+    """set unique_count['alias'] on every row from one grouped query for the whole page"""
+    source_values = [row.get(unique_count['source_field']) for row in rows]
+    counts_by_value = {}
+
+    if any(value is not None for value in source_values):
+        counts = db_model_unique_counts_in(
+            ctx,
+            unique_count['model_class'],
+            unique_count['group_by'],
+            unique_count['foreign_field'],
+            source_values,
+        )
+        counts_by_value = {str(value): value_counts for value, value_counts in counts.items()}
 
-    return projected_rows[0] if projected_rows else None
+    for row, source_value in zip(rows, source_values):
+        counts = counts_by_value.get(str(source_value), []) if source_value is not None else []
+        row[unique_count['alias']] = [dict(count) for count in counts]
 
-def db_read(ctx, model_class, model_id:str, include:dict=None) -> dict:
+def _db_select_fields(select:Optional[list[str]], include:Optional[dict], unique_counts:Optional[list]=None) -> Optional[list[str]]:
+    """fields to read for select, plus the fields includes and unique_counts are matched on"""
+    if select is None:
+        return None
+    fields = list(select)
+    if include is not None:
+        fields.append(include['local_field'])
+    for unique_count in unique_counts or []:
+        fields.append(unique_count['source_field'])
+    return list(dict.fromkeys(fields))
+
+def _db_drop_unselected(rows:list[dict], select:list[str], fields:list[str]) -> None:
+    """remove the fields read only to match includes and unique_counts once they are resolved"""
+    unselected = [field_name for field_name in fields if field_name not in select and field_name != 'id']
+    for row in rows:
+        for field_name in unselected:
+            row.pop(field_name, None)
+
+def db_read(ctx, model_class, model_id:str, include:dict=None, select:list=None) -> dict:
     try:
-        model = db_model_read(ctx, model_class, model_id)
-        model_value = model._asdict()
+        fields = _db_select_fields(select, include)
+        model = db_model_read(ctx, model_class, model_id, fields=fields)
+        model_value = model._asdict() if fields is None else model
         if include is not None:
-            model_value[include['alias']] = _db_resolve_include_for_row(ctx, model_value, include)
+            _db_resolve_includes(ctx, [model_value], include)
+        if fields is not None:
+            _db_drop_unselected([model_value], select, fields)
         return {'type': 'struct', 'value': model_value}
     except NotFoundError as e:
         raise
@@ -832,13 +929,8 @@ def db_create(ctx, model_class, data:dict) -> str:
     return str(model.id)
 
 def db_patch(ctx, model_class, model_id:str, data:dict) -> dict:
-    existing = db_model_read(ctx, model_class, model_id)
-    updated_data = existing._asdict()
-    updated_data.update(data)
-    updated_data['date_created'] = None
-    updated_data['date_modified'] = None
-    model = convert_dict_to_model(model_class, updated_data)
-    saved_model = db_model_update(ctx, model_class, model)
+    data = {key: value for key, value in data.items() if key not in ('date_created', 'date_modified')}
+    saved_model = db_model_patch(ctx, model_class, model_id, data)
     return {'type': 'struct', 'value': saved_model._asdict()}
 
 def db_upsert(ctx, model_class, data:dict, conflict_fields:list[str]) -> dict:
@@ -879,67 +971,40 @@ def db_upsert(ctx, model_class, data:dict, conflict_fields:list[str]) -> dict:
                 {field_name: 'Conflict field is required in data.'},
             )
 
-    where = {field_name: {'eq': data[field_name]} for field_name in conflict_fields}
-    query_result = db_model_query(ctx, model_class, where, 0, db_upsert_conflict_check_size)
-
-    if query_result['total'] == 0:
-        model = convert_dict_to_model(model_class, data)
-        saved_model = db_model_create(ctx, model_class, model)
-    elif query_result['total'] == 1:
-        existing = query_result['items'][0]
-        updated_data = existing._asdict()
-        updated_data.update(data)
-        # db_model_update expects timestamp inputs to be unset and handles them automatically.
-        updated_data['date_created'] = None
-        updated_data['date_modified'] = None
-        model = convert_dict_to_model(model_class, updated_data)
-        saved_model = db_model_update(ctx, model_class, model)
-    else:
-        raise MappValidationError(
-            'db.upsert - conflict_fields matched multiple rows; expected unique match',
-            {'conflict_fields': 'Matched multiple rows; expected one due to unique index.'},
-        )
-
+    saved_model = db_model_upsert(ctx, model_class, data, conflict_fields)
     return {'type': 'struct', 'value': saved_model._asdict()}
 
 def db_unique_counts(ctx, model_class, group_by:str, filters=None) -> list:
     rows = db_model_unique_counts(ctx, model_class, group_by, filters)
     return [{'type': 'struct', 'value': row} for row in rows]
 
-def db_query(ctx, model_class, where:dict, offset:int=0, size:int=25, include:dict=None, unique_counts:list=None, sort:list=None) -> list:
-    query_result = db_model_query(ctx, model_class, where, offset, size, sort=sort)
+def db_query(ctx, model_class, where:dict, offset:int=0, size:int=25, include:dict=None, unique_counts:list=None, sort:list=None, after:str=None, count:str=None, select:list=None) -> list:
+    fields = _db_select_fields(select, include, unique_counts)
+    query_result = db_model_query(ctx, model_class, where, offset, size, sort=sort, after=after, count=count, fields=fields)
 
-    items = [item._asdict() for item in query_result['items']]
+    items = [item._asdict() for item in query_result['items']] if fields is None else query_result['items']
     if include is not None:
-        for item in items:
-            item[include['alias']] = _db_resolve_include_for_row(ctx, item, include)
+        _db_resolve_includes(ctx, items, include)
 
     if unique_counts is not None:
-        for item in items:
-            for unique_count in unique_counts:
-                source_value = item.get(unique_count['source_field'])
-                if source_value is None:
-                    item[unique_count['alias']] = []
-                    continue
-                item[unique_count['alias']] = db_model_unique_counts(
-                    ctx,
-                    unique_count['model_class'],
-                    unique_count['group_by'],
-                    {unique_count['foreign_field']: source_value},
-                )
-    
+        for unique_count in unique_counts:
+            _db_resolve_unique_counts(ctx, items, unique_count)
+
+    if fields is not None:
+        _db_drop_unselected(items, select, fields)
+
     return {
         'type': 'struct',
         'value': {
             'items': items,
-            'total': query_result['total']
+            'total': query_result['total'],
+            'next_cursor': query_result['next_cursor'],
+            'has_more': query_result['has_more']
         }
     }
 
 def db_delete_where(ctx, model_class, where:dict, message:str='Items deleted.') -> dict:
-    query_result = db_model_query(ctx, model_class, where, 0, db_query_batch_size)
-    for item in query_result['items']:
-        db_model_delete(ctx, model_class, item.id)
+    db_model_delete_where(ctx, model_class, where)
     return {'type': 'struct', 'value': {'acknowledged': True, 'message': message}}
 
 def str_convert(object:Any) -> str:
@@ -1173,7 +1238,8 @@ lingo_function_lookup = {
         'current_user': {'func': current_user, 'create_args': _current_user_function_args},
         'logout_user': {'func': logout_user, 'create_args': _logout_user_function_args},
         'delete_user': {'func': delete_user, 'create_args': _delete_user_function_args},
-        'drop_sessions': {'func': drop_sessions, 'create_args': _drop_sessions_function_args}
+        'drop_sessions': {'func': drop_sessions, 'create_args': _drop_sessions_function_args},
+        'sweep_sessions': {'func': sweep_sessions, 'create_args': _sweep_sessions_function_args}
     },
 
     # com #
@@ -1189,6 +1255,8 @@ lingo_function_lookup = {
 
     'file_system': {
         'ingest_start': {'func': ingest_start, 'create_args': _ingest_start_function_args},
+        'ingest_part': {'func': ingest_part, 'create_args': _ingest_part_function_args},
+        'ingest_finish': {'func': ingest_finish, 'create_args': _ingest_finish_function_args},
         'list_files': {'func': list_files, 'create_args': _file_system_list_files_function_args},
         'list_parts': {'func': list_parts, 'create_args': _file_system_list_parts_function_args},
         'get_part_content': {'func': get_part_content, 'create_args': _file_system_get_part_content_function_args},
@@ -528,7 +528,7 @@ def main():
     # load spec and context #
 
     spec = spec_from_env()
-    ctx = get_context_from_env()
+    ctx = get_context_from_env(spec)
 
     seed(ctx, spec, num_users=args.users, min_models=args.min_models, max_models=args.max_models)
 
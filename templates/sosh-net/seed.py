@@ -347,8 +347,8 @@ def _seed_reactions(ctx, spec: dict, social_module: dict, users: list[dict], num
 
 def seed():
     load_dotenv()
-    ctx = get_context_from_env()
     spec = spec_from_env()
+    ctx = get_context_from_env(spec)
 
     social_module = spec['modules']['social']
 
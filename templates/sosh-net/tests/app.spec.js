@@ -30,6 +30,7 @@ test('test hidden entry points', async ({ browser, crudEnv }) => {
 
 	await page.getByRole('link', { name: 'auth' }).click();
   	await expect(page.locator('#lingo-app')).not.toContainText('drop-sessions');
+  	await expect(page.locator('#lingo-app')).not.toContainText('sweep-sessions');
 
 	let response = await page.goto(`${crudHost}/auth/drop-sessions`);
 	expect(response.status()).toBe(404);
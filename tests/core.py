@@ -1,5 +1,149 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
+from unittest.mock import patch
+
+from mapp.auth import _create_access_token
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.db import create_tables
+from mspec.core import load_generator_spec
 
 
 REPO_ROOT = Path(__file__).parent.parent
-TESTS_TMP_DIR = REPO_ROOT / 'tests' / 'tmp'
\ No newline at end of file
+TESTS_TMP_DIR = REPO_ROOT / 'tests' / 'tmp'
+
+#
+# mapp
+#
+
+def in_mem_ctx() -> MappContext:
+    conn = sqlite3.connect(':memory:')
+    db = DBContext(db_url=':memory:', connection=conn, cursor=conn.cursor(), commit=conn.commit)
+    return MappContext(
+        server_port=8000,
+        client=ClientContext(host='http://localhost:8000', headers={}),
+        db=db,
+        log=lambda msg: None,
+    )
+
+def make_module_spec(models_dict:dict) -> dict:
+    return {
+        'name': {'lower_case': 'test app', 'snake_case': 'test_app', 'pascal_case': 'TestApp', 'kebab_case': 'test-app'},
+        'models': models_dict,
+    }
+
+def make_owned_spec() -> dict:
+    label = {'name': {'lower_case': 'label', 'snake_case': 'label'}, 'type': 'str', 'unique': True}
+    color = {'name': {'lower_case': 'color', 'snake_case': 'color'}, 'type': 'str'}
+    user_id = {'name': {'lower_case': 'user id', 'snake_case': 'user_id'}, 'type': 'str'}
+    return {
+        'name': {'lower_case': 'owned', 'snake_case': 'owned', 'pascal_case': 'Owned', 'kebab_case': 'owned'},
+        'auth': {'require_login': True, 'max_models_per_user': 4, 'max_models_by_field': {'color': 2}},
+        'fields': {'color': color, 'label': label, 'user_id': user_id},
+        'non_list_fields': [color, label, user_id],
+        'list_fields': [],
+        'unique_model_fields': ['label'],
+    }
+
+def make_score_spec(count:str='exact') -> dict:
+    label = {'name': {'lower_case': 'label', 'snake_case': 'label'}, 'type': 'str'}
+    rank = {'name': {'lower_case': 'rank', 'snake_case': 'rank'}, 'type': 'int'}
+    return {
+        'name': {'lower_case': 'score', 'snake_case': 'score', 'pascal_case': 'Score', 'kebab_case': 'score'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'db': {'count': count},
+        'fields': {'label': label, 'rank': rank},
+        'non_list_fields': [label, rank],
+        'list_fields': [],
+        'unique_model_fields': [],
+    }
+
+
+class QueryCounter:
+    """count sql statements executed on a connection while active"""
+
+    def __init__(self, conn:sqlite3.Connection):
+        self.conn = conn
+        self.statements = []
+
+    def __enter__(self):
+        self.conn.set_trace_callback(self.statements.append)
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.set_trace_callback(None)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+AUTH_SECRET_KEY = 'test-secret-' + 'x' * 32
+
+
+class MappAuthTestCase(unittest.TestCase):
+    """
+    a file db with the sample store's auth tables and the other modules in modules,
+    alice as user 1, and the auth secret and password work factor patched for tests
+    """
+
+    modules = ('auth',)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.spec = load_generator_spec('my-sample-store.yaml')
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.db_path = os.path.join(tmp_dir.name, 'app.sqlite3')
+        for target, value in (
+            ('mapp.auth.MAPP_AUTH_SECRET_KEY', AUTH_SECRET_KEY),
+            ('mapp.auth.MAPP_AUTH_PASSWORD_ITERATIONS', 1000),
+            ('mapp.auth._HASH_SLOT_DIR', os.path.join(tmp_dir.name, 'hash-slots')),
+        ):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.ctx = self.worker_ctx()
+        create_tables(self.ctx, {'modules': {name: self.spec['modules'][name] for name in self.modules}})
+        self.ctx.db.cursor.execute("INSERT INTO auth_user (name, email, email_verified) VALUES ('alice', 'alice@example.com', 1)")
+        self.ctx.db.commit()
+
+    def worker_ctx(self, cleanup:bool=True) -> MappContext:
+        """a context with its own connection, like a server worker"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if cleanup:
+            self.addCleanup(conn.close)
+        return MappContext(
+            server_port=8000,
+            client=ClientContext(host='http://localhost:8000', headers={}),
+            db=DBContext(db_url=self.db_path, connection=conn, cursor=conn.cursor(), commit=conn.commit),
+            log=lambda msg: None,
+        )
+
+    def request_ctx(self, token:Optional[str]=None, worker:Optional[MappContext]=None, file_input:Optional[bytes]=None) -> MappContext:
+        """a new context per request on a worker's connection, like mapp.server.application"""
+        worker = worker or self.ctx
+        return MappContext(
+            server_port=8000,
+            client=worker.client,
+            db=worker.db,
+            log=worker.log,
+            current_access_token=lambda: token,
+            self={} if file_input is None else {'file_input': file_input},
+        )
+
+    def create_session(self, user_id:str='1') -> str:
+        """insert a session for user_id and return its access token"""
+        token, _, jti = _create_access_token(user_id)
+        self.ctx.db.cursor.execute('INSERT INTO auth_user_session (id, user_id, created_at) VALUES (?, ?, ?)', (jti, user_id, datetime.now(timezone.utc)))
+        self.ctx.db.commit()
+        return token
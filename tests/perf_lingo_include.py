@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+benchmark for lingo db.query includes and unique_counts
+
+compares resolving an include or unique_counts with one query per row of the page
+(the previous behaviour) against the single IN (...) query used by db.query now, for
+pages of `number` posts joined to their author's profile and their reaction counts,
+with and without a db.unique_counts summary table
+"""
+import sqlite3
+import timeit
+
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.module.model.db import db_model_create_table, db_model_bulk_create, db_model_query, db_model_unique_counts
+from mapp.types import new_model_class
+from mspec.lingo import LingoApp, lingo_execute
+
+
+def _field(name:str, field_type:str) -> dict:
+    return {'name': {'lower_case': name, 'snake_case': name}, 'type': field_type}
+
+def _model_spec(name:str, fields:list[dict]) -> dict:
+    return {
+        'name': {'lower_case': name, 'snake_case': name, 'pascal_case': name.title(), 'kebab_case': name},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'fields': {field['name']['snake_case']: field for field in fields},
+        'non_list_fields': fields,
+        'list_fields': [],
+        'unique_model_fields': [],
+    }
+
+def _setup(number:int, summary:bool=False) -> tuple[MappContext, LingoApp, type, type, type]:
+    conn = sqlite3.connect(':memory:')
+    ctx = MappContext(
+        server_port=8000,
+        client=ClientContext(host='http://localhost:8000', headers={}),
+        db=DBContext(db_url=':memory:', connection=conn, cursor=conn.cursor(), commit=conn.commit),
+        log=lambda msg: None,
+    )
+
+    post_spec = _model_spec('post', [_field('title', 'str'), _field('user_id', 'str')])
+    post_spec['db'] = {'joins': {'profile': {'model_type': 'perf.profile', 'local_field': 'user_id', 'foreign_field': 'user_id', 'fields': ['username']}}}
+    profile_spec = _model_spec('profile', [_field('user_id', 'str'), _field('username', 'str')])
+    reaction_spec = _model_spec('reaction', [_field('post_id', 'str'), _field('reaction_type', 'str')])
+    reaction_spec['db'] = {'unique_counts': [{'field': 'post_id', 'group_by': 'reaction_type'}] if summary else []}
+    module_spec = {
+        'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'},
+        'models': {'post': post_spec, 'profile': profile_spec, 'reaction': reaction_spec},
+    }
+    post_class = new_model_class({}, post_spec, module_spec)
+    profile_class = new_model_class({}, profile_spec, module_spec)
+    reaction_class = new_model_class({}, reaction_spec, module_spec)
+
+    for model_class in (post_class, profile_class, reaction_class):
+        db_model_create_table(ctx, model_class)
+    db_model_bulk_create(ctx, profile_class, [{'user_id': str(n), 'username': f'user {n}'} for n in range(number)])
+    db_model_bulk_create(ctx, post_class, [{'title': f'post {n}', 'user_id': str(n % (number // 2 or 1))} for n in range(number)])
+    db_model_bulk_create(ctx, reaction_class, [{'post_id': str(n % number + 1), 'reaction_type': ('like', 'love', 'laugh')[n % 3]} for n in range(number * 20)])
+
+    app = LingoApp(spec={'params': {}, 'state': {}, 'modules': {'perf': module_spec}}, params={}, state={}, buffer=[])
+    return ctx, app, post_class, profile_class, reaction_class
+
+def _query_expression(number:int, **args) -> dict:
+    return {
+        'call': 'db.query',
+        'args': {
+            'model_type': 'perf.post',
+            'where': {'title': {'ne': ''}},
+            'size': {'value': number, 'type': 'int'},
+            **args,
+        }
+    }
+
+_UNIQUE_COUNTS = [{'alias': 'reaction_counts', 'model_type': 'perf.reaction', 'source_field': 'id', 'foreign_field': 'post_id', 'group_by': 'reaction_type'}]
+
+def perf_include_query_per_row(repeat:int=5, number:int=500) -> list[float]:
+    ctx, _, post_class, profile_class, _ = _setup(number)
+
+    def run():
+        items = [item._asdict() for item in db_model_query(ctx, post_class, {'title': {'ne': ''}}, 0, number)['items']]
+        for item in items:
+            profiles = db_model_query(ctx, profile_class, {'user_id': {'eq': item['user_id']}}, 0, number)['items']
+            item['profile'] = {'username': profiles[0].username} if profiles else None
+        return items
+
+    return timeit.repeat(run, repeat=repeat, number=1)
+
+def perf_include_one_query(repeat:int=5, number:int=500) -> list[float]:
+    ctx, app, _, _, _ = _setup(number)
+    expression = _query_expression(number, include='profile')
+    return timeit.repeat(lambda: lingo_execute(app, expression, ctx), repeat=repeat, number=1)
+
+def perf_unique_counts_query_per_row(repeat:int=5, number:int=500) -> list[float]:
+    ctx, _, post_class, _, reaction_class = _setup(number)
+
+    def run():
+        items = [item._asdict() for item in db_model_query(ctx, post_class, {'title': {'ne': ''}}, 0, number)['items']]
+        for item in items:
+            item['reaction_counts'] = db_model_unique_counts(ctx, reaction_class, 'reaction_type', {'post_id': item['id']})
+        return items
+
+    return timeit.repeat(run, repeat=repeat, number=1)
+
+def perf_unique_counts_one_query(repeat:int=5, number:int=500) -> list[float]:
+    ctx, app, _, _, _ = _setup(number)
+    expression = _query_expression(number, unique_counts=_UNIQUE_COUNTS)
+    return timeit.repeat(lambda: lingo_execute(app, expression, ctx), repeat=repeat, number=1)
+
+def perf_unique_counts_summary_table(repeat:int=5, number:int=500) -> list[float]:
+    ctx, app, _, _, _ = _setup(number, summary=True)
+    expression = _query_expression(number, unique_counts=_UNIQUE_COUNTS)
+    return timeit.repeat(lambda: lingo_execute(app, expression, ctx), repeat=repeat, number=1)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 500
+    default_repeat = 5
+
+    parser = argparse.ArgumentParser(description='Run performance tests for lingo db.query includes and unique_counts.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of rows per page. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
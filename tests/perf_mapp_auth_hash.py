@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+benchmark for password hashing under load
+
+4 worker threads (standing in for uwsgi processes, each with its own connection) serve
+a shared request queue. 8 clients send logins back to back while one client sends
+`number` model reads 2ms apart, the result is the p99 latency of the reads in seconds,
+including time spent waiting for a free worker. Compares hashing in the worker with no
+limit (the previous behaviour) against the hashing pool with MAPP_AUTH_HASH_QUEUE_LIMIT=2,
+where logins over the limit are rejected with a 503 instead of occupying a worker
+"""
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+from unittest.mock import patch
+
+from mapp import auth
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.db import create_tables
+from mapp.errors import ServiceUnavailableError
+from mapp.module.model.db import db_model_create_table, db_model_read
+from mapp.types import new_model_class
+from mspec.core import load_generator_spec
+
+
+WORKERS = 4
+LOGIN_CLIENTS = 8
+
+
+def _note_class() -> type:
+    text = {'name': {'lower_case': 'text', 'snake_case': 'text'}, 'type': 'str'}
+    model_spec = {
+        'name': {'lower_case': 'note', 'snake_case': 'note', 'pascal_case': 'Note', 'kebab_case': 'note'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'fields': {'text': text},
+        'non_list_fields': [text],
+        'list_fields': [],
+        'unique_model_fields': [],
+    }
+    module_spec = {'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'}}
+    return new_model_class({}, model_spec, module_spec)
+
+def _ctx(db_path:str) -> MappContext:
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    return MappContext(
+        server_port=8000,
+        client=ClientContext(host='http://localhost:8000', headers={}),
+        db=DBContext(db_url=db_path, connection=conn, cursor=conn.cursor(), commit=conn.commit),
+        log=lambda msg: None,
+    )
+
+def _setup(db_path:str) -> type:
+    ctx = _ctx(db_path)
+    spec = load_generator_spec('my-sample-store.yaml')
+    create_tables(ctx, {'modules': {'auth': spec['modules']['auth']}})
+    note_class = _note_class()
+    db_model_create_table(ctx, note_class)
+    ctx.db.cursor.execute("INSERT INTO auth_user (name, email) VALUES ('perf', 'perf@example.com')")
+    ctx.db.cursor.execute("INSERT INTO auth_password_hash (id, user_id, hash) VALUES ('1', 1, ?)", (auth._get_password_hash('password'),))
+    ctx.db.cursor.execute("INSERT INTO perf_note (text) VALUES ('hello')")
+    ctx.db.commit()
+    ctx.db.connection.close()
+    return note_class
+
+def _p99_read_latency(number:int) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'perf.sqlite3')
+        note_class = _setup(db_path)
+        requests = queue.Queue()
+        done = threading.Event()
+
+        def worker():
+            ctx = _ctx(db_path)
+            while True:
+                request = requests.get()
+                if request is None:
+                    break
+                kind, reply = request
+                try:
+                    if kind == 'login':
+                        auth._check_user_credentials(ctx, 'perf@example.com', 'password')
+                    else:
+                        db_model_read(ctx, note_class, '1')
+                except ServiceUnavailableError:
+                    pass
+                reply.put(time.perf_counter())
+
+        def login_client():
+            reply = queue.Queue()
+            while not done.is_set():
+                requests.put(('login', reply))
+                reply.get()
+
+        workers = [threading.Thread(target=worker) for _ in range(WORKERS)]
+        clients = [threading.Thread(target=login_client) for _ in range(LOGIN_CLIENTS)]
+        for thread in workers + clients:
+            thread.start()
+
+        latencies = []
+        reply = queue.Queue()
+        for _ in range(number):
+            start = time.perf_counter()
+            requests.put(('read', reply))
+            latencies.append(reply.get() - start)
+            time.sleep(0.002)
+
+        done.set()
+        for thread in clients:
+            thread.join()
+        for _ in workers:
+            requests.put(None)
+        for thread in workers:
+            thread.join()
+
+        latencies.sort()
+        return latencies[int(len(latencies) * 0.99) - 1]
+
+def perf_read_p99_hash_in_worker(repeat:int=3, number:int=300) -> list[float]:
+    with patch.object(auth, 'MAPP_AUTH_HASH_WORKERS', 0), patch.object(auth, 'MAPP_AUTH_HASH_QUEUE_LIMIT', 0):
+        return [_p99_read_latency(number) for _ in range(repeat)]
+
+def perf_read_p99_hash_pool(repeat:int=3, number:int=300) -> list[float]:
+    with patch.object(auth, 'MAPP_AUTH_HASH_WORKERS', 2), patch.object(auth, 'MAPP_AUTH_HASH_QUEUE_LIMIT', 2):
+        return [_p99_read_latency(number) for _ in range(repeat)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 300
+    default_repeat = 3
+
+    parser = argparse.ArgumentParser(description='Run performance tests for password hashing under load.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of reads per run. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+load test for the auth session cache
+
+runs `number` authenticated GET /api/perf/note/<id> requests through model_read_route,
+each with a new MappContext like mapp.server.application, against a sqlite file with
+the builtin auth tables. Compares MAPP_AUTH_SESSION_CACHE_SECONDS=0 (token signature
+check and session query on every request) with the session cache enabled
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from mapp import auth
+from mapp.context import MappContext, ClientContext, DBContext, RequestContext, ModelRouteContext
+from mapp.db import create_tables
+from mapp.module.model.db import db_model_create_table
+from mapp.module.model.server import model_read_route
+from mapp.types import new_model_class
+from mspec.core import load_generator_spec
+
+
+def _note_class() -> type:
+    text = {'name': {'lower_case': 'text', 'snake_case': 'text'}, 'type': 'str'}
+    model_spec = {
+        'name': {'lower_case': 'note', 'snake_case': 'note', 'pascal_case': 'Note', 'kebab_case': 'note'},
+        'auth': {'require_login': True, 'max_models_per_user': -1},
+        'fields': {'text': text},
+        'non_list_fields': [text],
+        'list_fields': [],
+        'unique_model_fields': [],
+    }
+    module_spec = {'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'}}
+    return new_model_class({}, model_spec, module_spec)
+
+def _run(number:int, cache_seconds:float) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir, patch.object(auth, 'MAPP_AUTH_SECRET_KEY', 'perf-' + 'x' * 32), \
+            patch.object(auth, 'MAPP_AUTH_SESSION_CACHE_SECONDS', cache_seconds):
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'perf.sqlite3'))
+        db = DBContext(db_url='', connection=conn, cursor=conn.cursor(), commit=conn.commit)
+        worker = MappContext(server_port=8000, client=ClientContext(host='http://localhost:8000', headers={}), db=db, log=lambda msg: None)
+
+        spec = load_generator_spec('my-sample-store.yaml')
+        create_tables(worker, {'modules': {'auth': spec['modules']['auth']}})
+        note_class = _note_class()
+        db_model_create_table(worker, note_class)
+
+        conn.execute("INSERT INTO auth_user (name, email, email_verified) VALUES ('perf', 'perf@example.com', 1)")
+        token, _, jti = auth._create_access_token('1')
+        conn.execute('INSERT INTO auth_user_session (id, user_id, created_at) VALUES (?, ?, ?)', (jti, '1', datetime.now(timezone.utc)))
+        conn.execute("INSERT INTO perf_note (text) VALUES ('hello')")
+        conn.commit()
+
+        route = ModelRouteContext(
+            model_class=note_class,
+            model_kebab_case='note',
+            module_kebab_case='perf',
+            api_instance_path='/api/perf/note/{instance_id}',
+            api_model_path='/api/perf/note',
+        )
+        request = RequestContext(env={'QUERY_STRING': ''}, raw_req_body=b'', request_id='perf')
+
+        start = time.perf_counter()
+        for _ in range(number):
+            server_ctx = MappContext(server_port=8000, client=worker.client, db=db, log=worker.log, current_access_token=lambda: token)
+            model_read_route(route, server_ctx, request, '1').body()
+        elapsed = time.perf_counter() - start
+
+        conn.close()
+        return elapsed
+
+def perf_get_without_session_cache(repeat:int=3, number:int=5_000) -> list[float]:
+    return [_run(number, 0) for _ in range(repeat)]
+
+def perf_get_with_session_cache(repeat:int=3, number:int=5_000) -> list[float]:
+    return [_run(number, 30) for _ in range(repeat)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 5_000
+    default_repeat = 3
+
+    parser = argparse.ArgumentParser(description='Run load tests for the auth session cache.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of requests per run. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}: ({args.number / minimun:.0f} requests/s)')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+write contention benchmark for db profiles
+
+`processes` worker processes (like uwsgi workers) each open their own
+connection with mapp.context.apply_db_profile and commit `number` single row
+inserts into a shared sqlite file, reports wall time for all workers to finish
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+from multiprocessing import Process
+
+from mapp.context import apply_db_profile
+
+
+def _writer(db_path:str, profile:str, number:int) -> None:
+    conn = sqlite3.connect(db_path, timeout=60)
+    apply_db_profile(conn, profile, timeout=60)
+    for n in range(number):
+        conn.execute('INSERT INTO perf_item (pid, n, payload) VALUES (?, ?, ?)', (os.getpid(), n, 'x' * 200))
+        conn.commit()
+    conn.close()
+
+def _run_writers(profile:str, processes:int, number:int) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'perf.sqlite3')
+        conn = sqlite3.connect(db_path)
+        apply_db_profile(conn, profile)
+        conn.execute('CREATE TABLE perf_item (id INTEGER PRIMARY KEY, pid INTEGER, n INTEGER, payload TEXT)')
+        conn.commit()
+        conn.close()
+
+        workers = [Process(target=_writer, args=(db_path, profile, number)) for _ in range(processes)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - start
+
+def perf_default_profile(repeat:int=3, number:int=500, processes:int=4) -> list[float]:
+    return [_run_writers('default', processes, number) for _ in range(repeat)]
+
+def perf_performance_profile(repeat:int=3, number:int=500, processes:int=4) -> list[float]:
+    return [_run_writers('performance', processes, number) for _ in range(repeat)]
+
+def perf_durable_profile(repeat:int=3, number:int=500, processes:int=4) -> list[float]:
+    return [_run_writers('durable', processes, number) for _ in range(repeat)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 500
+    default_repeat = 3
+    default_processes = 4
+
+    parser = argparse.ArgumentParser(description='Run write contention tests for db profiles.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of committed inserts per process. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    parser.add_argument('--processes', type=int, default=default_processes, help=f'Number of writer processes. Default is {default_processes}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number, args.processes)
+
+        minimun = min(test_result)
+        total_writes = args.number * args.processes
+        print(f'{perf_test}:')
+        for result in test_result:
+            suffix = ' <- min' if result == minimun else ''
+            print(f'  {result:.3f}s ({total_writes / result:.0f} writes/s){suffix}')
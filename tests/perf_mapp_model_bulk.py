@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+benchmark for importing models
+
+compares a loop of db_model_create (one commit and one read back per row)
+with db_model_bulk_create, both inserting `number` models with 2 list fields
+into a sqlite file
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.module.model.db import db_model_create_table, db_model_create, db_model_bulk_create
+from mapp.types import new_model_class
+
+
+def _article_class() -> type:
+    title = {'name': {'lower_case': 'title', 'snake_case': 'title'}, 'type': 'str'}
+    rank = {'name': {'lower_case': 'rank', 'snake_case': 'rank'}, 'type': 'int'}
+    tags = {'name': {'lower_case': 'tags', 'snake_case': 'tags'}, 'type': 'list', 'element_type': 'str'}
+    scores = {'name': {'lower_case': 'scores', 'snake_case': 'scores'}, 'type': 'list', 'element_type': 'int'}
+    model_spec = {
+        'name': {'lower_case': 'article', 'snake_case': 'article', 'pascal_case': 'Article', 'kebab_case': 'article'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'fields': {'title': title, 'rank': rank, 'tags': tags, 'scores': scores},
+        'non_list_fields': [rank, title],
+        'list_fields': [scores, tags],
+        'unique_model_fields': [],
+    }
+    module_spec = {'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'}}
+    return new_model_class({}, model_spec, module_spec)
+
+def _items(number:int) -> list[dict]:
+    return [{'title': f'article {n}', 'rank': n, 'tags': ['a', 'b', 'c'], 'scores': [n, n + 1]} for n in range(number)]
+
+def _run(number:int, bulk:bool) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'perf.sqlite3'))
+        ctx = MappContext(
+            server_port=8000,
+            client=ClientContext(host='http://localhost:8000', headers={}),
+            db=DBContext(db_url='', connection=conn, cursor=conn.cursor(), commit=conn.commit),
+            log=lambda msg: None,
+        )
+        model_class = _article_class()
+        db_model_create_table(ctx, model_class)
+        ctx.db.commit()
+
+        items = _items(number)
+        start = time.perf_counter()
+        if bulk:
+            db_model_bulk_create(ctx, model_class, items)
+        else:
+            for item in items:
+                db_model_create(ctx, model_class, model_class(id=None, **item))
+        elapsed = time.perf_counter() - start
+
+        conn.close()
+        return elapsed
+
+def perf_create_loop(repeat:int=3, number:int=2_000) -> list[float]:
+    return [_run(number, bulk=False) for _ in range(repeat)]
+
+def perf_bulk_create(repeat:int=3, number:int=2_000) -> list[float]:
+    return [_run(number, bulk=True) for _ in range(repeat)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 2_000
+    default_repeat = 3
+
+    parser = argparse.ArgumentParser(description='Run performance tests for model import.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of models to create per run. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+benchmark for the model read cache
+
+compares `number` reads by id of a few hot models with 2 list fields, without db.cache
+and with it, on a sqlite file
+"""
+import os
+import sqlite3
+import tempfile
+import timeit
+
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.module.model.db import db_model_create_table, db_model_bulk_create, db_model_read
+from mapp.types import new_model_class
+
+
+def _profile_class(cache:bool) -> type:
+    username = {'name': {'lower_case': 'username', 'snake_case': 'username'}, 'type': 'str'}
+    bio = {'name': {'lower_case': 'bio', 'snake_case': 'bio'}, 'type': 'str'}
+    tags = {'name': {'lower_case': 'tags', 'snake_case': 'tags'}, 'type': 'list', 'element_type': 'str'}
+    links = {'name': {'lower_case': 'links', 'snake_case': 'links'}, 'type': 'list', 'element_type': 'str'}
+    model_spec = {
+        'name': {'lower_case': 'profile', 'snake_case': 'profile', 'pascal_case': 'Profile', 'kebab_case': 'profile'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'db': {'cache': {'size': 1000, 'ttl': 0}} if cache else {},
+        'fields': {'username': username, 'bio': bio, 'tags': tags, 'links': links},
+        'non_list_fields': [bio, username],
+        'list_fields': [links, tags],
+        'unique_model_fields': [],
+    }
+    module_spec = {'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'}}
+    return new_model_class({}, model_spec, module_spec)
+
+def _run(repeat:int, number:int, cache:bool) -> list[float]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'perf.sqlite3'))
+        ctx = MappContext(
+            server_port=8000,
+            client=ClientContext(host='http://localhost:8000', headers={}),
+            db=DBContext(db_url='', connection=conn, cursor=conn.cursor(), commit=conn.commit),
+            log=lambda msg: None,
+        )
+        profile_class = _profile_class(cache)
+        db_model_create_table(ctx, profile_class)
+        db_model_bulk_create(ctx, profile_class, [
+            {'username': f'user {n}', 'bio': 'hello', 'tags': ['a', 'b'], 'links': ['https://example.com']} for n in range(20)
+        ])
+
+        def run():
+            for n in range(number):
+                db_model_read(ctx, profile_class, str(n % 20 + 1))
+
+        result = timeit.repeat(run, repeat=repeat, number=1)
+        conn.close()
+        return result
+
+def perf_read_uncached(repeat:int=5, number:int=10_000) -> list[float]:
+    return _run(repeat, number, cache=False)
+
+def perf_read_cached(repeat:int=5, number:int=10_000) -> list[float]:
+    return _run(repeat, number, cache=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 10_000
+    default_repeat = 5
+
+    parser = argparse.ArgumentParser(description='Run performance tests for the model read cache.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of reads per run. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+benchmark for field projection
+
+compares listing pages of `number` posts with every field (a 24KB rich text body and a tags list
+field) against listing only their titles with fields=['title'], both reading the rows
+and serializing the page to json
+"""
+import sqlite3
+import timeit
+
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.module.model.db import db_model_create_table, db_model_bulk_create, db_model_list
+from mapp.types import new_model_class, to_json
+
+
+def _field(name:str, field_type:str, **extra) -> dict:
+    return {'name': {'lower_case': name, 'snake_case': name}, 'type': field_type, **extra}
+
+def _setup(number:int) -> tuple[MappContext, type]:
+    conn = sqlite3.connect(':memory:')
+    ctx = MappContext(
+        server_port=8000,
+        client=ClientContext(host='http://localhost:8000', headers={}),
+        db=DBContext(db_url=':memory:', connection=conn, cursor=conn.cursor(), commit=conn.commit),
+        log=lambda msg: None,
+    )
+
+    title = _field('title', 'str')
+    body = _field('body', 'str', rich_text=True)
+    tags = _field('tags', 'list', element_type='str')
+    model_spec = {
+        'name': {'lower_case': 'post', 'snake_case': 'post', 'pascal_case': 'Post', 'kebab_case': 'post'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'fields': {'title': title, 'body': body, 'tags': tags},
+        'non_list_fields': [body, title],
+        'list_fields': [tags],
+        'unique_model_fields': [],
+    }
+    module_spec = {'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'}}
+    post_class = new_model_class({}, model_spec, module_spec)
+
+    db_model_create_table(ctx, post_class)
+    conn.executemany(
+        'INSERT INTO perf_post (body, title) VALUES (?, ?)',
+        [('x' * 24_000, f'post {n}') for n in range(number)]
+    )
+    conn.executemany(
+        'INSERT INTO perf_post_tags (value, position, perf_post_id) VALUES (?, ?, ?)',
+        [(f'tag {n}', n, post_id) for post_id in range(1, number + 1) for n in range(3)]
+    )
+    conn.commit()
+    return ctx, post_class
+
+def perf_list_all_fields(repeat:int=5, number:int=500) -> list[float]:
+    ctx, post_class = _setup(number)
+    return timeit.repeat(lambda: to_json(db_model_list(ctx, post_class, size=number, count='none')), repeat=repeat, number=1)
+
+def perf_list_title_field(repeat:int=5, number:int=500) -> list[float]:
+    ctx, post_class = _setup(number)
+    return timeit.repeat(lambda: to_json(db_model_list(ctx, post_class, size=number, count='none', fields=['title'])), repeat=repeat, number=1)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 500
+    default_repeat = 5
+
+    parser = argparse.ArgumentParser(description='Run performance tests for field projection.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of rows per page. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
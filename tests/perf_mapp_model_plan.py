@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+benchmark for main table row conversion
+
+compares the compiled ModelPlan.row_to_data against the previous conversion that
+matched on each field type (and parsed datetimes with strptime) for every column of
+every row, over 10k rows read from a model with one field of each converted type,
+with text and epoch db.datetime_storage
+"""
+import sqlite3
+import timeit
+
+from datetime import datetime
+
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.module.model.db import db_model_create_table, db_model_bulk_create, db_model_list, model_plan
+from mapp.types import DATETIME_FORMAT_STR, new_model_class
+
+
+def _field(name:str, field_type:str) -> dict:
+    return {'name': {'lower_case': name, 'snake_case': name}, 'type': field_type}
+
+def _event_class(datetime_storage:str='text') -> type:
+    fields = [_field('active', 'bool'), _field('happened_at', 'datetime'), _field('rank', 'int'), _field('title', 'str'), _field('venue_id', 'foreign_key')]
+    fields[-1]['references'] = {'module': 'perf', 'table': 'venue', 'field': 'id'}
+    model_spec = {
+        'name': {'lower_case': 'event', 'snake_case': 'event', 'pascal_case': 'Event', 'kebab_case': 'event'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'db': {'datetime_storage': datetime_storage},
+        'fields': {field['name']['snake_case']: field for field in fields},
+        'non_list_fields': fields,
+        'list_fields': [],
+        'unique_model_fields': [],
+    }
+    module_spec = {'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'}}
+    return new_model_class({}, model_spec, module_spec)
+
+def _ctx() -> MappContext:
+    conn = sqlite3.connect(':memory:')
+    return MappContext(
+        server_port=8000,
+        client=ClientContext(host='http://localhost:8000', headers={}),
+        db=DBContext(db_url=':memory:', connection=conn, cursor=conn.cursor(), commit=conn.commit),
+        log=lambda msg: None,
+    )
+
+def _setup(number:int, datetime_storage:str='text') -> tuple[MappContext, type, list[tuple]]:
+    ctx = _ctx()
+    model_class = _event_class(datetime_storage)
+    db_model_create_table(ctx, model_class)
+    db_model_bulk_create(ctx, model_class, [
+        {'active': n % 2 == 0, 'happened_at': datetime(2024, 1, 1, 12, 30), 'rank': n, 'title': f'event {n}', 'venue_id': str(n % 10)}
+        for n in range(number)
+    ])
+    rows = ctx.db.cursor.execute(f'SELECT * FROM {model_plan(model_class).table_name}').fetchall()
+    return ctx, model_class, rows
+
+def _match_row_to_data(model_spec:dict, row:tuple) -> dict:
+    """previous conversion, kept here as the baseline"""
+    data = {'id': str(row[0])}
+    data['date_created'] = datetime.fromisoformat(row[1])
+    data['date_modified'] = datetime.fromisoformat(row[2])
+
+    for index, field in enumerate(model_spec['non_list_fields'], start=3):
+        field_name = field['name']['snake_case']
+        match field['type']:
+            case 'bool':
+                value = bool(row[index])
+            case 'datetime' if row[index] is not None:
+                value = datetime.strptime(row[index], DATETIME_FORMAT_STR).replace(microsecond=0)
+            case 'foreign_key':
+                value = str(row[index])
+            case _:
+                value = row[index]
+
+        data[field_name] = value
+
+    return data
+
+def perf_match_convert_10k_rows(repeat:int=5, number:int=10_000) -> list[float]:
+    _, model_class, rows = _setup(number)
+    model_spec = model_class._model_spec
+    return timeit.repeat(lambda: [model_class(**_match_row_to_data(model_spec, row)) for row in rows], repeat=repeat, number=1)
+
+def perf_plan_convert_10k_rows(repeat:int=5, number:int=10_000) -> list[float]:
+    _, model_class, rows = _setup(number)
+    plan = model_plan(model_class)
+    return timeit.repeat(lambda: [model_class(**plan.row_to_data(row)) for row in rows], repeat=repeat, number=1)
+
+def perf_plan_convert_10k_epoch_rows(repeat:int=5, number:int=10_000) -> list[float]:
+    _, model_class, rows = _setup(number, 'epoch')
+    plan = model_plan(model_class)
+    return timeit.repeat(lambda: [model_class(**plan.row_to_data(row)) for row in rows], repeat=repeat, number=1)
+
+def perf_db_model_list_10k_rows(repeat:int=5, number:int=10_000) -> list[float]:
+    ctx, model_class, _ = _setup(number)
+    return timeit.repeat(lambda: db_model_list(ctx, model_class, size=number, count='none'), repeat=repeat, number=1)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 10_000
+    default_repeat = 5
+
+    parser = argparse.ArgumentParser(description='Run performance tests for model row conversion.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of rows per run. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
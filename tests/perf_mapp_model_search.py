@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+benchmark for full text search
+
+compares finding posts that contain a word with a LIKE '%word%' scan over the title
+and rich text body columns against db_model_search on the fts5 index of the same
+fields, over `number` posts
+"""
+import json
+import sqlite3
+import timeit
+
+from mapp.context import MappContext, ClientContext, DBContext
+from mapp.module.model.db import db_model_create_table, db_model_bulk_create, db_model_search
+from mapp.types import new_model_class
+
+
+_WORDS = ['solar', 'garden', 'bicycle', 'river', 'kitchen', 'violin', 'harbor', 'meadow', 'lantern', 'quartz']
+
+
+def _field(name:str, field_type:str, **extra) -> dict:
+    return {'name': {'lower_case': name, 'snake_case': name}, 'type': field_type, **extra}
+
+def _body(n:int) -> str:
+    text = ' '.join(_WORDS[(n * 7 + i) % len(_WORDS)] for i in range(200))
+    return json.dumps({'lingo': {'version': 'rich-text-beta-1'}, 'block': [{'text': text}, {'text': f'entry {n}'}]})
+
+def _setup(number:int) -> tuple[MappContext, type]:
+    conn = sqlite3.connect(':memory:')
+    ctx = MappContext(
+        server_port=8000,
+        client=ClientContext(host='http://localhost:8000', headers={}),
+        db=DBContext(db_url=':memory:', connection=conn, cursor=conn.cursor(), commit=conn.commit),
+        log=lambda msg: None,
+    )
+
+    title = _field('title', 'str', search=True)
+    body = _field('body', 'str', rich_text=True, search=True)
+    model_spec = {
+        'name': {'lower_case': 'post', 'snake_case': 'post', 'pascal_case': 'Post', 'kebab_case': 'post'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'fields': {'title': title, 'body': body},
+        'non_list_fields': [body, title],
+        'list_fields': [],
+        'unique_model_fields': [],
+    }
+    module_spec = {'name': {'lower_case': 'perf', 'snake_case': 'perf', 'pascal_case': 'Perf', 'kebab_case': 'perf'}}
+    post_class = new_model_class({}, model_spec, module_spec)
+
+    db_model_create_table(ctx, post_class)
+    db_model_bulk_create(ctx, post_class, [{'title': f'post {n}', 'body': _body(n)} for n in range(number)])
+    return ctx, post_class
+
+def perf_like_scan(repeat:int=5, number:int=10_000) -> list[float]:
+    ctx, _ = _setup(number)
+    sql = "SELECT * FROM perf_post WHERE title LIKE ? OR body LIKE ? ORDER BY id LIMIT 25"
+    return timeit.repeat(lambda: ctx.db.cursor.execute(sql, ('%entry 4242%', '%entry 4242%')).fetchall(), repeat=repeat, number=1)
+
+def perf_fts_search(repeat:int=5, number:int=10_000) -> list[float]:
+    ctx, post_class = _setup(number)
+    return timeit.repeat(lambda: db_model_search(ctx, post_class, 'entry 4242'), repeat=repeat, number=1)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 10_000
+    default_repeat = 5
+
+    parser = argparse.ArgumentParser(description='Run performance tests for full text search.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of posts. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
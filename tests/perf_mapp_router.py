@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+micro benchmark for api route dispatch
+
+compares the compiled mapp.router.Router against the previous linear scan of
+regex route resolvers, resolving the last registered model route in a spec
+with `total_modules` modules of 10 models each
+"""
+import re
+import timeit
+
+from mapp.router import Router
+
+
+def _route_paths(total_modules:int, models_per_module:int=10) -> list[str]:
+    return [
+        f'/api/module-{m}/model-{n}'
+        for m in range(total_modules)
+        for n in range(models_per_module)
+    ]
+
+def _handler(server, request, **params):
+    return params
+
+def _linear_resolver(paths:list[str]):
+    patterns = []
+    for path in paths:
+        patterns.append((re.compile(f'^{path}/(.+)$'), 'instance'))
+        patterns.append((re.compile(f'^{path}$'), 'model'))
+
+    def resolve(path:str):
+        for pattern, kind in patterns:
+            if pattern.match(path):
+                return kind
+        return None
+
+    return resolve
+
+def _router(paths:list[str]) -> Router:
+    router = Router()
+    for path in paths:
+        router.add('GET', path + '/{instance_id}', _handler)
+        router.add('GET', path, _handler)
+    return router
+
+def perf_router_resolve_10_modules(repeat:int=5, number:int=100_000) -> float:
+    paths = _route_paths(10)
+    router = _router(paths)
+    target = paths[-1] + '/123'
+    return timeit.repeat(lambda: router.resolve('GET', target), repeat=repeat, number=number)
+
+def perf_linear_resolve_10_modules(repeat:int=5, number:int=100_000) -> float:
+    paths = _route_paths(10)
+    resolve = _linear_resolver(paths)
+    target = paths[-1] + '/123'
+    return timeit.repeat(lambda: resolve(target), repeat=repeat, number=number)
+
+def perf_router_resolve_100_modules(repeat:int=5, number:int=100_000) -> float:
+    paths = _route_paths(100)
+    router = _router(paths)
+    target = paths[-1] + '/123'
+    return timeit.repeat(lambda: router.resolve('GET', target), repeat=repeat, number=number)
+
+def perf_linear_resolve_100_modules(repeat:int=5, number:int=100_000) -> float:
+    paths = _route_paths(100)
+    resolve = _linear_resolver(paths)
+    target = paths[-1] + '/123'
+    return timeit.repeat(lambda: resolve(target), repeat=repeat, number=number)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 100_000
+    default_repeat = 5
+
+    parser = argparse.ArgumentParser(description='Run performance tests for api route dispatch.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of lookups per run. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+micro benchmark for the server response protocol
+
+dispatches GET /api/<module>/<model>/<id> from model_routes the way
+mapp.server.application does, once with the resolver returning its response
+and once through a resolver that raises it (the compatibility path)
+"""
+import sqlite3
+import timeit
+
+from mapp.context import MappContext, ClientContext, DBContext, RequestContext
+from mapp.db import create_tables
+from mapp.module.model.db import db_model_create
+from mapp.module.model.server import create_model_routes
+from mapp.router import Router
+from mapp.types import MappResponse, new_model
+from mspec.core import load_generator_spec
+
+
+def _model_get_setup() -> tuple[MappContext, Router, str]:
+    spec = load_generator_spec('my-sample-store.yaml')
+    module = spec['modules']['store']
+    model = module['models']['products']
+
+    conn = sqlite3.connect(':memory:')
+    ctx = MappContext(
+        server_port=0,
+        client=ClientContext(host='http://localhost', headers={}),
+        db=DBContext(db_url=':memory:', connection=conn, cursor=conn.cursor(), commit=conn.commit),
+        log=lambda msg: msg
+    )
+    create_tables(ctx, spec)
+
+    route_defs, model_class = create_model_routes(spec, module, model)
+    router = Router()
+    for method, path, handler in route_defs:
+        router.add(method, path, handler)
+
+    data = {name: field['examples'][0] for name, field in model['fields'].items()}
+    item = db_model_create(ctx, model_class, new_model(model_class, data))
+
+    path = f'/api/{module["name"]["kebab_case"]}/{model["name"]["kebab_case"]}/{item.id}'
+    return ctx, router, path
+
+def _dispatch(route, ctx:MappContext, request:RequestContext):
+    try:
+        response = route(ctx, request)
+    except MappResponse as e:
+        response = e
+    return response.status, response.body()
+
+def _raise_style(route):
+    def raising_route(server, request):
+        raise route(server, request)
+    return raising_route
+
+def perf_model_get_return_response(repeat:int=5, number:int=10_000) -> float:
+    ctx, router, path = _model_get_setup()
+    request = RequestContext(env={'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': ''}, raw_req_body=b'', request_id='perf')
+    route = router.resolve('GET', path)
+    return timeit.repeat(lambda: _dispatch(route, ctx, request), repeat=repeat, number=number)
+
+def perf_model_get_raise_response(repeat:int=5, number:int=10_000) -> float:
+    ctx, router, path = _model_get_setup()
+    request = RequestContext(env={'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': ''}, raw_req_body=b'', request_id='perf')
+    route = _raise_style(router.resolve('GET', path))
+    return timeit.repeat(lambda: _dispatch(route, ctx, request), repeat=repeat, number=number)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    default_number = 10_000
+    default_repeat = 5
+
+    parser = argparse.ArgumentParser(description='Run performance tests for the server response protocol.')
+    parser.add_argument('--number', type=int, default=default_number, help=f'Number of requests per run. Default is {default_number}.')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help=f'Number of times to repeat the test. Default is {default_repeat}.')
+    args = parser.parse_args()
+
+    perf_tests = [name for name in globals() if name.startswith('perf_') and callable(globals()[name])]
+
+    for perf_test in perf_tests:
+        test_result = globals()[perf_test](args.repeat, args.number)
+
+        minimun = min(test_result)
+        print(f'{perf_test}:')
+        for result in test_result:
+            if result == minimun:
+                print(f'  {result} <- min')
+            else:
+                print(f'  {result}')
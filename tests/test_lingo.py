@@ -733,11 +733,12 @@ def _make_profile_spec():
             'username': {
                 'name': {'lower_case': 'username', 'snake_case': 'username'},
                 'type': 'str',
+                'unique': True,
             },
         },
         'non_list_fields': [
             {'name': {'lower_case': 'user id', 'snake_case': 'user_id'}, 'type': 'foreign_key', 'references': {'module': 'auth', 'table': 'user', 'field': 'id'}},
-            {'name': {'lower_case': 'username', 'snake_case': 'username'}, 'type': 'str'},
+            {'name': {'lower_case': 'username', 'snake_case': 'username'}, 'type': 'str', 'unique': True},
         ],
         'list_fields': [],
         'unique_model_fields': ['username'],
@@ -792,6 +793,10 @@ class TestLingoDbFunctions(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         post_spec = _make_post_spec()
+        post_spec['db'] = {'joins': {
+            'profile': {'model_type': 'test_app.profile', 'local_field': 'user_id', 'foreign_field': 'user_id', 'fields': ['username'], 'cardinality': 'one'},
+            'reactions': {'model_type': 'test_app.reaction', 'local_field': 'id', 'foreign_field': 'post_id', 'fields': ['id', 'reaction_type'], 'cardinality': 'many'},
+        }}
         profile_spec = _make_profile_spec()
         reaction_spec = _make_reaction_spec()
 
@@ -984,6 +989,37 @@ class TestLingoDbFunctions(unittest.TestCase):
         result = lingo_execute(app, expression, self.ctx)
         self.assertEqual(result['value']['profile']['username'], 'alice')
 
+    def test_db_read_include_join_alias(self):
+        expression = {
+            'call': 'db.read',
+            'args': {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'model_id': {'value': '1', 'type': 'str'},
+                'include': {'value': 'reactions', 'type': 'str'},
+            }
+        }
+        app = self._make_app()
+        result = lingo_execute(app, expression, self.ctx)
+        self.assertEqual(result['value']['reactions'], [
+            {'id': '1', 'reaction_type': 'like'},
+            {'id': '2', 'reaction_type': 'love'},
+            {'id': '3', 'reaction_type': 'like'},
+        ])
+
+    def test_db_read_include_unknown_join_raises(self):
+        expression = {
+            'call': 'db.read',
+            'args': {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'model_id': {'value': '1', 'type': 'str'},
+                'include': {'join': 'author'},
+            }
+        }
+        app = self._make_app()
+        with self.assertRaises(ValueError) as cm:
+            lingo_execute(app, expression, self.ctx)
+        self.assertIn('join not found in model db.joins: author', str(cm.exception))
+
     # db.patch tests #
 
     def test_db_patch(self):
@@ -1302,6 +1338,116 @@ class TestLingoDbFunctions(unittest.TestCase):
         counts = {row['group']: row['count'] for row in first['reaction_counts']}
         self.assertTrue('like' in counts or 'love' in counts)
 
+    def test_db_query_include_resolves_page_with_one_query(self):
+        statements = []
+        self.ctx.db.connection.set_trace_callback(statements.append)
+        expression = {
+            'call': 'db.query',
+            'args': {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'where': {'user_id': {'ne': '999'}},
+                'include': {'join': 'profile', 'alias': 'author'},
+            }
+        }
+        app = self._make_app()
+        result = lingo_execute(app, expression, self.ctx)
+        self.ctx.db.connection.set_trace_callback(None)
+
+        items = result['value']['items']
+        self.assertEqual([item['id'] for item in items], ['1', '2', '3', '4'])
+        self.assertEqual(
+            [item['author'] for item in items],
+            [{'username': 'alice'}, {'username': 'bob'}, None, {'username': 'alice'}],
+        )
+        profile_selects = [sql for sql in statements if 'FROM test_app_profile' in sql]
+        self.assertEqual(len(profile_selects), 1)
+        self.assertIn('IN (', profile_selects[0])
+
+    def test_db_query_unique_counts_resolves_page_with_one_query(self):
+        statements = []
+        self.ctx.db.connection.set_trace_callback(statements.append)
+        expression = {
+            'call': 'db.query',
+            'args': {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'where': {'user_id': {'ne': '999'}},
+                'unique_counts': [{
+                    'alias': 'reaction_counts',
+                    'model_type': 'test_app.reaction',
+                    'source_field': 'id',
+                    'foreign_field': 'post_id',
+                    'group_by': 'reaction_type',
+                }],
+            }
+        }
+        app = self._make_app()
+        result = lingo_execute(app, expression, self.ctx)
+        self.ctx.db.connection.set_trace_callback(None)
+
+        self.assertEqual([item['reaction_counts'] for item in result['value']['items']], [
+            [{'group': 'like', 'count': 2}, {'group': 'love', 'count': 1}],
+            [{'group': 'like', 'count': 1}],
+            [],
+            [],
+        ])
+        reaction_selects = [sql for sql in statements if 'FROM test_app_reaction' in sql]
+        self.assertEqual(len(reaction_selects), 1)
+
+    def test_db_query_after_cursor_pages(self):
+        def query_page(after):
+            args = {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'where': {'user_id': {'ne': '999'}},
+                'size': {'value': 3, 'type': 'int'},
+                'sort': {'type': 'list', 'value': [{'field': 'view_count', 'order': 'desc'}]},
+            }
+            if after is not None:
+                args['after'] = {'value': after, 'type': 'str'}
+            return lingo_execute(self._make_app(), {'call': 'db.query', 'args': args}, self.ctx)['value']
+
+        first_page = query_page(None)
+        self.assertEqual([item['view_count'] for item in first_page['items']], [40, 30, 20])
+        self.assertIsNotNone(first_page['next_cursor'])
+
+        second_page = query_page(first_page['next_cursor'])
+        self.assertEqual([item['view_count'] for item in second_page['items']], [10])
+        self.assertIsNone(second_page['next_cursor'])
+        self.assertEqual(second_page['total'], 4)
+
+    def test_db_query_select_reads_only_selected_fields(self):
+        statements = []
+        self.ctx.db.connection.set_trace_callback(statements.append)
+        expression = {
+            'call': 'db.query',
+            'args': {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'where': {'user_id': {'ne': '999'}},
+                'select': {'type': 'list', 'value': ['title']},
+                'include': {'join': 'profile', 'alias': 'author'},
+            }
+        }
+        result = lingo_execute(self._make_app(), expression, self.ctx)
+        self.ctx.db.connection.set_trace_callback(None)
+
+        # user_id is read for the include but not returned
+        first = result['value']['items'][0]
+        self.assertEqual(set(first), {'id', 'title', 'author'})
+        self.assertEqual(first['author'], {'username': 'alice'})
+        post_selects = [sql for sql in statements if 'FROM test_app_post ' in sql and 'COUNT(*)' not in sql]
+        self.assertTrue(post_selects[0].startswith('SELECT "id", "title", "user_id" FROM'), post_selects[0])
+
+    def test_db_read_select_reads_only_selected_fields(self):
+        expression = {
+            'call': 'db.read',
+            'args': {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'model_id': {'value': '2', 'type': 'str'},
+                'select': ['view_count'],
+            }
+        }
+        result = lingo_execute(self._make_app(), expression, self.ctx)
+        self.assertEqual(result['value'], {'id': '2', 'view_count': 20})
+
     def test_db_query_rejects_where_and_fields_together(self):
         expression = {
             'call': 'db.query',
@@ -1491,10 +1637,30 @@ class TestLingoDbFunctions(unittest.TestCase):
         with self.assertRaises(ValueError):
             lingo_execute(app, expression, self.ctx)
 
-    def test_db_query_raises_on_unsupported_field_type(self):
+    def test_db_query_raises_on_unsupported_operator_for_field_type(self):
+        with self.assertRaises(ValueError) as cm:
+            db_model_query(self.ctx, self.post_class, {'view_count': {'prefix': '1'}})
+        self.assertIn('unsupported operator: prefix for int field', str(cm.exception))
+
         with self.assertRaises(ValueError) as cm:
             db_model_query(self.ctx, self.post_class, {'view_count': 10})
-        self.assertIn('unsupported field type', str(cm.exception))
+        self.assertIn('must have a single operator', str(cm.exception))
+
+    def test_db_query_range_and_in_operators(self):
+        expression = {
+            'call': 'db.query',
+            'args': {
+                'model_type': {'value': 'test_app.post', 'type': 'str'},
+                'where': {
+                    'view_count': {'ge': {'type': 'int', 'value': 20}},
+                    'user_id': {'in': {'type': 'list', 'value': [{'type': 'str', 'value': '1'}, '3']}},
+                },
+                'sort': [{'field': 'view_count', 'order': 'asc'}]
+            }
+        }
+        app = self._make_app()
+        result = lingo_execute(app, expression, self.ctx)
+        self.assertEqual([item['title'] for item in result['value']['items']], ['foo', 'bar'])
 
 
 class TestValidateRichTextSpec(unittest.TestCase):
@@ -0,0 +1,243 @@
+import os
+import time
+import hashlib
+import unittest
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from unittest.mock import patch
+
+import jwt
+
+from mapp.auth import (
+    _acquire_hash_slot,
+    _check_user_credentials,
+    _get_password_hash,
+    _verify_password,
+    current_user,
+    login_user,
+    logout_user,
+    session_cache_stats,
+    sweep_sessions,
+)
+from mapp.errors import AuthenticationError, MappValidationError, ServiceUnavailableError
+from mapp.module.model.db import db_model_create_table
+from mapp.types import new_model_class
+from mspec.lingo import LingoApp, lingo_execute
+
+from .core import AUTH_SECRET_KEY, MappAuthTestCase, QueryCounter, make_module_spec, make_owned_spec
+
+
+# 'secret' in the <salt>$<hash> format with 100,000 iterations used before the work factor was configurable
+_LEGACY_HASH = (
+    '000102030405060708090a0b0c0d0e0f$'
+    + hashlib.pbkdf2_hmac('sha256', b'secret', bytes(range(16)), 100_000).hex()
+)
+
+
+class TestMappAuthCurrentUser(MappAuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.create_session()
+
+        post_spec = make_owned_spec()
+        post_spec['db'] = {'joins': {'author': {'model_type': 'test_app.owned', 'local_field': 'user_id', 'foreign_field': 'user_id', 'fields': ['label']}}}
+        self.module_spec = make_module_spec({'owned': post_spec})
+        self.post_class = new_model_class({}, post_spec, self.module_spec)
+        db_model_create_table(self.ctx, self.post_class)
+        self.ctx.db.cursor.executemany('INSERT INTO test_app_owned (color, label, user_id) VALUES (?, ?, ?)', [('red', f'post {n}', '1') for n in range(5)])
+        self.ctx.db.commit()
+
+    def test_current_user_single_query(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            user = current_user(self.request_ctx(self.token))
+        self.assertEqual(user, {'type': 'struct', 'value': {
+            'id': '1', 'name': 'alice', 'email': 'alice@example.com', 'email_verified': True, 'number_of_sessions': 1
+        }})
+        self.assertEqual(len(counter.statements), 1, counter.statements)
+
+    def test_feed_page_resolves_user_once_per_request(self):
+        app = LingoApp(spec={'params': {}, 'state': {}, 'modules': {'test_app': self.module_spec}}, params={}, state={}, buffer=[])
+        feed = {
+            'call': 'map',
+            'args': {
+                'function': {'call': 'db.read', 'args': {
+                    'model_type': 'test_app.owned',
+                    'model_id': {'call': 'key', 'args': {'object': {'self': 'item'}, 'key': 'id'}},
+                    'include': 'author',
+                }},
+                'iterable': {'call': 'key', 'args': {
+                    'object': {'call': 'db.query', 'args': {'model_type': 'test_app.owned', 'where': {'color': {'eq': 'red'}}, 'include': 'author'}},
+                    'key': 'items',
+                }},
+            }
+        }
+
+        # the second request is served by the session cache
+        for expected_auth_queries in (1, 0):
+            request_ctx = self.request_ctx(self.token)
+            with QueryCounter(self.ctx.db.connection) as counter:
+                result = lingo_execute(app, feed, request_ctx)
+            self.assertEqual(len(list(result['value'])), 5)
+            auth_queries = [sql for sql in counter.statements if 'auth_user' in sql]
+            self.assertEqual(len(auth_queries), expected_auth_queries, auth_queries)
+
+    def test_memo_is_keyed_by_token_and_dropped_on_logout(self):
+        request_ctx = self.request_ctx(self.token)
+        current_user(request_ctx)
+
+        request_ctx.current_access_token = lambda: 'not a token'
+        with self.assertRaises(AuthenticationError):
+            current_user(request_ctx)
+
+        request_ctx.current_access_token = lambda: self.token
+        logout_user(request_ctx, 'current')
+        with self.assertRaises(AuthenticationError):
+            current_user(request_ctx)
+
+    def test_expired_session_deleted_after_failed_request(self):
+        with patch('mapp.auth.time.time', return_value=time.time() + 60 * 60 * 24 * 8):
+            with self.assertRaises(AuthenticationError):
+                with self.ctx.db.unit_of_work():
+                    current_user(self.request_ctx(self.token))
+
+        self.assertEqual(self.ctx.db.after_unit, [])
+        other_worker = self.worker_ctx()
+        self.assertEqual(other_worker.db.cursor.execute('SELECT COUNT(*) FROM auth_user_session').fetchone()[0], 0)
+
+
+class TestMappAuthSessionCache(MappAuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.create_session()
+
+    def test_session_cache_skips_token_and_session_checks(self):
+        current_user(self.request_ctx(self.token))
+        with patch('mapp.auth.jwt.decode') as decode, QueryCounter(self.ctx.db.connection) as counter:
+            user = current_user(self.request_ctx(self.token))
+        self.assertEqual(user['value']['id'], '1')
+        decode.assert_not_called()
+        self.assertEqual([sql for sql in counter.statements if 'auth_user' in sql], [])
+        self.assertEqual(session_cache_stats(self.ctx), {'size': 10_000, 'entries': 1, 'hits': 1, 'misses': 1})
+
+        # expired tokens are rejected even when cached
+        with patch('mapp.auth.time.time', return_value=time.time() + 60 * 60 * 24 * 8):
+            with self.assertRaises(AuthenticationError):
+                current_user(self.request_ctx(self.token))
+
+    def test_revocation_reaches_other_workers(self):
+        other_worker = self.worker_ctx()
+        current_user(self.request_ctx(self.token))
+        current_user(self.request_ctx(self.token, other_worker))
+
+        logout_user(self.request_ctx(self.token), 'all')
+        for worker in (self.ctx, other_worker):
+            with self.assertRaises(AuthenticationError):
+                current_user(self.request_ctx(self.token, worker))
+
+    def test_session_cache_disabled(self):
+        with patch('mapp.auth.MAPP_AUTH_SESSION_CACHE_SECONDS', 0):
+            for _ in range(2):
+                with QueryCounter(self.ctx.db.connection) as counter:
+                    current_user(self.request_ctx(self.token))
+                self.assertEqual(len(counter.statements), 1, counter.statements)
+        self.assertIsNone(session_cache_stats(self.ctx))
+
+
+class TestMappAuthPasswordHash(MappAuthTestCase):
+
+    def test_hash_and_verify_in_pool(self):
+        hashed = _get_password_hash('secret')
+        self.assertTrue(hashed.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(_verify_password('secret', hashed))
+        self.assertFalse(_verify_password('wrong', hashed))
+        self.assertFalse(_verify_password('secret', 'not a hash'))
+
+        with patch('mapp.auth.MAPP_AUTH_HASH_WORKERS', 0):
+            self.assertTrue(_verify_password('secret', hashed))
+
+    def test_no_queue_limit_by_default(self):
+        self.assertIsNone(_acquire_hash_slot())
+
+    def test_queue_limit_fails_fast(self):
+        with patch('mapp.auth.MAPP_AUTH_HASH_QUEUE_LIMIT', 2):
+            slots = [_acquire_hash_slot(), _acquire_hash_slot()]
+            try:
+                with self.assertRaises(ServiceUnavailableError):
+                    _verify_password('secret', _LEGACY_HASH)
+            finally:
+                for fd in slots:
+                    os.close(fd)
+            self.assertTrue(_verify_password('secret', _LEGACY_HASH))
+
+    def test_login_rehashes_legacy_hash(self):
+        self.ctx.db.cursor.execute("INSERT INTO auth_password_hash (id, user_id, hash) VALUES ('1', 1, ?)", (_LEGACY_HASH,))
+
+        self.assertEqual(_check_user_credentials(self.ctx, 'alice@example.com', 'secret'), '1')
+        rehashed = self.ctx.db.cursor.execute('SELECT hash FROM auth_password_hash').fetchone()[0]
+        self.assertTrue(rehashed.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(_check_user_credentials(self.ctx, 'alice@example.com', 'secret'), '1')
+        with self.assertRaises(AuthenticationError):
+            _check_user_credentials(self.ctx, 'alice@example.com', 'wrong')
+
+
+class TestMappAuthSessionSweep(MappAuthTestCase):
+
+    def _insert_sessions(self, created_at:datetime, expires_at:Optional[datetime], number:int, start:int) -> None:
+        self.ctx.db.cursor.executemany(
+            'INSERT INTO auth_user_session (id, user_id, created_at, expires_at) VALUES (?, 1, ?, ?)',
+            [(n, created_at, None if expires_at is None else expires_at.isoformat()) for n in range(start, start + number)]
+        )
+        self.ctx.db.commit()
+
+    def _session_ids(self) -> list[int]:
+        return [row[0] for row in self.ctx.db.cursor.execute('SELECT id FROM auth_user_session ORDER BY id')]
+
+    def test_sweep_deletes_expired_sessions_in_batches(self):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        week = timedelta(days=7)
+        self._insert_sessions(now - week * 2, now - week, 7, start=1)     # expired
+        self._insert_sessions(now, now + week, 2, start=100)              # valid
+        self._insert_sessions(now - week * 2, None, 3, start=200)         # expired, stored before expires_at
+        self._insert_sessions(now, None, 1, start=300)                    # valid, stored before expires_at
+
+        # the cli runs the sweep inside a unit of work, each batch still commits #
+
+        commit_count = self.ctx.db.commit_count
+        with self.ctx.db.unit_of_work(), QueryCounter(self.ctx.db.connection) as counter:
+            result = sweep_sessions(self.ctx, batch_size=3)
+            self.assertEqual(self.ctx.db.commit_count - commit_count, 3 + 2)
+            self.assertFalse(self.ctx.db.connection.in_transaction)
+
+        self.assertEqual(result['value']['deleted'], 10)
+        self.assertEqual(self._session_ids(), [100, 101, 300])
+        deletes = [sql for sql in counter.statements if sql.startswith('DELETE')]
+        self.assertEqual(len(deletes), 3 + 2)
+
+        self.assertEqual(sweep_sessions(self.ctx)['value']['deleted'], 0)
+        with self.assertRaises(MappValidationError):
+            sweep_sessions(self.ctx, batch_size=0)
+
+    def test_sweep_uses_expires_at_index(self):
+        plan = self.ctx.db.cursor.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM auth_user_session WHERE expires_at < ? LIMIT ?', ('2024-01-01T00:00:00+00:00', 10)
+        ).fetchall()
+        self.assertIn('idx_auth_user_session_expires_at', ' '.join(row[-1] for row in plan))
+
+        plan = self.ctx.db.cursor.execute('EXPLAIN QUERY PLAN SELECT id FROM auth_user WHERE email = ?', ('alice@example.com',)).fetchall()
+        self.assertIn('idx_auth_user_email', ' '.join(row[-1] for row in plan))
+
+    def test_login_stores_token_expiry(self):
+        self.ctx.db.cursor.execute("INSERT INTO auth_password_hash (user_id, hash) VALUES (1, ?)", (_get_password_hash('secret'),))
+
+        token = login_user(self.request_ctx(), 'alice@example.com', 'secret')['value']['access_token']
+
+        payload = jwt.decode(token, AUTH_SECRET_KEY, algorithms=['HS256'])
+        expires_at = self.ctx.db.cursor.execute('SELECT expires_at FROM auth_user_session WHERE id = ?', (payload['jti'],)).fetchone()[0]
+        self.assertEqual(datetime.fromisoformat(expires_at), datetime.fromtimestamp(payload['exp'], timezone.utc))
+
+
+if __name__ == '__main__':
+    unittest.main()
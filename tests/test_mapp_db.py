@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from mapp.context import apply_db_profile
+from mapp.db import create_tables, explain_queries
+from mapp.errors import MappError
+
+from .core import in_mem_ctx, make_module_spec, make_score_spec
+
+
+class TestMappDbExplain(unittest.TestCase):
+
+    def _spec(self, indexes:list) -> dict:
+        score_spec = make_score_spec()
+        score_spec['db']['indexes'] = indexes
+        module_spec = make_module_spec({'score': score_spec})
+        module_spec['ops'] = {
+            'top_scores': {'func': {'call': 'db.query', 'args': {
+                'model_type': {'type': 'str', 'value': 'test_app.score'},
+                'where': {'type': 'struct', 'value': {'label': {'eq': {'params': {'label': {}}}}}},
+                'sort': {'type': 'list', 'value': [
+                    {'type': 'struct', 'value': {'field': 'rank', 'order': 'desc'}},
+                ]},
+            }}},
+        }
+        return {'modules': {'test_app': module_spec}}
+
+    def _op_entries(self, spec:dict) -> list[dict]:
+        ctx = in_mem_ctx()
+        self.addCleanup(ctx.db.connection.close)
+        create_tables(ctx, spec)
+        entries = explain_queries(ctx, spec)
+        return [entry for entry in entries if entry['source'].startswith('test_app.ops.top_scores')]
+
+    def test_flags_unindexed_query_and_suggests_index(self):
+        page_sql, count_sql = self._op_entries(self._spec([]))
+
+        self.assertEqual(page_sql['sql'], 'SELECT * FROM test_app_score WHERE label = ? ORDER BY rank DESC, id ASC LIMIT ? OFFSET ?')
+        self.assertEqual(page_sql['flags'], ['full_scan', 'temp_b_tree'])
+        self.assertEqual(page_sql['suggested_index'], {'name': 'idx_test_app_score_label_rank', 'fields': ['label', 'rank']})
+
+        self.assertEqual(count_sql['sql'], 'SELECT COUNT(*) FROM test_app_score WHERE label = ?')
+        self.assertEqual(count_sql['flags'], ['full_scan'])
+
+    def test_indexed_query_is_not_flagged(self):
+        spec = self._spec([{'name': 'idx_test_app_score_label_rank', 'fields': ['label', 'rank']}])
+        for entry in self._op_entries(spec):
+            self.assertEqual(entry['flags'], [], entry['plan'])
+            self.assertIsNone(entry['suggested_index'])
+
+
+class TestMappDbProfile(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.conn = sqlite3.connect(os.path.join(tmp_dir.name, 'profile.sqlite3'))
+        self.addCleanup(self.conn.close)
+
+    def test_performance_profile(self):
+        pragmas = apply_db_profile(self.conn, 'performance', timeout=5)
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 1)     # NORMAL
+        self.assertEqual(pragmas['temp_store'], 2)      # MEMORY
+        self.assertEqual(pragmas['cache_size'], -65536)
+        self.assertEqual(pragmas['busy_timeout'], 5000)
+
+    def test_pragma_overrides(self):
+        pragmas = apply_db_profile(self.conn, 'durable', {'cache_size': -2000, 'busy_timeout': 100})
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 2)     # FULL
+        self.assertEqual(pragmas['cache_size'], -2000)
+        self.assertEqual(pragmas['busy_timeout'], 100)
+
+    def test_default_profile_keeps_rollback_journal(self):
+        pragmas = apply_db_profile(self.conn)
+        self.assertEqual(pragmas['journal_mode'], 'delete')
+        self.assertEqual(pragmas['busy_timeout'], 20000)
+
+    def test_invalid_profile_and_pragma(self):
+        with self.assertRaises(MappError) as cm:
+            apply_db_profile(self.conn, 'fast')
+        self.assertEqual(cm.exception.code, 'INVALID_DB_PROFILE')
+
+        for pragmas in ({'page_size': 4096}, {'cache_size': '1; DROP TABLE x'}):
+            with self.assertRaises(MappError) as cm:
+                apply_db_profile(self.conn, 'default', pragmas)
+            self.assertEqual(cm.exception.code, 'INVALID_DB_PRAGMA')
+
+
+if __name__ == '__main__':
+    unittest.main()
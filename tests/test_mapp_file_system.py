@@ -0,0 +1,156 @@
+import io
+import os
+import hashlib
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from unittest.mock import patch
+
+from mapp.context import MappContext
+from mapp.errors import MappUserError, MappValidationError
+from mapp.file_system import _file_part_path, get_file_content, http_ingest_file, ingest_finish, ingest_part, ingest_start, list_files, list_parts
+
+from .core import MappAuthTestCase
+
+
+class TestMappFileSystemMultipartIngest(MappAuthTestCase):
+
+    modules = ('auth', 'file_system')
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('mapp.file_system.MAPP_FILE_SYSTEM_REPO', self.tmp_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.token = self.create_session()
+
+        self.content = os.urandom(2500)
+        self.chunks = [self.content[0:1000], self.content[1000:2000], self.content[2000:]]
+
+    def _request_ctx(self, file_input:Optional[bytes]=None, worker:Optional[MappContext]=None) -> MappContext:
+        return self.request_ctx(self.token, worker, file_input)
+
+    def _start(self) -> str:
+        return ingest_start(self._request_ctx(), 'data.bin', len(self.content), 3)['file_id']
+
+    def _upload(self, file_id:str, part_number:int, chunk:bytes, worker:Optional[MappContext]=None) -> dict:
+        return ingest_part(self._request_ctx(chunk, worker), file_id, part_number, hashlib.sha3_256(chunk).hexdigest())
+
+    def _file_content(self, file_id:str) -> bytes:
+        output = io.BytesIO()
+        ctx = self._request_ctx()
+        ctx.self['file_output'] = output
+        get_file_content(ctx, file_id)
+        return output.getvalue()
+
+    def test_parts_upload_in_parallel_and_finish_assembles_file(self):
+        file_id = self._start()
+
+        def upload(part_number:int) -> dict:
+            # each thread is a worker with its own connection
+            worker = self.worker_ctx(cleanup=False)
+            try:
+                return self._upload(file_id, part_number, self.chunks[part_number - 1], worker)
+            finally:
+                worker.db.connection.close()
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(upload, (3, 1, 2)))
+        self.assertTrue(all(result['acknowledged'] for result in results))
+
+        result = ingest_finish(self._request_ctx(), file_id)
+        self.assertTrue(result['acknowledged'], result)
+        self.assertIn('status: good', result['message'])
+        self.assertEqual(self._file_content(file_id), self.content)
+
+        file_record = list_files(self.ctx, file_id=file_id)['items'][0]
+        self.assertEqual(file_record['sha3_256'], hashlib.sha3_256(self.content).hexdigest())
+
+        with self.assertRaises(MappUserError) as error:
+            self._upload(file_id, 1, self.chunks[0])
+        self.assertEqual(error.exception.code, 'FILE_NOT_INGESTING')
+
+    def test_parts_are_checked_and_retried_by_part_number(self):
+        file_id = self._start()
+
+        with self.assertRaises(MappUserError) as error:
+            ingest_part(self._request_ctx(self.chunks[0]), file_id, 1, hashlib.sha3_256(b'other').hexdigest())
+        self.assertEqual(error.exception.code, 'FILE_PART_CHECKSUM_MISMATCH')
+        self.assertEqual(list_parts(self.ctx, file_id)['total'], 0)
+
+        with self.assertRaises(MappValidationError):
+            self._upload(file_id, 4, self.chunks[0])
+
+        # a retry with other content replaces the part, the same content is acknowledged #
+
+        self._upload(file_id, 1, b'x' * 1000)
+        self._upload(file_id, 1, self.chunks[0])
+        self._upload(file_id, 1, self.chunks[0])
+        parts = list_parts(self.ctx, file_id)
+        self.assertEqual(parts['total'], 1)
+        self.assertEqual(parts['items'][0]['sha3_256'], hashlib.sha3_256(self.chunks[0]).hexdigest())
+
+        # finishing with missing parts keeps the file ingesting so the upload can resume #
+
+        with self.assertRaises(MappUserError) as error:
+            ingest_finish(self._request_ctx(), file_id)
+        self.assertEqual(error.exception.code, 'FILE_PARTS_MISSING')
+        self.assertIn('2, 3', error.exception.error_message)
+
+        self._upload(file_id, 2, self.chunks[1])
+        self._upload(file_id, 3, self.chunks[2])
+        self.assertTrue(ingest_finish(self._request_ctx(), file_id)['acknowledged'])
+        self.assertEqual(self._file_content(file_id), self.content)
+
+    def test_finish_reports_replaced_part_as_missing(self):
+        file_id = self._start()
+        for part_number, chunk in enumerate(self.chunks, start=1):
+            self._upload(file_id, part_number, chunk)
+
+        # a concurrent retry of part 2 wrote its file but not its row #
+
+        with open(_file_part_path(file_id, 2), 'wb') as f:
+            f.write(b'y' * 1000)
+
+        with self.assertRaises(MappUserError) as error:
+            ingest_finish(self._request_ctx(), file_id)
+        self.assertEqual(error.exception.code, 'FILE_PARTS_MISSING')
+        self.assertIn('missing 1 of 3 parts: 2 ', error.exception.error_message)
+        self.assertEqual(list_files(self.ctx, file_id=file_id)['items'][0]['status'], 'ingesting')
+
+        with self.assertRaises(MappUserError) as error:
+            ingest_finish(self._request_ctx(), file_id)
+        self.assertIn('missing 1 of 3 parts: 2', error.exception.error_message)
+
+        self._upload(file_id, 2, self.chunks[1])
+        self.assertTrue(ingest_finish(self._request_ctx(), file_id)['acknowledged'])
+        self.assertEqual(self._file_content(file_id), self.content)
+
+    def test_http_ingest_file_splits_file_into_parts(self):
+        calls = []
+
+        def fake_http_run_op(ctx, params_class, output_class, params):
+            op_name = params_class._op_spec['name']['snake_case']
+            calls.append((op_name, params._asdict(), ctx.self.get('file_input')))
+            result = {'ingest_start': {'file_id': '7', 'message': 'started'}, 'ingest_finish': {'acknowledged': True, 'message': 'finished'}}
+            return output_class(result=result.get(op_name, {'acknowledged': True, 'message': 'uploaded'}))
+
+        ctx = self._request_ctx(self.content)
+        ctx.self['file_input_name'] = 'data.bin'
+        with patch('mapp.file_system.http_run_op', fake_http_run_op), patch('mapp.file_system.MAPP_FILE_PART_SIZE', 1000):
+            result = http_ingest_file(ctx, self.spec['modules']['file_system'], 'data.bin')
+
+        self.assertEqual(result, {'file_id': '7', 'message': 'finished'})
+        self.assertEqual(calls[0][0], 'ingest_start')
+        self.assertEqual(calls[0][1]['parts'], 3)
+        self.assertFalse(calls[0][1]['finish'])
+        self.assertIsNone(calls[0][2])
+        self.assertEqual(calls[-1][0], 'ingest_finish')
+
+        uploaded = sorted((params['part_number'], params['sha3_256'], chunk) for _, params, chunk in calls[1:-1])
+        self.assertEqual(uploaded, [(n + 1, hashlib.sha3_256(chunk).hexdigest(), chunk) for n, chunk in enumerate(self.chunks)])
+
+
+if __name__ == '__main__':
+    unittest.main()
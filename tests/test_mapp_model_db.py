@@ -0,0 +1,1312 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import unittest
+
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from mapp.context import MappContext, ClientContext, DBContext, RequestContext, ModelRouteContext
+from mapp.db import migrate_datetime_storage
+from mapp.errors import AuthenticationError, MappError, MappUserError, MappValidationError, NotFoundError, RequestError
+from mapp.module.model.db import (
+    db_model_create_table,
+    db_model_column_plan,
+    db_model_index_plan,
+    db_model_create,
+    db_model_read,
+    db_model_delete,
+    db_model_patch,
+    db_model_upsert,
+    db_model_delete_where,
+    db_model_bulk_create,
+    db_model_bulk_update,
+    db_model_bulk_delete,
+    db_model_cache_stats,
+    db_model_list,
+    db_model_query,
+    db_model_search,
+    db_model_unique_counts,
+    db_model_unique_counts_in,
+    db_model_migrate_datetime,
+)
+from mapp.module.model.server import model_list_route, model_patch_route, model_read_route
+from mapp.types import new_model_class
+
+from .core import QueryCounter, in_mem_ctx, make_module_spec, make_owned_spec, make_score_spec
+
+
+def _make_article_spec():
+    title = {'name': {'lower_case': 'title', 'snake_case': 'title'}, 'type': 'str'}
+    tags = {'name': {'lower_case': 'tags', 'snake_case': 'tags'}, 'type': 'list', 'element_type': 'str'}
+    scores = {'name': {'lower_case': 'scores', 'snake_case': 'scores'}, 'type': 'list', 'element_type': 'int'}
+    flags = {'name': {'lower_case': 'flags', 'snake_case': 'flags'}, 'type': 'list', 'element_type': 'bool'}
+    return {
+        'name': {'lower_case': 'article', 'snake_case': 'article', 'pascal_case': 'Article', 'kebab_case': 'article'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'fields': {'title': title, 'tags': tags, 'scores': scores, 'flags': flags},
+        'non_list_fields': [title],
+        'list_fields': [flags, scores, tags],
+        'unique_model_fields': [],
+    }
+
+
+class TestMappModelDbListFields(unittest.TestCase):
+
+    total_articles = 12
+
+    @classmethod
+    def setUpClass(cls):
+        article_spec = _make_article_spec()
+        module_spec = make_module_spec({'article': article_spec})
+        cls.article_class = new_model_class({}, article_spec, module_spec)
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        db_model_create_table(self.ctx, self.article_class)
+
+        self.articles = []
+        for n in range(self.total_articles):
+            article = self.article_class(
+                id=None,
+                title=f'article {n}',
+                tags=[f'tag-{n}-{i}' for i in range(n % 4)],
+                scores=list(range(n, n - (n % 3), -1)),
+                flags=[n % 2 == 0, True] if n % 5 else [],
+            )
+            self.articles.append(db_model_create(self.ctx, self.article_class, article))
+
+    def tearDown(self):
+        self.ctx.db.connection.close()
+
+    def test_list_queries_per_page(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_list(self.ctx, self.article_class, offset=0, size=10)
+
+        # 1 page query + 1 per list field + 1 total count
+        self.assertEqual(counter.count, 1 + 3 + 1, counter.statements)
+        self.assertEqual(result.items, self.articles[:10])
+        self.assertEqual(result.total, self.total_articles)
+
+    def test_query_queries_per_page(self):
+        where = {'title': {'ne': 'article 0'}}
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_query(self.ctx, self.article_class, where, offset=0, size=25)
+
+        # 1 page query + 1 total count + 1 per list field
+        self.assertEqual(counter.count, 1 + 1 + 3, counter.statements)
+        self.assertEqual(result['items'], self.articles[1:])
+        self.assertEqual(result['total'], self.total_articles - 1)
+
+    def test_read_queries(self):
+        article = self.articles[7]
+        with QueryCounter(self.ctx.db.connection) as counter:
+            item = db_model_read(self.ctx, self.article_class, article.id)
+
+        # 1 main row + 1 per list field
+        self.assertEqual(counter.count, 1 + 3, counter.statements)
+        self.assertEqual(item, article)
+
+    def test_list_field_order_and_types(self):
+        article = self.articles[3]
+        self.assertEqual(article.tags, ['tag-3-0', 'tag-3-1', 'tag-3-2'])
+        self.assertEqual(article.scores, [])
+        self.assertEqual(article.flags, [False, True])
+
+        article = self.articles[5]
+        self.assertEqual(article.scores, [5, 4])
+        self.assertEqual(article.flags, [])
+
+    def test_empty_page(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_list(self.ctx, self.article_class, offset=100, size=10)
+
+        # no list field queries for an empty page
+        self.assertEqual(counter.count, 2, counter.statements)
+        self.assertEqual(result.items, [])
+
+
+class TestMappModelDbCursorPagination(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        score_spec = make_score_spec()
+        module_spec = make_module_spec({'score': score_spec})
+        cls.score_class = new_model_class({}, score_spec, module_spec)
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        db_model_create_table(self.ctx, self.score_class)
+
+        # duplicate and null ranks to exercise tie breaking and NULL ordering
+        ranks = [3, None, 1, 3, 2, None, 1, 3, 2, 5, 4, 3, None, 0]
+        score_ids = []
+        for n, rank in enumerate(ranks):
+            label = 'even' if n % 2 == 0 else 'odd'
+            score = self.score_class(id=None, label=label, rank=0 if rank is None else rank)
+            score_ids.append(db_model_create(self.ctx, self.score_class, score).id)
+
+        # validation does not allow null ints, set them directly
+        null_ids = [score_id for score_id, rank in zip(score_ids, ranks) if rank is None]
+        self.ctx.db.cursor.execute(f'UPDATE test_app_score SET rank = NULL WHERE id IN ({", ".join("?" * len(null_ids))})', null_ids)
+        self.ctx.db.commit()
+
+        self.scores = [db_model_read(self.ctx, self.score_class, score_id) for score_id in score_ids]
+
+    def tearDown(self):
+        self.ctx.db.connection.close()
+
+    def _walk_list(self, size:int) -> list:
+        items = []
+        result = db_model_list(self.ctx, self.score_class, size=size)
+        items.extend(result.items)
+        while result.next_cursor is not None:
+            result = db_model_list(self.ctx, self.score_class, size=size, after=result.next_cursor)
+            items.extend(result.items)
+        return items
+
+    def _walk_query(self, where:dict, sort:list, size:int) -> list:
+        items = []
+        result = db_model_query(self.ctx, self.score_class, where, size=size, sort=sort)
+        items.extend(result['items'])
+        while result['next_cursor'] is not None:
+            result = db_model_query(self.ctx, self.score_class, where, size=size, sort=sort, after=result['next_cursor'])
+            items.extend(result['items'])
+        return items
+
+    def test_list_cursor_walk_matches_offset(self):
+        for size in (1, 4, 5, len(self.scores), 50):
+            self.assertEqual(self._walk_list(size), self.scores, f'size={size}')
+
+    def test_list_next_cursor_only_when_more_rows(self):
+        result = db_model_list(self.ctx, self.score_class, size=len(self.scores))
+        self.assertIsNone(result.next_cursor)
+
+        result = db_model_list(self.ctx, self.score_class, size=len(self.scores) - 1)
+        self.assertIsNotNone(result.next_cursor)
+
+    def test_query_cursor_walk_matches_offset_with_sort(self):
+        sorts = [
+            [{'field': 'rank', 'order': 'asc'}],
+            [{'field': 'rank', 'order': 'desc'}],
+            [{'field': 'label', 'order': 'asc'}, {'field': 'rank', 'order': 'desc'}],
+            [{'field': 'date_created', 'order': 'desc'}],
+            [{'field': 'id', 'order': 'desc'}],
+        ]
+        where = {'label': {'ne': 'none'}}
+        for sort in sorts:
+            expected = db_model_query(self.ctx, self.score_class, where, size=100, sort=sort)['items']
+            self.assertEqual(len(expected), len(self.scores))
+            for size in (1, 3, 7):
+                self.assertEqual(self._walk_query(where, sort, size), expected, f'sort={sort} size={size}')
+
+    def test_query_cursor_with_where(self):
+        where = {'label': {'eq': 'odd'}}
+        sort = [{'field': 'rank', 'order': 'asc'}]
+        expected = db_model_query(self.ctx, self.score_class, where, size=100, sort=sort)['items']
+        self.assertEqual(self._walk_query(where, sort, 2), expected)
+        self.assertTrue(all(item.label == 'odd' for item in expected))
+
+    def test_cursor_sort_mismatch_raises(self):
+        sort = [{'field': 'rank', 'order': 'asc'}]
+        result = db_model_query(self.ctx, self.score_class, {}, size=2, sort=sort)
+        with self.assertRaises(MappUserError):
+            db_model_query(self.ctx, self.score_class, {}, size=2, after=result['next_cursor'])
+
+    def test_invalid_cursor_raises(self):
+        with self.assertRaises(MappUserError):
+            db_model_list(self.ctx, self.score_class, size=2, after='not-a-cursor')
+
+
+class TestMappModelDbCountModes(unittest.TestCase):
+
+    total_scores = 9
+
+    @classmethod
+    def setUpClass(cls):
+        cls.exact_class = new_model_class({}, make_score_spec('exact'), make_module_spec({}))
+        cls.counter_class = new_model_class({}, make_score_spec('counter'), make_module_spec({}))
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        # both classes share a table, only the counter class creates the triggers
+        db_model_create_table(self.ctx, self.counter_class)
+
+        for n in range(self.total_scores):
+            score = self.counter_class(id=None, label='even' if n % 2 == 0 else 'odd', rank=n)
+            db_model_create(self.ctx, self.counter_class, score)
+
+    def tearDown(self):
+        self.ctx.db.connection.close()
+
+    def test_none_skips_count(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_list(self.ctx, self.exact_class, size=5, count='none')
+
+        self.assertEqual(counter.count, 1, counter.statements)
+        self.assertIsNone(result.total)
+        self.assertTrue(result.has_more)
+
+        result = db_model_list(self.ctx, self.exact_class, offset=5, size=5, count='none')
+        self.assertEqual(len(result.items), 4)
+        self.assertFalse(result.has_more)
+
+    def test_window_counts_in_page_query(self):
+        where = {'label': {'eq': 'even'}}
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_query(self.ctx, self.exact_class, where, size=2, count='window')
+
+        self.assertEqual(counter.count, 1, counter.statements)
+        self.assertEqual(result['total'], 5)
+        self.assertEqual([item.rank for item in result['items']], [0, 2])
+
+        # keyset page still reports the filtered total
+        result = db_model_query(self.ctx, self.exact_class, where, size=2, count='window', after=result['next_cursor'])
+        self.assertEqual(result['total'], 5)
+        self.assertEqual([item.rank for item in result['items']], [4, 6])
+
+        # page past the end falls back to a count
+        result = db_model_query(self.ctx, self.exact_class, where, offset=50, size=2, count='window')
+        self.assertEqual(result['items'], [])
+        self.assertEqual(result['total'], 5)
+
+    def test_counter_tracks_inserts_and_deletes(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_list(self.ctx, self.counter_class, size=3)
+
+        # page + counter row
+        self.assertEqual(counter.count, 2, counter.statements)
+        self.assertEqual(result.total, self.total_scores)
+
+        db_model_delete(self.ctx, self.counter_class, result.items[0].id)
+        db_model_create(self.ctx, self.counter_class, self.counter_class(id=None, label='new', rank=100))
+        db_model_create(self.ctx, self.counter_class, self.counter_class(id=None, label='new', rank=101))
+
+        result = db_model_list(self.ctx, self.counter_class, size=3)
+        self.assertEqual(result.total, self.total_scores + 1)
+
+    def test_counter_filtered_query_uses_window(self):
+        where = {'label': {'eq': 'odd'}}
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_query(self.ctx, self.counter_class, where, size=2)
+
+        self.assertEqual(counter.count, 1, counter.statements)
+        self.assertEqual(result['total'], 4)
+
+    def test_counter_seeded_for_existing_rows(self):
+        # creating the table again is a no-op for the existing counter row
+        db_model_create_table(self.ctx, self.counter_class)
+        result = db_model_list(self.ctx, self.counter_class, size=1)
+        self.assertEqual(result.total, self.total_scores)
+
+    def test_count_mode_override_and_errors(self):
+        result = db_model_list(self.ctx, self.counter_class, size=1, count='exact')
+        self.assertEqual(result.total, self.total_scores)
+
+        with self.assertRaises(MappUserError):
+            db_model_list(self.ctx, self.exact_class, size=1, count='counter')
+
+        with self.assertRaises(MappUserError):
+            db_model_list(self.ctx, self.exact_class, size=1, count='bogus')
+
+
+class TestMappModelDbIndexes(unittest.TestCase):
+
+    def _score_class(self, indexes:list):
+        score_spec = make_score_spec()
+        score_spec['db']['indexes'] = indexes
+        return new_model_class({}, score_spec, make_module_spec({}))
+
+    def _indexes(self) -> dict:
+        return dict(self.ctx.db.cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'test_app_score' AND sql IS NOT NULL"
+        ).fetchall())
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.indexes = [
+            {'name': 'idx_test_app_score_label_rank', 'fields': ['label', 'rank'], 'unique': True},
+            {'name': 'idx_test_app_score_ranked', 'fields': ['rank'], 'where': 'rank IS NOT NULL'},
+        ]
+        self.score_class = self._score_class(self.indexes)
+
+    def tearDown(self):
+        self.ctx.db.connection.close()
+
+    def test_create_table_creates_spec_indexes(self):
+        self.assertEqual(db_model_index_plan(self.ctx, self.score_class), [
+            'CREATE UNIQUE INDEX idx_test_app_score_label_rank ON test_app_score(label, rank)',
+            'CREATE INDEX idx_test_app_score_ranked ON test_app_score(rank) WHERE rank IS NOT NULL',
+        ])
+
+        db_model_create_table(self.ctx, self.score_class)
+
+        indexes = self._indexes()
+        self.assertIn('idx_test_app_score_label_rank', indexes)
+        self.assertIn('idx_test_app_score_ranked', indexes)
+        self.assertEqual(db_model_index_plan(self.ctx, self.score_class), [])
+
+        plan = self.ctx.db.cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM test_app_score WHERE label = ? AND rank = ?', ('a', 1)).fetchall()
+        self.assertIn('idx_test_app_score_label_rank', ' '.join(row[-1] for row in plan))
+
+    def test_unique_index_is_enforced(self):
+        db_model_create_table(self.ctx, self.score_class)
+        db_model_create(self.ctx, self.score_class, self.score_class(id=None, label='a', rank=1))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.ctx.db.cursor.execute("INSERT INTO test_app_score (label, rank) VALUES ('a', 1)")
+
+    def test_reconcile_changed_and_removed_indexes(self):
+        db_model_create_table(self.ctx, self.score_class)
+        self.ctx.db.cursor.execute('CREATE INDEX manual_score_label ON test_app_score(label)')
+
+        changed_class = self._score_class([
+            {'name': 'idx_test_app_score_label_rank', 'fields': ['label', 'rank'], 'unique': False},
+        ])
+
+        self.assertEqual(db_model_index_plan(self.ctx, changed_class), [
+            'DROP INDEX idx_test_app_score_label_rank',
+            'CREATE INDEX idx_test_app_score_label_rank ON test_app_score(label, rank)',
+            'DROP INDEX idx_test_app_score_ranked',
+        ])
+
+        db_model_create_table(self.ctx, changed_class)
+
+        indexes = self._indexes()
+        self.assertEqual(indexes['idx_test_app_score_label_rank'], 'CREATE INDEX idx_test_app_score_label_rank ON test_app_score(label, rank)')
+        self.assertNotIn('idx_test_app_score_ranked', indexes)
+        # indexes outside the idx_<table>_ prefix are not managed by the spec
+        self.assertIn('manual_score_label', indexes)
+
+    def test_create_table_adds_new_columns(self):
+        db_model_create_table(self.ctx, self.score_class)
+        db_model_create(self.ctx, self.score_class, self.score_class(id=None, label='a', rank=1))
+
+        score_spec = make_score_spec()
+        note = {'name': {'lower_case': 'note', 'snake_case': 'note'}, 'type': 'str'}
+        score_spec['fields']['note'] = note
+        score_spec['non_list_fields'].append(note)
+        score_spec['db']['indexes'] = [{'name': 'idx_test_app_score_note', 'fields': ['note']}]
+        noted_class = new_model_class({}, score_spec, make_module_spec({}))
+
+        self.assertEqual(db_model_column_plan(self.ctx, noted_class), [
+            'ALTER TABLE test_app_score ADD COLUMN note TEXT CHECK (LENGTH("note") <= 1000)',
+        ])
+
+        db_model_create_table(self.ctx, noted_class)
+
+        self.assertEqual(db_model_column_plan(self.ctx, noted_class), [])
+        self.assertIn('idx_test_app_score_note', self._indexes())
+        self.assertIsNone(db_model_read(self.ctx, noted_class, '1').note)
+
+
+class TestMappDbUnitOfWork(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.score_class = new_model_class({}, make_score_spec(), make_module_spec({}))
+        db_model_create_table(self.ctx, self.score_class)
+        self.ctx.db.commit()
+
+    def tearDown(self):
+        self.ctx.db.connection.close()
+
+    def _create(self, label:str):
+        return db_model_create(self.ctx, self.score_class, self.score_class(id=None, label=label, rank=1))
+
+    def _labels(self) -> list[str]:
+        return [row[0] for row in self.ctx.db.cursor.execute('SELECT label FROM test_app_score ORDER BY id')]
+
+    def test_commits_outside_unit_of_work(self):
+        commit_count = self.ctx.db.commit_count
+        self._create('a')
+        self._create('b')
+        self.assertEqual(self.ctx.db.commit_count - commit_count, 2)
+
+    def test_unit_of_work_commits_once(self):
+        commit_count = self.ctx.db.commit_count
+        with self.ctx.db.unit_of_work():
+            for label in ('a', 'b', 'c'):
+                self._create(label)
+            self.assertTrue(self.ctx.db.connection.in_transaction)
+            self.assertEqual(self.ctx.db.commit_count, commit_count)
+
+        self.assertEqual(self.ctx.db.commit_count - commit_count, 1)
+        self.assertEqual(self.ctx.db.deferred_commit_count, 3)
+        self.assertFalse(self.ctx.db.connection.in_transaction)
+        self.assertEqual(self._labels(), ['a', 'b', 'c'])
+
+    def test_unit_of_work_rolls_back_on_error(self):
+        self._create('kept')
+        with self.assertRaises(RuntimeError):
+            with self.ctx.db.unit_of_work():
+                self._create('a')
+                # outside of a savepoint a rollback is left to the unit
+                self.ctx.db.rollback()
+                self._create('b')
+                raise RuntimeError('op failed')
+
+        self.assertEqual(self._labels(), ['kept'])
+
+    def test_nested_unit_of_work(self):
+        commit_count = self.ctx.db.commit_count
+        with self.ctx.db.unit_of_work():
+            self._create('a')
+            with self.ctx.db.unit_of_work():
+                self._create('b')
+            self.assertEqual(self.ctx.db.commit_count, commit_count)
+        self.assertEqual(self.ctx.db.commit_count - commit_count, 1)
+        self.assertEqual(self.ctx.db.unit_of_work_depth, 0)
+
+    def test_failed_op_rolls_back_to_savepoint(self):
+        tags = {'name': {'lower_case': 'tags', 'snake_case': 'tags'}, 'type': 'list', 'element_type': 'str'}
+        tagged_spec = make_score_spec()
+        tagged_spec['fields']['tags'] = tags
+        tagged_spec['list_fields'] = [tags]
+        tagged_class = new_model_class({}, tagged_spec, make_module_spec({}))
+        self.ctx.db.cursor.execute('DROP TABLE test_app_score')
+        db_model_create_table(self.ctx, tagged_class)
+
+        # the parent row is written before the list insert fails
+        self.ctx.db.cursor.execute('ALTER TABLE test_app_score_tags RENAME TO test_app_score_tags_moved')
+
+        with self.ctx.db.unit_of_work():
+            with self.assertRaises(MappError):
+                db_model_create(self.ctx, tagged_class, tagged_class(id=None, label='partial', rank=1, tags=['a']))
+            self.assertEqual(self.ctx.db.savepoints, [])
+            self.ctx.db.cursor.execute('ALTER TABLE test_app_score_tags_moved RENAME TO test_app_score_tags')
+            db_model_create(self.ctx, tagged_class, tagged_class(id=None, label='kept', rank=1, tags=[]))
+
+        self.assertEqual(self._labels(), ['kept'])
+
+
+
+def _user(user_id:str) -> dict:
+    return {'type': 'struct', 'value': {'id': user_id}}
+
+
+class TestMappModelDbBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        module_spec = make_module_spec({})
+        self.article_class = new_model_class({}, _make_article_spec(), module_spec)
+        self.owned_class = new_model_class({}, make_owned_spec(), module_spec)
+        db_model_create_table(self.ctx, self.article_class)
+        db_model_create_table(self.ctx, self.owned_class)
+        self.ctx.db.commit()
+
+    def tearDown(self):
+        self.ctx.db.connection.close()
+
+    def _errors(self, result) -> dict[int, str]:
+        return {item['index']: item['error']['code'] for item in result.items if item['error'] is not None}
+
+    def test_bulk_create_with_list_fields(self):
+        items = [
+            {'title': f'article {n}', 'tags': [f't{n}', 'x'], 'scores': [n], 'flags': [True, False]}
+            for n in range(30)
+        ]
+        items.insert(5, {'title': 123, 'tags': 'not a list', 'scores': [], 'flags': []})
+
+        commit_count = self.ctx.db.commit_count
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_bulk_create(self.ctx, self.article_class, items)
+
+        self.assertEqual(self.ctx.db.commit_count - commit_count, 1)
+        # created models are not read back
+        self.assertFalse([sql for sql in counter.statements if sql.startswith('SELECT *')])
+
+        self.assertEqual((result.succeeded, result.failed), (30, 1))
+        self.assertEqual(self._errors(result), {5: 'VALIDATION_ERROR'})
+
+        created = [item for item in result.items if item['error'] is None]
+        for item in created:
+            article = db_model_read(self.ctx, self.article_class, item['id'])
+            n = int(article.title.split()[1])
+            self.assertEqual(article.tags, [f't{n}', 'x'])
+            self.assertEqual(article.scores, [n])
+            self.assertEqual(article.flags, [True, False])
+
+    # user_id is overridden server side, items carry a placeholder like single creates
+
+    def test_bulk_create_unique_violation_skips_only_duplicates(self):
+        with patch('mapp.module.model.db.current_user', return_value=_user('1')):
+            db_model_bulk_create(self.ctx, self.owned_class, [{'label': 'a', 'color': 'red', 'user_id': '0'}])
+            result = db_model_bulk_create(self.ctx, self.owned_class, [
+                {'label': 'b', 'color': 'red', 'user_id': '0'},
+                {'label': 'a', 'color': 'blue', 'user_id': '0'},
+                {'label': 'c', 'color': 'blue', 'user_id': '0'},
+            ])
+
+        self.assertEqual(self._errors(result), {1: 'UNIQUE_CONSTRAINT_VIOLATED'})
+        labels = [row[0] for row in self.ctx.db.cursor.execute('SELECT label FROM test_app_owned ORDER BY id')]
+        self.assertEqual(labels, ['a', 'b', 'c'])
+
+    def test_bulk_create_enforces_auth_limits(self):
+        with patch('mapp.module.model.db.current_user', return_value=_user('1')):
+            db_model_bulk_create(self.ctx, self.owned_class, [{'label': 'a', 'color': 'red', 'user_id': '0'}])
+            result = db_model_bulk_create(self.ctx, self.owned_class, [
+                {'label': 'b', 'color': 'red', 'user_id': '0'},
+                {'label': 'c', 'color': 'red', 'user_id': '0'},     # 3rd red for this user
+                {'label': 'd', 'color': 'blue', 'user_id': '0'},
+                {'label': 'e', 'color': 'green', 'user_id': '0'},
+                {'label': 'f', 'color': 'green', 'user_id': '0'},  # 5th model for this user
+            ])
+
+        self.assertEqual(self._errors(result), {
+            1: 'MAX_MODELS_BY_FIELD_EXCEEDED',
+            4: 'MAX_MODELS_EXCEEDED',
+        })
+
+        # limits are per user
+        with patch('mapp.module.model.db.current_user', return_value=_user('2')):
+            result = db_model_bulk_create(self.ctx, self.owned_class, [{'label': 'g', 'color': 'red', 'user_id': '0'}])
+        self.assertEqual(result.failed, 0)
+
+        owners = self.ctx.db.cursor.execute('SELECT user_id, COUNT(*) FROM test_app_owned GROUP BY user_id').fetchall()
+        self.assertEqual(owners, [('1', 4), ('2', 1)])
+
+    def test_bulk_update_and_delete(self):
+        with patch('mapp.module.model.db.current_user', return_value=_user('1')):
+            created = db_model_bulk_create(self.ctx, self.owned_class, [{'label': 'a', 'color': 'red', 'user_id': '0'}, {'label': 'b', 'color': 'red', 'user_id': '0'}])
+        with patch('mapp.module.model.db.current_user', return_value=_user('2')):
+            other = db_model_bulk_create(self.ctx, self.owned_class, [{'label': 'c', 'color': 'red', 'user_id': '0'}])
+
+        a_id, b_id = [item['id'] for item in created.items]
+        c_id = other.items[0]['id']
+
+        with patch('mapp.module.model.db.current_user', return_value=_user('1')):
+            result = db_model_bulk_update(self.ctx, self.owned_class, [
+                {'id': a_id, 'label': 'a2', 'color': 'blue', 'user_id': '1'},
+                {'id': c_id, 'label': 'c2', 'color': 'blue', 'user_id': '1'},
+                {'id': '999', 'label': 'z', 'color': 'blue', 'user_id': '1'},
+                {'label': 'no id', 'color': 'blue', 'user_id': '1'},
+            ])
+            self.assertEqual(self._errors(result), {1: 'AUTHENTICATION_ERROR', 2: 'NOT_FOUND', 3: 'MODEL_ID_NOT_PROVIDED'})
+
+            result = db_model_bulk_delete(self.ctx, self.owned_class, [b_id, c_id, '999'])
+            self.assertEqual(self._errors(result), {1: 'AUTHENTICATION_ERROR'})
+
+        rows = self.ctx.db.cursor.execute('SELECT label, color FROM test_app_owned ORDER BY id').fetchall()
+        self.assertEqual(rows, [('a2', 'blue'), ('c', 'red')])
+
+
+class TestMappModelDbUpsertDeleteWhere(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.addCleanup(self.ctx.db.connection.close)
+        unlimited_spec = make_owned_spec()
+        unlimited_spec['name'] = {'lower_case': 'unlimited', 'snake_case': 'unlimited', 'pascal_case': 'Unlimited', 'kebab_case': 'unlimited'}
+        unlimited_spec['auth'] = {'require_login': True, 'max_models_per_user': -1, 'max_models_by_field': {}}
+        module_spec = make_module_spec({})
+        self.article_class = new_model_class({}, _make_article_spec(), module_spec)
+        self.owned_class = new_model_class({}, make_owned_spec(), module_spec)
+        self.unlimited_class = new_model_class({}, unlimited_spec, module_spec)
+        for model_class in (self.article_class, self.owned_class, self.unlimited_class):
+            db_model_create_table(self.ctx, model_class)
+
+    def _statements(self, counter:QueryCounter) -> list[str]:
+        return [sql for sql in counter.statements if sql.split()[0] not in ('BEGIN', 'COMMIT')]
+
+    def _upsert(self, user_id:str, model_class:type, data:dict):
+        with patch('mapp.module.model.db.current_user', return_value=_user(user_id)):
+            return db_model_upsert(self.ctx, model_class, data, ['label'])
+
+    def test_upsert_creates_then_updates_with_one_statement(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            created = self._upsert('1', self.unlimited_class, {'label': 'a', 'color': 'red'})
+        statements = self._statements(counter)
+        self.assertEqual(len(statements), 1, statements)
+        self.assertIn('ON CONFLICT("label") DO UPDATE', statements[0])
+        self.assertEqual((created.label, created.color, created.user_id), ('a', 'red', '1'))
+
+        with QueryCounter(self.ctx.db.connection) as counter:
+            updated = self._upsert('1', self.unlimited_class, {'label': 'a', 'color': 'blue', 'user_id': '9'})
+        self.assertEqual(len(self._statements(counter)), 1)
+        self.assertEqual((updated.id, updated.color, updated.user_id), (created.id, 'blue', '1'))
+        self.assertEqual(updated.date_created, created.date_created)
+
+    def test_upsert_only_updates_rows_of_current_user(self):
+        self._upsert('1', self.owned_class, {'label': 'a', 'color': 'red'})
+        with self.assertRaises(AuthenticationError):
+            self._upsert('2', self.owned_class, {'label': 'a', 'color': 'blue'})
+
+        rows = self.ctx.db.cursor.execute('SELECT label, color, user_id FROM test_app_owned').fetchall()
+        self.assertEqual(rows, [('a', 'red', '1')])
+
+    def test_upsert_partial_data_only_updates_rows_of_current_user(self):
+        self._upsert('1', self.owned_class, {'label': 'a', 'color': 'red'})
+        with self.assertRaises(AuthenticationError):
+            self._upsert('2', self.owned_class, {'label': 'a'})
+        with self.assertRaises(MappValidationError):
+            self._upsert('2', self.owned_class, {'label': 'b'})
+
+        rows = self.ctx.db.cursor.execute('SELECT label, color, user_id FROM test_app_owned').fetchall()
+        self.assertEqual(rows, [('a', 'red', '1')])
+
+    def test_upsert_checks_create_limits_only_for_new_rows(self):
+        self._upsert('1', self.owned_class, {'label': 'a', 'color': 'red'})
+        self._upsert('1', self.owned_class, {'label': 'b', 'color': 'red'})
+        # updating an existing row is not a 3rd red model
+        self._upsert('1', self.owned_class, {'label': 'b', 'color': 'red'})
+        with self.assertRaises(MappUserError) as cm:
+            self._upsert('1', self.owned_class, {'label': 'c', 'color': 'red'})
+        self.assertEqual(cm.exception.code, 'MAX_MODELS_BY_FIELD_EXCEEDED')
+
+    def test_upsert_partial_data_updates_existing_row_only(self):
+        created = self._upsert('1', self.unlimited_class, {'label': 'a', 'color': 'red'})
+        updated = self._upsert('1', self.unlimited_class, {'label': 'a'})
+        self.assertEqual((updated.id, updated.color), (created.id, 'red'))
+
+        with self.assertRaises(MappValidationError):
+            self._upsert('1', self.unlimited_class, {'label': 'b'})
+
+    def test_delete_where_deletes_list_values_in_one_commit(self):
+        db_model_bulk_create(self.ctx, self.article_class, [
+            {'title': f'article {n}', 'tags': ['x', 'y'], 'scores': [n], 'flags': [True]} for n in range(6)
+        ])
+
+        commit_count = self.ctx.db.commit_count
+        with QueryCounter(self.ctx.db.connection) as counter:
+            deleted = db_model_delete_where(self.ctx, self.article_class, {'title': {'in': ['article 1', 'article 4', 'missing']}})
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(len(self._statements(counter)), 4)
+        self.assertEqual(self.ctx.db.commit_count - commit_count, 1)
+        remaining = [article.title for article in db_model_list(self.ctx, self.article_class).items]
+        self.assertEqual(remaining, ['article 0', 'article 2', 'article 3', 'article 5'])
+        tag_owners = {row[0] for row in self.ctx.db.cursor.execute('SELECT test_app_article_id FROM test_app_article_tags')}
+        self.assertEqual(tag_owners, {1, 3, 4, 6})
+
+    def test_delete_where_only_deletes_rows_of_current_user(self):
+        self._upsert('1', self.owned_class, {'label': 'a', 'color': 'red'})
+        self._upsert('2', self.owned_class, {'label': 'b', 'color': 'red'})
+
+        with patch('mapp.module.model.db.current_user', return_value=_user('1')):
+            deleted = db_model_delete_where(self.ctx, self.owned_class, {'color': {'eq': 'red'}})
+
+        self.assertEqual(deleted, 1)
+        rows = self.ctx.db.cursor.execute('SELECT label, user_id FROM test_app_owned').fetchall()
+        self.assertEqual(rows, [('b', '2')])
+
+
+class TestMappModelDbPatch(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.addCleanup(self.ctx.db.connection.close)
+        module_spec = make_module_spec({})
+        self.article_class = new_model_class({}, _make_article_spec(), module_spec)
+        self.owned_class = new_model_class({}, make_owned_spec(), module_spec)
+        db_model_create_table(self.ctx, self.article_class)
+        db_model_create_table(self.ctx, self.owned_class)
+        self.article = db_model_create(self.ctx, self.article_class, self.article_class(
+            id=None, title='first', tags=['a', 'b', 'c'], scores=[1, 2], flags=[True],
+        ))
+
+    def _statements(self, counter:QueryCounter) -> list[str]:
+        return [sql for sql in counter.statements if sql.split()[0] not in ('BEGIN', 'COMMIT')]
+
+    def test_patch_non_list_field_writes_one_update(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            patched = db_model_patch(self.ctx, self.article_class, self.article.id, {'title': 'second'})
+
+        # 1 update of the main row + 1 read per list field, no list writes
+        statements = self._statements(counter)
+        writes = [sql for sql in statements if not sql.startswith('SELECT')]
+        self.assertEqual(len(writes), 1, statements)
+        self.assertIn('SET "title" = \'second\', date_modified', writes[0])
+        self.assertEqual(patched, self.article._replace(title='second', date_modified=patched.date_modified))
+        self.assertEqual(db_model_read(self.ctx, self.article_class, self.article.id), patched)
+
+    def test_patch_list_field_diffs_by_position(self):
+        def tag_rows() -> list[tuple]:
+            return self.ctx.db.cursor.execute('SELECT id, value, position FROM test_app_article_tags ORDER BY position').fetchall()
+
+        before = tag_rows()
+        with QueryCounter(self.ctx.db.connection) as counter:
+            patched = db_model_patch(self.ctx, self.article_class, self.article.id, {'tags': ['a', 'x', 'c', 'd']})
+
+        # 1 update of the main row + 1 changed value + 1 appended value
+        writes = [sql for sql in self._statements(counter) if not sql.startswith('SELECT')]
+        self.assertEqual(len(writes), 3, writes)
+        self.assertEqual(patched.tags, ['a', 'x', 'c', 'd'])
+        self.assertEqual((patched.scores, patched.flags), (self.article.scores, self.article.flags))
+        after = tag_rows()
+        self.assertEqual([row[0] for row in after[:3]], [row[0] for row in before])
+
+        patched = db_model_patch(self.ctx, self.article_class, self.article.id, {'tags': ['a'], 'scores': [], 'flags': [False]})
+        self.assertEqual((patched.tags, patched.scores, patched.flags), (['a'], [], [False]))
+        self.assertEqual(db_model_read(self.ctx, self.article_class, self.article.id), patched)
+
+    def test_patch_validates_only_given_fields(self):
+        with self.assertRaises(MappValidationError) as cm:
+            db_model_patch(self.ctx, self.article_class, self.article.id, {'title': 5})
+        self.assertEqual(list(cm.exception.field_errors), ['title'])
+
+        with self.assertRaises(MappValidationError) as cm:
+            db_model_patch(self.ctx, self.article_class, self.article.id, {'missing': 'x'})
+        self.assertEqual(list(cm.exception.field_errors), ['missing'])
+
+        with self.assertRaises(MappValidationError):
+            db_model_patch(self.ctx, self.article_class, self.article.id, {'date_created': '2024-01-01T00:00:00'})
+
+        with self.assertRaises(NotFoundError):
+            db_model_patch(self.ctx, self.article_class, '999', {'title': 'second'})
+
+        self.assertEqual(db_model_read(self.ctx, self.article_class, self.article.id), self.article)
+
+    def test_patch_only_updates_rows_of_current_user(self):
+        with patch('mapp.module.model.db.current_user', return_value=_user('1')):
+            owned = db_model_create(self.ctx, self.owned_class, self.owned_class(id=None, label='a', color='red', user_id='1'))
+            patched = db_model_patch(self.ctx, self.owned_class, owned.id, {'color': 'blue'})
+            self.assertEqual((patched.label, patched.color), ('a', 'blue'))
+
+            with self.assertRaises(AuthenticationError):
+                db_model_patch(self.ctx, self.owned_class, owned.id, {'user_id': '2'})
+
+        with patch('mapp.module.model.db.current_user', return_value=_user('2')):
+            with self.assertRaises(AuthenticationError):
+                db_model_patch(self.ctx, self.owned_class, owned.id, {'color': 'green'})
+
+        rows = self.ctx.db.cursor.execute('SELECT label, color, user_id FROM test_app_owned').fetchall()
+        self.assertEqual(rows, [('a', 'blue', '1')])
+
+    def test_patch_route(self):
+        route = ModelRouteContext(
+            model_class=self.article_class,
+            model_kebab_case='article',
+            module_kebab_case='test-app',
+            api_instance_path='/api/test-app/article/{instance_id}',
+            api_model_path='/api/test-app/article',
+        )
+
+        def patch_request(body:bytes):
+            request = RequestContext(env={'QUERY_STRING': ''}, raw_req_body=body, request_id='test')
+            return model_patch_route(route, self.ctx, request, self.article.id)
+
+        response = patch_request(b'{"tags": ["z"]}')
+        self.assertEqual((response.data.title, response.data.tags), ('first', ['z']))
+
+        for body in (b'not json', b'["title"]'):
+            with self.assertRaises(RequestError):
+                patch_request(body)
+
+
+class TestMappModelDbFieldProjection(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.addCleanup(self.ctx.db.connection.close)
+        self.article_class = new_model_class({}, _make_article_spec(), make_module_spec({}))
+        db_model_create_table(self.ctx, self.article_class)
+        db_model_bulk_create(self.ctx, self.article_class, [
+            {'title': f'article {n}', 'tags': [f'tag {n}'], 'scores': [n, n], 'flags': [True]} for n in range(5)
+        ])
+
+    def _selects(self, counter:QueryCounter) -> list[str]:
+        return [sql for sql in counter.statements if sql.startswith('SELECT')]
+
+    def test_read_fields(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            item = db_model_read(self.ctx, self.article_class, '2', fields=['tags', 'title'])
+
+        self.assertEqual(item, {'id': '2', 'title': 'article 1', 'tags': ['tag 1']})
+        selects = self._selects(counter)
+        self.assertEqual(len(selects), 2, selects)
+        self.assertTrue(selects[0].startswith('SELECT "id", "title" FROM test_app_article '), selects[0])
+        self.assertIn('FROM test_app_article_tags', selects[1])
+
+    def test_list_and_query_fields(self):
+        with QueryCounter(self.ctx.db.connection) as counter:
+            result = db_model_list(self.ctx, self.article_class, size=2, count='none', fields=['date_created'])
+        self.assertEqual(len(self._selects(counter)), 1)
+        self.assertEqual([set(item) for item in result.items], [{'id', 'date_created'}] * 2)
+        self.assertIsInstance(result.items[0]['date_created'], datetime)
+
+        # pages by a sort key that is not selected
+        where = {'title': {'ne': 'article 0'}}
+        sort = [{'field': 'title', 'order': 'desc'}]
+        first = db_model_query(self.ctx, self.article_class, where, size=3, sort=sort, count='window', fields=['scores'])
+        second = db_model_query(self.ctx, self.article_class, where, size=3, sort=sort, count='window', fields=['scores'], after=first['next_cursor'])
+        self.assertEqual([item for item in first['items']], [{'id': '5', 'scores': [4, 4]}, {'id': '4', 'scores': [3, 3]}, {'id': '3', 'scores': [2, 2]}])
+        self.assertEqual(second['items'], [{'id': '2', 'scores': [1, 1]}])
+        self.assertEqual((first['total'], second['total'], second['has_more']), (4, 4, False))
+
+    def test_unknown_fields_raise(self):
+        with self.assertRaises(MappUserError) as cm:
+            db_model_list(self.ctx, self.article_class, fields=['title', 'body'])
+        self.assertEqual(cm.exception.code, 'INVALID_FIELDS')
+
+    def test_routes_fields_param(self):
+        route = ModelRouteContext(
+            model_class=self.article_class,
+            model_kebab_case='article',
+            module_kebab_case='test-app',
+            api_instance_path='/api/test-app/article/{instance_id}',
+            api_model_path='/api/test-app/article',
+        )
+
+        def request(query_string:str) -> RequestContext:
+            return RequestContext(env={'QUERY_STRING': query_string}, raw_req_body=b'', request_id='test')
+
+        response = model_list_route(route, self.ctx, request('fields=title&title.prefix=article%203'))
+        self.assertEqual(response.data.items, [{'id': '4', 'title': 'article 3'}])
+
+        response = model_read_route(route, self.ctx, request('fields=title,flags'), '1')
+        self.assertEqual(response.data, {'id': '1', 'title': 'article 0', 'flags': [True]})
+
+        with self.assertRaises(RequestError):
+            model_list_route(route, self.ctx, request('fields=,'))
+        with self.assertRaises(MappUserError):
+            model_read_route(route, self.ctx, request('fields=body'), '1')
+
+
+class TestMappModelDbReadCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.db_path = os.path.join(tmp_dir.name, 'cache.sqlite3')
+        self.ctx = self._ctx()
+        self.addCleanup(self.ctx.db.connection.close)
+
+        article_spec = _make_article_spec()
+        article_spec['db'] = {'cache': {'size': 2, 'ttl': 60}}
+        self.article_class = new_model_class({}, article_spec, make_module_spec({}))
+        db_model_create_table(self.ctx, self.article_class)
+        db_model_bulk_create(self.ctx, self.article_class, [
+            {'title': f'article {n}', 'tags': ['a'], 'scores': [n], 'flags': []} for n in range(3)
+        ])
+
+    def _ctx(self) -> MappContext:
+        conn = sqlite3.connect(self.db_path)
+        return MappContext(
+            server_port=8000,
+            client=ClientContext(host='http://localhost:8000', headers={}),
+            db=DBContext(db_url=self.db_path, connection=conn, cursor=conn.cursor(), commit=conn.commit),
+            log=lambda msg: None,
+        )
+
+    def _stats(self) -> dict:
+        return db_model_cache_stats(self.ctx)['test_app_article']
+
+    def _read_selects(self, model_id:str) -> tuple[object, list[str]]:
+        with QueryCounter(self.ctx.db.connection) as counter:
+            item = db_model_read(self.ctx, self.article_class, model_id)
+        return item, [sql for sql in counter.statements if sql.startswith('SELECT')]
+
+    def test_read_hits_cache(self):
+        first, selects = self._read_selects('1')
+        self.assertEqual(len(selects), 4)
+        second, selects = self._read_selects('1')
+        self.assertEqual(selects, [])
+        self.assertIs(second, first)
+        self.assertEqual(db_model_read(self.ctx, self.article_class, '1', fields=['scores']), {'id': '1', 'scores': [0]})
+        self.assertEqual(self._stats(), {'size': 2, 'entries': 1, 'hits': 2, 'misses': 1})
+
+    def test_lru_eviction_and_ttl(self):
+        for model_id in ('1', '2', '1', '3'):
+            db_model_read(self.ctx, self.article_class, model_id)
+        self.assertEqual(list(self.ctx.db.model_caches['test_app_article'].entries), ['1', '3'])
+
+        with patch('mapp.module.model.db.time.monotonic', return_value=time.monotonic() + 61):
+            _, selects = self._read_selects('1')
+        self.assertEqual(len(selects), 4)
+
+    def test_writes_invalidate(self):
+        db_model_read(self.ctx, self.article_class, '1')
+        db_model_patch(self.ctx, self.article_class, '1', {'title': 'patched'})
+        self.assertEqual(db_model_read(self.ctx, self.article_class, '1').title, 'patched')
+
+        db_model_bulk_update(self.ctx, self.article_class, [{'id': '1', 'title': 'bulk', 'tags': [], 'scores': [], 'flags': []}])
+        self.assertEqual(db_model_read(self.ctx, self.article_class, '1').title, 'bulk')
+
+        db_model_delete_where(self.ctx, self.article_class, {'title': {'eq': 'bulk'}})
+        with self.assertRaises(NotFoundError):
+            db_model_read(self.ctx, self.article_class, '1')
+
+        db_model_read(self.ctx, self.article_class, '2')
+        db_model_delete(self.ctx, self.article_class, '2')
+        with self.assertRaises(NotFoundError):
+            db_model_read(self.ctx, self.article_class, '2')
+
+    def test_other_connection_writes_invalidate(self):
+        db_model_read(self.ctx, self.article_class, '1')
+        other_ctx = self._ctx()
+        self.addCleanup(other_ctx.db.connection.close)
+        db_model_patch(other_ctx, self.article_class, '1', {'title': 'other process'})
+
+        self.assertEqual(db_model_read(self.ctx, self.article_class, '1').title, 'other process')
+
+    def test_not_cached_in_transaction(self):
+        with self.ctx.db.unit_of_work():
+            db_model_patch(self.ctx, self.article_class, '1', {'title': 'uncommitted'})
+            self.assertEqual(db_model_read(self.ctx, self.article_class, '1').title, 'uncommitted')
+            self.assertEqual(self._stats()['entries'], 0)
+
+
+class TestMappModelDbSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.addCleanup(self.ctx.db.connection.close)
+        self.post_class = new_model_class({}, self._post_spec(), make_module_spec({}))
+        db_model_create_table(self.ctx, self.post_class)
+        db_model_bulk_create(self.ctx, self.post_class, [
+            {'title': 'solar panels on the roof', 'category': 'energy', 'body': self._body('cheap solar panels', 'https://solar.example')},
+            {'title': 'wind turbines', 'category': 'energy', 'body': self._body('running solar and wind', 'https://wind.example')},
+            {'title': 'garden beds', 'category': 'home', 'body': self._body('raised beds with a solar light', 'https://red.example')},
+        ])
+
+    @staticmethod
+    def _post_spec(search:bool=True) -> dict:
+        title = {'name': {'lower_case': 'title', 'snake_case': 'title'}, 'type': 'str', 'search': search}
+        category = {'name': {'lower_case': 'category', 'snake_case': 'category'}, 'type': 'str'}
+        body = {'name': {'lower_case': 'body', 'snake_case': 'body'}, 'type': 'str', 'rich_text': True, 'search': search}
+        return {
+            'name': {'lower_case': 'post', 'snake_case': 'post', 'pascal_case': 'Post', 'kebab_case': 'post'},
+            'auth': {'require_login': False, 'max_models_per_user': -1},
+            'fields': {'title': title, 'category': category, 'body': body},
+            'non_list_fields': [body, category, title],
+            'list_fields': [],
+            'unique_model_fields': [],
+        }
+
+    @staticmethod
+    def _body(text:str, link:str) -> str:
+        return json.dumps({
+            'lingo': {'version': 'rich-text-beta-1'},
+            'block': [{'text': text, 'style': {'color': 'red'}}, {'link': link, 'text': 'read more'}],
+        })
+
+    def _ids(self, q:str, **kwargs) -> list[str]:
+        return [item.id for item in db_model_search(self.ctx, self.post_class, q, **kwargs)['items']]
+
+    def test_search_ranks_and_pages(self):
+        # the post that mentions solar twice ranks first
+        self.assertEqual(self._ids('solar'), ['1', '2', '3'])
+        # porter stemming and prefix match of the last word
+        self.assertEqual(self._ids('run sol'), ['2'])
+        self.assertEqual(self._ids('turb'), ['2'])
+
+        result = db_model_search(self.ctx, self.post_class, 'solar', offset=1, size=1, fields=['title'])
+        self.assertEqual(result, {'items': [{'id': '2', 'title': 'wind turbines'}], 'total': 3, 'next_cursor': None, 'has_more': True})
+
+        result = db_model_search(self.ctx, self.post_class, 'solar', {'category': {'eq': 'home'}})
+        self.assertEqual(([item.id for item in result['items']], result['total']), (['3'], 1))
+        self.assertEqual(db_model_search(self.ctx, self.post_class, 'solar', offset=5)['total'], 3)
+
+    def test_rich_text_indexes_only_text(self):
+        self.assertEqual(sorted(self._ids('read more')), ['1', '2', '3'])
+        for q in ('example', 'red', 'rich'):
+            self.assertEqual(self._ids(q), [], q)
+
+    def test_query_special_characters_are_literal(self):
+        self.assertEqual(self._ids('"solar" OR NEAR(wind'), [])
+        self.assertEqual(sorted(self._ids('solar*')), ['1', '2', '3'])
+        with self.assertRaises(ValueError):
+            db_model_search(self.ctx, self.post_class, '  ')
+
+    def test_triggers_sync_writes(self):
+        db_model_patch(self.ctx, self.post_class, '3', {'title': 'compost heap'})
+        self.assertEqual(self._ids('garden'), [])
+        self.assertEqual(self._ids('compost'), ['3'])
+
+        db_model_patch(self.ctx, self.post_class, '3', {'category': 'yard'})
+        self.assertEqual(self._ids('compost'), ['3'])
+
+        db_model_delete(self.ctx, self.post_class, '3')
+        self.assertEqual(self._ids('compost'), [])
+        self.assertEqual(self.ctx.db.cursor.execute('SELECT COUNT(*) FROM test_app_post_fts').fetchone()[0], 2)
+
+    def test_search_operator(self):
+        result = db_model_query(self.ctx, self.post_class, {'title': {'search': 'solar'}})
+        self.assertEqual([item.id for item in result['items']], ['1'])
+        result = db_model_query(self.ctx, self.post_class, {'body': {'search': 'solar'}, 'category': {'eq': 'home'}})
+        self.assertEqual([item.id for item in result['items']], ['3'])
+
+        for where in ({'category': {'search': 'home'}}, {'title': {'search': 5}}):
+            with self.assertRaises(ValueError):
+                db_model_query(self.ctx, self.post_class, where)
+
+    def test_create_table_rebuilds_index(self):
+        # unchanged spec keeps the index, changed search fields rebuild it from the rows
+        db_model_create_table(self.ctx, self.post_class)
+        self.assertEqual(self._ids('garden'), ['3'])
+
+        title_only = self._post_spec()
+        title_only['fields']['body']['search'] = False
+        title_only_class = new_model_class({}, title_only, make_module_spec({}))
+        db_model_create_table(self.ctx, title_only_class)
+        self.assertEqual(self._ids_for(title_only_class, 'solar'), ['1'])
+
+        no_search_class = new_model_class({}, self._post_spec(search=False), make_module_spec({}))
+        db_model_create_table(self.ctx, no_search_class)
+        names = self.ctx.db.cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE 'test_app_post_fts%'").fetchall()
+        self.assertEqual(names, [])
+        with self.assertRaises(MappUserError) as cm:
+            db_model_search(self.ctx, no_search_class, 'solar')
+        self.assertEqual(cm.exception.code, 'SEARCH_NOT_ENABLED')
+
+    def _ids_for(self, model_class:type, q:str) -> list[str]:
+        return [item.id for item in db_model_search(self.ctx, model_class, q)['items']]
+
+    def test_list_route_q_param(self):
+        route = ModelRouteContext(
+            model_class=self.post_class,
+            model_kebab_case='post',
+            module_kebab_case='test-app',
+            api_instance_path='/api/test-app/post/{instance_id}',
+            api_model_path='/api/test-app/post',
+        )
+
+        def request(query_string:str) -> RequestContext:
+            return RequestContext(env={'QUERY_STRING': query_string}, raw_req_body=b'', request_id='test')
+
+        response = model_list_route(route, self.ctx, request('q=solar&category.eq=energy&fields=title'))
+        self.assertEqual(response.data.items, [{'id': '1', 'title': 'solar panels on the roof'}, {'id': '2', 'title': 'wind turbines'}])
+        self.assertEqual(response.data.total, 2)
+
+        for query_string in ('q=solar&after=abc', 'q=solar&title.search=%20'):
+            with self.assertRaises(RequestError):
+                model_list_route(route, self.ctx, request(query_string))
+
+
+class TestMappModelDbQueryOperators(unittest.TestCase):
+
+    labels = ['apple', 'apricot', 'banana', 'Apple', 'ap', 'cherry']
+
+    @classmethod
+    def setUpClass(cls):
+        score_spec = make_score_spec()
+        module_spec = make_module_spec({'score': score_spec})
+        cls.score_class = new_model_class({}, score_spec, module_spec)
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.addCleanup(self.ctx.db.connection.close)
+        db_model_create_table(self.ctx, self.score_class)
+        for rank, label in enumerate(self.labels):
+            db_model_create(self.ctx, self.score_class, self.score_class(id=None, label=label, rank=rank))
+        self.ctx.db.cursor.execute("UPDATE test_app_score SET rank = NULL WHERE label = 'cherry'")
+
+    def _labels(self, where:dict) -> list[str]:
+        result = db_model_query(self.ctx, self.score_class, where, size=100)
+        return [item.label for item in result['items']]
+
+    def test_range_operators(self):
+        self.assertEqual(self._labels({'rank': {'ge': 2}}), ['banana', 'Apple', 'ap'])
+        self.assertEqual(self._labels({'rank': {'gt': 2}}), ['Apple', 'ap'])
+        self.assertEqual(self._labels({'rank': {'lt': 1}}), ['apple'])
+        self.assertEqual(self._labels({'rank': {'le': 1}}), ['apple', 'apricot'])
+        self.assertEqual(self._labels({'id': {'gt': '4'}}), ['ap', 'cherry'])
+
+    def test_in_operators(self):
+        self.assertEqual(self._labels({'label': {'in': ['banana', 'ap', 'missing']}}), ['banana', 'ap'])
+        self.assertEqual(self._labels({'id': {'in': ['1', 3]}}), ['apple', 'banana'])
+        self.assertEqual(self._labels({'rank': {'not_in': [0, 1, 2]}}), ['Apple', 'ap'])
+        self.assertEqual(self._labels({'label': {'in': []}}), [])
+        self.assertEqual(len(self._labels({'label': {'not_in': []}})), len(self.labels))
+
+    def test_prefix_is_case_sensitive_range(self):
+        self.assertEqual(self._labels({'label': {'prefix': 'ap'}}), ['apple', 'apricot', 'ap'])
+        self.assertEqual(self._labels({'label': {'prefix': 'app'}}), ['apple'])
+        self.assertEqual(self._labels({'label': {'prefix': ''}}), self.labels)
+
+        with QueryCounter(self.ctx.db.connection) as counter:
+            self._labels({'label': {'prefix': 'ap'}})
+        self.assertNotIn('LIKE', ' '.join(counter.statements))
+
+    def test_is_null(self):
+        self.assertEqual(self._labels({'rank': {'is_null': True}}), ['cherry'])
+        self.assertEqual(len(self._labels({'rank': {'is_null': False}})), len(self.labels) - 1)
+
+    def test_invalid_conditions(self):
+        for where in (
+            {'rank': {'prefix': '1'}},
+            {'label': {'in': 'apple'}},
+            {'rank': {'is_null': 'yes'}},
+            {'id': {'is_null': True}},
+            {'label': {'like': 'a%'}},
+            {'missing': {'eq': 1}},
+        ):
+            with self.subTest(where=where):
+                with self.assertRaises(ValueError):
+                    db_model_query(self.ctx, self.score_class, where)
+
+    def test_list_route_query_string(self):
+        route = ModelRouteContext(
+            model_class=self.score_class,
+            model_kebab_case='score',
+            module_kebab_case='test-app',
+            api_instance_path='/api/test-app/score/{instance_id}',
+            api_model_path='/api/test-app/score',
+        )
+
+        def get(query_string:str):
+            request = RequestContext(env={'QUERY_STRING': query_string}, raw_req_body=b'', request_id='test')
+            response = model_list_route(route, self.ctx, request)
+            return [item.label for item in response.data.items]
+
+        self.assertEqual(get('rank.ge=2&label.prefix=a'), ['ap'])
+        self.assertEqual(get('label.in=apple&label.in=banana&size=1'), ['apple'])
+        self.assertEqual(get('rank.is_null=true'), ['cherry'])
+        self.assertEqual(len(get('')), len(self.labels))
+
+        for query_string in ('rank.ge=high', 'rank.prefix=1', 'rank.is_null=maybe', 'rank.gt=1&rank.gt=2'):
+            with self.subTest(query_string=query_string):
+                with self.assertRaises(RequestError):
+                    get(query_string)
+
+
+class TestMappModelDbUniqueCounts(unittest.TestCase):
+
+    # the last two rows get a null label and rank after they are created
+    rows = [('a', 1), ('b', 1), ('a', 1), ('a', 2), ('c', 3), ('x', 2), ('b', 0)]
+
+    def _score_class(self, summaries:list):
+        score_spec = make_score_spec()
+        score_spec['db']['unique_counts'] = summaries
+        return new_model_class({}, score_spec, make_module_spec({'score': score_spec}))
+
+    def _setup(self, summaries:list):
+        ctx = in_mem_ctx()
+        self.addCleanup(ctx.db.connection.close)
+        score_class = self._score_class(summaries)
+        db_model_create_table(ctx, score_class)
+        db_model_bulk_create(ctx, score_class, [{'label': label, 'rank': rank} for label, rank in self.rows])
+        ctx.db.cursor.execute("UPDATE test_app_score SET label = NULL WHERE label = 'x'")
+        ctx.db.cursor.execute('UPDATE test_app_score SET rank = NULL WHERE rank = 0')
+        return ctx, score_class
+
+    def _expected(self, ctx, score_class, ranks:list) -> dict:
+        expected = {}
+        for rank in ranks:
+            counts = db_model_unique_counts(ctx, self._score_class([]), 'label', {'rank': rank})
+            if counts:
+                expected[rank] = counts
+        return expected
+
+    def test_counts_for_many_values_in_one_query(self):
+        ctx, score_class = self._setup([])
+        with QueryCounter(ctx.db.connection) as counter:
+            counts = db_model_unique_counts_in(ctx, score_class, 'label', 'rank', [1, 2, 3, 4, 1, None])
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(counts, {
+            1: [{'group': 'a', 'count': 2}, {'group': 'b', 'count': 1}],
+            2: [{'group': None, 'count': 1}, {'group': 'a', 'count': 1}],
+            3: [{'group': 'c', 'count': 1}],
+        })
+
+    def test_summary_table_is_initialized_and_kept_in_sync(self):
+        ctx, _ = self._setup([])
+        score_class = self._score_class([{'field': 'rank', 'group_by': 'label'}])
+        db_model_create_table(ctx, score_class)
+        ranks = [1, 2, 3, 4]
+        self.assertEqual(db_model_unique_counts_in(ctx, score_class, 'label', 'rank', ranks), self._expected(ctx, score_class, ranks))
+
+        created = db_model_create(ctx, score_class, score_class(id=None, label='d', rank=4))
+        db_model_create(ctx, score_class, score_class(id=None, label='x', rank=2))
+        ctx.db.cursor.execute("UPDATE test_app_score SET label = NULL WHERE label = 'x'")
+        ctx.db.cursor.execute("UPDATE test_app_score SET label = 'c' WHERE label = 'b'")
+        ctx.db.cursor.execute('UPDATE test_app_score SET rank = 3 WHERE rank IS NULL')
+        db_model_delete(ctx, score_class, '1')
+        db_model_delete(ctx, score_class, created.id)
+
+        with QueryCounter(ctx.db.connection) as counter:
+            counts = db_model_unique_counts_in(ctx, score_class, 'label', 'rank', ranks)
+        self.assertIn('test_app_score_unique_counts_rank_label', counter.statements[0])
+        self.assertEqual(counts, self._expected(ctx, score_class, ranks))
+        self.assertEqual(db_model_unique_counts(ctx, score_class, 'label', {'rank': 1}), counts[1])
+
+
+def _make_event_spec(datetime_storage:str):
+    happened_at = {'name': {'lower_case': 'happened at', 'snake_case': 'happened_at'}, 'type': 'datetime'}
+    days = {'name': {'lower_case': 'days', 'snake_case': 'days'}, 'type': 'list', 'element_type': 'datetime'}
+    return {
+        'name': {'lower_case': 'event', 'snake_case': 'event', 'pascal_case': 'Event', 'kebab_case': 'event'},
+        'auth': {'require_login': False, 'max_models_per_user': -1},
+        'db': {'count': 'counter', 'datetime_storage': datetime_storage, 'indexes': [{'name': 'idx_test_app_event_happened_at', 'fields': ['happened_at']}]},
+        'fields': {'happened_at': happened_at, 'days': days},
+        'non_list_fields': [happened_at],
+        'list_fields': [days],
+        'unique_model_fields': [],
+    }
+
+
+class TestMappModelDbDatetimeStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = in_mem_ctx()
+        self.addCleanup(self.ctx.db.connection.close)
+        self.text_class = new_model_class({}, _make_event_spec('text'), make_module_spec({}))
+        self.epoch_class = new_model_class({}, _make_event_spec('epoch'), make_module_spec({}))
+
+    def _create_events(self, model_class) -> list:
+        db_model_create_table(self.ctx, model_class)
+        events = []
+        for n in range(3):
+            event = model_class(id=None, happened_at=datetime(2024, 1, 1 + n, 12, 30), days=[datetime(2020, 1, 1), datetime(2021, 6, 1, 8)])
+            events.append(db_model_create(self.ctx, model_class, event))
+        return events
+
+    def test_epoch_storage(self):
+        events = self._create_events(self.epoch_class)
+
+        row = self.ctx.db.cursor.execute('SELECT date_created, happened_at FROM test_app_event WHERE id = ?', (events[0].id,)).fetchone()
+        self.assertIsInstance(row[0], int)
+        self.assertEqual(row[1], int(datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc).timestamp()) * 1_000_000)
+
+        event = db_model_read(self.ctx, self.epoch_class, events[0].id)
+        self.assertEqual(event.happened_at, datetime(2024, 1, 1, 12, 30))
+        self.assertEqual(event.days, [datetime(2020, 1, 1), datetime(2021, 6, 1, 8)])
+        self.assertEqual(event.date_created.tzinfo, timezone.utc)
+        self.assertLess(abs(event.date_created - datetime.now(timezone.utc)).total_seconds(), 60)
+
+        result = db_model_query(self.ctx, self.epoch_class, {}, sort=[{'field': 'happened_at', 'order': 'desc'}])
+        self.assertEqual([item.id for item in result['items']], [events[2].id, events[1].id, events[0].id])
+
+        counts = db_model_unique_counts(self.ctx, self.epoch_class, 'happened_at', {'happened_at': '2024-01-02T12:30:00'})
+        self.assertEqual(counts, [{'group': '2024-01-02T12:30:00', 'count': 1}])
+
+    def test_create_table_rejects_mismatched_storage(self):
+        self._create_events(self.text_class)
+        with self.assertRaises(MappError) as cm:
+            db_model_create_table(self.ctx, self.epoch_class)
+        self.assertEqual(cm.exception.code, 'DATETIME_STORAGE_MISMATCH')
+
+    def test_migrate_text_to_epoch_and_back(self):
+        events = self._create_events(self.text_class)
+        db_model_delete(self.ctx, self.text_class, events[2].id)
+
+        ack = db_model_migrate_datetime(self.ctx, self.epoch_class)
+        self.assertIn('converted from text to epoch', ack.message)
+        self.assertEqual(db_model_list(self.ctx, self.epoch_class).items, events[:2])
+        self.assertEqual(db_model_list(self.ctx, self.epoch_class, count='counter').total, 2)
+
+        # indexes are restored and the id sequence continues after the deleted row
+        index_names = {row[0] for row in self.ctx.db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('idx_test_app_event_happened_at', index_names)
+        event = db_model_create(self.ctx, self.epoch_class, self.epoch_class(id=None, happened_at=datetime(2025, 1, 1), days=[]))
+        self.assertEqual(event.id, '4')
+
+        db_model_migrate_datetime(self.ctx, self.text_class)
+        self.assertEqual(db_model_read(self.ctx, self.text_class, events[0].id), events[0])
+
+        ack = db_model_migrate_datetime(self.ctx, self.text_class)
+        self.assertIn('already stores datetimes as text', ack.message)
+
+    def test_migrate_spec(self):
+        self._create_events(self.text_class)
+        module_spec = make_module_spec({'event': _make_event_spec('epoch'), 'score': make_score_spec()})
+        results = migrate_datetime_storage(self.ctx, {'modules': {'test_app': module_spec}})
+        self.assertIn('converted from text to epoch', results['test_app_event'])
+        self.assertIn('does not exist', results['test_app_score'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from mapp.router import Router
+from mapp.types import JSONResponse
+
+
+class _FakeServer:
+    def __init__(self):
+        self.messages = []
+
+    def log(self, msg:str):
+        self.messages.append(msg)
+
+
+class _FakeRequest:
+    def __init__(self, method:str, path:str):
+        self.env = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': ''}
+
+
+def _resolve_and_call(router:Router, method:str, path:str):
+    resolver = router.resolve(method, path)
+    if resolver is None:
+        return None
+    return resolver(_FakeServer(), _FakeRequest(method, path))
+
+
+class TestMappRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        self.router.add('GET', '/api/my-module/my-model', lambda server, request: ('list',))
+        self.router.add('POST', '/api/my-module/my-model', lambda server, request: ('create',))
+        self.router.add('GET', '/api/my-module/my-model/{instance_id}', lambda server, request, instance_id: ('read', instance_id))
+        self.router.add('POST', '/api/my-module/my-model/_bulk', lambda server, request: ('bulk',))
+        self.router.add('GET', '/api/my-module/my-model-two', lambda server, request: ('list two',))
+
+    def test_resolve_literal_routes(self):
+        self.assertEqual(_resolve_and_call(self.router, 'GET', '/api/my-module/my-model'), ('list',))
+        self.assertEqual(_resolve_and_call(self.router, 'POST', '/api/my-module/my-model'), ('create',))
+        self.assertEqual(_resolve_and_call(self.router, 'GET', '/api/my-module/my-model/'), ('list',))
+
+    def test_resolve_does_not_prefix_match(self):
+        self.assertEqual(_resolve_and_call(self.router, 'GET', '/api/my-module/my-model-two'), ('list two',))
+
+    def test_resolve_param_route(self):
+        self.assertEqual(_resolve_and_call(self.router, 'GET', '/api/my-module/my-model/42'), ('read', '42'))
+
+    def test_param_route_rejects_trailing_slash(self):
+        self.assertIsNone(self.router.resolve('GET', '/api/my-module/my-model/42/'))
+        self.assertEqual(_resolve_and_call(self.router, 'POST', '/api/my-module/my-model/_bulk/'), ('bulk',))
+
+    def test_param_matches_one_segment(self):
+        self.assertEqual(_resolve_and_call(self.router, 'GET', '/api/my-module/my-model/abc-12_3.x'), ('read', 'abc-12_3.x'))
+        self.assertIsNone(self.router.resolve('GET', '/api/my-module/my-model/42/extra'))
+        self.assertIsNone(self.router.resolve('GET', '/api/my-module/my-model//42'))
+
+    def test_literal_segment_takes_priority_over_param(self):
+        self.assertEqual(_resolve_and_call(self.router, 'POST', '/api/my-module/my-model/_bulk'), ('bulk',))
+
+    def test_unknown_path_returns_none(self):
+        self.assertIsNone(self.router.resolve('GET', '/api/my-module/other-model'))
+        self.assertIsNone(self.router.resolve('GET', '/api/my-module'))
+        self.assertIsNone(self.router.resolve('GET', '/api/my-module/my-model/42/extra'))
+        self.assertIsNone(self.router.resolve('GET', '/'))
+
+    def test_unknown_method_returns_405(self):
+        response = _resolve_and_call(self.router, 'PATCH', '/api/my-module/my-model')
+        self.assertIsInstance(response, JSONResponse)
+        self.assertEqual(response.status, '405 Method Not Allowed')
+
+    def test_duplicate_route_raises(self):
+        with self.assertRaises(ValueError):
+            self.router.add('GET', '/api/my-module/my-model', lambda server, request: None)
+
+    def test_conflicting_param_names_raise(self):
+        with self.assertRaises(ValueError):
+            self.router.add('PUT', '/api/my-module/my-model/{model_id}', lambda server, request, model_id: None)
+
+
+if __name__ == '__main__':
+    unittest.main()